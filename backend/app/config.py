@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Any, Dict, List
 
 
 class Settings(BaseSettings):
@@ -17,11 +18,15 @@ class Settings(BaseSettings):
     JWT_ALGORITHM: str = "HS256"
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES: int = 480
     JWT_REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+    AUTH_USER_CACHE_TTL_SECONDS: int = 30  # 已认证用户快照缓存时长（跳过 JWT 解码与用户查询）
+    AUTH_USER_CACHE_MAX_ENTRIES: int = 10000
     
     TEST_MODE: bool = True
     
     # 验证码配置
     ENABLE_SMS_VERIFICATION: bool = False  # 临时禁用验证码功能，待接入真实短信服务后启用
+    SMS_CODE_STORE_BACKEND: str = "memory"  # memory（单进程）/ database（多 worker 共享验证码与频率限制）
+    SMS_CODE_STORE_URL: str = ""  # database 存储使用的数据库，留空使用 DATABASE_URL
     
     # LLM 配置
     LLM_PROVIDER: str = "qwen"
@@ -39,19 +44,108 @@ class Settings(BaseSettings):
     LLM_MAX_RETRIES: int = 1  # LLM 调用最大重试次数
     LLM_MAX_TOKENS: int = 1500  # 普通 LLM 最大 token
     LLM_VL_MAX_TOKENS: int = 2000  # 多模态 LLM 最大 token
-    
+
+    # LLM 调度配置
+    LLM_MAX_CONCURRENCY: int = 16  # 单个模型的最大并发调用数
+    LLM_TOKENS_PER_MINUTE: int = 0  # 单个模型每分钟 token 预算，0 表示不限制
+    LLM_RESERVED_INTERACTIVE_SLOTS: int = 4  # 为在线问诊预留、后台任务不可占用的并发数
+    LLM_MODEL_LIMITS: Dict[str, Dict[str, int]] = {}  # 按模型覆盖，如 {"qwen-plus": {"max_concurrency": 32}}
+    LLM_LANE_ORDER: List[str] = ["interactive", "emergency", "background"]  # 排队优先级顺序（在线问诊 / 紧急问诊 / 后台任务）
+
+    # LLM 服务商池配置
+    LLM_BACKUP_PROVIDERS: List[Dict[str, Any]] = []  # 备用 OpenAI 兼容服务商（按顺序故障转移），如 [{"name": "deepseek", "base_url": "...", "api_key": "...", "model_map": {"*": "deepseek-chat"}}]
+    LLM_HEDGE_DELAY_SECONDS: float = 0  # 首个 token 超过该时长未返回时向下一个服务商发起对冲请求，0 表示关闭
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = 3  # 连续失败次数达到该值时熔断服务商
+    LLM_CIRCUIT_RESET_SECONDS: float = 30  # 熔断时长（秒），到期后放行一次试探请求
+
+    # LLM 任务路由配置（任务类型 → model / temperature / max_tokens，未配置的任务沿用调用方参数）
+    LLM_TASK_ROUTES: Dict[str, Dict[str, Any]] = {
+        "quick_options": {"model": "qwen-turbo", "max_tokens": 300},
+        "assessment": {"model": "qwen-turbo", "max_tokens": 400},
+        "symptom_extraction": {"model": "qwen-turbo", "max_tokens": 300},
+        "relation_check": {"model": "qwen-turbo", "max_tokens": 800},
+    }
+
+    # 对话上下文配置
+    LLM_CONTEXT_TOKEN_BUDGET: int = 6000  # 单次调用提示词（系统提示 + 关键信息 + 摘要 + 近期对话）的 token 预算
+    LLM_CONTEXT_BUDGETS: Dict[str, int] = {"qwen-turbo": 4000}  # 按模型覆盖提示词预算
+    LLM_CONTEXT_SUMMARY_TOKENS: int = 500  # 早期对话滚动摘要的 token 上限
+
+    # 提示词缓存配置
+    LLM_PROMPT_CACHE_MODELS: List[str] = []  # 支持显式缓存标记（cache_control）的模型，如 ["qwen-plus", "qwen-max"]；隐式前缀缓存无需配置
+    LLM_PROMPT_CACHE_MIN_TOKENS: int = 1024  # 可缓存前缀达到该 token 数才加显式缓存标记（服务商的最小缓存长度）
+
+    # 图片预处理配置（多模态分析前）
+    IMAGE_PREPROCESS_ENABLED: bool = True
+    IMAGE_MAX_EDGE: int = 1536  # 长边超过该像素时等比缩小
+    IMAGE_OUTPUT_FORMAT: str = "jpeg"  # jpeg/webp
+    IMAGE_OUTPUT_QUALITY: int = 85  # 重新编码质量（1-100）
+    IMAGE_PREPROCESS_WORKERS: int = 2  # 预处理进程池大小，0 表示在线程中处理
+    IMAGE_PREPROCESS_TIMEOUT_SECONDS: float = 20  # 单张图片处理超时，超时后发送原图
+
+    # SSE 流重放配置
+    STREAM_REPLAY_TTL_SECONDS: int = 300  # 轮次结束后事件缓冲保留时长（秒）
+    STREAM_REPLAY_MAX_AGE_SECONDS: int = 3600  # 运行中轮次缓冲最长保留时长（秒）
+
+    # 会话轮次串行化配置
+    SESSION_TURN_LOCK_TTL_SECONDS: int = 180  # 会话锁租约时长，超时视为持有者已崩溃
+    SESSION_TURN_LOCK_WAIT_SECONDS: int = 60  # 等待会话锁的最长时间
+
+    # 病历事件列表配置
+    EVENT_LIST_APPROX_COUNT_CAP: int = 1000  # 估算总数时最多统计的条数
+
+    # PDF 导出配置
+    EXPORT_DIR: str = "exports"  # 导出文件目录（按内容指纹缓存）
+    EXPORT_RENDER_WORKERS: int = 2  # 多事件导出时并发渲染的进程数
+
+    # 共享链接配置
+    SHARE_SNAPSHOT_TTL_SECONDS: int = 60  # 共享内容快照缓存时长，事件修改后最多滞后该时长
+    SHARE_SNAPSHOT_MAX_ENTRIES: int = 256
+    SHARE_ACCESS_LOG_BATCH_SIZE: int = 100  # 访问日志积累到该条数时立即批量写入
+    SHARE_ACCESS_LOG_FLUSH_SECONDS: float = 2.0  # 访问日志批量写入间隔（秒）
+
     # AI 算法服务配置
     AI_SUMMARY_MODEL: str = ""  # 留空使用 LLM_MODEL
     AI_SUMMARY_MAX_TOKENS: int = 2000
     AI_SUMMARY_TEMPERATURE: float = 0.3
+    AI_SUMMARY_CONCURRENCY: int = 4  # map 阶段单次问诊摘要的最大并发数
+    AI_SUMMARY_SINGLE_PASS_TOKENS: int = 4000  # 对话总量低于该值时单次调用生成摘要，否则走 map-reduce
+    AI_SUMMARY_SESSION_TOKEN_BUDGET: int = 3000  # map 阶段单个会话对话记录的 token 预算
+    AI_SUMMARY_REDUCE_TOKEN_BUDGET: int = 6000  # reduce 阶段输入的 token 预算，超出则分组逐级归并
     AI_AGGREGATION_TIME_WINDOW_DAYS: int = 7
     AI_AGGREGATION_SIMILARITY_THRESHOLD: float = 0.7
+    AI_SINGLE_FLIGHT_TTL_SECONDS: int = 600  # AI 任务结果缓存时长（内容不变时复用）
+    AI_SINGLE_FLIGHT_MAX_ENTRIES: int = 512
+    AI_SIMILARITY_NUM_PERM: int = 64  # MinHash 签名长度
+    AI_SIMILARITY_BANDS: int = 16  # LSH 分段数（每段行数 = 签名长度 / 分段数）
+    AI_RELATED_CANDIDATES: int = 10  # 查找相关事件时交给 LLM 的候选数量
     
     # 语音转写配置
     ASR_PROVIDER: str = "mock"  # mock/aliyun/openai
     ASR_SAMPLE_RATE: int = 16000
     OPENAI_API_KEY: str = ""  # 用于 Whisper API
-    
+
+    # 指标配置
+    METRICS_ENABLED: bool = True  # 是否开放 GET /metrics
+    METRICS_MAX_SERIES: int = 200  # 单个指标最多保留的标签组合数，超出记为 "other"
+
+    # 日志配置
+    LOG_LEVEL: str = "INFO"  # 默认级别
+    LOG_MODULE_LEVELS: Dict[str, str] = {}  # 按 logger 名覆盖级别，如 {"app.routes.sessions": "DEBUG"}
+    LOG_FORMAT: str = "text"  # text/json
+    LOG_SAMPLE_RATE_PER_SECOND: float = 5.0  # WARNING 以下同一事件每秒最多输出条数，0 表示不限流
+    LOG_DEBUG_CAPTURE_SIZE: int = 500  # 单个会话调试捕获的环形缓冲条数
+    LOG_DEBUG_CAPTURE_TTL_SECONDS: int = 1800  # 调试捕获自动关闭时长（秒）
+
+    # 链路追踪配置
+    TRACING_ENABLED: bool = True
+    TRACING_SERVICE_NAME: str = "home-health-backend"
+    TRACING_SAMPLE_RATIO: float = 1.0  # 采样比例（按 trace 采样，子 span 跟随父 span）
+    TRACING_MAX_TRACES: int = 200  # 内存中保留的最近 trace 数（供瀑布图查询）
+    TRACING_EXPORTER: str = "none"  # none/file/otlp
+    TRACING_FILE_PATH: str = "traces.jsonl"  # file 导出：JSON Lines 文件路径
+    TRACING_OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"  # otlp 导出：OTLP/HTTP 地址
+
     # Admin JWT 配置
     ADMIN_JWT_SECRET: str = "admin-secret-key-change-in-production"
     ADMIN_JWT_EXPIRE_HOURS: int = 24
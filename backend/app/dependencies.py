@@ -1,21 +1,56 @@
+from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from .database import get_db
 from .services.auth_service import AuthService
 from .services.admin_auth_service import AdminAuthService
+from .services.user_cache import CurrentUser, get_auth_user_cache
 from .models.user import User
 from .models.admin_user import AdminUser
 
 security = HTTPBearer()
 
 
+def _resolve_user(db: Session, user_id: int) -> Optional[CurrentUser]:
+    """按ID取用户快照（优先读缓存）"""
+    cache = get_auth_user_cache()
+    user = cache.get_user(user_id)
+    if user is None:
+        orm_user = db.query(User).filter(User.id == user_id).first()
+        if orm_user is None:
+            return None
+        user = cache.set_user(orm_user)
+    return user
+
+
+def _resolve_user_token(token: str) -> Optional[int]:
+    """验证普通用户 token（已验证的 token 短时间内不再解码）"""
+    cache = get_auth_user_cache()
+    user_id = cache.get_user_id(token)
+    if user_id is None:
+        payload = AuthService.decode_token(token)
+        if payload is None:
+            return None
+        try:
+            user_id = int(payload["sub"])
+        except (TypeError, ValueError):
+            return None
+        cache.set_token(token, user_id, payload.get("exp"))
+    return user_id
+
+
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
-) -> User:
+) -> CurrentUser:
+    """
+    当前登录用户
+
+    返回与数据库会话无关的用户快照（CurrentUser），需要修改用户时按 id 重新查询
+    """
     token = credentials.credentials
-    user_id = AuthService.verify_token(token)
+    user_id = _resolve_user_token(token)
 
     if user_id is None:
         raise HTTPException(
@@ -24,7 +59,7 @@ def get_current_user(
             headers={"WWW-Authenticate": "Bearer"}
         )
 
-    user = db.query(User).filter(User.id == user_id).first()
+    user = _resolve_user(db, user_id)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -37,17 +72,25 @@ def get_current_user(
 def get_current_user_or_admin(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
-) -> User:
+) -> CurrentUser:
     """
     允许普通用户或管理员访问
     如果是管理员token，创建一个临时的User对象用于测试
     """
     token = credentials.credentials
+    cache = get_auth_user_cache()
     
     # 先尝试验证普通用户token
-    user_id = AuthService.verify_token(token)
+    user_id = _resolve_user_token(token)
     if user_id is not None:
-        user = db.query(User).filter(User.id == user_id).first()
+        user = _resolve_user(db, user_id)
+        if user:
+            return user
+    
+    # 管理员token已解析过对应的测试用户
+    test_user_id = cache.get_user_id(token, kind="admin")
+    if test_user_id is not None:
+        user = _resolve_user(db, test_user_id)
         if user:
             return user
     
@@ -69,7 +112,8 @@ def get_current_user_or_admin(
                 db.add(test_user)
                 db.commit()
                 db.refresh(test_user)
-            return test_user
+            cache.set_token(token, test_user.id, kind="admin")
+            return cache.set_user(test_user)
     
     # 都不是有效token
     raise HTTPException(
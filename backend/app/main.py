@@ -1,5 +1,7 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from .config import get_settings
 from .database import engine, Base, SessionLocal
 from .routes import (
     auth_router, departments_router, sessions_router, sessions_v2_router, feedbacks_router, diseases_router, drugs_router,
@@ -9,10 +11,24 @@ from .routes import (
     admin_diseases_router, admin_drugs_router, admin_drug_categories_router
 )
 from .services.admin_auth_service import AdminAuthService
+from .services.share_link_service import get_access_log_buffer
+from .services.llm_scheduler import get_llm_scheduler
+from .services.stream_replay import get_stream_registry
+from .services.image_preprocessing import get_image_preprocessor
+from .services.metrics import (
+    ACCESS_LOG_PENDING, LLM_ACTIVE_REQUESTS, LLM_QUEUE_DEPTH, STREAM_BUFFERS,
+    get_metrics_registry, instrument_engine
+)
+from .services.tracing import instrument_engine_tracing, shutdown_tracing
+from .services.structured_logging import configure_logging
+from .middleware import MetricsMiddleware, TracingMiddleware
 from .seed import seed_data
 import os
 
+configure_logging()
 Base.metadata.create_all(bind=engine)
+instrument_engine(engine)
+instrument_engine_tracing(engine)
 
 app = FastAPI(
     title="鑫琳医生 API",
@@ -27,6 +43,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 
 # 用户端路由
 app.include_router(auth_router)
@@ -77,6 +95,19 @@ def startup_event():
     finally:
         db.close()
 
+    # 预先启动图片预处理进程池，首张图片不承担进程启动耗时
+    get_image_preprocessor().warm_up()
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    # 写入尚未落库的共享链接访问日志
+    get_access_log_buffer().stop()
+    # 导出尚未发送的链路追踪数据
+    shutdown_tracing()
+    # 关闭图片预处理进程池
+    get_image_preprocessor().shutdown()
+
 
 @app.get("/")
 def root():
@@ -86,3 +117,27 @@ def root():
 @app.get("/health")
 def health():
     return {"status": "healthy"}
+
+
+def _collect_queue_depths():
+    """渲染指标前读取各队列的当前深度"""
+    for model, stats in get_llm_scheduler().stats().items():
+        LLM_ACTIVE_REQUESTS.set(stats["active"], model=model)
+        for lane, lane_stats in stats["lanes"].items():
+            LLM_QUEUE_DEPTH.set(lane_stats["queued"], model=model, lane=lane)
+    STREAM_BUFFERS.set(len(get_stream_registry()))
+    ACCESS_LOG_PENDING.set(get_access_log_buffer().pending_count)
+
+
+get_metrics_registry().add_collector(_collect_queue_depths)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus 文本格式指标"""
+    if not get_settings().METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(
+        get_metrics_registry().render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,94 @@
+"""
+HTTP 中间件
+"""
+import time
+
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+
+from .services.metrics import HTTP_REQUEST_SECONDS
+from .services.tracing import format_trace_id, start_span
+
+_propagator = TraceContextTextMapPropagator()
+
+
+class MetricsMiddleware:
+    """
+    记录每个请求的耗时（直到响应体发送完毕，SSE 流式接口即整个流的时长）
+
+    route 标签使用路由模板（如 /sessions/{session_id}/messages），未匹配的路径统一记为 "unmatched"，
+    保证标签基数与路由数量一致。纯 ASGI 实现，不缓冲流式响应。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope.get("method", ""),
+                route=getattr(route, "path", None) or "unmatched",
+                status=status
+            )
+
+
+class TracingMiddleware:
+    """
+    为每个请求创建根 span（上游带 traceparent 头时作为其子 span），
+    请求内的智能体、LLM、数据库 span 都挂在其下；响应头 X-Trace-Id 返回 trace_id，
+    可用于 GET /admin/stats/traces/{trace_id} 查询瀑布图
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        carrier = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        parent = _propagator.extract(carrier)
+        method = scope.get("method", "")
+        attributes = {"http.method": method, "http.target": scope.get("path", "")}
+
+        with start_span(f"HTTP {method}", attributes, kind=SpanKind.SERVER, context=parent) as span:
+            trace_id = format_trace_id(span.get_span_context().trace_id)
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    span.set_attribute("http.status_code", status)
+                    if status >= 500:
+                        span.set_status(Status(StatusCode.ERROR))
+                    if span.is_recording():
+                        message = {
+                            **message,
+                            "headers": [*message.get("headers", []), (b"x-trace-id", trace_id.encode())]
+                        }
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    span.update_name(f"{method} {route}")
+                    span.set_attribute("http.route", route)
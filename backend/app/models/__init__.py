@@ -10,9 +10,10 @@ from .disease import Disease
 from .drug import Drug, DrugCategory
 from .diagnosis_session import DiagnosisSession
 from .derma_session import DermaSession
+from .session_turn import SessionTurn, SessionLock, TurnStatus
 from .medical_event import (
-    MedicalEvent, EventAttachment, EventNote, ExportRecord, ExportAccessLog,
-    EventStatus, RiskLevel, AgentType, AttachmentType
+    MedicalEvent, EventSession, EventAttachment, EventNote, ExportRecord, ExportJob, ExportAccessLog,
+    EventStatus, RiskLevel, AgentType, AttachmentType, ExportJobStatus
 )
 
 __all__ = [
@@ -20,6 +21,7 @@ __all__ = [
     "KnowledgeBase", "KnowledgeDocument", "AdminUser", "AuditLog",
     "SessionFeedback", "Disease", "Drug", "DrugCategory",
     "DiagnosisSession", "DermaSession",
-    "MedicalEvent", "EventAttachment", "EventNote", "ExportRecord", "ExportAccessLog",
-    "EventStatus", "RiskLevel", "AgentType", "AttachmentType"
+    "SessionTurn", "SessionLock", "TurnStatus",
+    "MedicalEvent", "EventSession", "EventAttachment", "EventNote", "ExportRecord", "ExportJob", "ExportAccessLog",
+    "EventStatus", "RiskLevel", "AgentType", "AttachmentType", "ExportJobStatus"
 ]
@@ -3,11 +3,19 @@
 """
 import enum
 import secrets
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, JSON, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, JSON, Index, UniqueConstraint, Enum as SQLEnum
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import relationship, deferred
 from ..database import Base
 
+# SQLite 以文本存储时间：写入值统一为与数据库默认值（CURRENT_TIMESTAMP）相同的秒级格式，
+# 排序与游标比较直接作用于列本身，可以使用索引
+SortableDateTime = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite"
+)
+
 
 class EventStatus(str, enum.Enum):
     """事件状态"""
@@ -37,6 +45,14 @@ class AgentType(str, enum.Enum):
     respiratory = "respiratory"
 
 
+class ExportJobStatus(str, enum.Enum):
+    """PDF 渲染任务状态"""
+    pending = "pending"
+    rendering = "rendering"
+    ready = "ready"
+    failed = "failed"
+
+
 class AttachmentType(str, enum.Enum):
     """附件类型"""
     image = "image"
@@ -47,6 +63,12 @@ class AttachmentType(str, enum.Enum):
 class MedicalEvent(Base):
     """医疗事件 - 病历资料夹核心实体"""
     __tablename__ = "medical_events"
+    __table_args__ = (
+        # 列表筛选 + 按时间排序/游标分页
+        Index("ix_medical_events_user_status_start", "user_id", "status", "start_time"),
+        Index("ix_medical_events_user_agent_start", "user_id", "agent_type", "start_time"),
+        Index("ix_medical_events_user_created", "user_id", "created_at"),  # 默认排序
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
@@ -61,22 +83,58 @@ class MedicalEvent(Base):
     risk_level = Column(SQLEnum(RiskLevel), default=RiskLevel.low)
     
     ai_analysis = Column(JSON, nullable=True, default=dict)
-    sessions = Column(JSON, nullable=True, default=list)
+    # 旧版会话记录 JSON（已迁移到 event_sessions 表，仅兼容未迁移数据，延迟加载）
+    sessions = deferred(Column(JSON, nullable=True, default=list))
     
     session_count = Column(Integer, default=0)
     attachment_count = Column(Integer, default=0)
     export_count = Column(Integer, default=0)
     
-    start_time = Column(DateTime(timezone=True), server_default=func.now())
+    start_time = Column(SortableDateTime, server_default=func.now())
     end_time = Column(DateTime(timezone=True), nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    created_at = Column(SortableDateTime, server_default=func.now())
+    updated_at = Column(SortableDateTime, server_default=func.now(), onupdate=func.now())
     
+    session_records = relationship(
+        "EventSession", back_populates="event", cascade="all, delete-orphan",
+        order_by="EventSession.started_at"
+    )
     attachments = relationship("EventAttachment", back_populates="event", cascade="all, delete-orphan")
     notes = relationship("EventNote", back_populates="event", cascade="all, delete-orphan")
     export_records = relationship("ExportRecord", back_populates="event", cascade="all, delete-orphan")
 
 
+class EventSession(Base):
+    """事件关联的问诊会话（对话内容按 ID 引用 messages 表）"""
+    __tablename__ = "event_sessions"
+    __table_args__ = (
+        UniqueConstraint("event_id", "session_id", name="uq_event_session"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_id = Column(Integer, ForeignKey("medical_events.id"), nullable=False, index=True)
+    session_id = Column(String(36), nullable=False, index=True)
+    
+    session_type = Column(String(50), nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    summary = Column(Text, nullable=True)
+    chief_complaint = Column(Text, nullable=True)
+    symptoms = Column(JSON, nullable=True, default=list)
+    risk_level = Column(String(20), nullable=True)
+    stage = Column(String(50), nullable=True)
+    message_count = Column(Integer, default=0)
+    
+    # 以下字段体积较大，详情接口不需要，延迟加载
+    message_ids = deferred(Column(JSON, nullable=True, default=list))
+    details = deferred(Column(JSON, nullable=True, default=dict))  # 科室特定数据（皮肤分析、心电解读等）
+    ai_summary = deferred(Column(JSON, nullable=True))  # 单次问诊 AI 摘要
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    event = relationship("MedicalEvent", back_populates="session_records")
+
+
 class EventAttachment(Base):
     """事件附件"""
     __tablename__ = "event_attachments"
@@ -141,12 +199,33 @@ class ExportRecord(Base):
     
     event = relationship("MedicalEvent", back_populates="export_records")
     access_logs = relationship("ExportAccessLog", back_populates="export_record", cascade="all, delete-orphan")
+    job = relationship("ExportJob", back_populates="export_record", uselist=False, cascade="all, delete-orphan")
     
     @staticmethod
     def generate_share_token():
         return secrets.token_urlsafe(32)
 
 
+class ExportJob(Base):
+    """PDF 导出渲染任务（文件按内容指纹缓存，相同内容的导出共用一个文件）"""
+    __tablename__ = "export_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    export_id = Column(Integer, ForeignKey("export_records.id"), nullable=False, unique=True)
+    
+    cache_key = Column(String(64), nullable=False, index=True)
+    status = Column(SQLEnum(ExportJobStatus), default=ExportJobStatus.pending, nullable=False)
+    file_path = Column(String(500), nullable=True)
+    file_size = Column(Integer, nullable=True)
+    page_count = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    
+    export_record = relationship("ExportRecord", back_populates="job")
+
+
 class ExportAccessLog(Base):
     """导出访问日志"""
     __tablename__ = "export_access_logs"
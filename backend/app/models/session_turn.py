@@ -0,0 +1,49 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON, UniqueConstraint
+from sqlalchemy.sql import func
+import enum
+from ..database import Base
+
+
+class TurnStatus(str, enum.Enum):
+    running = "running"
+    completed = "completed"
+    failed = "failed"
+
+
+class SessionTurn(Base):
+    """
+    会话轮次记录
+
+    每次发送消息对应一个轮次，用于 Idempotency-Key 去重与结果重放
+    """
+    __tablename__ = "session_turns"
+    __table_args__ = (
+        UniqueConstraint("session_id", "idempotency_key", name="uq_session_turn_idempotency"),
+    )
+
+    id = Column(String(36), primary_key=True, index=True)  # 与 SSE 重放缓冲的 turn_id 一致
+    session_id = Column(String(36), ForeignKey("sessions.id"), nullable=False, index=True)
+    idempotency_key = Column(String(128), nullable=True)
+    request_hash = Column(String(64), nullable=True)  # 请求内容指纹，防止同一 key 用于不同请求
+
+    status = Column(String(20), default=TurnStatus.running.value, nullable=False)
+    user_message_id = Column(Integer, ForeignKey("messages.id"), nullable=True)
+    ai_message_id = Column(Integer, ForeignKey("messages.id"), nullable=True)
+    result = Column(JSON, nullable=True)  # 流式 complete 事件数据
+    error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class SessionLock(Base):
+    """
+    会话级互斥锁（跨 worker）
+
+    通过主键唯一性实现：插入成功即持有锁，expires_at 过期后可被抢占
+    """
+    __tablename__ = "session_locks"
+
+    session_id = Column(String(36), primary_key=True)
+    owner = Column(String(36), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
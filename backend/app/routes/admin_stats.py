@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from typing import Optional
@@ -12,6 +12,13 @@ from ..models.knowledge_base import KnowledgeDocument
 from ..models.feedback import SessionFeedback
 from ..models.admin_user import AdminUser, AuditLog
 from ..schemas.stats import OverviewStats, DailyStats, TrendStats, DoctorStats
+from ..config import get_settings
+from ..services.ai.prompt_cache import get_prompt_cache_stats
+from ..services.llm_provider import LLMProvider
+from ..services.llm_routing import get_task_latency_stats
+from ..services.llm_scheduler import get_llm_scheduler
+from ..services.tracing import get_trace_store
+from ..services.structured_logging import get_debug_capture
 from .admin_auth import get_current_admin
 
 router = APIRouter(prefix="/admin/stats", tags=["admin-stats"])
@@ -204,3 +211,122 @@ def get_audit_logs(
         "ip_address": log.ip_address,
         "created_at": log.created_at.isoformat() if log.created_at else None
     } for log in logs]
+
+
+@router.get("/llm-scheduler")
+def get_llm_scheduler_stats(
+    admin: AdminUser = Depends(get_current_admin)
+):
+    """LLM 调度器各模型的运行数、各优先级排队数与等待时长"""
+    return {"models": get_llm_scheduler().stats()}
+
+
+@router.get("/llm-providers")
+def get_llm_provider_stats(
+    admin: AdminUser = Depends(get_current_admin)
+):
+    """LLM 服务商健康状态、熔断状态与对冲请求统计"""
+    return LLMProvider.get_pool().stats()
+
+
+@router.get("/llm-tasks")
+def get_llm_task_stats(
+    admin: AdminUser = Depends(get_current_admin)
+):
+    """各任务类型的 LLM 路由配置与调用耗时（用于调整 LLM_TASK_ROUTES）"""
+    return {
+        "routes": get_settings().LLM_TASK_ROUTES,
+        "latency": get_task_latency_stats().stats()
+    }
+
+
+@router.get("/llm-prompt-cache")
+def get_llm_prompt_cache_stats(
+    admin: AdminUser = Depends(get_current_admin)
+):
+    """各模型提示词 token 中命中服务商上下文缓存的比例（来自响应 usage）"""
+    settings = get_settings()
+    return {
+        "explicit_cache_models": settings.LLM_PROMPT_CACHE_MODELS,
+        "min_prefix_tokens": settings.LLM_PROMPT_CACHE_MIN_TOKENS,
+        "models": get_prompt_cache_stats().stats()
+    }
+
+
+@router.get("/traces")
+def list_recent_traces(
+    limit: int = Query(20, ge=1, le=200),
+    admin: AdminUser = Depends(get_current_admin)
+):
+    """最近的请求链路摘要（新的在前）"""
+    return {"traces": get_trace_store().recent(limit)}
+
+
+@router.get("/traces/{trace_id}")
+def get_trace_waterfall(
+    trace_id: str,
+    admin: AdminUser = Depends(get_current_admin)
+):
+    """单条链路的瀑布图（trace_id 见响应头 X-Trace-Id）"""
+    waterfall = get_trace_store().waterfall(trace_id)
+    if waterfall is None:
+        raise HTTPException(status_code=404, detail="链路不存在或已过期")
+    return waterfall
+
+
+@router.get("/turns/{turn_id}/trace")
+def get_turn_waterfall(
+    turn_id: str,
+    admin: AdminUser = Depends(get_current_admin)
+):
+    """问诊轮次的瀑布图（轮次进行中时只包含已结束的 span）"""
+    store = get_trace_store()
+    trace_id = store.trace_for_turn(turn_id)
+    waterfall = store.waterfall(trace_id) if trace_id else None
+    if waterfall is None:
+        raise HTTPException(status_code=404, detail="轮次链路不存在或已过期")
+    return waterfall
+
+
+@router.get("/debug-captures")
+def list_debug_captures(
+    admin: AdminUser = Depends(get_current_admin)
+):
+    """开启中的会话调试捕获"""
+    return {"captures": get_debug_capture().sessions()}
+
+
+@router.post("/debug-captures/{session_id}")
+def enable_debug_capture(
+    session_id: str,
+    ttl_seconds: Optional[int] = Query(None, ge=10, le=86400, description="自动关闭时长（秒），默认 LOG_DEBUG_CAPTURE_TTL_SECONDS"),
+    admin: AdminUser = Depends(get_current_admin)
+):
+    """开启会话调试捕获：该会话的全部级别日志（含 DEBUG）写入环形缓冲，重复开启会清空已有记录"""
+    try:
+        return get_debug_capture().enable(session_id, ttl_seconds=ttl_seconds)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/debug-captures/{session_id}")
+def get_debug_capture_records(
+    session_id: str,
+    admin: AdminUser = Depends(get_current_admin)
+):
+    """读取会话调试捕获的日志"""
+    records = get_debug_capture().records(session_id)
+    if records is None:
+        raise HTTPException(status_code=404, detail="该会话未开启调试捕获或已过期")
+    return {"session_id": session_id, "records": records}
+
+
+@router.delete("/debug-captures/{session_id}")
+def disable_debug_capture(
+    session_id: str,
+    admin: AdminUser = Depends(get_current_admin)
+):
+    """关闭会话调试捕获"""
+    if not get_debug_capture().disable(session_id):
+        raise HTTPException(status_code=404, detail="该会话未开启调试捕获")
+    return {"message": "已关闭"}
@@ -6,12 +6,14 @@ AI 算法服务 API 路由
 - 智能事件聚合
 - 语音转写
 """
+import asyncio
 import logging
 from typing import Optional, List
 from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File, Form
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 
+from ..config import get_settings
 from ..database import get_db
 from ..dependencies import get_current_user
 from ..models.user import User
@@ -24,9 +26,13 @@ from ..services.ai import (
 from ..services.ai.summary_service import get_summary_service
 from ..services.ai.aggregation_service import get_aggregation_service
 from ..services.ai.transcription_service import get_transcription_service
+from ..services.ai.single_flight import get_single_flight, content_version
+from ..services.ai.similarity_index import get_similarity_index
+from ..services.event_session_service import EventSessionService
 
 router = APIRouter(prefix="/ai", tags=["ai"])
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
 
 # ============= 请求/响应模型 =============
@@ -196,26 +202,8 @@ async def generate_ai_summary(
             detail="病历事件不存在"
         )
     
-    # 检查是否已有摘要且不强制重新生成
-    if event.summary and event.ai_analysis and not request.force_regenerate:
-        return SummaryResponse(
-            event_id=event.id,
-            summary=event.summary,
-            key_points=event.ai_analysis.get("key_points", []),
-            symptoms=event.ai_analysis.get("symptoms", []),
-            symptom_details=event.ai_analysis.get("symptom_details", {}),
-            possible_diagnosis=event.ai_analysis.get("possible_diagnosis", []),
-            risk_level=event.ai_analysis.get("risk_level", "low"),
-            risk_warning=event.ai_analysis.get("risk_warning"),
-            recommendations=event.ai_analysis.get("recommendations", []),
-            follow_up_reminders=event.ai_analysis.get("follow_up_reminders", []),
-            timeline=event.ai_analysis.get("timeline", []),
-            confidence=event.ai_analysis.get("confidence", 0.5),
-            message="已有摘要，使用缓存"
-        )
-    
     # 准备数据
-    sessions = event.sessions or []
+    sessions = EventSessionService.load_sessions(db, event)
     attachments = [
         {
             "type": att.type.value if att.type else "unknown",
@@ -233,25 +221,58 @@ async def generate_ai_summary(
         for note in event.notes
     ]
     
-    # 调用 AI 摘要服务
+    # 检查是否已有摘要且不强制重新生成
     summary_service = get_summary_service()
+    if (
+        event.summary and event.ai_analysis and not request.force_regenerate
+        and not summary_service.needs_update(sessions, attachments, notes, event.ai_analysis)
+    ):
+        return SummaryResponse(
+            event_id=event.id,
+            summary=event.summary,
+            key_points=event.ai_analysis.get("key_points", []),
+            symptoms=event.ai_analysis.get("symptoms", []),
+            symptom_details=event.ai_analysis.get("symptom_details", {}),
+            possible_diagnosis=event.ai_analysis.get("possible_diagnosis", []),
+            risk_level=event.ai_analysis.get("risk_level", "low"),
+            risk_warning=event.ai_analysis.get("risk_warning"),
+            recommendations=event.ai_analysis.get("recommendations", []),
+            follow_up_reminders=event.ai_analysis.get("follow_up_reminders", []),
+            timeline=event.ai_analysis.get("timeline", []),
+            confidence=event.ai_analysis.get("confidence", 0.5),
+            message="已有摘要，使用缓存"
+        )
+    
+    # 增量更新摘要（与 /medical-events/{id}/generate-summary 共享同一合并键）
+    version = content_version(event.chief_complaint, event.department, sessions, attachments, notes)
+    existing_summary = event.summary
+    existing_analysis = event.ai_analysis
     
     try:
-        result = await summary_service.generate_summary(
-            chief_complaint=event.chief_complaint or "",
-            department=event.department or "",
-            sessions=sessions,
-            attachments=attachments,
-            notes=notes,
-            existing_analysis=event.ai_analysis
-        )
+        update = await get_single_flight().do(
+            ("summary", event.id, version),
+            lambda: summary_service.update_summary(
+                chief_complaint=event.chief_complaint or "",
+                department=event.department or "",
+                sessions=sessions,
+                attachments=attachments,
+                notes=notes,
+                existing_summary=existing_summary,
+                existing_analysis=existing_analysis,
+                force_regenerate=request.force_regenerate
+            ),
+            use_cache=not request.force_regenerate
+        )
+        result = update.result
         
         # 更新事件
         event.summary = result.summary
-        event.ai_analysis = result.to_dict()
+        event.ai_analysis = update.analysis
+        EventSessionService.save_sessions(db, event, update.sessions)
         db.commit()
+        get_similarity_index().upsert_event(event)
         
-        logger.info(f"Generated AI summary for event {event.id}")
+        logger.info(f"Generated AI summary for event {event.id} (mode={update.mode})")
         
         return SummaryResponse(
             event_id=event.id,
@@ -428,7 +449,7 @@ async def smart_aggregate_session(
     # 获取现有活跃事件
     existing_events = db.query(MedicalEvent).filter(
         MedicalEvent.user_id == current_user.id,
-        MedicalEvent.status == EventStatus.ACTIVE
+        MedicalEvent.status == EventStatus.active
     ).order_by(MedicalEvent.start_time.desc()).limit(10).all()
     
     # 准备数据
@@ -506,11 +527,23 @@ async def find_related_events(
             detail="事件不存在"
         )
     
-    # 获取候选事件
-    candidates = db.query(MedicalEvent).filter(
-        MedicalEvent.user_id == current_user.id,
-        MedicalEvent.id != event_id_int
-    ).order_by(MedicalEvent.start_time.desc()).limit(20).all()
+    # 从相似度索引中取候选事件（覆盖用户全部历史，只把最相似的几个交给 LLM）
+    similarity_index = get_similarity_index()
+    similarity_index.ensure_user(db, current_user.id)
+    similarity_index.upsert_event(target_event)
+    shortlist = similarity_index.query(
+        current_user.id,
+        event_id=target_event.id,
+        top_k=settings.AI_RELATED_CANDIDATES
+    )
+    rank = {eid: i for i, (eid, _) in enumerate(shortlist)}
+    candidates = sorted(
+        db.query(MedicalEvent).filter(
+            MedicalEvent.user_id == current_user.id,
+            MedicalEvent.id.in_(list(rank))
+        ).all(),
+        key=lambda e: rank[e.id]
+    ) if rank else []
     
     if not candidates:
         return FindRelatedResponse(
@@ -545,8 +578,15 @@ async def find_related_events(
     # 调用聚合服务
     aggregation_service = get_aggregation_service()
     
+    version = content_version(target_dict, candidates_list)
+    
     try:
-        related = await aggregation_service.find_related_events(target_dict, candidates_list)
+        related = await get_single_flight().do(
+            ("find_related", target_event.id, version),
+            lambda: aggregation_service.find_related_events(
+                target_dict, candidates_list, time_window_days=None
+            )
+        )
         
         return FindRelatedResponse(
             target_event_id=request.event_id,
@@ -608,6 +648,7 @@ async def merge_events(
         )
     
     # 准备数据
+    sessions_by_event = {e.id: EventSessionService.load_sessions(db, e) for e in events}
     events_list = [
         {
             "id": e.id,
@@ -618,53 +659,92 @@ async def merge_events(
             "end_time": e.end_time.isoformat() if e.end_time else "",
             "summary": e.summary,
             "risk_level": e.risk_level.value if e.risk_level else "low",
-            "sessions": e.sessions or []
+            "sessions": sessions_by_event[e.id]
         }
         for e in events
     ]
     
-    # 调用聚合服务生成合并摘要
+    # 找到最早的事件作为主事件
+    events.sort(key=lambda x: x.start_time or x.created_at)
+    main_event = events[0]
+    
+    # 合并会话记录
+    all_sessions = []
+    for e in events:
+        all_sessions.extend(sessions_by_event[e.id])
+    all_sessions.sort(key=lambda s: s.get("timestamp", ""))
+    
+    attachments = [
+        {
+            "type": att.type.value if att.type else "unknown",
+            "filename": att.filename,
+            "description": att.description
+        }
+        for e in events for att in e.attachments
+    ]
+    notes = [
+        {
+            "content": note.content,
+            "is_important": note.is_important,
+            "created_at": note.created_at.isoformat() if note.created_at else ""
+        }
+        for e in events for note in e.notes
+    ]
+    
+    # 病程分析 + 与摘要服务相同的 map-reduce 摘要流程（复用已有的单次问诊摘要）
     aggregation_service = get_aggregation_service()
+    summary_service = get_summary_service()
+    version = content_version(events_list, attachments, notes)
+    
+    async def run_merge():
+        merge_result, (summary_result, merged_sessions) = await asyncio.gather(
+            aggregation_service.generate_merged_summary(events_list),
+            summary_service.generate_full_summary(
+                chief_complaint=main_event.chief_complaint or "",
+                department=main_event.department or "",
+                sessions=all_sessions,
+                attachments=attachments,
+                notes=notes
+            )
+        )
+        update = summary_service.build_update(summary_result, merged_sessions, attachments, notes)
+        return merge_result, update
     
     try:
-        merge_result = await aggregation_service.generate_merged_summary(events_list)
-        
-        # 找到最早的事件作为主事件
-        events.sort(key=lambda x: x.start_time or x.created_at)
-        main_event = events[0]
-        
-        # 合并会话记录
-        all_sessions = []
-        for e in events:
-            if e.sessions:
-                all_sessions.extend(e.sessions)
+        merge_result, update = await get_single_flight().do(
+            ("merge_events", tuple(sorted(event_ids_int)), version),
+            run_merge
+        )
         
         # 更新主事件
         main_event.title = request.new_title or merge_result.merged_title
-        main_event.summary = merge_result.summary
-        main_event.sessions = all_sessions
-        main_event.session_count = len(all_sessions)
+        main_event.summary = update.result.summary
+        EventSessionService.save_sessions(db, main_event, update.sessions)
         main_event.ai_analysis = {
+            **update.analysis,
             "disease_progression": merge_result.disease_progression,
             "key_milestones": merge_result.key_milestones,
             "current_status": merge_result.current_status,
-            "recommendations": merge_result.recommendations,
             "merged_from": [e.id for e in events[1:]]
         }
         
         # 归档其他事件
         for e in events[1:]:
-            e.status = EventStatus.ARCHIVED
+            e.status = EventStatus.archived
             e.summary = f"[已合并到 {main_event.id}] " + (e.summary or "")
         
         db.commit()
         
+        similarity_index = get_similarity_index()
+        for e in events:
+            similarity_index.upsert_event(e)
+        
         logger.info(f"Merged events {request.event_ids} into {main_event.id}")
         
         return MergeEventsResponse(
-            merged_event_id=main_event.id,
+            merged_event_id=str(main_event.id),
             merged_title=main_event.title,
-            summary=merge_result.summary,
+            summary=update.result.summary,
             disease_progression=merge_result.disease_progression,
             current_status=merge_result.current_status,
             overall_risk_level=merge_result.overall_risk_level,
@@ -338,8 +338,8 @@ def set_password(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error_msg)
     
     # 设置密码
-    success = AuthService.set_user_password(db, current_user, request_body.new_password)
-    if not success:
+    updated_user = AuthService.set_user_password(db, current_user, request_body.new_password)
+    if updated_user is None:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="密码设置失败，请重试"
@@ -349,7 +349,7 @@ def set_password(
         "ip": client_ip
     })
     
-    return UserResponse.model_validate(current_user)
+    return UserResponse.model_validate(updated_user)
 
 
 @router.post("/password/reset", response_model=LoginResponse)
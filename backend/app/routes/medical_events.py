@@ -11,18 +11,24 @@
 
 权限控制：用户只能访问自己的病历数据
 """
+import base64
+import json
 import logging
+import os
 from datetime import datetime, timedelta
-from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
+from typing import List, Optional
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import TypeAdapter
+from sqlalchemy.orm import Session, joinedload, load_only, selectinload
+from sqlalchemy import or_, and_, func
 
+from ..config import get_settings
 from ..database import get_db
 from ..dependencies import get_current_user
 from ..models.user import User
 from ..models.medical_event import (
-    MedicalEvent, EventAttachment, EventNote, ExportRecord, ExportAccessLog,
+    MedicalEvent, EventAttachment, EventNote, ExportRecord, ExportJobStatus,
     EventStatus, RiskLevel, AgentType, AttachmentType
 )
 from ..schemas.medical_event import (
@@ -33,9 +39,16 @@ from ..schemas.medical_event import (
     AggregateSessionRequest, AggregateResponse, GenerateSummaryRequest, GenerateSummaryResponse,
     AIAnalysisSchema, SessionRecordSchema, SessionSummarySchema
 )
+from ..services.ai.similarity_index import get_similarity_index
+from ..services.event_session_service import EventSessionService, MAX_SESSION_MESSAGES
+from ..services.export_service import get_export_service, parse_byte_range
+from ..services.share_link_service import (
+    ShareLinkService, ShareSnapshot, get_access_log_buffer, get_share_snapshot_cache
+)
 
 router = APIRouter(prefix="/medical-events", tags=["medical-events"])
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
 
 # ============= 权限检查辅助函数 =============
@@ -89,6 +102,7 @@ def create_medical_event(
     db.add(event)
     db.commit()
     db.refresh(event)
+    get_similarity_index().upsert_event(event)
     
     logger.info(f"Created medical event {event.id} for user {current_user.id}")
     return _build_event_detail(event)
@@ -107,15 +121,21 @@ def list_medical_events(
     page_size: int = Query(20, ge=1, le=100),
     sort_by: str = Query("created_at", regex="^(created_at|updated_at|start_time)$"),
     sort_order: str = Query("desc", regex="^(asc|desc)$"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），传入后忽略 page"),
+    approximate_total: bool = Query(False, description="是否只估算总数（超过上限时返回上限）"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     获取病历事件列表
     
-    支持搜索和多维度筛选，只返回当前用户的数据
+    支持搜索和多维度筛选，只返回当前用户的数据。
+    推荐使用游标分页：按 (排序字段, id) 定位下一页，翻页深度不影响查询耗时
     """
-    query = db.query(MedicalEvent).filter(MedicalEvent.user_id == current_user.id)
+    # 列表只需要摘要字段，不加载 ai_analysis / sessions 等 JSON 大字段
+    query = db.query(MedicalEvent).options(load_only(*_SUMMARY_COLUMNS)).filter(
+        MedicalEvent.user_id == current_user.id
+    )
     
     # 关键词搜索
     if keyword:
@@ -143,24 +163,58 @@ def list_medical_events(
     if end_date:
         query = query.filter(MedicalEvent.start_time <= end_date)
     
-    # 总数
-    total = query.count()
+    # 总数（估算模式最多统计 EVENT_LIST_APPROX_COUNT_CAP 条）
+    total_approximate = False
+    if approximate_total:
+        cap = settings.EVENT_LIST_APPROX_COUNT_CAP
+        capped = query.with_entities(MedicalEvent.id).limit(cap + 1).subquery()
+        total = db.query(func.count()).select_from(capped).scalar() or 0
+        if total > cap:
+            total, total_approximate = cap, True
+    else:
+        total = query.count()
     
-    # 排序
+    # 排序（id 作为第二排序键，保证游标位置唯一）
     sort_column = getattr(MedicalEvent, sort_by)
-    if sort_order == "desc":
-        query = query.order_by(sort_column.desc())
+    descending = sort_order == "desc"
+    
+    # 直接比较列本身，筛选 + 排序可由复合索引完成（SQLite 下的时间格式由 SortableDateTime 统一）
+    if cursor:
+        sort_value, last_id = _decode_cursor(cursor, sort_by, sort_order)
+        if sort_value is None:
+            query = query.filter(MedicalEvent.id < last_id if descending else MedicalEvent.id > last_id)
+        elif descending:
+            query = query.filter(or_(
+                sort_column < sort_value,
+                and_(sort_column == sort_value, MedicalEvent.id < last_id)
+            ))
+        else:
+            query = query.filter(or_(
+                sort_column > sort_value,
+                and_(sort_column == sort_value, MedicalEvent.id > last_id)
+            ))
+    
+    if descending:
+        query = query.order_by(sort_column.desc(), MedicalEvent.id.desc())
     else:
-        query = query.order_by(sort_column.asc())
+        query = query.order_by(sort_column.asc(), MedicalEvent.id.asc())
     
-    # 分页
-    events = query.offset((page - 1) * page_size).limit(page_size).all()
+    # 分页（多取一条判断是否还有下一页）
+    if not cursor:
+        query = query.offset((page - 1) * page_size)
+    rows = query.limit(page_size + 1).all()
+    events = rows[:page_size]
+    next_cursor = None
+    if len(rows) > page_size and events:
+        next_cursor = _encode_cursor(events[-1], sort_by, sort_order)
     
     return MedicalEventListResponse(
         events=[_build_event_summary(e) for e in events],
         total=total,
         page=page,
-        page_size=page_size
+        page_size=page_size,
+        next_cursor=next_cursor,
+        total_approximate=total_approximate
     )
 
 
@@ -197,6 +251,7 @@ def update_medical_event(
     
     db.commit()
     db.refresh(event)
+    get_similarity_index().upsert_event(event)
     
     logger.info(f"Updated medical event {event_id}")
     return _build_event_detail(event)
@@ -222,8 +277,10 @@ def delete_medical_event(
     
     event = get_event_with_permission(event_id, current_user, db)
     
+    user_id, deleted_id = event.user_id, event.id
     db.delete(event)
     db.commit()
+    get_similarity_index().remove_event(user_id, deleted_id)
     
     logger.info(f"Deleted medical event {event_id}")
 
@@ -509,15 +566,6 @@ def aggregate_session(
         "risk_level": risk_level,
         "stage": stage,
         "message_count": len(messages),
-        "messages": [
-            {
-                "role": msg.sender.value if msg.sender else "user",
-                "content": msg.content,
-                "timestamp": msg.created_at.isoformat() if msg.created_at else "",
-                "type": msg.message_type or "text"
-            }
-            for msg in messages[:50]  # 限制消息数量，避免JSON过大
-        ],
         # 科室特定数据（从 agent_state 提取）
         "skin_analyses": state.get("skin_analyses", []),
         "ecg_interpretations": state.get("ecg_interpretations", []),
@@ -538,23 +586,13 @@ def aggregate_session(
     
     is_new_event = False
     
+    # 对话内容按消息 ID 引用，限制数量与旧版 JSON 一致
+    message_ids = [msg.id for msg in messages[:MAX_SESSION_MESSAGES]]
+    
     if existing_event:
-        # 添加到现有事件
-        sessions_list = existing_event.sessions or []
-        # 检查是否已存在该会话
-        existing_session_idx = next(
-            (i for i, s in enumerate(sessions_list) if s.get("session_id") == request.session_id),
-            None
-        )
-        if existing_session_idx is not None:
-            # 更新现有会话数据
-            sessions_list[existing_session_idx] = session_data
-        else:
-            # 添加新会话
-            sessions_list.append(session_data)
-        
-        existing_event.sessions = sessions_list
-        existing_event.session_count = len(sessions_list)
+        # 添加到现有事件（同一会话重复聚合时更新该会话记录）
+        EventSessionService.upsert_session(db, existing_event, session_data, message_ids)
+        existing_event.session_count = len(existing_event.session_records)
         
         # 更新主诉（如果当前会话有主诉且事件没有主诉）
         if chief_complaint and not existing_event.chief_complaint:
@@ -577,14 +615,16 @@ def aggregate_session(
             chief_complaint=chief_complaint,
             risk_level=RiskLevel(risk_level) if risk_level in ["low", "medium", "high", "emergency"] else RiskLevel.low,
             status=EventStatus.active,
-            sessions=[session_data],
+            sessions=[],
             session_count=1
         )
         db.add(event)
+        EventSessionService.upsert_session(db, event, session_data, message_ids)
         is_new_event = True
     
     db.commit()
     db.refresh(event)
+    get_similarity_index().upsert_event(event)
     
     logger.info(f"Successfully aggregated session {request.session_id} to event {event.id} (new={is_new_event})")
     
@@ -622,19 +662,12 @@ async def generate_summary(
     调用AI生成结构化摘要
     """
     from ..services.ai.summary_service import get_summary_service
+    from ..services.ai.single_flight import get_single_flight, content_version
     
     event = get_event_with_permission(event_id, current_user, db)
     
-    if event.summary and event.ai_analysis and not force_regenerate:
-        return GenerateSummaryResponse(
-            event_id=event.id,
-            summary=event.summary,
-            ai_analysis=AIAnalysisSchema(**event.ai_analysis) if event.ai_analysis else AIAnalysisSchema(),
-            message="已有摘要，无需重新生成"
-        )
-    
     # 准备数据
-    sessions = event.sessions or []
+    sessions = EventSessionService.load_sessions(db, event)
     attachments = [
         {
             "type": att.type.value if att.type else "unknown",
@@ -652,39 +685,50 @@ async def generate_summary(
         for note in event.notes
     ]
     
-    # 调用 AI 摘要服务
     summary_service = get_summary_service()
     
+    if (
+        event.summary and event.ai_analysis and not force_regenerate
+        and not summary_service.needs_update(sessions, attachments, notes, event.ai_analysis)
+    ):
+        return GenerateSummaryResponse(
+            event_id=event.id,
+            summary=event.summary,
+            ai_analysis=AIAnalysisSchema(**event.ai_analysis) if event.ai_analysis else AIAnalysisSchema(),
+            message="已有摘要，无需重新生成"
+        )
+    
+    # 增量更新摘要（相同内容的并发请求合并为一次计算）
+    version = content_version(event.chief_complaint, event.department, sessions, attachments, notes)
+    existing_summary = event.summary
+    existing_analysis = event.ai_analysis
+    
     try:
-        result = await summary_service.generate_summary(
-            chief_complaint=event.chief_complaint or "",
-            department=event.department or "",
-            sessions=sessions,
-            attachments=attachments,
-            notes=notes,
-            existing_analysis=event.ai_analysis
+        update = await get_single_flight().do(
+            ("summary", event.id, version),
+            lambda: summary_service.update_summary(
+                chief_complaint=event.chief_complaint or "",
+                department=event.department or "",
+                sessions=sessions,
+                attachments=attachments,
+                notes=notes,
+                existing_summary=existing_summary,
+                existing_analysis=existing_analysis,
+                force_regenerate=force_regenerate
+            ),
+            use_cache=not force_regenerate
         )
-        
-        # 构建 AI 分析结果
-        ai_analysis = {
-            "symptoms": result.symptoms,
-            "possible_diagnosis": result.possible_diagnosis,
-            "recommendations": result.recommendations,
-            "follow_up_reminders": result.follow_up_reminders,
-            "timeline": result.timeline,
-            "key_points": result.key_points,
-            "symptom_details": result.symptom_details,
-            "risk_level": result.risk_level,
-            "risk_warning": result.risk_warning,
-            "confidence": result.confidence
-        }
+        result = update.result
+        ai_analysis = update.analysis
         
         event.summary = result.summary
         event.ai_analysis = ai_analysis
+        EventSessionService.save_sessions(db, event, update.sessions)
         db.commit()
         db.refresh(event)
+        get_similarity_index().upsert_event(event)
         
-        logger.info(f"Generated AI summary for event {event_id}")
+        logger.info(f"Generated AI summary for event {event_id} (mode={update.mode})")
         
         return GenerateSummaryResponse(
             event_id=event.id,
@@ -731,6 +775,7 @@ async def generate_summary(
 def create_export(
     request: ExportCreateRequest,
     http_request: Request,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -739,6 +784,7 @@ def create_export(
     
     支持单个或多个事件导出为 PDF 或生成共享链接
     需要二次确认（通过请求体确认）
+    PDF 在后台渲染，通过 file_status 查看进度，完成后从 file_url 下载
     """
     # 验证所有事件的权限
     events = []
@@ -765,13 +811,18 @@ def create_export(
         if request.max_views:
             export_record.max_views = request.max_views
     
-    # TODO: PDF生成逻辑
-    if request.export_type == "pdf":
-        # 这里应该调用PDF生成服务
-        export_record.file_url = f"/api/exports/{export_record.id}/download"
-    
     db.add(export_record)
     
+    # PDF：登记渲染任务，内容未变化时复用已渲染的文件
+    job = None
+    if request.export_type == "pdf":
+        export_service = get_export_service()
+        job = export_service.prepare_job(
+            db, export_record, events, export_record.export_options, current_user
+        )
+        db.flush()
+        export_record.file_url = f"/api/medical-events/exports/{export_record.id}/download"
+    
     # 更新事件导出计数
     for event in events:
         event.export_count += 1
@@ -781,6 +832,9 @@ def create_export(
     db.commit()
     db.refresh(export_record)
     
+    if job is not None and job.status != ExportJobStatus.ready:
+        background_tasks.add_task(export_service.run_job, job.id)
+    
     # 构建响应
     base_url = str(http_request.base_url).rstrip("/")
     share_url = None
@@ -788,23 +842,58 @@ def create_export(
         share_url = f"{base_url}/api/medical-events/share/{export_record.share_token}"
     
     return ExportResponse(
-        export_id=export_record.id,
+        export_id=str(export_record.id),
         export_type=export_record.export_type,
         file_url=export_record.file_url,
         share_url=share_url,
         share_token=export_record.share_token,
         expires_at=export_record.expires_at,
+        file_status=job.status.value if job is not None else None,
         message="导出创建成功"
     )
 
 
+@router.get("/exports/{export_id}/download")
+def download_export(
+    export_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    下载导出的 PDF
+    
+    支持 Range 请求（断点续传 / 分段下载）；渲染未完成时返回 202
+    """
+    export = db.query(ExportRecord).filter(
+        ExportRecord.id == export_id,
+        ExportRecord.user_id == current_user.id
+    ).first()
+    
+    if not export or not export.is_active:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="导出记录不存在")
+    
+    job = export.job
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="该导出没有 PDF 文件")
+    if job.status == ExportJobStatus.failed:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="PDF 生成失败，请重新导出")
+    if job.status != ExportJobStatus.ready or not job.file_path or not os.path.exists(job.file_path):
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content={"file_status": job.status.value, "message": "PDF 正在生成，请稍后重试"}
+        )
+    
+    return _file_response(job.file_path, f"medical_record_{export.id}.pdf", request.headers.get("range"))
+
+
 @router.get("/exports", response_model=list[ExportRecordSchema])
 def list_exports(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """获取导出记录列表"""
-    exports = db.query(ExportRecord).filter(
+    exports = db.query(ExportRecord).options(selectinload(ExportRecord.job)).filter(
         ExportRecord.user_id == current_user.id
     ).order_by(ExportRecord.created_at.desc()).all()
     
@@ -828,6 +917,7 @@ def delete_export(
     
     export.is_active = False
     db.commit()
+    get_share_snapshot_cache().invalidate(export.share_token)
 
 
 @router.get("/share/{token}", response_model=ShareLinkResponse)
@@ -841,53 +931,87 @@ def access_share_link(
     访问共享链接（无需登录）
     
     验证链接有效性、密码、过期时间、访问次数
+    共享内容读取缓存的快照；访问次数用一条带条件的 UPDATE 原子递增；访问日志异步批量写入
     """
-    export = db.query(ExportRecord).filter(
-        ExportRecord.share_token == token,
-        ExportRecord.is_active == True
-    ).first()
-    
-    if not export:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="链接不存在或已失效")
+    cache = get_share_snapshot_cache()
+    snapshot = cache.get(token)
+    if snapshot is None:
+        export = db.query(ExportRecord).options(joinedload(ExportRecord.job)).filter(
+            ExportRecord.share_token == token,
+            ExportRecord.is_active == True
+        ).first()
+        if not export:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="链接不存在或已失效")
+        snapshot = _build_share_snapshot(db, export)
+        cache.set(token, snapshot)
+    
+    now = datetime.utcnow()
     
     # 验证过期时间
-    if export.expires_at and export.expires_at < datetime.utcnow():
+    if snapshot.expires_at and snapshot.expires_at < now:
         raise HTTPException(status_code=status.HTTP_410_GONE, detail="链接已过期")
     
-    # 验证访问次数
-    if export.max_views and export.view_count >= export.max_views:
-        raise HTTPException(status_code=status.HTTP_410_GONE, detail="链接已达最大访问次数")
-    
     # 验证密码
-    if export.share_password and export.share_password != password:
+    if snapshot.share_password and snapshot.share_password != password:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="密码错误")
     
-    # 获取事件数据
-    events = db.query(MedicalEvent).filter(
-        MedicalEvent.id.in_(export.event_ids)
-    ).all()
-    
-    # 记录访问
-    export.view_count += 1
-    export.last_viewed_at = datetime.utcnow()
+    # 记录访问（同时校验链接状态与访问次数）
+    view_count = ShareLinkService.consume_view(db, snapshot.export_id, now)
+    if view_count is None:
+        cache.invalidate(token)
+        export = db.query(ExportRecord).filter(ExportRecord.id == snapshot.export_id).first()
+        if not export or not export.is_active:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="链接不存在或已失效")
+        if export.expires_at and export.expires_at < now:
+            raise HTTPException(status_code=status.HTTP_410_GONE, detail="链接已过期")
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="链接已达最大访问次数")
     
-    access_log = ExportAccessLog(
-        export_id=export.id,
+    get_access_log_buffer().add(
+        snapshot.export_id,
         ip_address=request.client.host if request and request.client else None,
-        user_agent=request.headers.get("user-agent") if request else None
+        user_agent=request.headers.get("user-agent") if request else None,
+        accessed_at=now
     )
-    db.add(access_log)
-    db.commit()
     
-    return ShareLinkResponse(
-        events=[_build_event_detail(e) for e in events],
-        export_info=_build_export_record(export),
-        accessed_at=datetime.utcnow()
-    )
+    return Response(content=snapshot.render(view_count, now), media_type="application/json")
 
 
 # ============= 辅助函数 =============
 
+_EVENT_DETAIL_LIST = TypeAdapter(List[MedicalEventDetailSchema])
+
+# 列表摘要需要的字段
+_SUMMARY_COLUMNS = (
+    MedicalEvent.id, MedicalEvent.title, MedicalEvent.department, MedicalEvent.agent_type,
+    MedicalEvent.status, MedicalEvent.risk_level, MedicalEvent.start_time, MedicalEvent.end_time,
+    MedicalEvent.summary, MedicalEvent.chief_complaint, MedicalEvent.attachment_count,
+    MedicalEvent.session_count, MedicalEvent.created_at, MedicalEvent.updated_at
+)
+
+
+def _encode_cursor(event: MedicalEvent, sort_by: str, sort_order: str) -> str:
+    """编码分页游标：(排序字段, 排序方向, 排序值, id)"""
+    value = getattr(event, sort_by)
+    payload = [sort_by, sort_order, value.isoformat() if value else None, event.id]
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str, sort_by: str, sort_order: str):
+    """解析分页游标，排序条件与游标不一致时报错"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort_by, cursor_sort_order, value, last_id = json.loads(raw)
+        sort_value = datetime.fromisoformat(value) if value else None
+        last_id = int(last_id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="无效的分页游标")
+    
+    if cursor_sort_by != sort_by or cursor_sort_order != sort_order:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="分页游标与排序条件不一致")
+    return sort_value, last_id
+
+
 def _build_event_summary(event: MedicalEvent) -> MedicalEventSummarySchema:
     """构建事件摘要"""
     # 安全获取枚举值，防止无效数据导致500错误
@@ -937,9 +1061,18 @@ def _build_event_detail(event: MedicalEvent) -> MedicalEventDetailSchema:
         except Exception as e:
             logger.warning(f"Failed to parse ai_analysis for event {event.id}: {e}")
     
-    # 安全解析会话记录
+    # 安全解析会话记录（只读取概要字段，对话内容等大字段延迟加载）
     sessions = []
-    if event.sessions:
+    if event.session_records:
+        for r in event.session_records:
+            sessions.append(SessionRecordSchema(
+                session_id=r.session_id,
+                session_type=r.session_type or "",
+                timestamp=r.started_at.isoformat() if r.started_at else "",
+                summary=r.summary
+            ))
+    elif event.session_count and event.sessions:
+        # 未迁移的旧数据
         for s in event.sessions:
             try:
                 sessions.append(SessionRecordSchema(**s))
@@ -1003,10 +1136,64 @@ def _build_event_detail(event: MedicalEvent) -> MedicalEventDetailSchema:
     )
 
 
+def _file_response(path: str, filename: str, range_header: Optional[str]):
+    """文件下载响应（支持单区间 Range 请求）"""
+    size = os.path.getsize(path)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    }
+    try:
+        byte_range = parse_byte_range(range_header, size)
+    except ValueError:
+        return Response(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    
+    start, end = byte_range if byte_range else (0, size - 1)
+    length = end - start + 1
+    
+    def iter_file():
+        with open(path, "rb") as fp:
+            fp.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = fp.read(min(64 * 1024, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    
+    headers["Content-Length"] = str(length)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(
+        iter_file(),
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        media_type="application/pdf",
+        headers=headers
+    )
+
+
+def _build_share_snapshot(db: Session, export: ExportRecord) -> ShareSnapshot:
+    """构建共享链接快照（事件详情预先序列化）"""
+    events = db.query(MedicalEvent).filter(
+        MedicalEvent.id.in_(export.event_ids)
+    ).all()
+    return ShareSnapshot(
+        export_id=export.id,
+        expires_at=export.expires_at,
+        share_password=export.share_password,
+        events_json=_EVENT_DETAIL_LIST.dump_json([_build_event_detail(e) for e in events]),
+        export_info=_build_export_record(export)
+    )
+
+
 def _build_export_record(export: ExportRecord) -> ExportRecordSchema:
     """构建导出记录"""
     return ExportRecordSchema(
-        id=export.id,
+        id=str(export.id),
         export_type=export.export_type,
         file_url=export.file_url,
         share_token=export.share_token,
@@ -1016,5 +1203,6 @@ def _build_export_record(export: ExportRecord) -> ExportRecordSchema:
         max_views=export.max_views,
         is_active=export.is_active,
         created_at=export.created_at,
-        event_ids=export.event_ids or []
+        event_ids=[str(eid) for eid in (export.event_ids or [])],
+        file_status=export.job.status.value if export.job else None
     )
@@ -1,22 +1,42 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Optional, Dict, Any, AsyncGenerator, Union
+from typing import List, Optional, Dict, Any, AsyncGenerator, Callable, Union
 import uuid
 import json
 import asyncio
 from ..database import get_db
+from ..config import get_settings
 from ..schemas.session import SessionCreate, SessionResponse, EnhancedSessionCreate, AgentCapabilitiesResponse
 from ..schemas.message import MessageCreate, MessageResponse, MessageListResponse, EnhancedMessageCreate
 from ..models.session import Session as SessionModel
 from ..models.message import Message, SenderType
 from ..models.doctor import Doctor
 from ..models.user import User
+from ..models.session_turn import SessionTurn, TurnStatus
 from ..dependencies import get_current_user
 from ..services.qwen_service import QwenService
 from ..services.agent_router import AgentRouter
+from ..services.llm_scheduler import llm_priority, priority_for_state
+from ..services.metrics import GenerationTimer
+from ..services.tracing import start_span
+from ..services.structured_logging import get_logger, log_context
+from ..services.stream_replay import (
+    TurnStreamBuffer, format_sse, get_stream_registry, parse_last_event_id, turn_events
+)
+from ..services.session_turn_service import (
+    SessionTurnService, SessionBusyError, IdempotencyConflictError,
+    compute_request_hash, get_session_lock
+)
 
 router = APIRouter(prefix="/sessions", tags=["sessions"])
+log = get_logger(__name__)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no"
+}
 
 
 @router.post("", response_model=SessionResponse)
@@ -159,7 +179,8 @@ async def send_message(
     - content: 文本内容
     - attachments: [{type: "image", url: "...", base64: "..."}]
     - action: "conversation" | "analyze_skin" | "interpret_report" | ...
-    - 流式响应（Accept: text/event-stream）
+    - 流式响应（Accept: text/event-stream）：meta → chunk（文本片段）/ structured_partial（诊断卡等结构化结果中
+      已完整的字段，{source, updates: [{path, value}]}）→ complete 或 error
     """
     session = db.query(SessionModel).filter(
         SessionModel.id == session_id,
@@ -190,138 +211,298 @@ async def send_message(
             elif isinstance(att, dict):
                 attachments_data.append(att)
 
-    # 保存用户消息
-    user_message = Message(
-        session_id=session_id,
-        sender=SenderType.user,
-        content=content,
-        message_type="text" if not attachments_data else "image",
-        attachments=attachments_data if attachments_data else None
-    )
-    db.add(user_message)
-    db.commit()
-    db.refresh(user_message)
-
-    # 恢复智能体状态
-    state = session.agent_state
-    print(f"[send_message] 从数据库恢复的 agent_state:")
-    print(f"  - agent_state is None: {state is None}")
-    if state:
-        print(f"  - chief_complaint: {state.get('chief_complaint', '')}")
-        print(f"  - skin_location: {state.get('skin_location', '')}")
-        print(f"  - questions_asked: {state.get('questions_asked', 0)}")
-        print(f"  - stage: {state.get('stage', '')}")
-    else:
-        print(f"  - 状态为空，将创建新状态")
-    
-    if not state:
-        state = await agent.create_initial_state(session_id, current_user.id)
-        print(f"[send_message] 创建了新的初始状态")
-
     # 检查是否请求流式响应
     accept_header = http_request.headers.get("accept", "")
     want_stream = "text/event-stream" in accept_header
 
-    if want_stream:
-        # 预先获取医生信息（避免在生成器中使用已关闭的数据库会话）
-        doctor = db.query(Doctor).filter(Doctor.id == session.doctor_id).first() if session.doctor_id else None
-        doctor_info = None
-        if doctor:
-            doctor_info = {
-                "name": doctor.name,
-                "title": doctor.title if doctor.title else "主治医师",
-                "specialty": doctor.specialty if doctor.specialty else "全科医学",
-                "persona_prompt": doctor.ai_persona_prompt if hasattr(doctor, 'ai_persona_prompt') else None,
-                "model": doctor.ai_model if hasattr(doctor, 'ai_model') else None,
-                "temperature": doctor.ai_temperature if hasattr(doctor, 'ai_temperature') else None,
-                "max_tokens": doctor.ai_max_tokens if hasattr(doctor, 'ai_max_tokens') else None
-            }
+    # 幂等键：重复请求直接重放进行中/已完成的轮次，不再重复调用 LLM
+    idempotency_key = http_request.headers.get("idempotency-key") or None
+    try:
+        turn, should_run = SessionTurnService.claim_turn(
+            db, session_id, idempotency_key,
+            compute_request_hash(content, attachments_data, action)
+        )
+    except IdempotencyConflictError:
+        raise HTTPException(status_code=422, detail="幂等键已被用于不同的请求")
+    if not should_run:
+        return await replay_turn(turn, want_stream, http_request, db)
+
+    # 同一会话的轮次串行执行，避免并发覆盖 agent_state
+    session_lock = get_session_lock()
+    try:
+        lock_owner = await session_lock.acquire(session_id)
+    except SessionBusyError:
+        SessionTurnService.finish_turn(turn.id, TurnStatus.failed, error="会话正忙")
+        raise HTTPException(status_code=409, detail="会话正忙，请稍后重试")
+
+    handed_over = False  # 流式响应时锁由后台任务负责释放
+    try:
+        # 获取锁后重新读取会话，拿到上一轮保存的最新状态
+        db.refresh(session)
+
+        # 保存用户消息
+        user_message = Message(
+            session_id=session_id,
+            sender=SenderType.user,
+            content=content,
+            message_type="text" if not attachments_data else "image",
+            attachments=attachments_data if attachments_data else None
+        )
+        db.add(user_message)
+        db.flush()
+        turn.user_message_id = user_message.id
+        db.commit()
+        db.refresh(user_message)
+
+        # 恢复智能体状态
+        state = session.agent_state
+        if state:
+            log.debug(
+                "agent_state_restored",
+                session_id=session_id,
+                stage=state.get("stage"),
+                questions_asked=state.get("questions_asked", 0),
+                chief_complaint=lambda: state.get("chief_complaint")
+            )
+        else:
+            state = await agent.create_initial_state(session_id, current_user.id)
+            log.debug("agent_state_created", session_id=session_id)
+
+        if want_stream:
+            # 预先获取医生信息（避免在生成器中使用已关闭的数据库会话）
+            doctor = db.query(Doctor).filter(Doctor.id == session.doctor_id).first() if session.doctor_id else None
+            doctor_info = None
+            if doctor:
+                doctor_info = {
+                    "name": doctor.name,
+                    "title": doctor.title if doctor.title else "主治医师",
+                    "specialty": doctor.specialty if doctor.specialty else "全科医学",
+                    "persona_prompt": doctor.ai_persona_prompt if hasattr(doctor, 'ai_persona_prompt') else None,
+                    "model": doctor.ai_model if hasattr(doctor, 'ai_model') else None,
+                    "temperature": doctor.ai_temperature if hasattr(doctor, 'ai_temperature') else None,
+                    "max_tokens": doctor.ai_max_tokens if hasattr(doctor, 'ai_max_tokens') else None
+                }
         
-        return StreamingResponse(
-            stream_agent_response(
+            buffer = start_agent_turn(
                 agent=agent,
                 state=state,
                 user_input=content,
                 attachments=attachments_data,
                 action=action,
                 session_id=session.id,
+                user_id=current_user.id,
                 agent_type=agent_type,
-                doctor_info=doctor_info
-            ),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no"
-            }
-        )
-    else:
-        # 非流式响应
-        doctor = db.query(Doctor).filter(Doctor.id == session.doctor_id).first() if session.doctor_id else None
+                doctor_info=doctor_info,
+                turn_id=turn.id,
+                on_finish=lambda: session_lock.release(session_id, lock_owner)
+            )
+            handed_over = True
+            return StreamingResponse(
+                buffer.stream(),
+                media_type="text/event-stream",
+                headers={**SSE_HEADERS, "X-Turn-Id": buffer.turn_id}
+            )
+        else:
+            # 非流式响应
+            doctor = db.query(Doctor).filter(Doctor.id == session.doctor_id).first() if session.doctor_id else None
         
-        # 准备额外参数
-        extra_kwargs = {}
-        if agent_type == "general":
-            # 通用智能体需要医生信息和历史记录
-            history = db.query(Message).filter(
-                Message.session_id == session_id
-            ).order_by(Message.created_at.desc()).limit(10).all()
-            history.reverse()
-            history_data = [{"sender": m.sender.value, "content": m.content} for m in history]
+            # 准备额外参数
+            extra_kwargs = {}
+            if agent_type == "general":
+                # 通用智能体需要医生信息和历史记录
+                history = db.query(Message).filter(
+                    Message.session_id == session_id
+                ).order_by(Message.created_at.desc()).limit(10).all()
+                history.reverse()
+                history_data = [{"sender": m.sender.value, "content": m.content} for m in history]
             
-            rag_context = ""
-            if doctor and hasattr(doctor, 'knowledge_base_id') and doctor.knowledge_base_id:
-                from ..services.knowledge_service import KnowledgeService
-                rag_context = KnowledgeService.get_context_for_query(
-                    db, doctor.knowledge_base_id, content
-                )
+                rag_context = ""
+                if doctor and hasattr(doctor, 'knowledge_base_id') and doctor.knowledge_base_id:
+                    from ..services.knowledge_service import KnowledgeService
+                    rag_context = KnowledgeService.get_context_for_query(
+                        db, doctor.knowledge_base_id, content
+                    )
             
-            extra_kwargs = {
-                "doctor_info": {
-                    "name": doctor.name if doctor else "AI助手",
-                    "title": doctor.title if doctor else "主治医师",
-                    "specialty": doctor.specialty if doctor else "全科医学",
-                    "persona_prompt": doctor.ai_persona_prompt if doctor else None,
-                    "model": doctor.ai_model if doctor else None,
-                    "temperature": doctor.ai_temperature if doctor else None,
-                    "max_tokens": doctor.ai_max_tokens if doctor else None
-                } if doctor else None,
-                "history": history_data,
-                "rag_context": rag_context
-            }
+                extra_kwargs = {
+                    "doctor_info": {
+                        "name": doctor.name if doctor else "AI助手",
+                        "title": doctor.title if doctor else "主治医师",
+                        "specialty": doctor.specialty if doctor else "全科医学",
+                        "persona_prompt": doctor.ai_persona_prompt if doctor else None,
+                        "model": doctor.ai_model if doctor else None,
+                        "temperature": doctor.ai_temperature if doctor else None,
+                        "max_tokens": doctor.ai_max_tokens if doctor else None
+                    } if doctor else None,
+                    "history": history_data,
+                    "rag_context": rag_context
+                }
         
-        updated_state = await agent.run(
-            state=state,
-            user_input=content,
-            attachments=attachments_data,
-            action=action,
-            **extra_kwargs
-        )
+            updated_state = await agent.run(
+                state=state,
+                user_input=content,
+                attachments=attachments_data,
+                action=action,
+                **extra_kwargs
+            )
         
-        # 保存 AI 消息
-        ai_content = updated_state.get("current_response", "")
-        ai_message = Message(
-            session_id=session_id,
-            sender=SenderType.ai,
-            content=ai_content,
-            message_type="text",
-            structured_data=extract_structured_data(updated_state)
-        )
-        db.add(ai_message)
+            # 保存 AI 消息
+            ai_content = updated_state.get("current_response", "")
+            ai_message = Message(
+                session_id=session_id,
+                sender=SenderType.ai,
+                content=ai_content,
+                message_type="text",
+                structured_data=extract_structured_data(updated_state)
+            )
+            db.add(ai_message)
         
-        # 更新会话
-        session.agent_state = updated_state
-        session.last_message = ai_content[:100] if ai_content else ""
-        db.commit()
-        db.refresh(ai_message)
+            # 更新会话
+            session.agent_state = updated_state
+            session.last_message = ai_content[:100] if ai_content else ""
+            db.commit()
+            db.refresh(ai_message)
+            SessionTurnService.finish_turn(
+                turn.id, TurnStatus.completed, ai_message_id=ai_message.id
+            )
         
-        return {
-            "user_message": MessageResponse.model_validate(user_message),
-            "ai_message": MessageResponse.model_validate(ai_message)
-        }
+            return {
+                "user_message": MessageResponse.model_validate(user_message),
+                "ai_message": MessageResponse.model_validate(ai_message)
+            }
+    except Exception as e:
+        SessionTurnService.finish_turn(turn.id, TurnStatus.failed, error=str(e))
+        raise
+    finally:
+        if not handed_over:
+            session_lock.release(session_id, lock_owner)
+
+
+async def replay_turn(
+    turn: SessionTurn,
+    want_stream: bool,
+    http_request: Request,
+    db: Session
+):
+    """
+    重放已存在的轮次（幂等键命中）
+    
+    - 流式：优先从重放缓冲续传；缓冲不在本 worker 或已过期时，等待轮次结束后返回 complete 事件
+    - 非流式：等待轮次结束后返回保存的消息
+    """
+    settings = get_settings()
+    if want_stream:
+        start_id = parse_last_event_id(http_request.headers.get("last-event-id"))
+        return StreamingResponse(
+            stream_turn_replay(turn.id, turn.session_id, start_id, settings.SESSION_TURN_LOCK_TTL_SECONDS),
+            media_type="text/event-stream",
+            headers={**SSE_HEADERS, "X-Turn-Id": turn.id}
+        )
+
+    if turn.status == TurnStatus.running.value:
+        turn = await SessionTurnService.wait_for_turn(turn.id, timeout=settings.SESSION_TURN_LOCK_TTL_SECONDS)
+        if turn is None:
+            raise HTTPException(status_code=409, detail="请求正在处理中，请稍后重试")
+    if turn.status == TurnStatus.failed.value:
+        raise HTTPException(status_code=500, detail=turn.error or "AI 响应失败")
+
+    user_message = db.query(Message).filter(Message.id == turn.user_message_id).first()
+    ai_message = db.query(Message).filter(Message.id == turn.ai_message_id).first()
+    if not user_message or not ai_message:
+        raise HTTPException(status_code=404, detail="轮次消息不存在")
+    return {
+        "user_message": MessageResponse.model_validate(user_message),
+        "ai_message": MessageResponse.model_validate(ai_message)
+    }
+
+
+async def stream_turn_replay(
+    turn_id: str,
+    session_id: str,
+    last_event_id: int,
+    timeout: float,
+    poll_interval: float = 0.5
+) -> AsyncGenerator[str, None]:
+    """以 SSE 形式重放轮次，必要时等待其它请求/worker 上的轮次结束"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        buffer = get_stream_registry().get(turn_id)
+        if buffer:
+            async for item in buffer.stream(last_event_id):
+                yield item
+            return
+
+        turn = await SessionTurnService.wait_for_turn(turn_id, timeout=0)
+        if turn:
+            meta_data = {"session_id": session_id, "turn_id": turn_id, "replayed": True}
+            yield format_sse(None, "meta", json.dumps(meta_data, ensure_ascii=False))
+            if turn.status == TurnStatus.completed.value and turn.result:
+                yield format_sse(None, "complete", json.dumps(turn.result, ensure_ascii=False))
+            else:
+                error_data = {"error": turn.error or "AI 响应失败"}
+                yield format_sse(None, "error", json.dumps(error_data, ensure_ascii=False))
+            return
+
+        if asyncio.get_running_loop().time() >= deadline:
+            error_data = {"error": "请求正在处理中，请稍后重试"}
+            yield format_sse(None, "error", json.dumps(error_data, ensure_ascii=False))
+            return
+        await asyncio.sleep(poll_interval)
+
+
+def start_agent_turn(
+    agent,
+    state: Dict,
+    user_input: str,
+    attachments: list,
+    action: str,
+    session_id: str,
+    user_id: int,
+    agent_type: str,
+    doctor_info: Optional[Dict] = None,
+    turn_id: Optional[str] = None,
+    on_finish: Optional[Callable[[], None]] = None
+) -> TurnStreamBuffer:
+    """
+    启动一轮对话
+
+    智能体任务在后台独立运行，事件写入重放缓冲；
+    HTTP 连接断开不会中断任务，客户端可通过 turn_id 续传。
+    on_finish 在任务结束后调用（如释放会话锁）
+    """
+    buffer = get_stream_registry().create(session_id=session_id, user_id=user_id, turn_id=turn_id)
+    
+    async def run_guarded():
+        try:
+            # 上一轮已判定为紧急的会话优先调度 LLM
+            span_attributes = {"session.id": session_id, "turn.id": buffer.turn_id, "agent.type": agent_type}
+            with llm_priority(priority_for_state(state)), start_span("session.turn", span_attributes), \
+                    log_context(session_id):
+                await run_agent_turn(
+                    buffer=buffer,
+                    agent=agent,
+                    state=state,
+                    user_input=user_input,
+                    attachments=attachments,
+                    action=action,
+                    session_id=session_id,
+                    agent_type=agent_type,
+                    doctor_info=doctor_info
+                )
+        except Exception as e:
+            log.exception("agent_turn_unhandled", session_id=session_id, turn_id=buffer.turn_id)
+            SessionTurnService.finish_turn(buffer.turn_id, TurnStatus.failed, error=str(e))
+            await buffer.append("error", {"error": str(e)})
+        finally:
+            if on_finish:
+                on_finish()
+            await buffer.finish()
+    
+    buffer.task = asyncio.create_task(run_guarded())
+    return buffer
 
 
-async def stream_agent_response(
+async def run_agent_turn(
+    buffer: TurnStreamBuffer,
     agent,
     state: Dict,
     user_input: str,
@@ -330,46 +511,55 @@ async def stream_agent_response(
     session_id: str,  # 改为传 session_id，而不是 session 对象
     agent_type: str,
     doctor_info: Optional[Dict] = None  # 改为传医生信息字典
-) -> AsyncGenerator[str, None]:
+):
     """
-    生成 SSE 流式响应
+    运行智能体并把 SSE 事件写入重放缓冲
     
-    注意：由于 FastAPI StreamingResponse 的生命周期问题，
-    在生成器内部创建独立的数据库会话来保存状态
+    注意：任务生命周期独立于 HTTP 请求，
+    在任务内部创建独立的数据库会话来保存状态
     """
     from ..database import SessionLocal  # 导入数据库会话工厂
     
-    chunk_queue = asyncio.Queue()
     final_state = None
     error_occurred = None
+    timer = GenerationTimer(agent_type)
     
     async def on_chunk(chunk: str):
-        await chunk_queue.put(("chunk", chunk))
+        timer.first_token()
+        await buffer.append("chunk", {"text": chunk})
     
-    async def run_agent_task():
-        nonlocal final_state, error_occurred
-        try:
-            # 准备额外参数
-            extra_kwargs = {}
-            
-            if agent_type == "general":
-                # 创建独立的数据库会话来查询历史
-                db_temp = SessionLocal()
-                try:
-                    history = db_temp.query(Message).filter(
-                        Message.session_id == session_id
-                    ).order_by(Message.created_at.desc()).limit(10).all()
-                    history.reverse()
-                    history_data = [{"sender": m.sender.value, "content": m.content} for m in history]
-                finally:
-                    db_temp.close()
-                
-                extra_kwargs = {
-                    "doctor_info": doctor_info,
-                    "history": history_data,
-                    "rag_context": ""  # RAG context 需要在外部预先计算
-                }
+    # 发送初始元数据
+    meta_data = {
+        "session_id": state.get("session_id", session_id),
+        "agent_type": agent_type,
+        "turn_id": buffer.turn_id
+    }
+    await buffer.append("meta", meta_data)
+    
+    try:
+        # 准备额外参数
+        extra_kwargs = {}
+        
+        if agent_type == "general":
+            # 创建独立的数据库会话来查询历史
+            db_temp = SessionLocal()
+            try:
+                history = db_temp.query(Message).filter(
+                    Message.session_id == session_id
+                ).order_by(Message.created_at.desc()).limit(10).all()
+                history.reverse()
+                history_data = [{"sender": m.sender.value, "content": m.content} for m in history]
+            finally:
+                db_temp.close()
             
+            extra_kwargs = {
+                "doctor_info": doctor_info,
+                "history": history_data,
+                "rag_context": ""  # RAG context 需要在外部预先计算
+            }
+        
+        # 智能体内部的结构化增量（structured_partial）等事件写入本轮缓冲
+        async with turn_events(buffer):
             final_state = await agent.run(
                 state=state,
                 user_input=user_input,
@@ -378,47 +568,24 @@ async def stream_agent_response(
                 on_chunk=on_chunk,
                 **extra_kwargs
             )
-        except Exception as e:
-            error_occurred = str(e)
-            print(f"[stream_agent_response] Error: {e}")
-            import traceback
-            traceback.print_exc()
-        finally:
-            await chunk_queue.put(("done", None))
-    
-    agent_task = asyncio.create_task(run_agent_task())
-    
-    # 发送初始元数据
-    meta_data = {
-        "session_id": state.get("session_id", session_id),
-        "agent_type": agent_type
-    }
-    yield f"event: meta\ndata: {json.dumps(meta_data, ensure_ascii=False)}\n\n"
-    
-    # 流式输出 chunks
-    while True:
-        event_type, data = await chunk_queue.get()
-        if event_type == "done":
-            break
-        elif event_type == "chunk":
-            chunk_data = {"text": data}
-            yield f"event: chunk\ndata: {json.dumps(chunk_data, ensure_ascii=False)}\n\n"
+        timer.finish()
+    except Exception as e:
+        error_occurred = str(e)
+        timer.finish("error")
+        log.exception("agent_run_failed", agent_type=agent_type, turn_id=buffer.turn_id)
+    if not error_occurred and not final_state:
+        error_occurred = "AI 未返回结果"
+        log.error("agent_run_empty", agent_type=agent_type, turn_id=buffer.turn_id)
     
-    await agent_task
-    
-    # === 调试：检查 final_state ===
-    print(f"[DEBUG] stream_agent_response 在 await agent_task 后:")
-    print(f"[DEBUG] - error_occurred: {error_occurred}")
-    print(f"[DEBUG] - final_state is None: {final_state is None}")
-    print(f"[DEBUG] - final_state type: {type(final_state).__name__ if final_state else 'N/A'}")
-    if final_state:
-        print(f"[DEBUG] - final_state keys: {list(final_state.keys())[:10]}")
-    # === 调试结束 ===
+    log.debug(
+        "agent_run_finished",
+        turn_id=buffer.turn_id,
+        error=error_occurred,
+        state_keys=lambda: list(final_state.keys())[:10] if final_state else None
+    )
     
-    if error_occurred:
-        error_data = {"error": error_occurred}
-        yield f"event: error\ndata: {json.dumps(error_data, ensure_ascii=False)}\n\n"
-    elif final_state:
+    if not error_occurred:
+        ai_message_id = None
         # 创建独立的数据库会话来保存状态（关键修复！）
         db_save = SessionLocal()
         try:
@@ -440,29 +607,33 @@ async def stream_agent_response(
                 db_save.add(ai_message)
                 
                 # 更新会话状态
-                print(f"[stream_agent_response] 保存状态到数据库:")
-                print(f"  - chief_complaint: {final_state.get('chief_complaint', '')}")
-                print(f"  - skin_location: {final_state.get('skin_location', '')}")
-                print(f"  - questions_asked: {final_state.get('questions_asked', 0)}")
-                # === 调试日志：advice_history ===
-                adv_state = final_state.get('advice_history')
-                print(f"  - advice_history: 类型={type(adv_state).__name__}, 是None={adv_state is None}, 数量={len(adv_state) if adv_state else 0}")
-                diag_state = final_state.get('diagnosis_card')
-                print(f"  - diagnosis_card: 类型={type(diag_state).__name__}, 是None={diag_state is None}")
-                # === 日志结束 ===
                 session_obj.agent_state = final_state
                 session_obj.last_message = ai_content[:100] if ai_content else ""
                 db_save.commit()
-                print(f"[stream_agent_response] 数据库 commit 完成")
+                ai_message_id = ai_message.id
+                log.debug(
+                    "agent_state_saved",
+                    turn_id=buffer.turn_id,
+                    stage=final_state.get("stage"),
+                    questions_asked=final_state.get("questions_asked", 0),
+                    advice_count=lambda: len(final_state.get("advice_history") or []),
+                    has_diagnosis=lambda: final_state.get("diagnosis_card") is not None
+                )
             else:
-                print(f"[stream_agent_response] 错误: 找不到会话 {session_id}")
-        except Exception as e:
-            print(f"[stream_agent_response] 保存状态时出错: {e}")
-            import traceback
-            traceback.print_exc()
+                error_occurred = "会话不存在"
+                log.warning("session_not_found", turn_id=buffer.turn_id)
+        except Exception:
+            error_occurred = "保存 AI 回复失败"
+            log.exception("agent_state_save_failed", turn_id=buffer.turn_id)
         finally:
             db_save.close()
-        
+
+    # 智能体失败、未返回结果或回复未能保存时，轮次标记为失败（同一幂等键可重试）
+    if error_occurred:
+        error_data = {"error": error_occurred}
+        SessionTurnService.finish_turn(buffer.turn_id, TurnStatus.failed, error=error_occurred)
+        await buffer.append("error", error_data)
+    else:
         # 发送完成事件
         complete_data = {
             "message": final_state.get("current_response", ""),
@@ -479,23 +650,58 @@ async def stream_agent_response(
             "should_show_dossier_prompt": final_state.get("should_show_dossier_prompt", False),
             "stage": final_state.get("stage", "collecting")
         }
-        
-        # === 调试日志 ===
-        print(f"[DEBUG] complete_data 发送给前端:")
-        print(f"[DEBUG] - advice_history: {len(complete_data.get('advice_history', []))} 条")
-        print(f"[DEBUG] - diagnosis_card: {'有' if complete_data.get('diagnosis_card') else '无'}")
-        
-        # 打印实际的 JSON 字符串
         json_str = json.dumps(complete_data, ensure_ascii=False)
-        print(f"[DEBUG] complete_data JSON 长度: {len(json_str)} 字符")
-        print(f"[DEBUG] complete_data JSON 包含 'advice_history': {'advice_history' in json_str}")
-        if 'advice_history' in json_str:
-            # 找到 advice_history 在 JSON 中的位置
-            idx = json_str.find('"advice_history"')
-            print(f"[DEBUG] advice_history 片段: {json_str[idx:idx+200]}")
-        # === 调试结束 ===
+        log.debug(
+            "turn_complete",
+            turn_id=buffer.turn_id,
+            advice_count=len(complete_data["advice_history"] or []),
+            has_diagnosis=complete_data["diagnosis_card"] is not None,
+            payload_chars=len(json_str)
+        )
         
-        yield f"event: complete\ndata: {json_str}\n\n"
+        SessionTurnService.finish_turn(
+            buffer.turn_id, TurnStatus.completed,
+            ai_message_id=ai_message_id, result=complete_data
+        )
+        await buffer.append("complete", json_str)
+
+
+@router.get("/{session_id}/turns/{turn_id}/stream")
+async def resume_turn_stream(
+    session_id: str,
+    turn_id: str,
+    http_request: Request,
+    last_event_id: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    续传一轮对话的 SSE 流
+    
+    - 通过 Last-Event-ID 请求头（或 last_event_id 查询参数）指定断点
+    - 返回断点之后的已缓冲事件，并继续推送直到该轮结束
+    - 轮次结束超过 TTL 后缓冲失效，返回 404
+    """
+    session = db.query(SessionModel).filter(
+        SessionModel.id == session_id,
+        SessionModel.user_id == current_user.id
+    ).first()
+
+    if not session:
+        raise HTTPException(status_code=404, detail="会话不存在")
+
+    buffer = get_stream_registry().get(turn_id)
+    if not buffer or buffer.session_id != session_id:
+        raise HTTPException(status_code=404, detail="对话流不存在或已过期")
+
+    start_id = parse_last_event_id(
+        http_request.headers.get("last-event-id") or last_event_id
+    )
+    return StreamingResponse(
+        buffer.stream(start_id),
+        media_type="text/event-stream",
+        headers={**SSE_HEADERS, "X-Turn-Id": buffer.turn_id}
+    )
 
 
 def extract_structured_data(state: Dict) -> Optional[Dict]:
@@ -23,8 +23,13 @@ from ..models.doctor import Doctor
 from ..models.user import User
 from ..dependencies import get_current_user
 from ..services.agent_router_v2 import AgentRouterV2
+from ..services.llm_scheduler import llm_priority, priority_for_state
+from ..services.metrics import GenerationTimer
+from ..services.tracing import start_span
+from ..services.structured_logging import get_logger, log_context
 
 router = APIRouter(prefix="/v2/sessions", tags=["sessions-v2"])
+log = get_logger(__name__)
 
 
 @router.post("", response_model=SessionResponse)
@@ -161,12 +166,14 @@ async def send_message_v2(
         )
     else:
         # 非流式响应
-        response: AgentResponse = await agent.run(
-            state=state,
-            user_input=content,
-            attachments=attachments_data,
-            action=action
-        )
+        span_attributes = {"session.id": session_id, "agent.type": agent_type}
+        with llm_priority(priority_for_state(state)), start_span("session.turn", span_attributes):
+            response: AgentResponse = await agent.run(
+                state=state,
+                user_input=content,
+                attachments=attachments_data,
+                action=action
+            )
         
         # 保存 AI 消息
         ai_message = Message(
@@ -205,25 +212,30 @@ async def stream_agent_response_v2(
     chunk_queue = asyncio.Queue()
     final_response: Optional[AgentResponse] = None
     error_occurred = None
+    timer = GenerationTimer(agent_type)
     
     async def on_chunk(chunk: str):
+        timer.first_token()
         await chunk_queue.put(("chunk", chunk))
     
     async def run_agent_task():
         nonlocal final_response, error_occurred
         try:
-            final_response = await agent.run(
-                state=state,
-                user_input=user_input,
-                attachments=attachments,
-                action=action,
-                on_chunk=on_chunk
-            )
+            span_attributes = {"session.id": session_id, "agent.type": agent_type}
+            with llm_priority(priority_for_state(state)), start_span("session.turn", span_attributes), \
+                    log_context(session_id):
+                final_response = await agent.run(
+                    state=state,
+                    user_input=user_input,
+                    attachments=attachments,
+                    action=action,
+                    on_chunk=on_chunk
+                )
+            timer.finish()
         except Exception as e:
             error_occurred = str(e)
-            print(f"[stream_agent_response_v2] Error: {e}")
-            import traceback
-            traceback.print_exc()
+            timer.finish("error")
+            log.exception("agent_run_failed", session_id=session_id, agent_type=agent_type)
         finally:
             await chunk_queue.put(("done", None))
     
@@ -273,8 +285,8 @@ async def stream_agent_response_v2(
                 session_obj.agent_state = final_response.next_state
                 session_obj.last_message = final_response.message[:100] if final_response.message else ""
                 db_save.commit()
-        except Exception as e:
-            print(f"[stream_agent_response_v2] 保存状态时出错: {e}")
+        except Exception:
+            log.exception("agent_state_save_failed", session_id=session_id)
         finally:
             db_save.close()
         
@@ -176,6 +176,8 @@ class MedicalEventListResponse(BaseModel):
     total: int
     page: int
     page_size: int
+    next_cursor: Optional[str] = None  # 下一页游标，为空表示没有更多
+    total_approximate: bool = False  # total 是否为估算值（超过上限时只返回上限）
 
 
 # ============= 导出相关 =============
@@ -212,6 +214,7 @@ class ExportRecordSchema(BaseModel):
     is_active: bool = True
     created_at: datetime
     event_ids: List[str] = []
+    file_status: Optional[str] = None  # PDF 渲染状态: pending/rendering/ready/failed
 
     class Config:
         from_attributes = True
@@ -225,6 +228,7 @@ class ExportResponse(BaseModel):
     share_url: Optional[str] = None
     share_token: Optional[str] = None
     expires_at: Optional[datetime] = None
+    file_status: Optional[str] = None
     message: str
 
 
@@ -13,6 +13,7 @@ from typing import Dict, Type, Any, Optional, Callable, Awaitable
 
 # 从 base 模块导入 BaseAgent（向后兼容）
 from .base import BaseAgent
+from .tracing import trace_agent
 
 
 class AgentRouter:
@@ -46,7 +47,7 @@ class AgentRouter:
         agent_class = cls._agents.get(agent_type)
         if not agent_class:
             raise ValueError(f"Unknown agent type: {agent_type}")
-        return agent_class()
+        return trace_agent(agent_class(), agent_type)
     
     @classmethod
     def get_capabilities(cls, agent_type: str) -> Dict:
@@ -6,6 +6,7 @@
 """
 from typing import Dict, Type
 from .base.base_agent_v2 import BaseAgentV2
+from .tracing import trace_agent
 from .general_v2 import GeneralAgentV2
 from .dermatology.agent_v2 import DermatologyAgentV2
 
@@ -57,7 +58,7 @@ class AgentRouterV2:
         agent_class = cls._AGENTS.get(agent_type)
         if not agent_class:
             raise ValueError(f"未知智能体类型: {agent_type}")
-        return agent_class()
+        return trace_agent(agent_class(), agent_type)
     
     @classmethod
     def get_capabilities(cls, agent_type: str) -> Dict:
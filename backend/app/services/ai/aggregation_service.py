@@ -13,6 +13,7 @@ from datetime import datetime, timedelta
 from dataclasses import dataclass, asdict
 
 from .base_ai_service import BaseAIService
+from ..llm_routing import LLMTask
 from .prompts.aggregation_prompts import AGGREGATION_PROMPTS
 
 
@@ -65,7 +66,8 @@ class EventAggregationService(BaseAIService):
     def __init__(self):
         super().__init__(
             temperature=0.2,
-            max_tokens=1500
+            max_tokens=1500,
+            task=LLMTask.AGGREGATION
         )
     
     async def analyze_relation(
@@ -107,7 +109,8 @@ class EventAggregationService(BaseAIService):
         try:
             response = await self._call_llm(
                 system_prompt=AGGREGATION_PROMPTS["system"],
-                user_prompt=prompt
+                user_prompt=prompt,
+                task=LLMTask.RELATION_CHECK
             )
             
             result = self._parse_json(response, {
@@ -133,7 +136,8 @@ class EventAggregationService(BaseAIService):
     async def find_related_events(
         self,
         target_event: Dict,
-        candidate_events: List[Dict]
+        candidate_events: List[Dict],
+        time_window_days: Optional[int] = 30
     ) -> List[RelatedEvent]:
         """
         从候选事件中找出相关事件
@@ -141,6 +145,7 @@ class EventAggregationService(BaseAIService):
         Args:
             target_event: 目标事件
             candidate_events: 候选事件列表
+            time_window_days: 规则过滤的时间窗口（天），候选已由相似度索引筛选时可传 None 不限时间
         
         Returns:
             相关事件列表
@@ -149,7 +154,7 @@ class EventAggregationService(BaseAIService):
             return []
         
         # 先用规则过滤
-        filtered_candidates = self._filter_by_rules(target_event, candidate_events)
+        filtered_candidates = self._filter_by_rules(target_event, candidate_events, time_window_days)
         
         if not filtered_candidates:
             return []
@@ -169,7 +174,8 @@ class EventAggregationService(BaseAIService):
         try:
             response = await self._call_llm(
                 system_prompt=AGGREGATION_PROMPTS["system"],
-                user_prompt=prompt
+                user_prompt=prompt,
+                task=LLMTask.RELATION_CHECK
             )
             
             result = self._parse_json(response, {"related_events": []})
@@ -393,7 +399,8 @@ class EventAggregationService(BaseAIService):
     def _filter_by_rules(
         self,
         target: Dict,
-        candidates: List[Dict]
+        candidates: List[Dict],
+        time_window_days: Optional[int] = 30
     ) -> List[Dict]:
         """规则过滤候选事件"""
         target_time = self._parse_time(target.get("start_time"))
@@ -404,11 +411,15 @@ class EventAggregationService(BaseAIService):
             if event.get("id") == target.get("id"):
                 continue
             
+            if time_window_days is None:
+                filtered.append(event)
+                continue
+            
             event_time = self._parse_time(event.get("start_time"))
             if target_time and event_time:
                 time_diff = abs((target_time - event_time).days)
-                # 只保留30天内的事件
-                if time_diff <= 30:
+                # 只保留时间窗口内的事件
+                if time_diff <= time_window_days:
                     filtered.append(event)
         
         return filtered
@@ -3,10 +3,15 @@ AI 服务基类
 
 提供 LLM 调用、JSON 解析、错误处理等通用功能
 """
-import json
-import httpx
+import asyncio
 from typing import Optional, Any, Dict
 from ...config import get_settings
+from ..llm_provider import LLMProvider
+from ..llm_routing import get_task_latency_stats, resolve_task
+from ..llm_scheduler import Priority, current_priority
+from ..tracing import start_span
+from .partial_json import parse_json_response
+from .tokens import estimate_tokens
 
 settings = get_settings()
 
@@ -19,7 +24,8 @@ class BaseAIService:
         model: Optional[str] = None,
         temperature: float = 0.3,
         max_tokens: int = 2000,
-        timeout: float = 60.0
+        timeout: float = 60.0,
+        task: Optional[str] = None  # 默认任务类型（LLMTask），用于查询 LLM_TASK_ROUTES 与记录耗时
     ):
         self.api_url = f"{settings.LLM_BASE_URL}/chat/completions"
         self.api_key = settings.LLM_API_KEY
@@ -27,6 +33,7 @@ class BaseAIService:
         self.temperature = temperature
         self.max_tokens = max_tokens
         self.timeout = timeout
+        self.task = task
     
     async def _call_llm(
         self,
@@ -34,7 +41,8 @@ class BaseAIService:
         user_prompt: str,
         temperature: Optional[float] = None,
         max_tokens: Optional[int] = None,
-        retry_count: int = 3
+        retry_count: int = 3,
+        task: Optional[str] = None
     ) -> str:
         """
         调用 LLM API
@@ -45,6 +53,7 @@ class BaseAIService:
             temperature: 温度参数
             max_tokens: 最大 token 数
             retry_count: 重试次数
+            task: 任务类型，缺省使用服务的默认任务；路由表中的配置优先于以上参数
         
         Returns:
             LLM 响应文本
@@ -52,83 +61,59 @@ class BaseAIService:
         if not self.api_key:
             raise ValueError("LLM API Key 未配置")
         
-        use_temperature = temperature if temperature is not None else self.temperature
-        use_max_tokens = max_tokens or self.max_tokens
+        route = resolve_task(
+            task or self.task,
+            model=self.model,
+            temperature=temperature if temperature is not None else self.temperature,
+            max_tokens=max_tokens or self.max_tokens
+        )
+        use_temperature = route.temperature
+        use_max_tokens = route.max_tokens
         
+        # 摘要、聚合等后台任务默认走低优先级，入口可用 llm_priority() 覆盖
+        priority = current_priority(Priority.BACKGROUND)
+        estimated = estimate_tokens(system_prompt) + estimate_tokens(user_prompt) + use_max_tokens
+        pool = LLMProvider.get_pool()
+        latency = get_task_latency_stats()
+
         last_error = None
         for attempt in range(retry_count):
             try:
-                async with httpx.AsyncClient(timeout=self.timeout) as client:
-                    response = await client.post(
-                        self.api_url,
-                        headers={
-                            "Authorization": f"Bearer {self.api_key}",
-                            "Content-Type": "application/json"
-                        },
-                        json={
-                            "model": self.model,
+                span_attributes = {"llm.task": route.task, "llm.model": route.model, "llm.retry": attempt}
+                with start_span("llm.call", span_attributes), latency.track(route.task, route.model):
+                    data = await pool.chat_completion(
+                        {
+                            "model": route.model,
                             "messages": [
                                 {"role": "system", "content": system_prompt},
                                 {"role": "user", "content": user_prompt}
                             ],
                             "temperature": use_temperature,
                             "max_tokens": use_max_tokens
-                        }
+                        },
+                        tokens=estimated,
+                        timeout=self.timeout,
+                        priority=priority
                     )
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        choices = data.get("choices", [])
-                        if choices:
-                            return choices[0].get("message", {}).get("content", "")
-                    else:
-                        last_error = f"API error: {response.status_code} - {response.text}"
-                        
+                choices = data.get("choices", [])
+                if choices:
+                    return choices[0].get("message", {}).get("content", "")
+                last_error = "无有效响应"
             except Exception as e:
                 last_error = str(e)
-                if attempt < retry_count - 1:
-                    import asyncio
-                    await asyncio.sleep(2 ** attempt)  # 指数退避
-        
+
+            if attempt < retry_count - 1:
+                await asyncio.sleep(2 ** attempt)  # 指数退避
+
         raise Exception(f"LLM 调用失败: {last_error}")
-    
+
     def _parse_json(self, text: str, default: Optional[Dict] = None) -> Dict[str, Any]:
         """
         解析 JSON 响应
         
         处理可能的 markdown 代码块包装
         """
-        if not text:
-            return default or {}
-        
-        # 尝试提取 JSON 内容
-        content = text.strip()
-        
-        # 处理 markdown 代码块
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0]
-        elif "```" in content:
-            parts = content.split("```")
-            if len(parts) >= 2:
-                content = parts[1]
-        
-        content = content.strip()
-        
-        # 尝试解析 JSON
-        try:
-            return json.loads(content)
-        except json.JSONDecodeError:
-            # 尝试修复常见问题
-            try:
-                # 尝试找到 JSON 对象的开始和结束
-                start = content.find("{")
-                end = content.rfind("}") + 1
-                if start >= 0 and end > start:
-                    return json.loads(content[start:end])
-            except:
-                pass
-            
-            return default or {}
+        return parse_json_response(text, default)
     
     def _clean_text(self, text: str) -> str:
         """清理文本，去除多余空白"""
@@ -0,0 +1,250 @@
+"""
+按 token 预算构建对话上下文
+
+各智能体原先按固定条数截取历史（history[-6:]、messages[-10:]）或整段发送，长会话的提示词 token 无上限增长，
+短会话又丢掉了本可以保留的内容。ContextBuilder 按模型的提示词预算组装上下文：
+
+- 近期消息原文保留：从最新一条往前装入，直到用完预算（至少保留最后一轮）
+- 工具调用与其结果（AIMessage.tool_calls + ToolMessage）作为整体保留或移出，不会拆开
+- 移出窗口的早期消息压缩进滚动摘要，摘要缓存在会话状态的 context_summary 中：
+  {"text": 摘要, "covered": 已压缩的对话消息数}，之后每轮只压缩新移出的消息，已有摘要不再重算
+- 主诉、部位、持续时间等关键信息单独列出，始终保留，不受窗口和摘要截断影响
+
+消息同时支持 dict（{"role"/"sender", "content"}）与 LangChain 消息对象，返回的近期消息保持原类型。
+默认的压缩方式是本地抽取（保留患者原话、医生回复只留开头），不产生额外 LLM 调用；
+可通过 summarizer 参数替换为其它实现。
+"""
+import json
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from ...config import get_settings
+from .tokens import MESSAGE_OVERHEAD_TOKENS, estimate_tokens, truncate_to_tokens
+
+settings = get_settings()
+
+# (role, text)，role 为 user / assistant
+Turn = Tuple[str, str]
+Summarizer = Callable[[str, List[Turn]], str]
+
+# 抽取式压缩时单条消息保留的 token 数
+_USER_LINE_TOKENS = 80
+_ASSISTANT_LINE_TOKENS = 30
+
+
+def context_budget(model: Optional[str] = None) -> int:
+    """模型的提示词 token 预算（LLM_CONTEXT_BUDGETS 按模型覆盖，缺省 LLM_CONTEXT_TOKEN_BUDGET）"""
+    model = model or settings.LLM_MODEL
+    return settings.LLM_CONTEXT_BUDGETS.get(model, settings.LLM_CONTEXT_TOKEN_BUDGET)
+
+
+# ============= 消息访问（dict / LangChain 消息） =============
+
+def _role(message: Any) -> str:
+    if isinstance(message, dict):
+        # 消息记录用 sender 区分发送方：user 以外都视为助手
+        role = message.get("role") or message.get("sender") or "user"
+        return role if role in ("user", "system", "tool") else "assistant"
+    role = getattr(message, "type", "human")
+    return {"human": "user", "ai": "assistant"}.get(role, role)
+
+
+def _text(message: Any) -> str:
+    content = message.get("content", "") if isinstance(message, dict) else getattr(message, "content", "")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        # 多模态消息只计文本部分
+        return "".join(
+            part.get("text", "") if isinstance(part, dict) else str(part)
+            for part in content
+        )
+    return str(content or "")
+
+
+def _message_tokens(message: Any) -> int:
+    tokens = estimate_tokens(_text(message)) + MESSAGE_OVERHEAD_TOKENS
+    tool_calls = message.get("tool_calls") if isinstance(message, dict) else getattr(message, "tool_calls", None)
+    if tool_calls:
+        tokens += estimate_tokens(json.dumps(tool_calls, ensure_ascii=False, default=str))
+    return tokens
+
+
+def _dialogue_turns(messages: Sequence[Any]) -> List[Turn]:
+    """
+    可计入摘要的对话消息：有文本内容的用户 / 助手消息
+
+    工具消息与空内容的工具调用消息不计入，这样会话结束时序列化（去掉工具消息）前后计数一致，
+    context_summary.covered 在各轮之间保持对齐
+    """
+    turns = []
+    for message in messages:
+        role = _role(message)
+        text = _text(message).strip()
+        if role in ("user", "assistant") and text:
+            turns.append((role, text))
+    return turns
+
+
+def _group_units(messages: Sequence[Any]) -> List[List[Any]]:
+    """按保留单位分组：工具消息归入前一组（即发起调用的助手消息）"""
+    units: List[List[Any]] = []
+    for message in messages:
+        if _role(message) == "tool" and units:
+            units[-1].append(message)
+        else:
+            units.append([message])
+    return units
+
+
+# ============= 摘要 =============
+
+def compress_turns(previous: str, turns: List[Turn], max_tokens: Optional[int] = None) -> str:
+    """
+    抽取式滚动摘要
+
+    患者消息保留原话（过长截断），医生消息只保留开头；超出 max_tokens 时丢弃最早的行
+    （最早的主诉等关键信息由 facts 单独保留）
+    """
+    max_tokens = max_tokens or settings.LLM_CONTEXT_SUMMARY_TOKENS
+    lines = previous.splitlines() if previous else []
+    for role, text in turns:
+        text = " ".join(text.split())
+        if role == "user":
+            lines.append(f"患者：{truncate_to_tokens(text, _USER_LINE_TOKENS)}")
+        else:
+            lines.append(f"医生：{truncate_to_tokens(text, _ASSISTANT_LINE_TOKENS)}")
+
+    total = sum(estimate_tokens(line) + 1 for line in lines)
+    start = 0
+    while total > max_tokens and start < len(lines) - 1:
+        total -= estimate_tokens(lines[start]) + 1
+        start += 1
+    text = "\n".join(lines[start:])
+    return truncate_to_tokens(text, max_tokens)
+
+
+def format_facts(facts: Optional[Dict[str, Any]]) -> str:
+    """关键信息：{"主诉": "...", "症状": [...]} → 多行文本，空值跳过"""
+    lines = []
+    for label, value in (facts or {}).items():
+        if isinstance(value, (list, tuple)):
+            value = "、".join(str(item) for item in value if item)
+        elif isinstance(value, dict):
+            value = json.dumps(value, ensure_ascii=False) if value else ""
+        value = str(value or "").strip()
+        if value:
+            lines.append(f"- {label}：{value}")
+    return "\n".join(lines)
+
+
+# ============= 构建 =============
+
+@dataclass
+class ConversationContext:
+    """构建结果"""
+    messages: List[Any]  # 原文保留的近期消息（保持传入的类型）
+    summary: str = ""  # 早期对话的滚动摘要
+    facts: str = ""  # 关键信息
+    summary_state: Optional[Dict[str, Any]] = None  # 写回会话状态 context_summary 的缓存
+    tokens: int = 0  # 估算的上下文 token 数（不含 reserved）
+    omitted: int = 0  # 移出窗口的消息数
+
+    def preamble(self) -> str:
+        """关键信息与早期对话摘要（附加在系统提示词之后）"""
+        sections = []
+        if self.facts:
+            sections.append(f"【已知关键信息】\n{self.facts}")
+        if self.summary:
+            sections.append(f"【早期对话摘要】\n{self.summary}")
+        return "\n\n".join(sections)
+
+    def as_dicts(self) -> List[Dict[str, str]]:
+        """近期消息转换为 OpenAI 格式（工具消息丢弃）"""
+        return [
+            {"role": _role(message), "content": _text(message)}
+            for message in self.messages
+            if _role(message) in ("user", "assistant") and _text(message)
+        ]
+
+    def as_transcript(self, user_label: str = "患者", assistant_label: str = "医生") -> str:
+        """摘要与近期消息拼成对话记录文本（用于单轮提示词模板）"""
+        lines = [f"（早期对话摘要）\n{self.summary}"] if self.summary else []
+        for role, text in _dialogue_turns(self.messages):
+            lines.append(f"{user_label if role == 'user' else assistant_label}: {text}")
+        return "\n".join(lines)
+
+
+@dataclass
+class ContextBuilder:
+    """
+    对话上下文构建器
+
+        builder = ContextBuilder.for_model(model, reserved=estimate_tokens(system_prompt) + max_tokens)
+        context = builder.build(state["messages"], facts={"主诉": ...}, summary_state=state.get("context_summary"))
+        state["context_summary"] = context.summary_state
+    """
+    budget: int  # 对话历史（含关键信息与摘要）可用的 token 数
+    summary_tokens: int = field(default_factory=lambda: settings.LLM_CONTEXT_SUMMARY_TOKENS)
+    summarizer: Optional[Summarizer] = None
+
+    @classmethod
+    def for_model(cls, model: Optional[str] = None, reserved: int = 0, **kwargs) -> "ContextBuilder":
+        """按模型预算创建，reserved 为系统提示词、当前输入与输出预留的 token 数"""
+        return cls(budget=max(context_budget(model) - reserved, 0), **kwargs)
+
+    def build(
+        self,
+        messages: Sequence[Any],
+        facts: Optional[Dict[str, Any]] = None,
+        summary_state: Optional[Dict[str, Any]] = None
+    ) -> ConversationContext:
+        messages = [m for m in messages if _role(m) != "system"]
+        facts_text = format_facts(facts)
+        facts_tokens = estimate_tokens(facts_text)
+        units = _group_units(messages)
+        unit_tokens = [sum(_message_tokens(m) for m in unit) for unit in units]
+        unit_turns = [len(_dialogue_turns(unit)) for unit in units]
+        total_turns = sum(unit_turns)
+
+        cached_text, covered = "", 0
+        if summary_state and 0 < summary_state.get("covered", 0) <= total_turns:
+            cached_text, covered = summary_state.get("text", ""), summary_state["covered"]
+
+        # 全部放得下且没有摘要：原样返回
+        if not covered and facts_tokens + sum(unit_tokens) <= self.budget:
+            return ConversationContext(messages=messages, facts=facts_text, tokens=facts_tokens + sum(unit_tokens))
+
+        # 从最新一组往前装入，至少保留最后一组；已被摘要覆盖的组不再原文保留
+        available = self.budget - facts_tokens - self.summary_tokens
+        first_kept, used = len(units), 0
+        turns_before = total_turns
+        for index in range(len(units) - 1, -1, -1):
+            turns_before -= unit_turns[index]
+            is_last = index == len(units) - 1
+            if not is_last and (used + unit_tokens[index] > available or turns_before + unit_turns[index] <= covered):
+                break
+            used += unit_tokens[index]
+            first_kept = index
+
+        evicted_turns = sum(unit_turns[:first_kept])
+        summary_text = cached_text
+        if evicted_turns > covered:
+            new_turns = _dialogue_turns([m for unit in units[:first_kept] for m in unit])[covered:]
+            summary_text = self._summarize(cached_text, new_turns)
+            covered = evicted_turns
+
+        kept = [m for unit in units[first_kept:] for m in unit]
+        return ConversationContext(
+            messages=kept,
+            summary=summary_text,
+            facts=facts_text,
+            summary_state={"text": summary_text, "covered": covered} if covered else None,
+            tokens=facts_tokens + estimate_tokens(summary_text) + used,
+            omitted=len(messages) - len(kept)
+        )
+
+    def _summarize(self, previous: str, turns: List[Turn]) -> str:
+        if self.summarizer is not None:
+            return truncate_to_tokens(self.summarizer(previous, turns), self.summary_tokens)
+        return compress_turns(previous, turns, self.summary_tokens)
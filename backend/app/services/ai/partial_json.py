@@ -0,0 +1,289 @@
+"""
+增量 JSON 解析
+
+LLM 逐 token 输出结构化结果时，PartialJsonParser 边接收边解析，每个字段的值完整到达后
+立即以路径形式报告（如 conditions[0].name），前端可以在完整结果返回前逐步渲染诊断卡。
+
+- 只报告完整的叶子值（字符串、数字、布尔、null 与空容器），不报告半截字符串
+- 第一个 { 或 [ 之前的内容（说明文字、```json 代码块标记）被忽略，根对象结束后的内容也被忽略
+- 输出不是合法 JSON 时停止报告，最终结果回退到 parse_json_response（与原有解析逻辑一致）
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..stream_replay import emit_turn_event
+
+# 流式生成结构化结果的 LLM 调用带上该标签，智能体转发流式文本时据此跳过这些 token
+STRUCTURED_STREAM_TAG = "structured_stream"
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_LITERAL_CHARS = frozenset("0123456789+-.eEtruefalsn")
+_WHITESPACE = frozenset(" \t\r\n")
+
+
+def parse_json_response(text: str, default: Optional[Dict] = None) -> Dict[str, Any]:
+    """
+    解析 JSON 响应
+
+    处理可能的 markdown 代码块包装，失败时尝试截取首个 { 到最后一个 } 之间的内容
+    """
+    if not text:
+        return default or {}
+
+    # 尝试提取 JSON 内容
+    content = text.strip()
+
+    # 处理 markdown 代码块
+    if "```json" in content:
+        content = content.split("```json")[1].split("```")[0]
+    elif "```" in content:
+        parts = content.split("```")
+        if len(parts) >= 2:
+            content = parts[1]
+
+    content = content.strip()
+
+    # 尝试解析 JSON
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        # 尝试修复常见问题
+        try:
+            # 尝试找到 JSON 对象的开始和结束
+            start = content.find("{")
+            end = content.rfind("}") + 1
+            if start >= 0 and end > start:
+                return json.loads(content[start:end])
+        except:
+            pass
+
+        return default or {}
+
+
+class _Frame:
+    """解析栈中的一层容器"""
+    __slots__ = ("container", "path", "key", "expect")
+
+    def __init__(self, container, path: str):
+        self.container = container
+        self.path = path
+        self.key: Optional[str] = None
+        # 对象：key → colon → value → comma；数组：value → comma
+        self.expect = "key" if isinstance(container, dict) else "value"
+
+    def child_path(self) -> str:
+        if isinstance(self.container, dict):
+            return f"{self.path}.{self.key}" if self.path else self.key
+        return f"{self.path}[{len(self.container)}]"
+
+
+class PartialJsonParser:
+    """
+    增量 JSON 解析器
+
+        parser = PartialJsonParser()
+        for chunk in chunks:
+            for path, value in parser.feed(chunk):
+                ...
+        if parser.done:
+            result = parser.value
+    """
+
+    def __init__(self):
+        self.value: Any = None  # 已解析的部分（只包含完整的值）
+        self.done = False  # 根对象已闭合
+        self.failed = False  # 遇到非法 JSON
+        self._stack: List[_Frame] = []
+        self._string: Optional[List[str]] = None  # 正在读取的字符串
+        self._escape: Optional[str] = None  # 未完成的转义序列（含反斜杠）
+        self._literal: Optional[List[str]] = None  # 正在读取的数字 / true / false / null
+        self._reported = 0
+        self._updates: List[Tuple[str, Any]] = []
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """喂入一个片段，返回本次新完成的 (路径, 值)"""
+        self._updates = []
+        pos, n = 0, len(chunk or "")
+        while pos < n and not self.done and not self.failed:
+            if self._string is not None:
+                pos = self._read_string(chunk, pos)
+            elif self._literal is not None:
+                pos = self._read_literal(chunk, pos)
+            else:
+                pos = self._read_token(chunk, pos)
+        self._reported += len(self._updates)
+        return self._updates
+
+    # ============= 词法 =============
+
+    def _read_string(self, chunk: str, pos: int) -> int:
+        n = len(chunk)
+        while pos < n:
+            if self._escape is not None:
+                self._escape += chunk[pos]
+                pos += 1
+                if self._escape[1] == "u" and len(self._escape) < 6:
+                    continue
+                try:
+                    self._string.append(json.loads(f'"{self._escape}"'))
+                except json.JSONDecodeError:
+                    self._fail()
+                    return n
+                self._escape = None
+                continue
+            match = _STRING_SPECIAL.search(chunk, pos)
+            if match is None:
+                self._string.append(chunk[pos:])
+                return n
+            self._string.append(chunk[pos:match.start()])
+            pos = match.end()
+            if match.group() == "\\":
+                self._escape = "\\"
+            else:
+                text = "".join(self._string)
+                self._string = None
+                self._on_string(text)
+                return pos
+        return pos
+
+    def _read_literal(self, chunk: str, pos: int) -> int:
+        n = len(chunk)
+        start = pos
+        while pos < n and chunk[pos] in _LITERAL_CHARS:
+            pos += 1
+        self._literal.append(chunk[start:pos])
+        if pos < n:
+            # 遇到分隔符，字面量结束（分隔符留给下一步处理）
+            raw = "".join(self._literal)
+            self._literal = None
+            try:
+                value = json.loads(raw)
+            except json.JSONDecodeError:
+                self._fail()
+                return n
+            self._on_value(value)
+        return pos
+
+    def _read_token(self, chunk: str, pos: int) -> int:
+        char = chunk[pos]
+        if char in _WHITESPACE:
+            return pos + 1
+        if not self._stack:
+            # 根对象之前的内容忽略
+            if char in "{[":
+                self._open({} if char == "{" else [], "")
+            return pos + 1
+
+        frame = self._stack[-1]
+        if char == '"' and frame.expect in ("key", "value"):
+            self._string = []
+        elif char in "{[" and frame.expect == "value":
+            self._open({} if char == "{" else [], frame.child_path())
+        elif char in "}]" and self._can_close(frame, char):
+            self._close()
+        elif char == ":" and frame.expect == "colon":
+            frame.expect = "value"
+        elif char == "," and frame.expect == "comma":
+            frame.expect = "key" if isinstance(frame.container, dict) else "value"
+        elif char in _LITERAL_CHARS and frame.expect == "value":
+            self._literal = []
+            return pos
+        else:
+            self._fail()
+        return pos + 1
+
+    # ============= 语法 =============
+
+    def _can_close(self, frame: _Frame, char: str) -> bool:
+        if isinstance(frame.container, dict) != (char == "}"):
+            return False
+        return frame.expect == "comma" or (not frame.container and frame.expect in ("key", "value"))
+
+    def _open(self, container, path: str):
+        if self._stack:
+            self._attach(container)
+        else:
+            self.value = container
+        self._stack.append(_Frame(container, path))
+
+    def _close(self):
+        frame = self._stack.pop()
+        if not frame.container and frame.path:
+            self._updates.append((frame.path, type(frame.container)()))
+        if self._stack:
+            self._stack[-1].expect = "comma"
+        else:
+            self.done = True
+
+    def _on_string(self, text: str):
+        frame = self._stack[-1]
+        if frame.expect == "key":
+            frame.key = text
+            frame.expect = "colon"
+        else:
+            self._on_value(text)
+
+    def _on_value(self, value: Any):
+        frame = self._stack[-1]
+        self._updates.append((frame.child_path(), value))
+        self._attach(value)
+        frame.expect = "comma"
+
+    def _attach(self, value: Any):
+        frame = self._stack[-1]
+        if isinstance(frame.container, dict):
+            frame.container[frame.key] = value
+        else:
+            frame.container.append(value)
+
+    def _fail(self):
+        """
+        非法输入：还没报告过任何字段时（多半是说明文字里的括号）丢弃已解析的部分，
+        等待下一个 { 或 [ 重新开始；否则停止解析
+        """
+        if self._reported or self._updates:
+            self.failed = True
+            return
+        self.value = None
+        self._stack = []
+        self._string = None
+        self._escape = None
+        self._literal = None
+
+
+class StructuredStream:
+    """
+    结构化输出的流式消费
+
+    把 LLM 输出片段喂给 PartialJsonParser，新完成的字段作为 structured_partial 事件写入当前轮次
+    （不在问诊轮次内时只解析不发送）。结束后 result() 返回完整结果，解析失败时回退到 parse_json_response。
+
+    事件格式：{"source": "diagnosis_card", "updates": [{"path": "conditions[0].name", "value": "湿疹"}]}
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.parser = PartialJsonParser()
+        self._chunks: List[str] = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        if not chunk:
+            return []
+        self._chunks.append(chunk)
+        updates = self.parser.feed(chunk)
+        if updates:
+            emit_turn_event("structured_partial", {
+                "source": self.source,
+                "updates": [{"path": path, "value": value} for path, value in updates]
+            })
+        return updates
+
+    def result(self, default: Optional[Dict] = None) -> Any:
+        if self.parser.done and not self.parser.failed:
+            return self.parser.value
+        return parse_json_response(self.text, default)
@@ -0,0 +1,184 @@
+"""
+提示词前缀稳定化与上下文缓存
+
+服务商的上下文缓存（DashScope 隐式 / 显式缓存、OpenAI 前缀缓存）只对逐字相同的消息前缀生效，
+把 RAG 资料、医生人设等动态内容拼在提示词中间会让之后的内容全部失效。PromptAssembly 按变化频率排列片段：
+
+    STATIC（固定指令） → SEMI_STATIC（医生人设等按医生 / 配置变化） → DYNAMIC（RAG、关键信息、摘要）
+
+同一级别内保持添加顺序，相同输入总是得到逐字相同的提示词。模型在 LLM_PROMPT_CACHE_MODELS 中且可缓存前缀
+达到 LLM_PROMPT_CACHE_MIN_TOKENS 时，系统消息改为分段内容并在前缀末尾加显式缓存标记（cache_control）；
+请求转发给备用服务商前由 strip_cache_markers 去掉标记，恢复为普通文本。
+
+响应中的 usage（prompt_tokens_details.cached_tokens / usage_metadata.input_token_details.cache_read）
+按模型累计命中缓存的 token 比例（GET /admin/stats/llm-prompt-cache，及 /metrics 中的
+llm_prompt_tokens_total、llm_cached_prompt_tokens_total）。
+"""
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from langchain_core.messages import BaseMessage, SystemMessage
+
+from ...config import get_settings
+from ..metrics import LLM_CACHED_PROMPT_TOKENS, LLM_PROMPT_TOKENS
+from .tokens import estimate_tokens
+
+settings = get_settings()
+
+STATIC = 0  # 固定指令
+SEMI_STATIC = 1  # 医生人设等，按医生 / 配置变化
+DYNAMIC = 2  # RAG 资料、关键信息、对话摘要，每轮变化
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def supports_cache_markers(model: Optional[str]) -> bool:
+    """模型是否支持显式缓存标记"""
+    return (model or settings.LLM_MODEL) in settings.LLM_PROMPT_CACHE_MODELS
+
+
+@dataclass
+class PromptAssembly:
+    """
+    按 静态 → 半静态 → 动态 排列的系统提示词
+
+        prompt = PromptAssembly().add(RULES).add(persona, SEMI_STATIC).add(rag_context, DYNAMIC)
+        messages = [prompt.system_message(model), *history]
+    """
+    separator: str = "\n\n"
+    _segments: List[Tuple[int, str]] = field(default_factory=list)
+
+    def add(self, text: Optional[str], level: int = STATIC) -> "PromptAssembly":
+        """添加片段，空内容忽略"""
+        if text and text.strip():
+            self._segments.append((level, text.strip()))
+        return self
+
+    def _join(self, levels) -> str:
+        ordered = sorted(self._segments, key=lambda segment: segment[0])  # 稳定排序，同级保持添加顺序
+        return self.separator.join(text for level, text in ordered if level in levels)
+
+    @property
+    def prefix(self) -> str:
+        """可缓存前缀（静态 + 半静态）"""
+        return self._join((STATIC, SEMI_STATIC))
+
+    @property
+    def dynamic(self) -> str:
+        return self._join((DYNAMIC,))
+
+    def text(self) -> str:
+        return self.separator.join(part for part in (self.prefix, self.dynamic) if part)
+
+    def content(self, model: Optional[str] = None) -> Union[str, List[Dict[str, Any]]]:
+        """
+        系统消息内容
+
+        支持显式缓存且前缀足够长时返回分段内容（前缀段带 cache_control），否则返回纯文本
+        """
+        prefix = self.prefix
+        if not supports_cache_markers(model) or estimate_tokens(prefix) < settings.LLM_PROMPT_CACHE_MIN_TOKENS:
+            return self.text()
+        parts = [{"type": "text", "text": prefix, "cache_control": dict(CACHE_CONTROL)}]
+        if self.dynamic:
+            parts.append({"type": "text", "text": self.separator + self.dynamic})
+        return parts
+
+    def system_message(self, model: Optional[str] = None) -> Dict[str, Any]:
+        """OpenAI 格式的系统消息"""
+        return {"role": "system", "content": self.content(model)}
+
+    def langchain_message(self, model: Optional[str] = None) -> SystemMessage:
+        """LangChain 系统消息"""
+        return SystemMessage(content=self.content(model))
+
+
+# ============= 缓存标记 =============
+
+def _strip_content(content: Any) -> Any:
+    if not isinstance(content, list) or not any(isinstance(p, dict) and "cache_control" in p for p in content):
+        return content
+    # 只剩文本段时还原为字符串，与未加标记时的请求一致
+    if all(isinstance(p, dict) and p.get("type") == "text" for p in content):
+        return "".join(p.get("text", "") for p in content)
+    return [{k: v for k, v in p.items() if k != "cache_control"} if isinstance(p, dict) else p for p in content]
+
+
+def strip_cache_markers(messages: List[Any]) -> List[Any]:
+    """去掉消息中的显式缓存标记（dict 与 LangChain 消息均可），没有标记的消息原样返回"""
+    stripped = []
+    for message in messages:
+        if isinstance(message, dict):
+            content = _strip_content(message.get("content"))
+            stripped.append(message if content is message.get("content") else {**message, "content": content})
+        elif isinstance(message, BaseMessage):
+            content = _strip_content(message.content)
+            stripped.append(message if content is message.content else message.model_copy(update={"content": content}))
+        else:
+            stripped.append(message)
+    return stripped
+
+
+# ============= 命中统计 =============
+
+class PromptCacheStats:
+    """按模型累计提示词 token 与命中缓存的 token"""
+
+    def __init__(self):
+        self._totals: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, prompt_tokens: int, cached_tokens: int = 0):
+        if prompt_tokens <= 0:
+            return
+        cached_tokens = min(max(cached_tokens, 0), prompt_tokens)
+        with self._lock:
+            totals = self._totals.setdefault(model, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0})
+            totals["requests"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["cached_tokens"] += cached_tokens
+        LLM_PROMPT_TOKENS.inc(prompt_tokens, model=model)
+        LLM_CACHED_PROMPT_TOKENS.inc(cached_tokens, model=model)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "model": model,
+                    **totals,
+                    "cached_ratio": round(totals["cached_tokens"] / totals["prompt_tokens"], 3)
+                }
+                for model, totals in sorted(self._totals.items())
+            ]
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+
+
+_prompt_cache_stats: Optional[PromptCacheStats] = None
+
+
+def get_prompt_cache_stats() -> PromptCacheStats:
+    """获取缓存命中统计单例"""
+    global _prompt_cache_stats
+    if _prompt_cache_stats is None:
+        _prompt_cache_stats = PromptCacheStats()
+    return _prompt_cache_stats
+
+
+def record_usage(model: str, usage: Optional[Dict[str, Any]]):
+    """记录 OpenAI 兼容响应中的 usage（prompt_tokens / prompt_tokens_details.cached_tokens）"""
+    if not usage:
+        return
+    details = usage.get("prompt_tokens_details") or {}
+    get_prompt_cache_stats().record(model, int(usage.get("prompt_tokens") or 0), int(details.get("cached_tokens") or 0))
+
+
+def record_usage_metadata(model: str, usage_metadata: Optional[Dict[str, Any]]):
+    """记录 LangChain 消息的 usage_metadata（input_tokens / input_token_details.cache_read）"""
+    if not usage_metadata:
+        return
+    details = usage_metadata.get("input_token_details") or {}
+    get_prompt_cache_stats().record(model, int(usage_metadata.get("input_tokens") or 0), int(details.get("cache_read") or 0))
@@ -97,5 +97,129 @@ SUMMARY_PROMPTS = {
     ]
 }}
 
+请直接输出 JSON：""",
+
+    "summarize_session": """请为以下单次问诊生成简要摘要，供后续合并到病历事件摘要中使用。
+
+主诉：{chief_complaint}
+科室：{department}
+对话记录：
+{conversation}
+
+请输出 JSON 格式：
+{{
+    "summary": "50-100字的本次问诊摘要",
+    "key_points": ["关键要点1"],
+    "symptoms": ["症状1", "症状2"],
+    "symptom_details": {{
+        "症状名": {{
+            "duration": "持续时间",
+            "severity": "严重程度"
+        }}
+    }},
+    "possible_diagnosis": ["可能诊断1"],
+    "risk_level": "low/medium/high/emergency",
+    "recommendations": ["建议1"]
+}}
+
+请直接输出 JSON：""",
+
+    "merge_summary": """以下是一个病历事件的现有结构化摘要，以及之后新增的问诊摘要。
+请把新增信息合并到现有摘要中，生成更新后的完整摘要。不要丢失现有摘要中仍然有效的信息，
+风险等级取两者中更高的一级。
+
+【现有摘要】
+{existing_analysis}
+
+【新增问诊摘要】
+{new_sessions}
+
+主诉：{chief_complaint}
+科室：{department}
+附件信息：{attachments}
+用户备注：{notes}
+
+请输出与现有摘要结构相同的 JSON：
+{{
+    "summary": "100-200字的病历摘要",
+    "key_points": ["关键要点1", "关键要点2", "关键要点3"],
+    "symptoms": ["症状1", "症状2"],
+    "symptom_details": {{}},
+    "possible_diagnosis": ["可能诊断1"],
+    "risk_level": "low/medium/high/emergency",
+    "risk_warning": "风险提示（如有）",
+    "recommendations": ["建议1"],
+    "follow_up_reminders": ["随访提醒1"],
+    "timeline": [
+        {{
+            "time": "时间点",
+            "event": "事件描述",
+            "type": "symptom/treatment/note"
+        }}
+    ],
+    "confidence": 0.85
+}}
+
+请直接输出 JSON：""",
+
+    "reduce_summary": """以下是同一病历事件中各次问诊的摘要（按时间排序），请综合生成整个事件的结构化摘要和时间轴。
+
+主诉：{chief_complaint}
+科室：{department}
+
+【各次问诊摘要】
+{session_summaries}
+
+附件信息：{attachments}
+用户备注：{notes}
+
+请生成以下 JSON 格式的摘要：
+{{
+    "summary": "100-200字的病历摘要",
+    "key_points": ["关键要点1", "关键要点2", "关键要点3"],
+    "symptoms": ["症状1", "症状2"],
+    "symptom_details": {{
+        "症状名": {{
+            "duration": "持续时间",
+            "severity": "严重程度",
+            "frequency": "发作频率"
+        }}
+    }},
+    "possible_diagnosis": ["可能诊断1", "可能诊断2"],
+    "risk_level": "low/medium/high/emergency",
+    "risk_warning": "风险提示（如有）",
+    "recommendations": ["建议1", "建议2"],
+    "follow_up_reminders": ["随访提醒1"],
+    "timeline": [
+        {{
+            "time": "时间点",
+            "event": "事件描述",
+            "type": "symptom/treatment/note"
+        }}
+    ],
+    "confidence": 0.85
+}}
+
+请直接输出 JSON，不要有其他内容：""",
+
+    "reduce_group": """以下是同一病历事件中连续几次问诊的摘要，请把它们归并为一份阶段摘要。
+
+主诉：{chief_complaint}
+科室：{department}
+
+【问诊摘要】
+{session_summaries}
+
+请输出 JSON 格式：
+{{
+    "summary": "100字以内的阶段摘要，保留时间信息",
+    "key_points": ["关键要点1"],
+    "symptoms": ["症状1", "症状2"],
+    "symptom_details": {{}},
+    "possible_diagnosis": ["可能诊断1"],
+    "risk_level": "low/medium/high/emergency",
+    "recommendations": ["建议1"]
+}}
+
 请直接输出 JSON："""
 }
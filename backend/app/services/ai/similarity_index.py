@@ -0,0 +1,290 @@
+"""
+病历事件相似度索引（MinHash + LSH）
+
+查找相关事件原先只取最近 20 个事件整体发给 LLM，较早的相关病历会被遗漏，
+提示词长度也随候选数量增长。这里为每个用户维护一个内存索引：
+
+- 文档：标题 + 科室 + 主诉 + 症状 + 摘要，中文按字二元组、英文/数字按词切分
+- 签名：MinHash（默认 64 个哈希函数）估算 Jaccard 相似度
+- 分桶：LSH 把签名切成若干 band，任一 band 相同即进入候选
+- 维护：事件创建/更新/聚合/摘要生成后增量更新；进程重启或其它进程写入时，
+  查询前按 (事件数, 最近更新时间) 检测变化并重载（签名按文档指纹复用，不重复计算）
+
+只有排名靠前的候选事件才会交给 EventAggregationService.find_related_events。
+"""
+import hashlib
+import random
+import re
+import threading
+import zlib
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, load_only
+
+from ...config import get_settings
+from ...models.medical_event import MedicalEvent
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# 梅森素数，用于通用哈希 (a * x + b) mod p
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+_TOKEN_RE = re.compile("[\u4e00-\u9fff]+|[a-z0-9]+")
+
+
+def shingles(text: str) -> Set[str]:
+    """把文本切分为 shingle 集合（中文字二元组，英文/数字整词）"""
+    result: Set[str] = set()
+    for token in _TOKEN_RE.findall((text or "").lower()):
+        if token.isascii():
+            result.add(token)
+        elif len(token) == 1:
+            result.add(token)
+        else:
+            result.update(token[i:i + 2] for i in range(len(token) - 1))
+    return result
+
+
+def event_document(
+    title: Optional[str],
+    department: Optional[str],
+    chief_complaint: Optional[str],
+    summary: Optional[str],
+    symptoms: Optional[Iterable[Any]] = None
+) -> str:
+    """拼接参与相似度计算的事件文本"""
+    parts = [title or "", department or "", chief_complaint or "", summary or ""]
+    parts.extend(str(s) for s in (symptoms or []) if s)
+    return " ".join(p for p in parts if p)
+
+
+def document_of(event: MedicalEvent) -> str:
+    """从事件模型构建索引文档"""
+    analysis = event.ai_analysis if isinstance(event.ai_analysis, dict) else {}
+    symptoms = analysis.get("symptoms", [])
+    return event_document(
+        event.title,
+        event.department,
+        event.chief_complaint,
+        event.summary,
+        symptoms if isinstance(symptoms, list) else []
+    )
+
+
+@dataclass
+class _IndexedEvent:
+    """索引中的单个事件"""
+    version: str
+    signature: Tuple[int, ...]
+
+
+@dataclass
+class _UserIndex:
+    """单个用户的索引"""
+    events: Dict[int, _IndexedEvent] = field(default_factory=dict)
+    buckets: Dict[Tuple[int, int], Set[int]] = field(default_factory=dict)
+    marker: Optional[Tuple[Any, ...]] = None
+
+
+class EventSimilarityIndex:
+    """按用户划分的 MinHash/LSH 事件相似度索引"""
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, seed: int = 1):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(seed)
+        self._perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+        self._users: Dict[int, _UserIndex] = {}
+        self._lock = threading.Lock()
+
+    # ============= 签名计算 =============
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        """计算文本的 MinHash 签名"""
+        hashes = [zlib.crc32(s.encode("utf-8")) for s in shingles(text)]
+        if not hashes:
+            return tuple([_MAX_HASH] * self.num_perm)
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self._perms
+        )
+
+    @staticmethod
+    def similarity(sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+        """由签名估算 Jaccard 相似度"""
+        if not sig_a or not sig_b:
+            return 0.0
+        same = sum(1 for x, y in zip(sig_a, sig_b) if x == y and x != _MAX_HASH)
+        return same / len(sig_a)
+
+    def _band_keys(self, signature: Tuple[int, ...]) -> List[Tuple[int, int]]:
+        keys = []
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows]
+            if all(v == _MAX_HASH for v in chunk):
+                continue
+            keys.append((band, hash(chunk)))
+        return keys
+
+    # ============= 索引维护 =============
+
+    def upsert(self, user_id: int, event_id: int, text: str):
+        """新增或更新事件（文档未变化时跳过）"""
+        version = hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            user_index = self._users.setdefault(user_id, _UserIndex())
+            current = user_index.events.get(event_id)
+            if current is not None and current.version == version:
+                return
+        signature = self.signature(text)
+        with self._lock:
+            user_index = self._users.setdefault(user_id, _UserIndex())
+            self._remove_locked(user_index, event_id)
+            user_index.events[event_id] = _IndexedEvent(version=version, signature=signature)
+            for key in self._band_keys(signature):
+                user_index.buckets.setdefault(key, set()).add(event_id)
+
+    def remove(self, user_id: int, event_id: int):
+        """移除事件"""
+        with self._lock:
+            user_index = self._users.get(user_id)
+            if user_index is not None:
+                self._remove_locked(user_index, event_id)
+
+    def _remove_locked(self, user_index: _UserIndex, event_id: int):
+        current = user_index.events.pop(event_id, None)
+        if current is None:
+            return
+        for key in self._band_keys(current.signature):
+            bucket = user_index.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(event_id)
+                if not bucket:
+                    user_index.buckets.pop(key, None)
+
+    def upsert_event(self, event: MedicalEvent):
+        """根据事件模型更新索引"""
+        self.upsert(event.user_id, event.id, document_of(event))
+
+    def remove_event(self, user_id: int, event_id: int):
+        """删除事件后移出索引"""
+        self.remove(user_id, event_id)
+
+    def ensure_user(self, db: Session, user_id: int):
+        """
+        确保用户索引与数据库一致
+
+        用 (事件数, 最近更新时间) 作为变化标记，一致时不访问事件数据；
+        不一致时重载轻量字段，文档未变化的事件复用已有签名
+        """
+        count, last_updated = db.query(
+            func.count(MedicalEvent.id), func.max(MedicalEvent.updated_at)
+        ).filter(MedicalEvent.user_id == user_id).one()
+        marker = (count, str(last_updated))
+
+        with self._lock:
+            user_index = self._users.get(user_id)
+            if user_index is not None and user_index.marker == marker:
+                return
+
+        events = db.query(MedicalEvent).options(load_only(
+            MedicalEvent.id, MedicalEvent.user_id, MedicalEvent.title, MedicalEvent.department,
+            MedicalEvent.chief_complaint, MedicalEvent.summary, MedicalEvent.ai_analysis
+        )).filter(MedicalEvent.user_id == user_id).all()
+
+        alive = {e.id for e in events}
+        for event in events:
+            self.upsert_event(event)
+        with self._lock:
+            user_index = self._users.setdefault(user_id, _UserIndex())
+            for stale_id in [eid for eid in user_index.events if eid not in alive]:
+                self._remove_locked(user_index, stale_id)
+            user_index.marker = marker
+        logger.debug("相似度索引已同步: user=%s events=%d", user_id, len(alive))
+
+    # ============= 查询 =============
+
+    def query(
+        self,
+        user_id: int,
+        event_id: Optional[int] = None,
+        text: Optional[str] = None,
+        top_k: int = 10,
+        min_score: float = 0.0
+    ) -> List[Tuple[int, float]]:
+        """
+        查询最相似的事件
+
+        优先取 LSH 同桶候选；同桶候选不足 top_k 时对该用户其余事件逐一比较签名补足，
+        保证文本较短、相似度偏低时仍能召回
+
+        Args:
+            user_id: 用户ID
+            event_id: 以已索引事件为查询对象（结果排除自身）
+            text: 以任意文本为查询对象
+            top_k: 返回数量
+            min_score: 最低相似度
+
+        Returns:
+            [(事件ID, 估算相似度)]，按相似度降序
+        """
+        with self._lock:
+            user_index = self._users.get(user_id)
+            if user_index is None:
+                return []
+            if event_id is not None and event_id in user_index.events:
+                signature = user_index.events[event_id].signature
+            else:
+                signature = None
+            events = dict(user_index.events)
+            lsh_ids: Set[int] = set()
+            if signature is not None or text is not None:
+                if signature is None:
+                    signature = self.signature(text or "")
+                for key in self._band_keys(signature):
+                    lsh_ids.update(user_index.buckets.get(key, ()))
+        if signature is None:
+            return []
+
+        lsh_ids.discard(event_id)
+        scored = [(eid, self.similarity(signature, events[eid].signature)) for eid in lsh_ids]
+        if len(scored) < top_k:
+            scored.extend(
+                (eid, self.similarity(signature, item.signature))
+                for eid, item in events.items()
+                if eid != event_id and eid not in lsh_ids
+            )
+        scored = [(eid, score) for eid, score in scored if score > min_score]
+        scored.sort(key=lambda x: (-x[1], -x[0]))
+        return scored[:top_k]
+
+    def clear(self):
+        """清空索引"""
+        with self._lock:
+            self._users.clear()
+
+
+# 单例
+_similarity_index: Optional[EventSimilarityIndex] = None
+
+
+def get_similarity_index() -> EventSimilarityIndex:
+    """获取事件相似度索引单例"""
+    global _similarity_index
+    if _similarity_index is None:
+        _similarity_index = EventSimilarityIndex(
+            num_perm=settings.AI_SIMILARITY_NUM_PERM,
+            bands=settings.AI_SIMILARITY_BANDS
+        )
+    return _similarity_index
@@ -0,0 +1,113 @@
+"""
+AI 任务单飞（single-flight）合并
+
+同一事件的摘要、相关事件、合并等 AI 任务耗时数秒，用户连点或多端同时打开时
+会重复触发。这里按 (任务名, 事件ID, 内容版本) 合并并发的相同请求：
+
+- 进行中的任务：后到的请求直接等待同一个结果
+- 已完成的任务：结果按内容版本缓存，事件的会话/附件/备注变化后版本改变，自然失效
+"""
+import asyncio
+import hashlib
+import json
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+from ...config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def content_version(*parts: Any) -> str:
+    """计算内容版本（参与 AI 计算的输入数据指纹）"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class SingleFlight:
+    """并发请求合并 + 结果缓存"""
+
+    def __init__(self, ttl_seconds: int = 600, max_entries: int = 512):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._memo: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[T]],
+        use_cache: bool = True
+    ) -> T:
+        """
+        执行任务，相同 key 的并发调用共享同一次计算
+
+        Args:
+            key: 任务键，建议 (任务名, 事件ID, 内容版本)
+            fn: 实际计算函数
+            use_cache: 是否读取已缓存结果（强制重新生成时为 False，但仍会合并进行中的任务）
+        """
+        if use_cache:
+            cached = self._get_cached(key)
+            if cached is not None:
+                logger.debug("single-flight 命中缓存: %s", key)
+                return cached
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run(key, fn))
+            self._inflight[key] = task
+        else:
+            logger.debug("single-flight 合并进行中的任务: %s", key)
+
+        # shield：某个请求断开不影响其它等待者
+        return await asyncio.shield(task)
+
+    async def _run(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        try:
+            result = await fn()
+            self._set_cached(key, result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    def _get_cached(self, key: Hashable) -> Optional[Any]:
+        entry = self._memo.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            self._memo.pop(key, None)
+            return None
+        self._memo.move_to_end(key)
+        return value
+
+    def _set_cached(self, key: Hashable, value: Any):
+        self._memo[key] = (time.time() + self.ttl_seconds, value)
+        self._memo.move_to_end(key)
+        while len(self._memo) > self.max_entries:
+            self._memo.popitem(last=False)
+
+    def clear(self):
+        """清空缓存（进行中的任务不受影响）"""
+        self._memo.clear()
+
+
+# 单例
+_single_flight: Optional[SingleFlight] = None
+
+
+def get_single_flight() -> SingleFlight:
+    """获取单飞合并器单例"""
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight(
+            ttl_seconds=settings.AI_SINGLE_FLIGHT_TTL_SECONDS,
+            max_entries=settings.AI_SINGLE_FLIGHT_MAX_ENTRIES
+        )
+    return _single_flight
@@ -6,14 +6,29 @@ AI 摘要服务
 - 提取症状信息
 - 生成时间轴
 - 风险评估
+- 增量摘要：单次问诊摘要只计算一次，新会话通过合并步骤并入现有摘要
+- map-reduce：会话较多时先并发生成单次问诊摘要，再归并为事件摘要
 """
+import asyncio
 import json
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 from dataclasses import dataclass, asdict
 
 from .base_ai_service import BaseAIService
+from ..llm_routing import LLMTask
 from .prompts.summary_prompts import SUMMARY_PROMPTS
+from .single_flight import content_version
+from .tokens import estimate_tokens, truncate_to_tokens
+from ..structured_logging import get_logger
+from ...config import get_settings
+
+settings = get_settings()
+log = get_logger(__name__)
+
+# ai_analysis 中记录增量摘要进度的字段
+SUMMARY_STATE_KEY = "summary_state"
+RISK_PRIORITY = {"low": 0, "medium": 1, "high": 2, "emergency": 3}
 
 
 @dataclass
@@ -55,14 +70,26 @@ class SummaryResult:
         return asdict(self)
 
 
+@dataclass
+class SummaryUpdate:
+    """摘要更新结果"""
+    result: SummaryResult
+    analysis: Dict[str, Any]  # 可直接写入 MedicalEvent.ai_analysis（含增量状态）
+    sessions: List[Dict]  # 附带单次问诊摘要（ai_summary）的会话列表
+    mode: str  # unchanged/incremental/full
+
+
 class AISummaryService(BaseAIService):
     """AI 摘要服务"""
     
     def __init__(self):
         super().__init__(
             temperature=0.3,
-            max_tokens=2000
+            max_tokens=2000,
+            task=LLMTask.SUMMARY
         )
+        # map 阶段并发上限（单例共享，跨请求生效）
+        self._map_semaphore = asyncio.Semaphore(max(settings.AI_SUMMARY_CONCURRENCY, 1))
     
     async def generate_summary(
         self,
@@ -88,7 +115,9 @@ class AISummaryService(BaseAIService):
             SummaryResult 摘要结果
         """
         # 格式化对话记录
-        conversation = self._format_conversations(sessions)
+        conversation = self._format_conversations(
+            sessions, token_budget=settings.AI_SUMMARY_SINGLE_PASS_TOKENS
+        )
         
         # 格式化附件信息
         attachments_text = self._format_attachments(attachments or [])
@@ -113,24 +142,305 @@ class AISummaryService(BaseAIService):
             
             result = self._parse_json(response, self._get_default_summary())
             
-            return SummaryResult(
-                summary=result.get("summary", "暂无摘要"),
-                key_points=result.get("key_points", []),
-                symptoms=result.get("symptoms", []),
-                symptom_details=result.get("symptom_details", {}),
-                possible_diagnosis=result.get("possible_diagnosis", []),
-                risk_level=result.get("risk_level", "low"),
-                risk_warning=result.get("risk_warning"),
-                recommendations=result.get("recommendations", []),
-                follow_up_reminders=result.get("follow_up_reminders", []),
-                timeline=result.get("timeline", []),
-                confidence=result.get("confidence", 0.5)
-            )
+            return self._to_summary_result(result)
             
         except Exception as e:
             print(f"AI 摘要生成失败: {e}")
             return self._get_fallback_summary(chief_complaint, department, sessions)
     
+    async def update_summary(
+        self,
+        chief_complaint: str,
+        department: str,
+        sessions: List[Dict],
+        attachments: Optional[List[Dict]] = None,
+        notes: Optional[List[Dict]] = None,
+        existing_summary: Optional[str] = None,
+        existing_analysis: Optional[Dict] = None,
+        force_regenerate: bool = False
+    ) -> SummaryUpdate:
+        """
+        增量更新病历摘要
+        
+        - 已并入摘要的会话不再重新发送给 LLM
+        - 新增/变化的会话先生成单次问诊摘要（存入会话的 ai_summary），再与现有摘要合并
+        - force_regenerate 或没有增量状态时全量重建
+        
+        Returns:
+            SummaryUpdate，调用方负责把 analysis 和 sessions 写回事件
+        """
+        attachments = attachments or []
+        notes = notes or []
+        sessions = [dict(s) for s in sessions]
+        state = (existing_analysis or {}).get(SUMMARY_STATE_KEY)
+        
+        if force_regenerate or not existing_summary or not state:
+            result, sessions = await self.generate_full_summary(
+                chief_complaint=chief_complaint,
+                department=department,
+                sessions=sessions,
+                attachments=attachments,
+                notes=notes,
+                reuse_session_summaries=not force_regenerate
+            )
+            return self.build_update(result, sessions, attachments, notes, "full")
+        
+        pending = self._pending_sessions(sessions, state)
+        extras_changed = state.get("extras") != self._extras_version(attachments, notes)
+        if not pending and not extras_changed:
+            result = self._to_summary_result({**existing_analysis, "summary": existing_summary})
+            return self.build_update(result, sessions, attachments, notes, "unchanged")
+        
+        # 单次问诊摘要：每个会话只计算一次
+        await self.map_sessions(pending, chief_complaint, department, reuse_existing=False)
+        new_summaries = [session["ai_summary"] for session in pending]
+        
+        result = await self._merge_into_existing(
+            chief_complaint=chief_complaint,
+            department=department,
+            existing_summary=existing_summary,
+            existing_analysis=existing_analysis,
+            new_summaries=new_summaries,
+            attachments=attachments,
+            notes=notes
+        )
+        return self.build_update(result, sessions, attachments, notes, "incremental")
+    
+    def needs_update(
+        self,
+        sessions: List[Dict],
+        attachments: Optional[List[Dict]],
+        notes: Optional[List[Dict]],
+        existing_analysis: Optional[Dict]
+    ) -> bool:
+        """
+        判断现有摘要是否落后于事件内容
+        
+        没有增量状态的历史数据视为已是最新，需 force_regenerate 才会重建
+        """
+        state = (existing_analysis or {}).get(SUMMARY_STATE_KEY)
+        if not state:
+            return False
+        if state.get("extras") != self._extras_version(attachments or [], notes or []):
+            return True
+        return bool(self._pending_sessions(sessions, state))
+    
+    async def summarize_session(
+        self,
+        session: Dict,
+        chief_complaint: str = "",
+        department: str = ""
+    ) -> Dict[str, Any]:
+        """
+        生成单次问诊摘要
+        
+        Args:
+            session: 会话记录
+            chief_complaint: 事件主诉
+            department: 科室
+        
+        Returns:
+            单次问诊摘要字典（附带 version，用于判断会话内容是否变化）
+        """
+        prompt = SUMMARY_PROMPTS["summarize_session"].format(
+            chief_complaint=session.get("chief_complaint") or chief_complaint or "未提供",
+            department=department or "未知",
+            conversation=self._format_conversations(
+                [session], token_budget=settings.AI_SUMMARY_SESSION_TOKEN_BUDGET
+            )
+        )
+        
+        try:
+            response = await self._call_llm(
+                system_prompt=SUMMARY_PROMPTS["system"],
+                user_prompt=prompt,
+                max_tokens=600
+            )
+            result = self._parse_json(response, {})
+        except Exception as e:
+            log.warning("session_summary_failed", error=str(e))
+            result = {}
+        
+        if not result:
+            result = {
+                "summary": session.get("summary", ""),
+                "symptoms": session.get("symptoms", []) if isinstance(session.get("symptoms"), list) else [],
+                "risk_level": session.get("risk_level", "low")
+            }
+        
+        result["session_id"] = session.get("session_id", "")
+        result["timestamp"] = session.get("timestamp", "")
+        result["version"] = self._session_version(session)
+        return result
+    
+    async def generate_full_summary(
+        self,
+        chief_complaint: str,
+        department: str,
+        sessions: List[Dict],
+        attachments: Optional[List[Dict]] = None,
+        notes: Optional[List[Dict]] = None,
+        reuse_session_summaries: bool = True
+    ) -> Tuple[SummaryResult, List[Dict]]:
+        """
+        全量生成事件摘要
+        
+        对话总量在单次调用预算内时直接生成；否则走 map-reduce：
+        各会话并发生成单次问诊摘要（map），再归并为事件摘要与时间轴（reduce）
+        
+        Returns:
+            (摘要结果, 会话列表)。map-reduce 时会话附带 ai_summary
+        """
+        sessions = [dict(s) for s in sessions]
+        total_tokens = sum(self._estimate_session_tokens(s) for s in sessions)
+        if total_tokens <= settings.AI_SUMMARY_SINGLE_PASS_TOKENS:
+            result = await self.generate_summary(
+                chief_complaint=chief_complaint,
+                department=department,
+                sessions=sessions,
+                attachments=attachments,
+                notes=notes
+            )
+            return result, sessions
+        
+        await self.map_sessions(sessions, chief_complaint, department, reuse_existing=reuse_session_summaries)
+        result = await self.reduce_summaries(
+            chief_complaint=chief_complaint,
+            department=department,
+            session_summaries=[s["ai_summary"] for s in sessions],
+            attachments=attachments or [],
+            notes=notes or []
+        )
+        return result, sessions
+    
+    async def map_sessions(
+        self,
+        sessions: List[Dict],
+        chief_complaint: str,
+        department: str,
+        reuse_existing: bool = True
+    ) -> List[Dict]:
+        """
+        map 阶段：并发生成单次问诊摘要，写入各会话的 ai_summary
+        
+        reuse_existing 时跳过已有且内容未变化的会话摘要
+        """
+        async def summarize(session: Dict):
+            existing = session.get("ai_summary")
+            if reuse_existing and existing and existing.get("version") == self._session_version(session):
+                return
+            async with self._map_semaphore:
+                session["ai_summary"] = await self.summarize_session(session, chief_complaint, department)
+        
+        await asyncio.gather(*(summarize(s) for s in sessions))
+        return sessions
+    
+    async def reduce_summaries(
+        self,
+        chief_complaint: str,
+        department: str,
+        session_summaries: List[Dict],
+        attachments: List[Dict],
+        notes: List[Dict]
+    ) -> SummaryResult:
+        """
+        reduce 阶段：归并单次问诊摘要为事件摘要
+        
+        输入超出 token 预算时按时间顺序分组，逐级归并为阶段摘要后再做最终归并
+        """
+        items = sorted(
+            [{k: v for k, v in s.items() if k != "version"} for s in session_summaries],
+            key=lambda s: s.get("timestamp", "")
+        )
+        budget = settings.AI_SUMMARY_REDUCE_TOKEN_BUDGET
+        while len(items) > 1 and self._estimate_json_tokens(items) > budget:
+            groups = self._group_by_budget(items, budget)
+            if len(groups) == len(items):
+                break
+            items = await asyncio.gather(*(
+                self._reduce_group(group, chief_complaint, department) for group in groups
+            ))
+        
+        prompt = SUMMARY_PROMPTS["reduce_summary"].format(
+            chief_complaint=chief_complaint or "未提供",
+            department=department or "未知",
+            session_summaries=truncate_to_tokens(json.dumps(items, ensure_ascii=False), budget),
+            attachments=self._format_attachments(attachments),
+            notes=self._format_notes(notes)
+        )
+        
+        try:
+            response = await self._call_llm(
+                system_prompt=SUMMARY_PROMPTS["system"],
+                user_prompt=prompt
+            )
+            result = self._parse_json(response, {})
+        except Exception as e:
+            log.warning("summary_reduce_failed", error=str(e))
+            result = {}
+        
+        summary = self._to_summary_result(result) if result else self._merge_locally({}, items)
+        if not summary.timeline:
+            summary.timeline = [
+                {"time": s.get("timestamp", ""), "event": s.get("summary", ""), "type": "consultation"}
+                for s in items if s.get("summary")
+            ]
+        return summary
+    
+    async def _reduce_group(self, group: List[Dict], chief_complaint: str, department: str) -> Dict:
+        """把一组摘要归并为阶段摘要"""
+        if len(group) == 1:
+            return group[0]
+        
+        prompt = SUMMARY_PROMPTS["reduce_group"].format(
+            chief_complaint=chief_complaint or "未提供",
+            department=department or "未知",
+            session_summaries=json.dumps(group, ensure_ascii=False)
+        )
+        try:
+            async with self._map_semaphore:
+                response = await self._call_llm(
+                    system_prompt=SUMMARY_PROMPTS["system"],
+                    user_prompt=prompt,
+                    max_tokens=600
+                )
+            result = self._parse_json(response, {})
+        except Exception as e:
+            log.warning("summary_group_reduce_failed", error=str(e))
+            result = {}
+        
+        if not result:
+            result = self._merge_locally({}, group).to_dict()
+        result["timestamp"] = group[0].get("timestamp", "")
+        return result
+    
+    def _group_by_budget(self, items: List[Dict], budget: int) -> List[List[Dict]]:
+        """按顺序把摘要打包成不超过预算的分组"""
+        groups: List[List[Dict]] = []
+        current: List[Dict] = []
+        used = 0
+        for item in items:
+            cost = self._estimate_json_tokens(item)
+            if current and used + cost > budget:
+                groups.append(current)
+                current, used = [], 0
+            current.append(item)
+            used += cost
+        if current:
+            groups.append(current)
+        return groups
+    
+    @staticmethod
+    def _estimate_json_tokens(value: Any) -> int:
+        return estimate_tokens(json.dumps(value, ensure_ascii=False))
+    
+    @staticmethod
+    def _estimate_session_tokens(session: Dict) -> int:
+        tokens = estimate_tokens(session.get("summary", "") or "")
+        for msg in session.get("messages", []) or []:
+            tokens += estimate_tokens(msg.get("content", "") or "") + 2
+        return tokens
+    
     async def extract_symptoms(
         self,
         conversation: str
@@ -152,7 +462,8 @@ class AISummaryService(BaseAIService):
             response = await self._call_llm(
                 system_prompt=SUMMARY_PROMPTS["system"],
                 user_prompt=prompt,
-                temperature=0.2
+                temperature=0.2,
+                task=LLMTask.SYMPTOM_EXTRACTION
             )
             
             result = self._parse_json(response, {"symptoms": [], "red_flags": []})
@@ -226,32 +537,187 @@ class AISummaryService(BaseAIService):
         
         return timeline
     
-    def _format_conversations(self, sessions: List[Dict]) -> str:
-        """格式化会话记录为文本"""
+    async def _merge_into_existing(
+        self,
+        chief_complaint: str,
+        department: str,
+        existing_summary: str,
+        existing_analysis: Dict,
+        new_summaries: List[Dict],
+        attachments: List[Dict],
+        notes: List[Dict]
+    ) -> SummaryResult:
+        """把新增问诊摘要合并到现有摘要（提示词只包含摘要，不含完整对话）"""
+        existing = {
+            key: value for key, value in existing_analysis.items()
+            if key != SUMMARY_STATE_KEY
+        }
+        existing["summary"] = existing_summary
+        
+        prompt = SUMMARY_PROMPTS["merge_summary"].format(
+            existing_analysis=json.dumps(existing, ensure_ascii=False),
+            new_sessions=json.dumps(
+                [{k: v for k, v in s.items() if k != "version"} for s in new_summaries],
+                ensure_ascii=False
+            ) if new_summaries else "无新增问诊",
+            chief_complaint=chief_complaint or "未提供",
+            department=department or "未知",
+            attachments=self._format_attachments(attachments),
+            notes=self._format_notes(notes)
+        )
+        
+        try:
+            response = await self._call_llm(
+                system_prompt=SUMMARY_PROMPTS["system"],
+                user_prompt=prompt
+            )
+            result = self._parse_json(response, {})
+            if result:
+                return self._to_summary_result(result)
+        except Exception as e:
+            log.warning("summary_merge_failed", error=str(e))
+        
+        return self._merge_locally(existing, new_summaries)
+    
+    def _merge_locally(self, existing: Dict, new_summaries: List[Dict]) -> SummaryResult:
+        """LLM 不可用时的本地合并：列表取并集，风险取最高"""
+        merged = dict(existing)
+        
+        def union(key: str) -> List:
+            items = list(merged.get(key) or [])
+            for summary in new_summaries:
+                for item in summary.get(key) or []:
+                    if item not in items:
+                        items.append(item)
+            return items
+        
+        for key in ("key_points", "symptoms", "possible_diagnosis", "recommendations"):
+            merged[key] = union(key)
+        
+        symptom_details = dict(merged.get("symptom_details") or {})
+        for summary in new_summaries:
+            symptom_details.update(summary.get("symptom_details") or {})
+        merged["symptom_details"] = symptom_details
+        
+        risk_levels = [merged.get("risk_level", "low")] + [s.get("risk_level", "low") for s in new_summaries]
+        merged["risk_level"] = max(risk_levels, key=lambda r: RISK_PRIORITY.get(r, 0))
+        
+        extra = "；".join(s.get("summary", "") for s in new_summaries if s.get("summary"))
+        if extra:
+            merged["summary"] = f"{merged.get('summary', '')}；{extra}".strip("；")
+        merged["confidence"] = min(merged.get("confidence", 0.5), 0.5)
+        return self._to_summary_result(merged)
+    
+    def build_update(
+        self,
+        result: SummaryResult,
+        sessions: List[Dict],
+        attachments: List[Dict],
+        notes: List[Dict],
+        mode: str = "full"
+    ) -> SummaryUpdate:
+        """生成可持久化的分析结果，记录已并入摘要的会话版本"""
+        analysis = result.to_dict()
+        analysis[SUMMARY_STATE_KEY] = {
+            "sessions": {
+                s.get("session_id", ""): self._session_version(s) for s in sessions
+            },
+            "extras": self._extras_version(attachments, notes)
+        }
+        return SummaryUpdate(result=result, analysis=analysis, sessions=sessions, mode=mode)
+    
+    def _pending_sessions(self, sessions: List[Dict], state: Dict) -> List[Dict]:
+        """尚未并入摘要、或并入后内容发生变化的会话"""
+        folded = state.get("sessions") or {}
+        return [
+            s for s in sessions
+            if folded.get(s.get("session_id", "")) != self._session_version(s)
+        ]
+    
+    @staticmethod
+    def _session_version(session: Dict) -> str:
+        return content_version({k: v for k, v in session.items() if k != "ai_summary"})
+    
+    @staticmethod
+    def _extras_version(attachments: List[Dict], notes: List[Dict]) -> str:
+        return content_version(attachments, notes)
+    
+    def _to_summary_result(self, result: Dict[str, Any]) -> SummaryResult:
+        """LLM 输出字典转换为 SummaryResult"""
+        return SummaryResult(
+            summary=result.get("summary", "暂无摘要"),
+            key_points=result.get("key_points", []),
+            symptoms=result.get("symptoms", []),
+            symptom_details=result.get("symptom_details", {}),
+            possible_diagnosis=result.get("possible_diagnosis", []),
+            risk_level=result.get("risk_level", "low"),
+            risk_warning=result.get("risk_warning"),
+            recommendations=result.get("recommendations", []),
+            follow_up_reminders=result.get("follow_up_reminders", []),
+            timeline=result.get("timeline", []),
+            confidence=result.get("confidence", 0.5)
+        )
+    
+    def _format_conversations(self, sessions: List[Dict], token_budget: Optional[int] = None) -> str:
+        """
+        格式化会话记录为文本
+        
+        指定 token_budget 时按预算均分给各会话，每个会话从最新消息往前装入；
+        未指定时沿用旧规则（每个会话最近 10 条、每条 200 字）
+        """
         if not sessions:
             return "暂无对话记录"
         
+        per_session_budget = token_budget // len(sessions) if token_budget else None
+        
         lines = []
         for session in sessions:
             session_id = session.get("session_id", "")
             summary = session.get("summary", "")
             timestamp = session.get("timestamp", "")
             
-            lines.append(f"【会话 {session_id[:8] if session_id else ''}】时间：{timestamp}")
+            header = [f"【会话 {session_id[:8] if session_id else ''}】时间：{timestamp}"]
             if summary:
-                lines.append(f"摘要：{summary}")
+                header.append(f"摘要：{summary}")
+            lines.extend(header)
             
             # 如果有详细消息
             messages = session.get("messages", [])
-            for msg in messages[-10:]:  # 只取最近10条
-                role = "患者" if msg.get("role") == "user" else "医生"
-                content = msg.get("content", "")
-                lines.append(f"{role}: {self._truncate_text(content, 200)}")
+            if per_session_budget is None:
+                for msg in messages[-10:]:  # 只取最近10条
+                    role = "患者" if msg.get("role") == "user" else "医生"
+                    content = msg.get("content", "")
+                    lines.append(f"{role}: {self._truncate_text(content, 200)}")
+            else:
+                lines.extend(self._pack_messages(
+                    messages, per_session_budget - estimate_tokens("\n".join(header))
+                ))
             
             lines.append("")
         
         return "\n".join(lines)
     
+    def _pack_messages(self, messages: List[Dict], budget: int) -> List[str]:
+        """从最新消息往前装入预算内的消息，保持时间顺序"""
+        picked: List[str] = []
+        used = 0
+        for msg in reversed(messages):
+            role = "患者" if msg.get("role") == "user" else "医生"
+            line = f"{role}: {msg.get('content', '')}"
+            cost = estimate_tokens(line) + 1
+            if used + cost > budget:
+                if not picked and budget > 0:
+                    picked.append(truncate_to_tokens(line, budget))
+                break
+            picked.append(line)
+            used += cost
+        
+        omitted = len(messages) - len(picked)
+        picked.reverse()
+        if omitted > 0:
+            picked.insert(0, f"（较早的 {omitted} 条消息已省略）")
+        return picked
+    
     def _format_attachments(self, attachments: List[Dict]) -> str:
         """格式化附件信息"""
         if not attachments:
@@ -0,0 +1,54 @@
+"""
+本地 token 估算
+
+不依赖远端 tokenizer，用于在发送请求前计算提示词预算：
+- 中日韩字符及全角标点按 1 字符 ≈ 1 token 估算（Qwen 系列实际略低，估算偏保守）
+- 其它字符（英文、数字、空白、半角标点）按 4 字符 ≈ 1 token 估算
+"""
+import math
+import re
+from typing import List
+
+_WIDE_CHAR_RE = re.compile("[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef\u3000-\u303f]")
+
+# 每条消息的格式开销（角色标记等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本 token 数"""
+    if not text:
+        return 0
+    wide = len(_WIDE_CHAR_RE.findall(text))
+    narrow = len(text) - wide
+    return wide + math.ceil(narrow / 4)
+
+
+def estimate_messages_tokens(messages: List[dict]) -> int:
+    """估算 OpenAI 格式消息列表的 token 数"""
+    total = 0
+    for message in messages:
+        content = message.get("content", "")
+        if not isinstance(content, str):
+            content = str(content)
+        total += estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    return total
+
+
+def truncate_to_tokens(text: str, max_tokens: int, suffix: str = "...") -> str:
+    """按 token 预算截断文本（保留开头）"""
+    if max_tokens <= 0 or not text:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    # 二分查找满足预算的最长前缀
+    low, high = 0, len(text)
+    budget = max_tokens - estimate_tokens(suffix)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + suffix
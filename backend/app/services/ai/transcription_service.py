@@ -17,6 +17,7 @@ from dataclasses import dataclass, asdict
 from enum import Enum
 
 from .base_ai_service import BaseAIService
+from ..llm_routing import LLMTask
 from ...config import get_settings
 
 settings = get_settings()
@@ -76,7 +77,7 @@ class SpeechTranscriptionService(BaseAIService):
     MAX_DURATION = 600  # 10分钟
     
     def __init__(self):
-        super().__init__()
+        super().__init__(task=LLMTask.TRANSCRIPTION)
         self._task_cache: Dict[str, TranscriptionResult] = {}
     
     async def transcribe(
@@ -387,7 +388,8 @@ class SpeechTranscriptionService(BaseAIService):
                 system_prompt=system_prompt,
                 user_prompt=user_prompt,
                 temperature=0.1,
-                max_tokens=500
+                max_tokens=500,
+                task=LLMTask.SYMPTOM_EXTRACTION
             )
             
             # 尝试解析 JSON 数组
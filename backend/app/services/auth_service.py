@@ -1,12 +1,13 @@
 import logging
 from datetime import datetime, timedelta
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Union
 from jose import jwt, JWTError
 from sqlalchemy.orm import Session
 from ..models.user import User
 from ..config import get_settings
 from .sms_service import sms_service
 from .password_service import hash_password, verify_password, validate_password_strength
+from .user_cache import CurrentUser, get_auth_user_cache
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
@@ -119,16 +120,16 @@ class AuthService:
         return access_token, refresh_token
 
     @staticmethod
-    def verify_token(token: str, token_type: str = "access") -> Optional[int]:
+    def decode_token(token: str, token_type: str = "access") -> Optional[dict]:
         """
-        验证JWT Token
+        解码并验证JWT Token
         
         Args:
             token: JWT Token
             token_type: 期望的Token类型
         
         Returns:
-            用户ID 或 None
+            Token 载荷（含 sub / exp）或 None
         """
         try:
             payload = jwt.decode(
@@ -142,11 +143,10 @@ class AuthService:
                 logger.warning(f"[AUTH] Token类型不匹配: expected={token_type}, got={payload.get('type')}")
                 return None
             
-            user_id = payload.get("sub")
-            if user_id is None:
+            if payload.get("sub") is None:
                 return None
             
-            return int(user_id)
+            return payload
         except JWTError as e:
             logger.warning(f"[AUTH] Token验证失败: {str(e)}")
             return None
@@ -154,6 +154,26 @@ class AuthService:
             logger.error(f"[AUTH] Token验证异常: {str(e)}")
             return None
 
+    @staticmethod
+    def verify_token(token: str, token_type: str = "access") -> Optional[int]:
+        """
+        验证JWT Token
+        
+        Args:
+            token: JWT Token
+            token_type: 期望的Token类型
+        
+        Returns:
+            用户ID 或 None
+        """
+        payload = AuthService.decode_token(token, token_type)
+        if payload is None:
+            return None
+        try:
+            return int(payload["sub"])
+        except (TypeError, ValueError):
+            return None
+
     @staticmethod
     def refresh_tokens(refresh_token: str) -> Optional[Tuple[str, str]]:
         """
@@ -172,18 +192,31 @@ class AuthService:
         return AuthService.create_tokens(user_id)
 
     @staticmethod
-    def update_user_profile(db: Session, user: User, profile_data: dict) -> User:
+    def invalidate_user_cache(user_id: int):
+        """用户资料、密码或启用状态变更后清除认证缓存中的用户快照"""
+        get_auth_user_cache().invalidate_user(user_id)
+
+    @staticmethod
+    def _attached_user(db: Session, user: Union[User, CurrentUser]) -> User:
+        """认证依赖返回的是用户快照，修改前需要取回 ORM 对象"""
+        if isinstance(user, User):
+            return user
+        return db.query(User).filter(User.id == user.id).one()
+
+    @staticmethod
+    def update_user_profile(db: Session, user: Union[User, CurrentUser], profile_data: dict) -> User:
         """
         更新用户资料
         
         Args:
             db: 数据库会话
-            user: 用户对象
+            user: 用户对象或当前用户快照
             profile_data: 要更新的资料字典
         
         Returns:
             更新后的用户对象
         """
+        user = AuthService._attached_user(db, user)
         update_fields = [
             'nickname', 'avatar_url', 'gender', 'birthday',
             'emergency_contact_name', 'emergency_contact_phone', 
@@ -200,6 +233,7 @@ class AuthService:
         
         db.commit()
         db.refresh(user)
+        AuthService.invalidate_user_cache(user.id)
         
         logger.info(f"[AUTH] 用户资料更新: user_id={user.id}")
         return user
@@ -313,28 +347,30 @@ class AuthService:
         return user, ""
     
     @staticmethod
-    def set_user_password(db: Session, user: User, new_password: str) -> bool:
+    def set_user_password(db: Session, user: Union[User, CurrentUser], new_password: str) -> Optional[User]:
         """
         设置或更新用户密码
         
         Args:
             db: 数据库会话
-            user: 用户对象
+            user: 用户对象或当前用户快照
             new_password: 新密码
             
         Returns:
-            是否成功
+            更新后的用户对象，失败返回 None
         """
+        user = AuthService._attached_user(db, user)
         try:
             user.password_hash = hash_password(new_password)
             db.commit()
             db.refresh(user)
+            AuthService.invalidate_user_cache(user.id)
             logger.info(f"[AUTH] 密码更新成功: user_id={user.id}")
-            return True
+            return user
         except Exception as e:
             logger.error(f"[AUTH] 密码更新失败: user_id={user.id}, error={str(e)}")
             db.rollback()
-            return False
+            return None
     
     @staticmethod
     def reset_password(db: Session, phone: str, new_password: str) -> Tuple[bool, str]:
@@ -360,6 +396,7 @@ class AuthService:
         try:
             user.password_hash = hash_password(new_password)
             db.commit()
+            AuthService.invalidate_user_cache(user.id)
             logger.info(f"[AUTH] 密码重置成功: user_id={user.id}")
             return True, ""
         except Exception as e:
@@ -13,6 +13,7 @@ from langgraph.graph import StateGraph, END, START
 from langgraph.graph.message import add_messages
 
 from .base_agent import BaseAgent
+from ..metrics import GraphNodeTimer
 
 
 def _serialize_messages(messages: List[dict]) -> List[dict]:
@@ -210,9 +211,11 @@ class LangGraphAgentBase(BaseAgent):
         """
         final_state = state.copy()
         streamed_content = ""
+        node_timer = GraphNodeTimer(type(self).__name__)
         
         try:
             async for event in self.graph.astream_events(state, version="v2"):
+                node_timer.observe(event)
                 event_type = event.get("event", "")
                 
                 # 处理 LLM 流式输出
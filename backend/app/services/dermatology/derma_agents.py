@@ -12,6 +12,7 @@ from pydantic import BaseModel, Field
 from crewai import Agent, Task, LLM
 
 from ...config import get_settings
+from ..llm_scheduler import schedule_crew_llm
 
 settings = get_settings()
 
@@ -30,7 +31,7 @@ def create_llm(multimodal: bool = False) -> LLM:
     # 多模态时使用 qwen-vl 系列模型
     model_name = settings.QWEN_VL_MODEL if multimodal else settings.LLM_MODEL
     
-    return LLM(
+    return schedule_crew_llm(LLM(
         model=f"openai/{model_name}",
         api_key=settings.LLM_API_KEY,
         base_url=settings.LLM_BASE_URL,
@@ -38,7 +39,7 @@ def create_llm(multimodal: bool = False) -> LLM:
         max_tokens=2000,
         timeout=120 if multimodal else 90,  # 多模态需要更长超时
         max_retries=2,
-    )
+    ))
 
 
 def create_multimodal_llm() -> LLM:
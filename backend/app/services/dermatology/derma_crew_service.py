@@ -11,6 +11,8 @@ from crewai import Crew, Process
 from openai import OpenAI
 
 from ...config import get_settings
+from ..ai.tokens import estimate_messages_tokens, estimate_tokens
+from ..llm_scheduler import get_llm_scheduler
 from .derma_agents import (
     create_conversation_orchestrator,
     create_conversation_task,
@@ -326,15 +328,20 @@ class DermaCrewService:
         
         # 调用多模态模型
         loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(
-            None,
-            lambda: client.chat.completions.create(
-                model=settings.QWEN_VL_MODEL,
-                messages=messages,
-                max_tokens=2000,
-                temperature=0.6
+        # 图片按 base64 长度估算会远超实际计费，只统计文本部分
+        text_messages = [m for m in messages if isinstance(m["content"], str)]
+        estimated = estimate_messages_tokens(text_messages) + estimate_tokens(user_input or "") + 2000
+        async with get_llm_scheduler().slot(settings.QWEN_VL_MODEL, estimated) as ticket:
+            response = await loop.run_in_executor(
+                None,
+                lambda: client.chat.completions.create(
+                    model=settings.QWEN_VL_MODEL,
+                    messages=messages,
+                    max_tokens=2000,
+                    temperature=0.6
+                )
             )
-        )
+            ticket.used_tokens = response.usage.total_tokens if response.usage else None
         
         response_text = response.choices[0].message.content
         print(f"[DermaCrewService] 多模态模型原始回复: {response_text[:200]}...")
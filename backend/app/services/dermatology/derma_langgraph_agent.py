@@ -13,6 +13,8 @@ from langchain_core.messages import HumanMessage, SystemMessage
 
 from ..base.langgraph_base import LangGraphAgentBase
 from ..llm_provider import LLMProvider
+from ..llm_routing import LLMTask
+from ..tracing import trace_node
 from .derma_state import DermaState, create_derma_initial_state
 from .output_models import (
     ConversationOutput, 
@@ -76,11 +78,11 @@ class DermaLangGraphAgent(LangGraphAgentBase):
         graph = StateGraph(DermaState)
         
         # 添加节点
-        graph.add_node("router", self._route_node)
-        graph.add_node("greeting", self._greeting_node)
-        graph.add_node("conversation", self._conversation_node)
-        graph.add_node("image_analysis", self._image_analysis_node)
-        graph.add_node("diagnosis", self._diagnosis_node)
+        graph.add_node("router", trace_node("derma", "router", self._route_node))
+        graph.add_node("greeting", trace_node("derma", "greeting", self._greeting_node))
+        graph.add_node("conversation", trace_node("derma", "conversation", self._conversation_node))
+        graph.add_node("image_analysis", trace_node("derma", "image_analysis", self._image_analysis_node))
+        graph.add_node("diagnosis", trace_node("derma", "diagnosis", self._diagnosis_node))
         
         # 设置入口点
         graph.add_edge(START, "router")
@@ -295,7 +297,7 @@ class DermaLangGraphAgent(LangGraphAgentBase):
     
     async def _diagnosis_node(self, state: DermaState) -> DermaState:
         """诊断节点 - 综合分析给出建议（流式输出优化）"""
-        llm = LLMProvider.get_llm()
+        llm = LLMProvider.get_llm(task=LLMTask.DIAGNOSIS)
         
         # 获取图片分析结果
         image_analysis_text = ""
@@ -7,6 +7,7 @@ from typing import List
 from pydantic import BaseModel, Field
 
 from ..llm_provider import LLMProvider
+from ..llm_routing import LLMTask
 
 
 class QuickOptionsOutput(BaseModel):
@@ -49,7 +50,7 @@ def generate_quick_options(response: str) -> List[dict]:
         return []
     
     try:
-        llm = LLMProvider.get_llm()
+        llm = LLMProvider.get_llm(task=LLMTask.QUICK_OPTIONS)
         
         # 使用结构化输出
         structured_llm = llm.with_structured_output(QuickOptionsOutput)
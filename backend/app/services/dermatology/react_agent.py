@@ -6,12 +6,22 @@
 import json
 from typing import Dict, Any, List
 from langgraph.graph import StateGraph, END, START
-from langchain_core.messages import SystemMessage, ToolMessage, AIMessage
+from langchain_core.messages import ToolMessage, AIMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
 
+from ...config import get_settings
+from ..ai.context_builder import ContextBuilder
+from ..ai.prompt_cache import DYNAMIC, PromptAssembly
+from ..ai.tokens import estimate_tokens, truncate_to_tokens
 from ..llm_provider import LLMProvider
+from ..structured_logging import get_logger
+from ..tracing import start_span, trace_node
 from .react_state import DermaReActState, create_react_initial_state
 from .react_tools import get_derma_tools
 
+log = get_logger(__name__)
+settings = get_settings()
+
 
 # System Prompt
 DERMA_REACT_PROMPT = """你是一位经验丰富的皮肤科专家医生，正在与患者进行问诊对话。
@@ -66,6 +76,22 @@ DERMA_REACT_PROMPT = """你是一位经验丰富的皮肤科专家医生，正
 - 不要透露自己使用的底层模型或服务提供商"""
 
 
+def _key_facts(state: DermaReActState) -> Dict[str, Any]:
+    """上下文中始终保留的关键信息，未提取到主诉时以患者第一条消息代替"""
+    chief_complaint = state.get("chief_complaint", "")
+    if not chief_complaint:
+        for message in state["messages"]:
+            if getattr(message, "type", "") == "human" and isinstance(message.content, str):
+                chief_complaint = truncate_to_tokens(message.content, 100)
+                break
+    return {
+        "主诉": chief_complaint,
+        "部位": state.get("skin_location", ""),
+        "持续时间": state.get("duration", ""),
+        "症状": state.get("symptoms", []),
+    }
+
+
 def _build_derma_react_graph():
     """构建皮肤科 ReAct Agent 状态图"""
     
@@ -77,17 +103,31 @@ def _build_derma_react_graph():
     llm = LLMProvider.get_llm()
     model_with_tools = llm.bind_tools(tools)
     
+    # 系统提示词、工具定义与输出预留之外的预算用于对话历史
+    tool_schema = json.dumps([convert_to_openai_tool(tool) for tool in tools], ensure_ascii=False)
+    context_builder = ContextBuilder.for_model(
+        settings.LLM_MODEL,
+        reserved=estimate_tokens(DERMA_REACT_PROMPT) + estimate_tokens(tool_schema) + settings.LLM_MAX_TOKENS
+    )
+    
     def call_model(state: DermaReActState) -> Dict[str, Any]:
         """Agent 节点：调用 LLM"""
-        system_message = SystemMessage(content=DERMA_REACT_PROMPT)
+        # 按预算截取对话历史，早期消息压缩为摘要，关键信息始终保留
+        context = context_builder.build(
+            state["messages"],
+            facts=_key_facts(state),
+            summary_state=state.get("context_summary")
+        )
+        # 固定提示词在前（可缓存前缀），关键信息与摘要在后
+        system_prompt = PromptAssembly().add(DERMA_REACT_PROMPT).add(context.preamble(), DYNAMIC)
         
         # 构建消息列表
-        messages = [system_message] + list(state["messages"])
+        messages = [system_prompt.langchain_message(settings.LLM_MODEL)] + context.messages
         
         # 调用 LLM
         response = model_with_tools.invoke(messages)
         
-        return {"messages": [response]}
+        return {"messages": [response], "context_summary": context.summary_state}
     
     def tool_node(state: DermaReActState) -> Dict[str, Any]:
         """工具节点：执行工具调用并更新状态"""
@@ -95,24 +135,16 @@ def _build_derma_react_graph():
         updates = {}  # 用于收集 state 更新
         last_message = state["messages"][-1]
         
-        # === 调试日志：工具调用 ===
-        if hasattr(last_message, "tool_calls") and last_message.tool_calls:
-            print(f"[DEBUG] tool_node 收到工具调用: {len(last_message.tool_calls)} 个")
-            for tc in last_message.tool_calls:
-                print(f"[DEBUG] - 工具名称: {tc['name']}")
-                print(f"[DEBUG] - 工具参数: {tc['args']}")
-        else:
-            print(f"[DEBUG] tool_node: 没有工具调用")
-        # === 日志结束 ===
-        
         if hasattr(last_message, "tool_calls") and last_message.tool_calls:
             for tool_call in last_message.tool_calls:
                 tool_name = tool_call["name"]
                 tool_args = tool_call["args"]
+                log.debug("tool_call", tool=tool_name, args=lambda: tool_args)
                 
                 # 执行工具
                 if tool_name in tools_by_name:
-                    result = tools_by_name[tool_name].invoke(tool_args)
+                    with start_span(f"tool {tool_name}", {"tool.name": tool_name}):
+                        result = tools_by_name[tool_name].invoke(tool_args)
                     
                     # 根据工具类型更新 state
                     if tool_name == "retrieve_derma_knowledge":
@@ -128,20 +160,20 @@ def _build_derma_react_graph():
                     elif tool_name == "generate_structured_diagnosis":
                         # 更新诊断卡
                         if isinstance(result, dict):
-                            # === 调试日志：诊断工具结果 ===
-                            summary_preview = result.get('summary', 'N/A')[:50] if result.get('summary') else 'N/A'
-                            print(f"[DEBUG] generate_structured_diagnosis 返回:")
-                            print(f"[DEBUG] - summary: {summary_preview}...")
-                            print(f"[DEBUG] - conditions: {len(result.get('conditions', []))} 个")
-                            print(f"[DEBUG] - risk_level: {result.get('risk_level', 'N/A')}")
-                            # === 日志结束 ===
-                            
+                            log.debug(
+                                "diagnosis_card_updated",
+                                conditions=lambda: len(result.get("conditions", [])),
+                                risk_level=result.get("risk_level"),
+                                card_keys=lambda: list(result.keys())
+                            )
                             updates["diagnosis_card"] = result
-                            
-                            # === 调试日志：state 更新 ===
-                            print(f"[DEBUG] 已更新 state['diagnosis_card']")
-                            print(f"[DEBUG] - 包含字段: {list(result.keys())}")
-                            # === 日志结束 ===
+                            # 诊断参数中的部位、持续时间、症状作为关键信息保留
+                            if tool_args.get("location") and not state.get("skin_location"):
+                                updates["skin_location"] = tool_args["location"]
+                            if tool_args.get("duration") and not state.get("duration"):
+                                updates["duration"] = tool_args["duration"]
+                            if tool_args.get("symptoms") and not state.get("symptoms"):
+                                updates["symptoms"] = list(tool_args["symptoms"])
                             # 更新推理步骤
                             if "reasoning_steps" in result:
                                 current_steps = state.get("reasoning_steps", [])
@@ -161,19 +193,13 @@ def _build_derma_react_graph():
                     elif tool_name == "record_intermediate_advice":
                         # 记录中间建议
                         if isinstance(result, dict):
-                            # === 调试日志：中间建议 ===
-                            content_preview = result.get('content', 'N/A')[:50] if result.get('content') else 'N/A'
-                            print(f"[DEBUG] record_intermediate_advice 返回:")
-                            print(f"[DEBUG] - title: {result.get('title', 'N/A')}")
-                            print(f"[DEBUG] - content: {content_preview}...")
-                            # === 日志结束 ===
-                            
                             advice_history = state.get("advice_history", [])
                             updates["advice_history"] = advice_history + [result]
-                            
-                            # === 调试日志：state 更新 ===
-                            print(f"[DEBUG] 已更新 state['advice_history'], 当前数量: {len(updates['advice_history'])}")
-                            # === 日志结束 ===
+                            log.debug(
+                                "advice_recorded",
+                                title=result.get("title"),
+                                advice_count=len(updates["advice_history"])
+                            )
                             # 同步推理步骤
                             current_steps = state.get("reasoning_steps", [])
                             updates["reasoning_steps"] = current_steps + [
@@ -230,8 +256,8 @@ def _build_derma_react_graph():
     workflow = StateGraph(DermaReActState)
     
     # 添加节点
-    workflow.add_node("agent", call_model)
-    workflow.add_node("tools", tool_node)
+    workflow.add_node("agent", trace_node("derma_react", "agent", call_model))
+    workflow.add_node("tools", trace_node("derma_react", "tools", tool_node))
     
     # 设置入口
     workflow.add_edge(START, "agent")
@@ -45,6 +45,9 @@ class DermaReActState(TypedDict):
     advice_history: List[dict]  # [{id, title, content, evidence, timestamp}]
     diagnosis_card: Optional[dict]  # 结构化诊断结果
     reasoning_steps: List[str]  # ["收集症状", "检索文献", "鉴别诊断"]
+    
+    # === 上下文 ===
+    context_summary: Optional[dict]  # 早期对话滚动摘要 {text, covered}（ContextBuilder 缓存）
 
 
 def create_react_initial_state(session_id: str, user_id: int) -> DermaReActState:
@@ -68,5 +71,6 @@ def create_react_initial_state(session_id: str, user_id: int) -> DermaReActState
         need_offline_visit=False,
         advice_history=[],
         diagnosis_card=None,
-        reasoning_steps=[]
+        reasoning_steps=[],
+        context_summary=None
     )
@@ -11,7 +11,10 @@ from langchain_core.tools import tool
 from langchain_core.messages import HumanMessage, SystemMessage
 from pydantic import BaseModel, Field
 
+from ..ai.partial_json import STRUCTURED_STREAM_TAG, StructuredStream
+from ..image_preprocessing import get_image_preprocessor
 from ..llm_provider import LLMProvider
+from ..llm_routing import LLMTask
 
 
 class SkinAnalysisResult(BaseModel):
@@ -168,6 +171,8 @@ def analyze_skin_image(image_base64: str, chief_complaint: str = "") -> dict:
         包含皮损描述、形态、颜色、分布特征的分析结果
     """
     llm = LLMProvider.get_multimodal_llm()
+    # 手机原图先缩放、重新编码再发送（在预处理进程池中执行）
+    image = get_image_preprocessor().preprocess_sync(image_base64)
     
     prompt = """你是皮肤科影像专家。分析皮肤照片，描述皮损特征。
 
@@ -182,7 +187,7 @@ def analyze_skin_image(image_base64: str, chief_complaint: str = "") -> dict:
     messages = [
         SystemMessage(content=prompt),
         HumanMessage(content=[
-            {"type": "image_url", "image_url": {"url": image_base64}},
+            {"type": "image_url", "image_url": {"url": image.data_url}},
             {"type": "text", "text": f"请分析这张皮肤图片。患者主诉：{chief_complaint or '未说明'}"}
         ])
     ]
@@ -191,7 +196,8 @@ def analyze_skin_image(image_base64: str, chief_complaint: str = "") -> dict:
     
     return {
         "description": response.content,
-        "type": "skin_analysis"
+        "type": "skin_analysis",
+        "preprocess": image.stats()
     }
 
 
@@ -214,7 +220,7 @@ def generate_diagnosis(
     Returns:
         包含鉴别诊断、风险等级、护理建议的诊断结果
     """
-    llm = LLMProvider.get_llm()
+    llm = LLMProvider.get_llm(task=LLMTask.DIAGNOSIS)
     
     prompt = f"""作为皮肤科专家，根据以下信息给出初步诊断建议：
 
@@ -260,8 +266,10 @@ def generate_structured_diagnosis(
     Returns:
         结构化诊断卡，包含 summary, conditions, risk_level, care_plan 等
     """
-    llm = LLMProvider.get_llm()
-    structured_llm = llm.with_structured_output(DiagnosisOutput)
+    # 以 JSON 模式流式生成，字段完整后即通过 structured_partial 事件推送给前端
+    llm = LLMProvider.get_llm(task=LLMTask.DIAGNOSIS).bind(
+        response_format={"type": "json_object"}
+    ).with_config(tags=[STRUCTURED_STREAM_TAG])
     
     # 构建参考资料文本
     refs_text = ""
@@ -286,11 +294,15 @@ def generate_structured_diagnosis(
 4. need_offline_visit: 是否建议线下就诊
 5. urgency: 如需就诊，紧急程度说明
 6. care_plan: 护理建议列表
-7. reasoning_steps: 你的推理步骤"""
+7. reasoning_steps: 你的推理步骤
+
+只输出一个 JSON 对象，按以上顺序包含这些字段，不要输出其他内容。"""
     
     try:
-        result = structured_llm.invoke(prompt)
-        result_dict = result.model_dump()
+        stream = StructuredStream("diagnosis_card")
+        for chunk in llm.stream(prompt):
+            stream.feed(chunk.content)
+        result_dict = DiagnosisOutput.model_validate(stream.result()).model_dump()
         # 确保包含 references 字段（即使为空）
         if "references" not in result_dict:
             result_dict["references"] = knowledge_refs if knowledge_refs else []
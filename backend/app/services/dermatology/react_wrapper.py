@@ -3,14 +3,20 @@ ReAct Agent API 适配层
 
 实现 BaseAgent 接口，保持与现有 API 兼容
 """
+import asyncio
 import re
 from typing import Dict, Any, Optional, Callable, Awaitable, List
 from langchain_core.messages import HumanMessage, AIMessage
 
+from ..ai.partial_json import STRUCTURED_STREAM_TAG
 from ..base import BaseAgent
 from .react_state import create_react_initial_state
 from .react_agent import get_derma_react_graph
 from .quick_options import generate_quick_options
+from ..metrics import GraphNodeTimer
+from ..structured_logging import get_logger
+
+log = get_logger(__name__)
 
 
 # JSON 特征关键词列表（诊断相关）
@@ -50,16 +56,15 @@ def _looks_like_json_start(text: str) -> bool:
     return False
 
 
-def _contains_json_field_keyword(text: str) -> bool:
-    """检测文本是否包含 JSON 字段关键词"""
-    for keyword in _JSON_FIELD_KEYWORDS:
-        if keyword in text:
-            return True
-    return False
+# 诊断相关的字段名（候选块的首个键属于这些字段时，不必等到冒号即可认定为 JSON）
+_JSON_FIELD_NAMES = {keyword.strip('":') for keyword in _JSON_FIELD_KEYWORDS}
+_JSON_KEY_MAX_LENGTH = 64  # 候选块的首个键超过该长度仍未结束，视为普通文本
+_BLOCK_TOKENS = re.compile(r'[{}"]')
+_STRING_TOKENS = re.compile(r'["\\]')
 
 
 def _filter_json_from_response(text: str) -> str:
-    """从 AI 回复中过滤掉 JSON 内容"""
+    """从 AI 回复中过滤掉 JSON 内容（与流式输出使用同一个过滤器）"""
     if not text:
         return text
     
@@ -67,37 +72,8 @@ def _filter_json_from_response(text: str) -> str:
     if _is_json_content(text):
         return ""
     
-    # 尝试移除文本中嵌入的 JSON 块（支持嵌套）
-    # 使用更健壮的方法：追踪括号层级
-    result = []
-    i = 0
-    n = len(text)
-    while i < n:
-        if text[i] == '{':
-            # 尝试找到匹配的 }
-            depth = 1
-            j = i + 1
-            while j < n and depth > 0:
-                if text[j] == '{':
-                    depth += 1
-                elif text[j] == '}':
-                    depth -= 1
-                j += 1
-            # 检查这个块是否包含 JSON 特征
-            block = text[i:j]
-            if _contains_json_field_keyword(block) or re.search(r'"[a-z_]+"\s*:', block):
-                # 跳过整个 JSON 块
-                i = j
-                continue
-            else:
-                # 不是 JSON，保留
-                result.append(text[i])
-                i += 1
-        else:
-            result.append(text[i])
-            i += 1
-    
-    cleaned = ''.join(result)
+    json_filter = StreamingJsonFilter()
+    cleaned = json_filter.process_chunk(text) + json_filter.flush()
     # 清理多余的空行
     cleaned = re.sub(r'\n{3,}', '\n\n', cleaned)
     
@@ -109,13 +85,24 @@ class StreamingJsonFilter:
     流式 JSON 过滤器
     
     用于在流式输出时检测并过滤 JSON 块，避免用户看到 "先闪 JSON，再被覆盖" 的现象。
+    
+    增量状态机，每个字符只处理一次（总耗时与输出长度成线性）：
+    - 文本：直接输出到下一个 `{`，不做缓冲
+    - 候选块：`{` 之后（忽略空白）必须紧跟字符串键，键后是 `:` 或键名属于诊断字段才认定为 JSON；
+      其余情况立即把缓冲的内容作为普通文本输出（缓冲不超过一个键的长度）
+    - JSON 块：按括号深度丢弃到块结束，字符串内的括号与转义字符不计入深度
     """
     
+    _TEXT, _CANDIDATE, _JSON = range(3)
+    
     def __init__(self):
-        self._buffer = ""  # 累积缓冲区
-        self._in_json_block = False  # 是否正在 JSON 块内
+        self._mode = self._TEXT
+        self._candidate: List[str] = []  # 候选块已缓冲的原文
+        self._key: Optional[List[str]] = None  # 候选块首个键，None 表示还没遇到引号
+        self._key_closed = False
+        self._escape = False  # 上一个字符是字符串内的反斜杠（可能跨 chunk）
+        self._in_string = False
         self._brace_depth = 0  # 花括号深度
-        self._pending_output = ""  # 待输出内容
     
     def process_chunk(self, chunk: str) -> str:
         """
@@ -127,45 +114,21 @@ class StreamingJsonFilter:
         if not chunk:
             return ""
         
-        output = []
-        
-        for char in chunk:
-            if self._in_json_block:
-                # 正在 JSON 块内，追踪括号
-                self._buffer += char
-                if char == '{':
-                    self._brace_depth += 1
-                elif char == '}':
-                    self._brace_depth -= 1
-                    if self._brace_depth == 0:
-                        # JSON 块结束，检查是否确实是 JSON
-                        if _contains_json_field_keyword(self._buffer) or re.search(r'"[a-z_]+"\s*:', self._buffer):
-                            # 确认是 JSON，丢弃整个块
-                            pass
-                        else:
-                            # 不是 JSON，输出缓冲区内容
-                            output.append(self._buffer)
-                        self._buffer = ""
-                        self._in_json_block = False
+        output: List[str] = []
+        pos, n = 0, len(chunk)
+        while pos < n:
+            if self._mode == self._TEXT:
+                start = chunk.find('{', pos)
+                if start < 0:
+                    output.append(chunk[pos:])
+                    break
+                output.append(chunk[pos:start])
+                self._start_candidate()
+                pos = start + 1
+            elif self._mode == self._CANDIDATE:
+                pos = self._feed_candidate(chunk, pos, output)
             else:
-                # 不在 JSON 块内
-                if char == '{':
-                    # 可能是 JSON 块开始
-                    # 先输出之前累积的待输出内容
-                    if self._pending_output:
-                        output.append(self._pending_output)
-                        self._pending_output = ""
-                    # 开始追踪
-                    self._in_json_block = True
-                    self._brace_depth = 1
-                    self._buffer = char
-                else:
-                    # 普通字符，累积到待输出
-                    self._pending_output += char
-                    # 如果累积了足够内容且不以 JSON 相关字符结尾，可以输出
-                    if len(self._pending_output) > 20 and not self._pending_output.rstrip().endswith(('"', ':')):
-                        output.append(self._pending_output)
-                        self._pending_output = ""
+                pos = self._skip_json(chunk, pos)
         
         return ''.join(output)
     
@@ -174,18 +137,96 @@ class StreamingJsonFilter:
         刷新剩余内容
         
         Returns:
-            剩余的待输出内容
+            尚未判定的候选块原文（未闭合的 JSON 块直接丢弃）
         """
-        result = self._pending_output
-        # 如果还在 JSON 块内但未闭合，也尝试输出（可能不是 JSON）
-        if self._in_json_block and self._buffer:
-            if not _contains_json_field_keyword(self._buffer):
-                result += self._buffer
-        self._pending_output = ""
-        self._buffer = ""
-        self._in_json_block = False
-        self._brace_depth = 0
+        result = ''.join(self._candidate) if self._mode == self._CANDIDATE else ""
+        self.__init__()
         return result
+    
+    def _start_candidate(self):
+        self._mode = self._CANDIDATE
+        self._candidate = ['{']
+        self._key = None
+        self._key_closed = False
+        self._escape = False
+    
+    def _feed_candidate(self, chunk: str, pos: int, output: List[str]) -> int:
+        """消费候选块的字符直到能判定是否为 JSON，返回下一个待处理位置"""
+        n = len(chunk)
+        while pos < n:
+            char = chunk[pos]
+            if self._key is None:
+                # 等待首个键的引号
+                if char == '"':
+                    self._key = []
+                elif not char.isspace():
+                    return self._reject(pos, output)
+            elif not self._key_closed:
+                # 键名内
+                if self._escape:
+                    self._escape = False
+                    self._key.append(char)
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._key_closed = True
+                    if ''.join(self._key) in _JSON_FIELD_NAMES:
+                        return self._accept(pos + 1)
+                else:
+                    self._key.append(char)
+                    if len(self._key) > _JSON_KEY_MAX_LENGTH:
+                        self._candidate.append(char)
+                        return self._reject(pos + 1, output)
+            elif char == ':':
+                return self._accept(pos + 1)
+            elif not char.isspace():
+                return self._reject(pos, output)
+            self._candidate.append(char)
+            pos += 1
+        return pos
+    
+    def _accept(self, pos: int) -> int:
+        """认定为 JSON：丢弃缓冲，进入块内（此时位于首个键之后、字符串之外）"""
+        self._mode = self._JSON
+        self._candidate = []
+        self._brace_depth = 1
+        self._in_string = False
+        self._escape = False
+        return pos
+    
+    def _reject(self, pos: int, output: List[str]) -> int:
+        """不是 JSON：缓冲内容作为普通文本输出，当前字符回到文本状态重新处理"""
+        output.append(''.join(self._candidate))
+        self._mode = self._TEXT
+        self._candidate = []
+        self._escape = False
+        return pos
+    
+    def _skip_json(self, chunk: str, pos: int) -> int:
+        """丢弃 JSON 块内的字符，块结束时回到文本状态，返回下一个待处理位置"""
+        n = len(chunk)
+        while pos < n:
+            if self._escape:
+                self._escape = False
+                pos += 1
+                continue
+            match = (_STRING_TOKENS if self._in_string else _BLOCK_TOKENS).search(chunk, pos)
+            if match is None:
+                return n
+            token = match.group()
+            pos = match.end()
+            if token == '\\':
+                self._escape = True
+            elif token == '"':
+                self._in_string = not self._in_string
+            elif token == '{':
+                self._brace_depth += 1
+            else:
+                self._brace_depth -= 1
+                if self._brace_depth == 0:
+                    self._mode = self._TEXT
+                    break
+        return pos
 
 
 def _serialize_messages(messages: list) -> List[dict]:
@@ -288,7 +329,8 @@ class DermaReActWrapper(BaseAgent):
         
         # 生成快捷选项
         if ai_response:
-            final_state["quick_options"] = generate_quick_options(ai_response)
+            # 同步 LLM 调用放到线程中执行，不阻塞事件循环
+            final_state["quick_options"] = await asyncio.to_thread(generate_quick_options, ai_response)
         
         # 序列化消息
         final_state["messages"] = _serialize_messages(final_state.get("messages", []))
@@ -305,24 +347,22 @@ class DermaReActWrapper(BaseAgent):
         
         # 使用流式 JSON 过滤器，避免用户看到"先闪 JSON 再被覆盖"的现象
         json_filter = StreamingJsonFilter()
+        node_timer = GraphNodeTimer(type(self).__name__)
         
         async for event in self._graph.astream_events(state, version="v2"):
+            node_timer.observe(event)
             if event.get("event") == "on_chat_model_stream":
+                # 工具内部生成结构化结果的 token 已通过 structured_partial 事件推送，不作为回复文本
+                if STRUCTURED_STREAM_TAG in event.get("tags", []):
+                    continue
                 chunk = event.get("data", {}).get("chunk")
                 if chunk and hasattr(chunk, "content") and chunk.content:
                     # 过滤掉工具调用相关的内容
                     if hasattr(chunk, "tool_calls") and chunk.tool_calls:
                         continue
                     
-                    # 使用流式 JSON 过滤器处理
-                    content = chunk.content
-                    
-                    # 快速检查：如果整个 chunk 明显是 JSON，直接跳过
-                    if _is_json_content(content):
-                        continue
-                    
-                    # 通过流式过滤器处理（处理跨 chunk 的 JSON 块）
-                    filtered_content = json_filter.process_chunk(content)
+                    # 通过流式过滤器处理（JSON 块可能跨多个 chunk，不能按单个 chunk 判断后跳过）
+                    filtered_content = json_filter.process_chunk(chunk.content)
                     if filtered_content:
                         await on_chunk(filtered_content)
             elif event.get("event") == "on_chain_end":
@@ -346,35 +386,23 @@ class DermaReActWrapper(BaseAgent):
                                     final_state[key] = value
                             else:
                                 final_state[key] = value
-                    # === 调试日志 ===
-                    if "advice_history" in output:
-                        adv_val = output.get('advice_history')
-                        print(f"[DEBUG] _run_with_stream: 捕获到 advice_history 更新")
-                        print(f"[DEBUG]   - 值类型: {type(adv_val).__name__}")
-                        print(f"[DEBUG]   - 值是否为None: {adv_val is None}")
-                        print(f"[DEBUG]   - 数量: {len(adv_val) if adv_val else 0}")
-                    if "diagnosis_card" in output:
-                        diag_val = output.get('diagnosis_card')
-                        print(f"[DEBUG] _run_with_stream: 捕获到 diagnosis_card 更新")
-                        print(f"[DEBUG]   - 值类型: {type(diag_val).__name__}")
-                        print(f"[DEBUG]   - 值是否为None: {diag_val is None}")
-                    # === 日志结束 ===
+                    if "advice_history" in output or "diagnosis_card" in output:
+                        log.debug(
+                            "stream_state_update",
+                            advice_count=lambda: len(output.get("advice_history") or []),
+                            has_diagnosis=lambda: output.get("diagnosis_card") is not None
+                        )
         
         # 刷新流式过滤器中剩余的内容
         remaining = json_filter.flush()
         if remaining:
             await on_chunk(remaining)
         
-        # === 调试日志：最终状态 ===
-        print(f"[DEBUG] _run_with_stream 最终状态:")
-        adv_final = final_state.get('advice_history')
-        diag_final = final_state.get('diagnosis_card')
-        print(f"[DEBUG] - advice_history: 类型={type(adv_final).__name__}, 是None={adv_final is None}, 数量={len(adv_final) if adv_final else 0}")
-        print(f"[DEBUG] - diagnosis_card: 类型={type(diag_final).__name__}, 是None={diag_final is None}")
-        if adv_final:
-            for i, adv in enumerate(adv_final):
-                print(f"[DEBUG]   - [{i}] {adv.get('title', 'N/A')}")
-        # === 日志结束 ===
+        log.debug(
+            "stream_final_state",
+            advice_titles=lambda: [a.get("title") for a in final_state.get("advice_history") or []],
+            has_diagnosis=lambda: final_state.get("diagnosis_card") is not None
+        )
         
         return final_state
     
@@ -2,10 +2,13 @@
 AI诊室智能体服务 - 基于LangGraph实现医疗问诊流程
 """
 import json
-import httpx
 from typing import TypedDict, List, Optional, Literal, Callable, Awaitable, AsyncIterator
 from datetime import datetime
 from ..config import get_settings
+from .ai.context_builder import ContextBuilder
+from .ai.tokens import estimate_tokens
+from .llm_provider import LLMProvider
+from .llm_routing import LLMTask, get_task_latency_stats, resolve_task
 
 settings = get_settings()
 
@@ -54,6 +57,9 @@ class DiagnosisState(TypedDict):
     confidence: int
     missing_info: List[str]
 
+    # 早期对话滚动摘要（ContextBuilder 缓存）
+    context_summary: Optional[dict]
+
 
 class DiagnosisAgent:
     """AI诊室智能体"""
@@ -69,7 +75,15 @@ class DiagnosisAgent:
 
 注意：你的回答仅供参考，不能替代专业医生的诊断。"""
 
-    QUESTION_PROMPT = """基于以下对话历史，生成下一个问诊问题。
+    # 以下模板固定的说明在前、患者信息与对话历史在后，前缀逐字不变，便于服务商缓存
+    QUESTION_PROMPT = """基于下面的对话历史，生成下一个问诊问题。
+
+要求：
+1. 根据已有信息，提出下一个最相关的问题
+2. 问题要具体、有针对性
+3. 如果信息足够，可以开始总结
+
+请直接输出问题，不要有多余的前缀。
 
 当前收集的信息：
 - 主诉：{chief_complaint}
@@ -78,19 +92,9 @@ class DiagnosisAgent:
 - 已提问次数：{questions_asked}
 
 对话历史：
-{messages}
-
-要求：
-1. 根据已有信息，提出下一个最相关的问题
-2. 问题要具体、有针对性
-3. 如果信息足够，可以开始总结
-
-请直接输出问题，不要有多余的前缀。"""
+{messages}"""
 
-    QUICK_OPTIONS_PROMPT = """你刚刚向患者提出了以下问题：
-"{question}"
-
-基于这个问题，预测患者最可能的3-5个回答选项。
+    QUICK_OPTIONS_PROMPT = """根据你刚刚向患者提出的问题（见末尾），预测患者最可能的3-5个回答选项。
 
 要求：
 1. 选项要覆盖常见情况（肯定/否定/具体描述）
@@ -102,18 +106,12 @@ class DiagnosisAgent:
 请严格按照以下JSON格式返回，不要有其他内容：
 {{"options": [{{"text": "选项文本", "value": "选项值", "category": "症状类别"}}]}}
 
-示例：{{"options": [{{"text": "持续2-3天", "value": "持续2-3天", "category": "时间"}}]}}"""
+示例：{{"options": [{{"text": "持续2-3天", "value": "持续2-3天", "category": "时间"}}]}}
 
-    ASSESSMENT_PROMPT = """评估当前收集的信息是否足够做出初步诊断。
+你提出的问题：
+{question}"""
 
-已收集信息：
-- 主诉：{chief_complaint}
-- 症状列表：{symptoms}
-- 症状详情：{symptom_details}
-- 已提问次数：{questions_asked}
-
-对话历史：
-{messages}
+    ASSESSMENT_PROMPT = """评估下面收集的信息是否足够做出初步诊断。
 
 评估标准：
 1. 是否收集了主要症状的持续时间、严重程度
@@ -131,11 +129,18 @@ class DiagnosisAgent:
     "confidence": 0到100的数字（诊断置信度）,
     "missing_info": ["缺失的关键信息1", "缺失的关键信息2"],
     "reasoning": "评估理由"
-}}"""
+}}
+
+已收集信息：
+- 主诉：{chief_complaint}
+- 症状列表：{symptoms}
+- 症状详情：{symptom_details}
+- 已提问次数：{questions_asked}
 
-    INITIAL_OPTIONS_PROMPT = """根据患者的主诉或常见就诊场景，生成4-5个初始快捷选项供患者选择。
+对话历史：
+{messages}"""
 
-当前主诉：{chief_complaint}
+    INITIAL_OPTIONS_PROMPT = """根据患者的主诉（见末尾）或常见就诊场景，生成4-5个初始快捷选项供患者选择。
 
 要求：
 1. 选项应覆盖常见的症状类别
@@ -147,13 +152,11 @@ class DiagnosisAgent:
 请严格按照以下JSON格式返回，不要有其他内容：
 {{"options": [{{"text": "选项文本", "value": "选项值", "category": "症状类别"}}]}}
 
-示例：{{"options": [{{"text": "咳嗽发烧", "value": "咳嗽发烧", "category": "呼吸系统"}}]}}"""
+示例：{{"options": [{{"text": "咳嗽发烧", "value": "咳嗽发烧", "category": "呼吸系统"}}]}}
 
-    DIAGNOSIS_PROMPT = """基于以下患者信息，生成完整的诊断报告。
+当前主诉：{chief_complaint}"""
 
-主诉：{chief_complaint}
-症状详情：{symptom_details}
-对话历史：{messages}
+    DIAGNOSIS_PROMPT = """基于下面的患者信息，生成完整的诊断报告。
 
 生成内容包括：
 1. 症状总结
@@ -175,42 +178,49 @@ class DiagnosisAgent:
         "urgency": "就诊紧急程度",
         "lifestyle": ["生活建议1", "生活建议2"]
     }}
-}}"""
+}}
+
+主诉：{chief_complaint}
+症状详情：{symptom_details}
+对话历史：{messages}"""
 
     def __init__(self):
         self.api_url = f"{settings.LLM_BASE_URL}/chat/completions"
         self.api_key = settings.LLM_API_KEY
         self.model = settings.LLM_MODEL
 
-    async def _call_llm(self, system_prompt: str, user_prompt: str, temperature: float = 0.7) -> str:
-        """调用LLM（非流式）"""
+    async def _call_llm(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        temperature: float = 0.7,
+        task: str = LLMTask.DIAGNOSIS
+    ) -> str:
+        """调用LLM（非流式），模型与参数按任务查询 LLM_TASK_ROUTES"""
         if not self.api_key:
             return ""
         
+        route = resolve_task(task, model=self.model, temperature=temperature, max_tokens=1000)
+        estimated = estimate_tokens(system_prompt) + estimate_tokens(user_prompt) + route.max_tokens
+
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    self.api_url,
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": self.model,
+            with get_task_latency_stats().track(route.task, route.model):
+                data = await LLMProvider.get_pool().chat_completion(
+                    {
+                        "model": route.model,
                         "messages": [
                             {"role": "system", "content": system_prompt},
                             {"role": "user", "content": user_prompt}
                         ],
-                        "temperature": temperature,
-                        "max_tokens": 1000
-                    }
+                        "temperature": route.temperature,
+                        "max_tokens": route.max_tokens
+                    },
+                    tokens=estimated,
+                    timeout=60.0
                 )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    choices = data.get("choices", [])
-                    if choices:
-                        return choices[0].get("message", {}).get("content", "")
+            choices = data.get("choices", [])
+            if choices:
+                return choices[0].get("message", {}).get("content", "")
         except Exception as e:
             print(f"LLM调用异常: {e}")
         
@@ -221,7 +231,8 @@ class DiagnosisAgent:
         system_prompt: str,
         user_prompt: str,
         temperature: float = 0.7,
-        on_chunk: Optional[Callable[[str], Awaitable[None]]] = None
+        on_chunk: Optional[Callable[[str], Awaitable[None]]] = None,
+        task: str = LLMTask.QUESTION
     ) -> str:
         """
         流式调用LLM，每收到一个token chunk就调用on_chunk回调
@@ -231,62 +242,52 @@ class DiagnosisAgent:
             return ""
         
         full_content = ""
-        
+        route = resolve_task(task, model=self.model, temperature=temperature, max_tokens=1000)
+        estimated = estimate_tokens(system_prompt) + estimate_tokens(user_prompt) + route.max_tokens
+
         try:
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                async with client.stream(
-                    "POST",
-                    self.api_url,
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": self.model,
+            with get_task_latency_stats().track(route.task, route.model):
+                # 首个 token 超时会向备用服务商发起对冲请求，回调只收到胜出一方的内容
+                chunks = LLMProvider.get_pool().stream_chat_completion(
+                    {
+                        "model": route.model,
                         "messages": [
                             {"role": "system", "content": system_prompt},
                             {"role": "user", "content": user_prompt}
                         ],
-                        "temperature": temperature,
-                        "max_tokens": 1000,
-                        "stream": True
-                    }
-                ) as response:
-                    if response.status_code != 200:
-                        print(f"LLM流式调用失败: {response.status_code}")
-                        return ""
-                    
-                    async for line in response.aiter_lines():
-                        if not line:
-                            continue
-                        if line.startswith("data: "):
-                            data_str = line[6:]
-                            if data_str.strip() == "[DONE]":
-                                break
-                            try:
-                                data = json.loads(data_str)
-                                choices = data.get("choices", [])
-                                if choices:
-                                    delta = choices[0].get("delta", {})
-                                    content = delta.get("content", "")
-                                    if content:
-                                        full_content += content
-                                        if on_chunk:
-                                            await on_chunk(content)
-                            except json.JSONDecodeError:
-                                continue
+                        "temperature": route.temperature,
+                        "max_tokens": route.max_tokens
+                    },
+                    tokens=estimated,
+                    timeout=120.0
+                )
+                async for content in chunks:
+                    full_content += content
+                    if on_chunk:
+                        await on_chunk(content)
         except Exception as e:
             print(f"LLM流式调用异常: {e}")
         
         return full_content
 
-    def _format_messages(self, messages: List[dict]) -> str:
-        """格式化对话历史"""
-        formatted = []
-        for msg in messages[-10:]:  # 只取最近10条
-            role = "患者" if msg.get("role") == "user" else "医生"
-            formatted.append(f"{role}: {msg.get('content', '')}")
-        return "\n".join(formatted)
+    def _format_messages(self, state: DiagnosisState, template: str, task: str) -> str:
+        """
+        格式化对话历史
+
+        按任务所用模型的提示词预算截取：近期消息原文保留，更早的压缩为摘要并缓存在 state["context_summary"]。
+        主诉与症状已由提示词模板单独列出，计入预留部分
+        """
+        route = resolve_task(task, model=self.model, max_tokens=1000)
+        reserved = (
+            estimate_tokens(self.SYSTEM_PROMPT) + estimate_tokens(template) + route.max_tokens
+            + estimate_tokens(state["chief_complaint"]) + estimate_tokens("、".join(state["symptoms"]))
+            + estimate_tokens(json.dumps(state["symptom_details"], ensure_ascii=False))
+        )
+        context = ContextBuilder.for_model(route.model, reserved=reserved).build(
+            state["messages"], summary_state=state.get("context_summary")
+        )
+        state["context_summary"] = context.summary_state
+        return context.as_transcript()
 
     async def generate_initial_options(self, chief_complaint: str = "") -> List[QuickOption]:
         """生成首轮快捷选项 - 由 AI 生成"""
@@ -294,7 +295,7 @@ class DiagnosisAgent:
             chief_complaint=chief_complaint or "无（用户刚开始问诊）"
         )
         
-        response = await self._call_llm(self.SYSTEM_PROMPT, prompt, temperature=0.5)
+        response = await self._call_llm(self.SYSTEM_PROMPT, prompt, temperature=0.5, task=LLMTask.QUICK_OPTIONS)
         
         default_options = [
             {"text": "头痛头晕", "value": "头痛头晕", "category": "神经系统"},
@@ -388,13 +389,13 @@ class DiagnosisAgent:
             symptoms=", ".join(state["symptoms"]) if state["symptoms"] else "无",
             symptom_details=json.dumps(state["symptom_details"], ensure_ascii=False) if state["symptom_details"] else "无",
             questions_asked=state["questions_asked"],
-            messages=self._format_messages(state["messages"])
+            messages=self._format_messages(state, self.QUESTION_PROMPT, LLMTask.QUESTION)
         )
         
         if on_chunk:
             question = await self._stream_llm(self.SYSTEM_PROMPT, prompt, on_chunk=on_chunk)
         else:
-            question = await self._call_llm(self.SYSTEM_PROMPT, prompt)
+            question = await self._call_llm(self.SYSTEM_PROMPT, prompt, task=LLMTask.QUESTION)
         
         if not question:
             question = "能否详细描述一下您的症状？比如持续时间、严重程度等。"
@@ -414,7 +415,7 @@ class DiagnosisAgent:
         """生成快捷选项"""
         prompt = self.QUICK_OPTIONS_PROMPT.format(question=state["current_question"])
         
-        response = await self._call_llm(self.SYSTEM_PROMPT, prompt, temperature=0.5)
+        response = await self._call_llm(self.SYSTEM_PROMPT, prompt, temperature=0.5, task=LLMTask.QUICK_OPTIONS)
         
         try:
             # 尝试解析JSON
@@ -462,10 +463,10 @@ class DiagnosisAgent:
             symptoms=", ".join(state["symptoms"]) if state["symptoms"] else "无",
             symptom_details=json.dumps(state["symptom_details"], ensure_ascii=False) if state["symptom_details"] else "无",
             questions_asked=state["questions_asked"],
-            messages=self._format_messages(state["messages"])
+            messages=self._format_messages(state, self.ASSESSMENT_PROMPT, LLMTask.ASSESSMENT)
         )
         
-        response = await self._call_llm(self.SYSTEM_PROMPT, prompt, temperature=0.3)
+        response = await self._call_llm(self.SYSTEM_PROMPT, prompt, temperature=0.3, task=LLMTask.ASSESSMENT)
         
         try:
             if "```json" in response:
@@ -508,11 +509,11 @@ class DiagnosisAgent:
         prompt = self.DIAGNOSIS_PROMPT.format(
             chief_complaint=state["chief_complaint"] or "未知",
             symptom_details=json.dumps(state["symptom_details"], ensure_ascii=False) if state["symptom_details"] else json.dumps({"symptoms": state["symptoms"]}, ensure_ascii=False),
-            messages=self._format_messages(state["messages"])
+            messages=self._format_messages(state, self.DIAGNOSIS_PROMPT, LLMTask.DIAGNOSIS)
         )
         
         # 诊断报告需要完整 JSON，不做流式输出，但生成诊断消息时可以流式
-        response = await self._call_llm(self.SYSTEM_PROMPT, prompt, temperature=0.5)
+        response = await self._call_llm(self.SYSTEM_PROMPT, prompt, temperature=0.5, task=LLMTask.DIAGNOSIS)
         
         try:
             if "```json" in response:
@@ -679,5 +680,6 @@ def create_initial_state(consultation_id: str, user_id: int, chief_complaint: st
         # AI评估字段（新增）
         should_diagnose=False,
         confidence=0,
-        missing_info=[]
+        missing_info=[],
+        context_summary=None
     )
@@ -0,0 +1,225 @@
+"""
+病历事件会话记录服务
+
+会话记录原先以 JSON 列表整体存放在 MedicalEvent.sessions 中，每次聚合都要重写整个列表，
+每次读取也要反序列化全部对话。现在每个会话一行（event_sessions），对话内容只保存
+messages 表的消息 ID，需要时再按 ID 批量加载。
+
+对外仍提供与旧 JSON 相同结构的会话字典（session_id / session_type / timestamp / summary /
+messages / ai_summary ...），供 AI 摘要、事件合并等流程直接使用。
+未迁移的事件（没有 event_sessions 行）回退读取旧 JSON。
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy.orm import Session, undefer
+
+from ..models.medical_event import MedicalEvent, EventSession
+from ..models.message import Message
+
+logger = logging.getLogger(__name__)
+
+# 单个会话引用的消息数上限（与旧版 JSON 一致）
+MAX_SESSION_MESSAGES = 50
+
+# 存入 details 的科室特定字段
+DETAIL_FIELDS = (
+    "skin_analyses", "ecg_interpretations", "possible_diseases",
+    "possible_conditions", "recommendations", "symptom_details"
+)
+
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    """解析会话时间戳"""
+    if isinstance(value, datetime):
+        return value
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        logger.warning("无法解析会话时间戳: %s", value)
+        return None
+
+
+def message_to_dict(message: Message) -> Dict[str, Any]:
+    """消息转为会话记录中的消息结构"""
+    return {
+        "role": message.sender.value if message.sender else "user",
+        "content": message.content,
+        "timestamp": message.created_at.isoformat() if message.created_at else "",
+        "type": message.message_type or "text"
+    }
+
+
+class EventSessionService:
+    """事件会话记录读写"""
+
+    @staticmethod
+    def apply(record: EventSession, data: Dict[str, Any], message_ids: Optional[List[int]] = None):
+        """
+        把旧版会话字典写入记录
+
+        Args:
+            record: 会话记录
+            data: 会话字典（旧 JSON 结构）
+            message_ids: 引用的消息 ID；为 None 时使用 data 中的 message_ids，
+                两者都没有时把 data 中的消息原样保存在 details 中
+        """
+        record.session_type = data.get("session_type")
+        record.started_at = parse_timestamp(data.get("timestamp"))
+        record.summary = data.get("summary")
+        record.chief_complaint = data.get("chief_complaint")
+        symptoms = data.get("symptoms")
+        record.symptoms = symptoms if isinstance(symptoms, list) else []
+        record.risk_level = data.get("risk_level")
+        record.stage = data.get("stage")
+
+        details = {k: data[k] for k in DETAIL_FIELDS if data.get(k)}
+        if message_ids is None:
+            message_ids = data.get("message_ids")
+        if not message_ids and data.get("messages"):
+            # 无法对应到 messages 表的旧数据，保留原始对话
+            details["messages"] = data["messages"]
+            record.message_ids = []
+            record.message_count = data.get("message_count") or len(data["messages"])
+        else:
+            record.message_ids = list(message_ids or [])
+            record.message_count = data.get("message_count") or len(record.message_ids)
+        record.details = details
+        if "ai_summary" in data:
+            record.ai_summary = data.get("ai_summary")
+
+    @staticmethod
+    def upsert_session(
+        db: Session,
+        event: MedicalEvent,
+        data: Dict[str, Any],
+        message_ids: Optional[List[int]] = None
+    ) -> EventSession:
+        """新增或更新事件中的会话记录（调用方负责提交）"""
+        if event.id is not None:
+            # 先把旧 JSON 转为记录，避免新旧数据混用
+            EventSessionService.migrate_legacy(db, event)
+        return EventSessionService._upsert(db, event, data, message_ids)
+
+    @staticmethod
+    def _upsert(
+        db: Session,
+        event: MedicalEvent,
+        data: Dict[str, Any],
+        message_ids: Optional[List[int]] = None
+    ) -> EventSession:
+        session_id = str(data.get("session_id"))
+        record = next((r for r in event.session_records if r.session_id == session_id), None)
+        if record is None:
+            record = EventSession(session_id=session_id)
+            event.session_records.append(record)
+        EventSessionService.apply(record, data, message_ids)
+        return record
+
+    @staticmethod
+    def save_sessions(db: Session, event: MedicalEvent, sessions: Iterable[Dict[str, Any]]):
+        """用会话字典列表回写事件的会话记录（如摘要服务返回的带 ai_summary 的列表）"""
+        EventSessionService.migrate_legacy(db, event)
+        for data in sessions:
+            EventSessionService._upsert(db, event, data)
+        event.session_count = len(event.session_records)
+
+    @staticmethod
+    def migrate_legacy(db: Session, event: MedicalEvent) -> int:
+        """
+        把事件的旧版 JSON 会话转为 event_sessions 记录（调用方负责提交）
+
+        旧 JSON 中的对话能与 messages 表一一对应时改为引用消息 ID，否则原样保存在 details 中
+
+        Returns:
+            转换的会话数
+        """
+        if event.session_records:
+            return 0
+        legacy = event.sessions or []
+        if not legacy:
+            return 0
+        for data in legacy:
+            message_ids = None
+            inline = data.get("messages") or []
+            if inline and data.get("session_id"):
+                ids = EventSessionService.resolve_message_ids(db, str(data["session_id"]), limit=len(inline))
+                if len(ids) == len(inline):
+                    message_ids = ids
+            EventSessionService._upsert(db, event, data, message_ids)
+        event.sessions = []
+        event.session_count = len(event.session_records)
+        return len(legacy)
+
+    @staticmethod
+    def load_sessions(db: Session, event: MedicalEvent, with_messages: bool = True) -> List[Dict[str, Any]]:
+        """
+        加载事件的会话字典列表（按时间排序）
+
+        Args:
+            with_messages: 是否加载对话内容（一次查询批量读取所有引用的消息）
+        """
+        records = db.query(EventSession).options(
+            undefer(EventSession.message_ids),
+            undefer(EventSession.details),
+            undefer(EventSession.ai_summary)
+        ).filter(EventSession.event_id == event.id).order_by(
+            EventSession.started_at, EventSession.id
+        ).all()
+        if not records:
+            return list(event.sessions or [])
+
+        messages_by_id: Dict[int, Message] = {}
+        if with_messages:
+            ids = [mid for r in records for mid in (r.message_ids or [])]
+            if ids:
+                messages_by_id = {
+                    m.id: m for m in db.query(Message).filter(Message.id.in_(ids)).all()
+                }
+        return [EventSessionService.to_dict(r, messages_by_id, with_messages) for r in records]
+
+    @staticmethod
+    def to_dict(
+        record: EventSession,
+        messages_by_id: Optional[Dict[int, Message]] = None,
+        with_messages: bool = True
+    ) -> Dict[str, Any]:
+        """记录转为旧版会话字典"""
+        details = dict(record.details or {})
+        inline_messages = details.pop("messages", None)
+        data: Dict[str, Any] = {
+            "session_id": record.session_id,
+            "session_type": record.session_type or "",
+            "timestamp": record.started_at.isoformat() if record.started_at else "",
+            "summary": record.summary,
+            "chief_complaint": record.chief_complaint,
+            "symptoms": record.symptoms or [],
+            "risk_level": record.risk_level,
+            "stage": record.stage,
+            "message_count": record.message_count or 0,
+            "message_ids": list(record.message_ids or []),
+            **details
+        }
+        if with_messages:
+            if inline_messages is not None:
+                data["messages"] = inline_messages
+            else:
+                messages_by_id = messages_by_id or {}
+                data["messages"] = [
+                    message_to_dict(messages_by_id[mid])
+                    for mid in data["message_ids"] if mid in messages_by_id
+                ]
+        if record.ai_summary:
+            data["ai_summary"] = record.ai_summary
+        return data
+
+    @staticmethod
+    def resolve_message_ids(db: Session, session_id: str, limit: int = MAX_SESSION_MESSAGES) -> List[int]:
+        """按会话 ID 查出对应的消息 ID（按时间顺序）"""
+        rows = db.query(Message.id).filter(
+            Message.session_id == session_id
+        ).order_by(Message.created_at, Message.id).limit(limit).all()
+        return [row[0] for row in rows]
@@ -0,0 +1,416 @@
+"""
+病历事件 PDF 导出服务
+
+导出请求只登记渲染任务（ExportJob），实际渲染在请求结束后的后台任务中进行：
+- 文件按 (事件ID, 事件版本, 导出选项) 指纹缓存，内容未变化的重复导出直接复用
+- 每个事件逐节排版、逐页落盘（见 pdf_writer），内存占用与事件大小无关
+- 多事件导出时各事件在进程池中并发渲染为页面片段，再按顺序拼接为一个 PDF
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, sessionmaker
+
+from ..config import get_settings
+from ..database import SessionLocal
+from ..models.medical_event import (
+    MedicalEvent, EventSession, EventNote, ExportRecord, ExportJob, ExportJobStatus
+)
+from ..models.message import Message
+from ..models.user import User
+from .pdf_writer import FragmentWriter, PageLayout, StreamingPDFWriter
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# 完整对话按批读取消息，避免一次加载整个会话
+MESSAGE_BATCH_SIZE = 200
+
+RISK_LEVEL_NAMES = {"low": "低", "medium": "中", "high": "高", "emergency": "紧急"}
+STATUS_NAMES = {"active": "进行中", "completed": "已完成", "exported": "已导出", "archived": "已归档"}
+
+
+def compute_cache_key(
+    db: Session,
+    events: List[MedicalEvent],
+    options: Dict[str, Any],
+    user: Optional[User] = None
+) -> str:
+    """
+    计算导出文件指纹
+
+    事件版本取更新时间、会话/附件计数及备注的最近更新时间，均为轻量查询
+    """
+    versions = []
+    for event in sorted(events, key=lambda e: e.id):
+        note_count, note_updated = db.query(
+            func.count(EventNote.id), func.max(EventNote.updated_at)
+        ).filter(EventNote.event_id == event.id).one()
+        versions.append([
+            event.id, str(event.updated_at), event.session_count or 0,
+            event.attachment_count or 0, note_count, str(note_updated)
+        ])
+    personal = None
+    if user is not None and options.get("include_personal_info", True):
+        personal = [user.id, str(user.updated_at)]
+    payload = json.dumps([versions, options, personal], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析 Range 请求头（只支持单个区间）
+
+    Returns:
+        (起始, 结束) 闭区间；无 Range 头或格式不支持时返回 None（返回完整文件）
+
+    Raises:
+        ValueError: 区间超出文件范围（应返回 416）
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text == "":
+            # 后缀区间：最后 N 个字节
+            length = int(end_text)
+            if length <= 0:
+                raise ValueError("无效的区间")
+            return max(size - length, 0), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        raise ValueError("无效的区间")
+    if start >= size or start > end:
+        raise ValueError("区间超出文件范围")
+    return start, min(end, size - 1)
+
+
+# ============= 排版 =============
+
+def _format_time(value: Optional[datetime]) -> str:
+    return value.strftime("%Y-%m-%d %H:%M") if value else "未知"
+
+
+def _enum_value(value: Any) -> str:
+    return getattr(value, "value", value) or ""
+
+
+def render_cover(layout: PageLayout, user: Optional[User], event_count: int, options: Dict[str, Any]):
+    """封面：导出信息与个人信息"""
+    layout.heading("病历资料", size=20)
+    layout.text(f"导出时间：{datetime.utcnow().strftime('%Y-%m-%d %H:%M')} (UTC)")
+    layout.text(f"病历事件数：{event_count}")
+    if user is not None and options.get("include_personal_info", True):
+        layout.rule()
+        layout.heading("个人信息", size=13)
+        layout.text(f"姓名：{user.nickname or '未填写'}")
+        if user.gender:
+            layout.text(f"性别：{user.gender}")
+        if user.birthday:
+            layout.text(f"出生日期：{user.birthday.isoformat()}")
+    layout.finish()
+
+
+def render_event(layout: PageLayout, db: Session, event: MedicalEvent, options: Dict[str, Any]):
+    """按节排版单个事件（每节写完即可能分页落盘）"""
+    layout.heading(event.title or f"病历事件 {event.id}", size=16)
+    layout.text(f"科室：{event.department or '全科'}    状态：{STATUS_NAMES.get(_enum_value(event.status), '')}")
+    layout.text(f"风险等级：{RISK_LEVEL_NAMES.get(_enum_value(event.risk_level), '低')}")
+    layout.text(f"开始时间：{_format_time(event.start_time)}    结束时间：{_format_time(event.end_time)}")
+    layout.rule()
+
+    if event.chief_complaint:
+        layout.heading("主诉", size=13)
+        layout.text(event.chief_complaint)
+    if event.summary:
+        layout.heading("病情摘要", size=13)
+        layout.text(event.summary)
+
+    analysis = event.ai_analysis if isinstance(event.ai_analysis, dict) else {}
+    if options.get("include_ai_analysis", True) and analysis:
+        sections = [
+            ("症状", analysis.get("symptoms")),
+            ("可能诊断", analysis.get("possible_diagnosis")),
+            ("建议", analysis.get("recommendations")),
+            ("随访提醒", analysis.get("follow_up_reminders")),
+        ]
+        for title, items in sections:
+            if items:
+                layout.heading(title, size=12)
+                for item in items:
+                    layout.text(f"• {item}", indent=8)
+        timeline = analysis.get("timeline") or []
+        if timeline:
+            layout.heading("时间轴", size=12)
+            for item in timeline:
+                if isinstance(item, dict):
+                    layout.text(f"{item.get('time', '')}  {item.get('event', '')}", indent=8)
+
+    _render_sessions(layout, db, event, options)
+
+    if options.get("include_user_notes", True):
+        notes = db.query(EventNote).filter(EventNote.event_id == event.id).order_by(EventNote.created_at).all()
+        if notes:
+            layout.heading("备注", size=13)
+            for note in notes:
+                mark = "【重要】" if note.is_important else ""
+                layout.text(f"{_format_time(note.created_at)} {mark}{note.content}")
+
+    if options.get("include_attachments", True) and event.attachments:
+        layout.heading("附件", size=13)
+        for att in event.attachments:
+            name = att.filename or att.url
+            desc = f" - {att.description}" if att.description else ""
+            layout.text(f"[{_enum_value(att.type)}] {name}{desc}", indent=8)
+
+    layout.finish()
+
+
+def _render_sessions(layout: PageLayout, db: Session, event: MedicalEvent, options: Dict[str, Any]):
+    """问诊记录；完整对话按批读取消息"""
+    full = options.get("include_full_conversation", False)
+    records = db.query(EventSession).filter(EventSession.event_id == event.id).order_by(
+        EventSession.started_at, EventSession.id
+    ).all()
+
+    if records:
+        layout.heading("问诊记录", size=13)
+        for record in records:
+            layout.text(f"{_format_time(record.started_at)}  {record.summary or ''}")
+            if not full:
+                continue
+            ids = list(record.message_ids or [])
+            for i in range(0, len(ids), MESSAGE_BATCH_SIZE):
+                batch = db.query(Message).filter(
+                    Message.id.in_(ids[i:i + MESSAGE_BATCH_SIZE])
+                ).order_by(Message.created_at, Message.id).all()
+                for msg in batch:
+                    role = "AI" if _enum_value(msg.sender) == "ai" else "患者"
+                    layout.text(f"{role}：{msg.content}", indent=12)
+                    db.expunge(msg)
+            for msg in (record.details or {}).get("messages", []):
+                role = "AI" if msg.get("role") in ("ai", "assistant") else "患者"
+                layout.text(f"{role}：{msg.get('content', '')}", indent=12)
+    elif event.sessions:
+        # 未迁移的旧数据
+        layout.heading("问诊记录", size=13)
+        for s in event.sessions:
+            layout.text(f"{s.get('timestamp', '')}  {s.get('summary') or ''}")
+            if full:
+                for msg in s.get("messages", []):
+                    role = "AI" if msg.get("role") in ("ai", "assistant") else "患者"
+                    layout.text(f"{role}：{msg.get('content', '')}", indent=12)
+
+
+def render_event_fragment(
+    event_id: int,
+    options: Dict[str, Any],
+    fragment_path: str,
+    session_factory: Optional[sessionmaker] = None
+) -> int:
+    """
+    把单个事件渲染为页面片段文件（进程池任务入口）
+
+    Returns:
+        页数
+    """
+    db = (session_factory or SessionLocal)()
+    try:
+        event = db.query(MedicalEvent).filter(MedicalEvent.id == event_id).first()
+        if event is None:
+            raise ValueError(f"病历事件不存在: {event_id}")
+        with open(fragment_path, "wb") as fp:
+            fragment = FragmentWriter(fp)
+            render_event(PageLayout(fragment), db, event, options)
+            return fragment.page_count
+    finally:
+        db.close()
+
+
+# ============= 任务调度 =============
+
+class ExportService:
+    """PDF 导出任务"""
+
+    def __init__(
+        self,
+        export_dir: str = "exports",
+        workers: int = 2,
+        session_factory: sessionmaker = SessionLocal
+    ):
+        self.export_dir = export_dir
+        self.workers = workers
+        self.session_factory = session_factory
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # cache_key -> [锁, 持有/等待的任务数]，计数归零时移除，字典大小只与进行中的任务数有关
+        self._key_locks: Dict[str, list] = {}
+        self._guard = threading.Lock()
+
+    def file_path(self, cache_key: str) -> str:
+        return os.path.join(self.export_dir, f"{cache_key}.pdf")
+
+    def prepare_job(
+        self,
+        db: Session,
+        export_record: ExportRecord,
+        events: List[MedicalEvent],
+        options: Dict[str, Any],
+        user: Optional[User] = None
+    ) -> ExportJob:
+        """
+        登记渲染任务（调用方负责提交）
+
+        相同内容已有渲染好的文件时直接标记为完成，无需后台渲染
+        """
+        cache_key = compute_cache_key(db, events, options, user)
+        path = self.file_path(cache_key)
+        job = ExportJob(cache_key=cache_key, status=ExportJobStatus.pending)
+        if os.path.exists(path):
+            job.status = ExportJobStatus.ready
+            job.file_path = path
+            job.file_size = os.path.getsize(path)
+            job.finished_at = datetime.utcnow()
+        export_record.job = job
+        return job
+
+    def run_job(self, job_id: int):
+        """执行渲染任务（在后台任务中调用）"""
+        db = self.session_factory()
+        try:
+            job = db.query(ExportJob).filter(ExportJob.id == job_id).first()
+            if job is None or job.status == ExportJobStatus.ready:
+                return
+            record = job.export_record
+            event_ids = [int(eid) for eid in (record.event_ids or [])]
+            options = record.export_options or {}
+            user = db.query(User).filter(User.id == record.user_id).first()
+
+            job.status = ExportJobStatus.rendering
+            db.commit()
+
+            path = self.file_path(job.cache_key)
+            page_count = None
+            with self._lock_for(job.cache_key):
+                # 等锁期间相同内容可能已由其它任务渲染完成
+                if not os.path.exists(path):
+                    page_count = self._render_file(db, event_ids, options, user, path)
+
+            job.status = ExportJobStatus.ready
+            job.file_path = path
+            job.file_size = os.path.getsize(path)
+            job.page_count = page_count
+            job.finished_at = datetime.utcnow()
+            db.commit()
+            logger.info("导出渲染完成: job=%s pages=%s size=%s", job_id, page_count, job.file_size)
+        except Exception as e:
+            logger.error("导出渲染失败: job=%s %s", job_id, e)
+            db.rollback()
+            job = db.query(ExportJob).filter(ExportJob.id == job_id).first()
+            if job is not None:
+                job.status = ExportJobStatus.failed
+                job.error = str(e)[:500]
+                job.finished_at = datetime.utcnow()
+                db.commit()
+        finally:
+            db.close()
+
+    @contextmanager
+    def _lock_for(self, cache_key: str):
+        """按内容指纹串行化渲染，同一份文件只渲染一次"""
+        with self._guard:
+            entry = self._key_locks.setdefault(cache_key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._key_locks[cache_key]
+
+    def _render_file(
+        self,
+        db: Session,
+        event_ids: List[int],
+        options: Dict[str, Any],
+        user: Optional[User],
+        path: str
+    ) -> int:
+        """渲染所有事件片段并拼接为最终文件（先写临时文件再原子替换）"""
+        os.makedirs(self.export_dir, exist_ok=True)
+        fragments = [
+            tempfile.NamedTemporaryFile(dir=self.export_dir, suffix=".frag", delete=False).name
+            for _ in event_ids
+        ]
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if self.workers > 1 and len(event_ids) > 1:
+                executor = self._get_executor()
+                futures = [
+                    executor.submit(render_event_fragment, eid, options, frag)
+                    for eid, frag in zip(event_ids, fragments)
+                ]
+                for future in futures:
+                    future.result()
+            else:
+                for eid, frag in zip(event_ids, fragments):
+                    render_event_fragment(eid, options, frag, self.session_factory)
+
+            with open(tmp_path, "wb") as fp:
+                writer = StreamingPDFWriter(fp)
+                render_cover(PageLayout(writer), user, len(event_ids), options)
+                for frag in fragments:
+                    with open(frag, "rb") as frag_fp:
+                        writer.add_fragment(frag_fp)
+                writer.close()
+                page_count = writer.page_count
+            os.replace(tmp_path, path)
+            return page_count
+        finally:
+            for frag in fragments:
+                if os.path.exists(frag):
+                    os.remove(frag)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._guard:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=get_context("spawn")
+                )
+            return self._executor
+
+    def shutdown(self):
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# 单例
+_export_service: Optional[ExportService] = None
+
+
+def get_export_service() -> ExportService:
+    """获取导出服务单例"""
+    global _export_service
+    if _export_service is None:
+        _export_service = ExportService(
+            export_dir=settings.EXPORT_DIR,
+            workers=settings.EXPORT_RENDER_WORKERS
+        )
+    return _export_service
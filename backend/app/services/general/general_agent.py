@@ -40,7 +40,7 @@ class GeneralAgent(BaseAgent):
             action: 动作类型（通用智能体只支持 conversation）
             on_chunk: 流式输出回调
             doctor_info: 医生信息 {name, title, specialty, persona_prompt, model, temperature, max_tokens}
-            history: 对话历史
+            history: 对话历史，缺省使用会话状态中的消息
             rag_context: RAG 上下文
             
         Returns:
@@ -67,8 +67,8 @@ class GeneralAgent(BaseAgent):
             temperature = doctor_info.get("temperature")
             max_tokens = doctor_info.get("max_tokens")
         
-        # 格式化历史记录
-        formatted_history = history or []
+        # 未传入历史时使用会话状态中的消息（按 token 预算截取，见 ContextBuilder）
+        formatted_history = history if history is not None else state.get("messages", [])
         
         # 调用 QwenService 获取 AI 响应
         ai_response = await QwenService.get_ai_response(
@@ -81,7 +81,8 @@ class GeneralAgent(BaseAgent):
             rag_context=rag_context,
             model=model,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            context_state=state
         )
         
         # 流式输出
@@ -0,0 +1,283 @@
+"""
+多模态分析前的图片预处理
+
+手机上传的原图通常有 4-8MB，原样转发给 Qwen-VL 既拖慢上传也拉长模型耗时，而皮损识别用不到这么高的分辨率。
+发送前统一处理：
+
+- 解码后按 EXIF 方向旋转（手机竖拍照片的像素是横向存储的），输出不保留 EXIF（同时去掉 GPS 等隐私信息）
+- 长边超过 IMAGE_MAX_EDGE 时等比缩小；JPEG 利用 draft 模式在解码阶段直接按比例缩小，避免解出全尺寸像素
+- 按 IMAGE_OUTPUT_FORMAT / IMAGE_OUTPUT_QUALITY 重新编码（jpeg / webp）；无需缩放旋转且重新编码反而更大时保留原图
+
+解码与编码是 CPU 密集操作，在独立的进程池中执行（IMAGE_PREPROCESS_WORKERS，0 表示在线程中执行），
+不阻塞事件循环。图片无法解码、处理超时或进程池异常时原样返回原图，不影响后续分析。
+每次处理的字节数变化记录在日志（image_preprocessed）与指标（image_preprocess_bytes_saved_total）中。
+"""
+import asyncio
+import base64
+import binascii
+import io
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from multiprocessing import get_context
+from typing import Any, Dict, Optional, Tuple
+
+from ..config import get_settings
+from .metrics import IMAGE_PREPROCESS_BYTES_SAVED, IMAGE_PREPROCESS_SECONDS
+from .structured_logging import get_logger
+
+settings = get_settings()
+log = get_logger(__name__)
+
+OUTPUT_MIME = {"jpeg": "image/jpeg", "webp": "image/webp"}
+DEFAULT_MIME = "image/jpeg"
+
+
+@dataclass
+class PreprocessedImage:
+    """预处理结果"""
+    base64: str  # 不带 data: 前缀
+    mime: str
+    original_bytes: int
+    output_bytes: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+    skipped: Optional[str] = None  # 保留原图的原因（未缩放且重新编码无收益 / 无法解码 / 超时等）
+    elapsed_ms: float = 0.0
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.output_bytes
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime};base64,{self.base64}"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "original_bytes": self.original_bytes,
+            "output_bytes": self.output_bytes,
+            "bytes_saved": self.bytes_saved,
+            "width": self.width,
+            "height": self.height,
+            "skipped": self.skipped,
+            "elapsed_ms": round(self.elapsed_ms, 1)
+        }
+
+
+def split_data_url(image: str) -> Tuple[Optional[str], str]:
+    """data:image/png;base64,xxx → ("image/png", "xxx")；纯 base64 返回 (None, 原串)"""
+    if image.startswith("data:") and "," in image:
+        header, data = image.split(",", 1)
+        mime = header[5:].split(";", 1)[0] or None
+        return mime, data
+    return None, image
+
+
+def _encoded_size(b64: str) -> int:
+    """base64 串对应的原始字节数"""
+    b64 = b64.strip()
+    return len(b64) * 3 // 4 - b64[-2:].count("=")
+
+
+# ============= 进程池中执行 =============
+
+def _process(b64: str, max_edge: int, output_format: str, quality: int) -> Dict[str, Any]:
+    """
+    解码 → EXIF 方向校正 → 缩放 → 重新编码
+
+    在工作进程中执行，只使用可序列化的参数与返回值；data 为 None 表示保留原图
+    """
+    from PIL import Image, ImageOps
+
+    raw = base64.b64decode(b64, validate=False)
+    with Image.open(io.BytesIO(raw)) as image:
+        source_mime = Image.MIME.get(image.format or "")
+        if getattr(image, "is_animated", False):
+            return {"data": None, "size": image.size, "mime": source_mime, "skipped": "animated"}
+        source_size = image.size
+        if image.format == "JPEG":
+            # 解码时直接按 1/2、1/4、1/8 缩小，得到的尺寸不小于目标尺寸
+            image.draft("RGB", (max_edge, max_edge))
+        orientation = image.getexif().get(0x0112, 1)
+        oriented = ImageOps.exif_transpose(image)
+
+    resized = max(source_size) > max_edge
+    if max(oriented.size) > max_edge:
+        oriented.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+    has_alpha = oriented.mode in ("RGBA", "LA") or (oriented.mode == "P" and "transparency" in oriented.info)
+    if output_format == "webp":
+        converted = oriented.convert("RGBA" if has_alpha else "RGB")
+        save_options = {"format": "WEBP", "quality": quality, "method": 4}
+    else:
+        if has_alpha:
+            rgba = oriented.convert("RGBA")
+            converted = Image.new("RGB", rgba.size, (255, 255, 255))
+            converted.paste(rgba, mask=rgba.getchannel("A"))
+        else:
+            converted = oriented.convert("RGB")
+        save_options = {"format": "JPEG", "quality": quality, "optimize": True}
+
+    buffer = io.BytesIO()
+    converted.save(buffer, **save_options)
+    data = buffer.getvalue()
+
+    unchanged = not resized and orientation == 1
+    if unchanged and len(data) >= len(raw) and source_mime in ("image/jpeg", "image/png", "image/webp"):
+        return {"data": None, "size": converted.size, "mime": source_mime, "skipped": "no_gain"}
+    return {"data": base64.b64encode(data).decode("ascii"), "size": converted.size, "mime": None, "skipped": None}
+
+
+def _warm_up() -> bool:
+    from PIL import Image  # noqa: F401  预先加载，首张图片不再承担导入耗时
+    return True
+
+
+# ============= 调度 =============
+
+class ImagePreprocessor:
+    """
+    图片预处理（进程池）
+
+        result = await get_image_preprocessor().preprocess(image_base64)
+        url = result.data_url
+    """
+
+    def __init__(
+        self,
+        max_edge: int = 1536,
+        output_format: str = "jpeg",
+        quality: int = 85,
+        workers: int = 2,
+        timeout: float = 20.0,
+        enabled: bool = True
+    ):
+        self.max_edge = max_edge
+        self.output_format = output_format if output_format in OUTPUT_MIME else "jpeg"
+        self.quality = quality
+        self.workers = workers
+        self.timeout = timeout
+        self.enabled = enabled
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._guard = threading.Lock()
+
+    async def preprocess(self, image: str) -> PreprocessedImage:
+        """异步预处理（image 为 base64，可带 data: 前缀）"""
+        mime, b64 = split_data_url(image)
+        if not self.enabled:
+            return self._original(mime, b64, "disabled", time.perf_counter())
+        started = time.perf_counter()
+        try:
+            if self.workers > 0:
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(self._get_executor(), _process, b64, self.max_edge, self.output_format, self.quality)
+            else:
+                future = asyncio.to_thread(_process, b64, self.max_edge, self.output_format, self.quality)
+            output = await asyncio.wait_for(future, self.timeout)
+        except Exception as e:
+            return self._failed(mime, b64, e, started)
+        return self._finish(mime, b64, output, started)
+
+    def preprocess_sync(self, image: str) -> PreprocessedImage:
+        """同步预处理（供 LangChain 同步工具在工作线程中调用）"""
+        mime, b64 = split_data_url(image)
+        if not self.enabled:
+            return self._original(mime, b64, "disabled", time.perf_counter())
+        started = time.perf_counter()
+        try:
+            if self.workers > 0:
+                future = self._get_executor().submit(_process, b64, self.max_edge, self.output_format, self.quality)
+                output = future.result(self.timeout)
+            else:
+                output = _process(b64, self.max_edge, self.output_format, self.quality)
+        except Exception as e:
+            return self._failed(mime, b64, e, started)
+        return self._finish(mime, b64, output, started)
+
+    def _original(self, mime: Optional[str], b64: str, reason: str, started: float) -> PreprocessedImage:
+        size = _encoded_size(b64)
+        return PreprocessedImage(
+            base64=b64,
+            mime=mime or DEFAULT_MIME,
+            original_bytes=size,
+            output_bytes=size,
+            skipped=reason,
+            elapsed_ms=(time.perf_counter() - started) * 1000
+        )
+
+    def _failed(self, mime: Optional[str], b64: str, error: BaseException, started: float) -> PreprocessedImage:
+        reason = "timeout" if isinstance(error, (asyncio.TimeoutError, TimeoutError)) else "error"
+        if isinstance(error, binascii.Error) or type(error).__name__ == "UnidentifiedImageError":
+            reason = "decode_error"
+        if isinstance(error, BrokenProcessPool):
+            # 工作进程异常退出后进程池不可再用，下次调用时重建
+            self.shutdown()
+        log.warning("image_preprocess_failed", reason=reason, error=str(error))
+        result = self._original(mime, b64, reason, started)
+        IMAGE_PREPROCESS_SECONDS.observe(result.elapsed_ms / 1000, outcome=reason)
+        return result
+
+    def _finish(self, mime: Optional[str], b64: str, output: Dict[str, Any], started: float) -> PreprocessedImage:
+        width, height = output["size"]
+        if output["data"] is None:
+            result = self._original(output["mime"] or mime, b64, output["skipped"], started)
+            result.width, result.height = width, height
+        else:
+            result = PreprocessedImage(
+                base64=output["data"],
+                mime=OUTPUT_MIME[self.output_format],
+                original_bytes=_encoded_size(b64),
+                output_bytes=_encoded_size(output["data"]),
+                width=width,
+                height=height,
+                elapsed_ms=(time.perf_counter() - started) * 1000
+            )
+        IMAGE_PREPROCESS_SECONDS.observe(result.elapsed_ms / 1000, outcome=result.skipped or "ok")
+        IMAGE_PREPROCESS_BYTES_SAVED.inc(max(result.bytes_saved, 0))
+        log.info("image_preprocessed", **result.stats())
+        return result
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._guard:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=get_context("spawn")
+                )
+            return self._executor
+
+    def warm_up(self):
+        """预先启动工作进程（不等待完成），避免首张图片承担进程启动与模块导入耗时"""
+        if self.enabled and self.workers > 0:
+            executor = self._get_executor()
+            for _ in range(self.workers):
+                executor.submit(_warm_up)
+
+    def shutdown(self):
+        """关闭进程池"""
+        with self._guard:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+# 单例
+_image_preprocessor: Optional[ImagePreprocessor] = None
+
+
+def get_image_preprocessor() -> ImagePreprocessor:
+    """获取图片预处理单例"""
+    global _image_preprocessor
+    if _image_preprocessor is None:
+        _image_preprocessor = ImagePreprocessor(
+            max_edge=settings.IMAGE_MAX_EDGE,
+            output_format=settings.IMAGE_OUTPUT_FORMAT,
+            quality=settings.IMAGE_OUTPUT_QUALITY,
+            workers=settings.IMAGE_PREPROCESS_WORKERS,
+            timeout=settings.IMAGE_PREPROCESS_TIMEOUT_SECONDS,
+            enabled=settings.IMAGE_PREPROCESS_ENABLED
+        )
+    return _image_preprocessor
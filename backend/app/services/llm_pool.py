@@ -0,0 +1,564 @@
+"""
+LLM 服务商池
+
+除主服务商（LLM_BASE_URL）外，可配置若干 OpenAI 兼容的备用服务商（LLM_BACKUP_PROVIDERS）：
+
+- 健康评分：按服务商统计首 token 延迟与错误率的指数滑动平均，错误率偏高的服务商排在健康服务商之后
+- 熔断：连续失败达到阈值后熔断一段时间，到期后放行一次试探请求，成功即恢复
+- 故障转移：超时、连接错误、5xx、429 时换下一个服务商；其它 4xx 属于请求本身的问题，直接抛出
+- 对冲请求：配置 LLM_HEDGE_DELAY_SECONDS 后，若首个 token 超时未返回，向下一个服务商再发一个请求，
+  先返回首个 token 的一方胜出，另一方立即取消
+
+每次尝试都会向 LLM 调度器申请该服务商对应模型的名额。提示词中的显式缓存标记只发给主服务商，
+响应中的 usage 按模型记录缓存命中情况（见 ai/prompt_cache.py）。
+"""
+import asyncio
+import json
+import threading
+import time
+import logging
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional
+
+import httpx
+
+from .ai.prompt_cache import record_usage, strip_cache_markers
+from .llm_scheduler import (
+    LLMScheduler, Priority, Ticket, get_llm_scheduler, retry_after_seconds, usage_tokens
+)
+from .tracing import get_tracer, set_error, start_span
+
+logger = logging.getLogger(__name__)
+
+# 这些 4xx 也视为服务商故障（换服务商重试），其它 4xx 直接抛出
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+@dataclass
+class ProviderConfig:
+    """服务商配置"""
+    name: str
+    base_url: str
+    api_key: str = ""
+    model_map: Dict[str, str] = field(default_factory=dict)  # 请求模型 → 该服务商的模型，"*" 匹配任意模型；为空时原样透传
+
+    def resolve_model(self, model: str) -> Optional[str]:
+        """该服务商上对应的模型，不支持时返回 None"""
+        if not self.model_map:
+            return model
+        return self.model_map.get(model) or self.model_map.get("*")
+
+
+class ProviderError(Exception):
+    """服务商返回错误响应"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def is_retryable(error: BaseException) -> bool:
+    """是否应换服务商重试（兼容 ProviderError 与 openai SDK 异常）"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        return True
+    return status >= 500 or status in RETRYABLE_STATUS
+
+
+class CircuitBreaker:
+    """熔断器：closed → open（连续失败）→ half_open（到期后试探一次）→ closed / open"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def available(self, now: float) -> bool:
+        """是否可以接收请求（不改变状态）"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return now - self.opened_at >= self.reset_timeout
+        return not self._trial_in_flight
+
+    def begin(self, now: float) -> bool:
+        """开始一次请求；半开状态下只放行一个试探请求"""
+        if not self.available(now):
+            return False
+        if self.state != self.CLOSED:
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = True
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self, now: float):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = now
+
+    def abandon(self):
+        """请求被取消（对冲落败），不计成败"""
+        self._trial_in_flight = False
+
+
+class ProviderState:
+    """服务商健康状态"""
+
+    def __init__(self, config: ProviderConfig, breaker: CircuitBreaker, alpha: float = 0.2):
+        self.config = config
+        self.breaker = breaker
+        self.alpha = alpha
+        self.latency: Optional[float] = None  # 首 token 延迟滑动平均（秒）
+        self.error_rate = 0.0  # 错误率滑动平均
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def degraded(self) -> bool:
+        return self.error_rate >= 0.5
+
+    def record_success(self, latency: float):
+        self.requests += 1
+        self.latency = latency if self.latency is None else self.latency + self.alpha * (latency - self.latency)
+        self.error_rate *= 1 - self.alpha
+        self.breaker.record_success()
+
+    def record_failure(self, now: float):
+        self.requests += 1
+        self.failures += 1
+        self.error_rate += self.alpha * (1 - self.error_rate)
+        self.breaker.record_failure(now)
+
+
+_END = object()
+
+
+class _Failure:
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class _Attempt:
+    """一次对某个服务商的请求：后台任务把结果写入队列，首个结果到达（或失败）时 first 完成"""
+
+    def __init__(self, provider: ProviderState, model: str, hedged: bool):
+        self.provider = provider
+        self.model = model
+        self.hedged = hedged
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.first: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task: Optional[asyncio.Task] = None
+
+
+# 尝试函数：(服务商配置, 服务商上的模型名, 调度名额) → 结果 / 结果流
+AttemptCall = Callable[[ProviderConfig, str, Ticket], Awaitable[Any]]
+AttemptStream = Callable[[ProviderConfig, str, Ticket], AsyncIterator[Any]]
+
+
+class ProviderPool:
+    """带健康评分、熔断、故障转移与对冲请求的服务商池"""
+
+    def __init__(
+        self,
+        providers: List[ProviderConfig],
+        hedge_delay: float = 0.0,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+        scheduler: Optional[LLMScheduler] = None
+    ):
+        if not providers:
+            raise ValueError("至少需要一个 LLM 服务商")
+        self.providers = [
+            ProviderState(config, CircuitBreaker(failure_threshold, reset_timeout)) for config in providers
+        ]
+        self.hedge_delay = hedge_delay
+        self.scheduler = scheduler or get_llm_scheduler()
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self._lock = threading.Lock()
+
+    @property
+    def primary(self) -> ProviderConfig:
+        return self.providers[0].config
+
+    def candidates(self, model: str) -> List[ProviderState]:
+        """可用服务商：按配置顺序，错误率偏高的排在后面，熔断中的跳过"""
+        now = time.monotonic()
+        with self._lock:
+            available = [
+                p for p in self.providers
+                if p.config.resolve_model(model) and p.breaker.available(now)
+            ]
+        return sorted(available, key=lambda p: p.degraded)
+
+    # ============= 结果记录 =============
+
+    def _begin(self, pending: List[ProviderState]) -> Optional[ProviderState]:
+        now = time.monotonic()
+        with self._lock:
+            while pending:
+                provider = pending.pop(0)
+                if provider.breaker.begin(now):
+                    return provider
+        return None
+
+    def _succeeded(self, provider: ProviderState, latency: float):
+        with self._lock:
+            provider.record_success(latency)
+
+    def _failed(self, provider: ProviderState, model: str, error: BaseException):
+        if not is_retryable(error):
+            # 请求本身的问题，不影响服务商健康
+            with self._lock:
+                provider.breaker.abandon()
+            return
+        if getattr(error, "status_code", None) == 429:
+            retry_after = getattr(error, "retry_after", None)
+            if retry_after is None:
+                response = getattr(error, "response", None)
+                retry_after = retry_after_seconds(getattr(response, "headers", None))
+            self.scheduler.throttle(model, retry_after)
+        with self._lock:
+            provider.record_failure(time.monotonic())
+        logger.warning("LLM 服务商 %s 请求失败: %s", provider.config.name, error)
+
+    def _abandoned(self, provider: ProviderState):
+        with self._lock:
+            provider.breaker.abandon()
+
+    # ============= 异步调用 =============
+
+    async def stream(
+        self,
+        model: str,
+        open_attempt: AttemptStream,
+        tokens: int = 0,
+        priority: Optional[Priority] = None,
+        hedge: bool = True
+    ) -> AsyncIterator[Any]:
+        """
+        流式调用：首个结果到达前失败则换服务商，超过对冲时长则并发请求下一个服务商，
+        先产出首个结果的一方胜出，其余请求取消
+        """
+        pending = self.candidates(model)
+        if not pending:
+            raise ProviderError(f"没有可用的 LLM 服务商: {model}")
+
+        attempts: List[_Attempt] = []
+        started: List[_Attempt] = []
+        winner: Optional[_Attempt] = None
+        last_error: Optional[BaseException] = None
+
+        def start(hedged: bool) -> bool:
+            provider = self._begin(pending)
+            if provider is None:
+                return False
+            attempt = _Attempt(provider, provider.config.resolve_model(model), hedged)
+            attempt.task = asyncio.create_task(self._pump(attempt, open_attempt, tokens, priority))
+            attempts.append(attempt)
+            started.append(attempt)
+            return True
+
+        try:
+            while winner is None:
+                if not attempts and not start(hedged=False):
+                    raise last_error or ProviderError(f"没有可用的 LLM 服务商: {model}")
+
+                can_hedge = hedge and self.hedge_delay > 0 and len(attempts) == 1 and bool(pending)
+                done, _ = await asyncio.wait(
+                    [a.first for a in attempts],
+                    timeout=self.hedge_delay if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # 首个结果超时，向下一个服务商发起对冲请求
+                    if start(hedged=True):
+                        self.hedges_fired += 1
+                    continue
+
+                for attempt in list(attempts):
+                    if not attempt.first.done():
+                        continue
+                    error = attempt.first.result()
+                    if error is None:
+                        winner = attempt
+                        break
+                    attempts.remove(attempt)
+                    last_error = error
+                    if not is_retryable(error):
+                        raise error
+
+            if winner.hedged:
+                self.hedges_won += 1
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.task.cancel()
+
+            while True:
+                item = await winner.queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            tasks = [a.task for a in started if not a.task.done()]
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _pump(self, attempt: _Attempt, open_attempt: AttemptStream, tokens: int, priority: Optional[Priority]):
+        provider = attempt.provider
+        with start_span("llm.attempt", _span_attributes(provider, attempt.model, attempt.hedged)) as span:
+            try:
+                async with self.scheduler.slot(attempt.model, tokens, priority) as ticket:
+                    span.set_attribute("llm.queue_ms", round(ticket.waited * 1000, 1))
+                    started = time.monotonic()  # 排队时间不计入服务商延迟
+                    async for item in open_attempt(provider.config, attempt.model, ticket):
+                        if not attempt.first.done():
+                            self._succeeded(provider, time.monotonic() - started)
+                            attempt.first.set_result(None)
+                        attempt.queue.put_nowait(item)
+                    if not attempt.first.done():
+                        self._succeeded(provider, time.monotonic() - started)
+                        attempt.first.set_result(None)
+                    if ticket.used_tokens is not None:
+                        span.set_attribute("llm.tokens", ticket.used_tokens)
+                attempt.queue.put_nowait(_END)
+            except asyncio.CancelledError:
+                span.set_attribute("llm.cancelled", True)
+                if not attempt.first.done():
+                    self._abandoned(provider)
+                raise
+            except Exception as e:
+                set_error(span, e)
+                if attempt.first.done():
+                    attempt.queue.put_nowait(_Failure(e))
+                else:
+                    self._failed(provider, attempt.model, e)
+                    attempt.first.set_result(e)
+
+    async def call(
+        self,
+        model: str,
+        run_attempt: AttemptCall,
+        tokens: int = 0,
+        priority: Optional[Priority] = None,
+        hedge: bool = True
+    ) -> Any:
+        """非流式调用（对冲以完整响应为准）"""
+        async def single(provider: ProviderConfig, provider_model: str, ticket: Ticket):
+            yield await run_attempt(provider, provider_model, ticket)
+
+        results = self.stream(model, single, tokens, priority, hedge)
+        try:
+            return await results.__anext__()
+        finally:
+            await results.aclose()
+
+    # ============= 同步调用（无对冲，仅故障转移） =============
+
+    def call_sync(
+        self,
+        model: str,
+        run_attempt: Callable[[ProviderConfig, str, Ticket], Any],
+        tokens: int = 0,
+        priority: Optional[Priority] = None
+    ) -> Any:
+        pending = self.candidates(model)
+        last_error: Optional[BaseException] = None
+        while True:
+            provider = self._begin(pending)
+            if provider is None:
+                raise last_error or ProviderError(f"没有可用的 LLM 服务商: {model}")
+            provider_model = provider.config.resolve_model(model)
+            try:
+                with start_span("llm.attempt", _span_attributes(provider, provider_model)), \
+                        self.scheduler.slot_sync(provider_model, tokens, priority) as ticket:
+                    started = time.monotonic()
+                    result = run_attempt(provider.config, provider_model, ticket)
+            except Exception as e:
+                self._failed(provider, provider_model, e)
+                if not is_retryable(e):
+                    raise
+                last_error = e
+                continue
+            self._succeeded(provider, time.monotonic() - started)
+            return result
+
+    def stream_sync(
+        self,
+        model: str,
+        open_attempt: Callable[[ProviderConfig, str, Ticket], Iterable[Any]],
+        tokens: int = 0,
+        priority: Optional[Priority] = None
+    ):
+        pending = self.candidates(model)
+        last_error: Optional[BaseException] = None
+        while True:
+            provider = self._begin(pending)
+            if provider is None:
+                raise last_error or ProviderError(f"没有可用的 LLM 服务商: {model}")
+            provider_model = provider.config.resolve_model(model)
+            # 生成器跨 yield 不能切换当前上下文，span 只记录不设为当前 span
+            span = get_tracer().start_span("llm.attempt", attributes=_span_attributes(provider, provider_model))
+            try:
+                with self.scheduler.slot_sync(provider_model, tokens, priority) as ticket:
+                    started = time.monotonic()
+                    iterator = iter(open_attempt(provider.config, provider_model, ticket))
+                    try:
+                        first = next(iterator, _END)
+                    except Exception as e:
+                        set_error(span, e)
+                        self._failed(provider, provider_model, e)
+                        if not is_retryable(e):
+                            raise
+                        last_error = e
+                        continue
+                    self._succeeded(provider, time.monotonic() - started)
+                    if first is not _END:
+                        yield first
+                        yield from iterator
+                    return
+            finally:
+                span.end()
+
+    # ============= OpenAI 兼容接口 =============
+
+    def _payload_for(self, provider: ProviderConfig, payload: Dict[str, Any], model: str) -> Dict[str, Any]:
+        """发给指定服务商的请求体：替换模型名，备用服务商去掉显式缓存标记"""
+        body = {**payload, "model": model}
+        if provider is not self.primary and "messages" in body:
+            body["messages"] = strip_cache_markers(body["messages"])
+        return body
+
+    async def chat_completion(
+        self,
+        payload: Dict[str, Any],
+        tokens: int = 0,
+        timeout: float = 60.0,
+        priority: Optional[Priority] = None,
+        hedge: bool = True
+    ) -> Dict[str, Any]:
+        """非流式 chat/completions，返回响应 JSON"""
+        async def run(provider: ProviderConfig, model: str, ticket: Ticket) -> Dict[str, Any]:
+            async with httpx.AsyncClient(timeout=timeout) as client:
+                response = await client.post(
+                    f"{provider.base_url}/chat/completions",
+                    headers=_headers(provider),
+                    json=self._payload_for(provider, payload, model)
+                )
+            if response.status_code != 200:
+                raise _response_error(response, response.text)
+            data = response.json()
+            ticket.used_tokens = usage_tokens(data)
+            record_usage(model, data.get("usage"))
+            return data
+
+        return await self.call(payload["model"], run, tokens, priority, hedge)
+
+    async def stream_chat_completion(
+        self,
+        payload: Dict[str, Any],
+        tokens: int = 0,
+        timeout: float = 120.0,
+        priority: Optional[Priority] = None,
+        hedge: bool = True
+    ) -> AsyncIterator[str]:
+        """流式 chat/completions，逐个产出内容片段（首个非空片段即视为首 token），最后一个数据块带 usage"""
+        async def open_stream(provider: ProviderConfig, model: str, ticket: Ticket):
+            async with httpx.AsyncClient(timeout=timeout) as client:
+                async with client.stream(
+                    "POST",
+                    f"{provider.base_url}/chat/completions",
+                    headers=_headers(provider),
+                    json={
+                        **self._payload_for(provider, payload, model),
+                        "stream": True,
+                        "stream_options": {"include_usage": True}
+                    }
+                ) as response:
+                    if response.status_code != 200:
+                        body = await response.aread()
+                        raise _response_error(response, body.decode("utf-8", "replace"))
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data: "):
+                            continue
+                        data_str = line[6:]
+                        if data_str.strip() == "[DONE]":
+                            break
+                        try:
+                            data = json.loads(data_str)
+                        except json.JSONDecodeError:
+                            continue
+                        if data.get("usage"):
+                            ticket.used_tokens = usage_tokens(data)
+                            record_usage(model, data["usage"])
+                        choices = data.get("choices", [])
+                        if choices:
+                            content = choices[0].get("delta", {}).get("content", "")
+                            if content:
+                                yield content
+
+        async for chunk in self.stream(payload["model"], open_stream, tokens, priority, hedge):
+            yield chunk
+
+    # ============= 监控 =============
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "hedge_delay_seconds": self.hedge_delay,
+                "hedges_fired": self.hedges_fired,
+                "hedges_won": self.hedges_won,
+                "providers": [
+                    {
+                        "name": p.config.name,
+                        "state": p.breaker.state,
+                        "available": p.breaker.available(now),
+                        "latency_ms": round(p.latency * 1000, 1) if p.latency is not None else None,
+                        "error_rate": round(p.error_rate, 3),
+                        "requests": p.requests,
+                        "failures": p.failures,
+                    }
+                    for p in self.providers
+                ]
+            }
+
+
+def _span_attributes(provider: ProviderState, model: str, hedged: bool = False) -> Dict[str, Any]:
+    return {"llm.provider": provider.config.name, "llm.model": model, "llm.hedged": hedged}
+
+
+def _headers(provider: ProviderConfig) -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {provider.api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+def _response_error(response: httpx.Response, text: str) -> ProviderError:
+    retry_after = retry_after_seconds(response.headers) if response.status_code == 429 else None
+    return ProviderError(
+        f"API error: {response.status_code} - {text}",
+        status_code=response.status_code,
+        retry_after=retry_after
+    )
@@ -1,9 +1,114 @@
 """
 LLM Provider 单例模块 - 提供 LangChain ChatOpenAI 实例复用
 """
-from typing import Optional
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from langchain_core.messages import BaseMessage
 from langchain_openai import ChatOpenAI
+from pydantic import PrivateAttr
 from ..config import get_settings
+from .ai.prompt_cache import record_usage_metadata, strip_cache_markers
+from .ai.tokens import estimate_tokens
+from .llm_pool import ProviderConfig, ProviderPool
+from .llm_routing import get_task_latency_stats, resolve_task
+
+
+def _result_tokens(result: Any) -> Optional[int]:
+    return ((result.llm_output or {}).get("token_usage") or {}).get("total_tokens")
+
+
+def _record_result_usage(model: str, result: Any):
+    for generation in result.generations:
+        record_usage_metadata(model, getattr(generation.message, "usage_metadata", None))
+
+
+class ScheduledChatOpenAI(ChatOpenAI):
+    """
+    经过服务商池与全局 LLM 调度器的 ChatOpenAI
+
+    同步、异步、流式调用均先申请调度名额；主服务商失败时切换备用服务商，
+    异步调用在配置了对冲时长时发起对冲请求（bind_tools 等参数原样传给备用服务商，显式缓存标记除外）。
+    调用耗时按 task 记录，usage 中的缓存命中按模型记录
+    """
+
+    task: Optional[str] = None  # 任务类型（LLMTask）
+    _backup_clients: Dict[Tuple[str, str], ChatOpenAI] = PrivateAttr(default_factory=dict)
+
+    def _estimate(self, messages: List[BaseMessage]) -> int:
+        text = "".join(str(m.content) for m in messages)
+        return estimate_tokens(text) + (self.max_tokens or 0)
+
+    def _client_for(self, provider: ProviderConfig, model: str) -> ChatOpenAI:
+        """服务商对应的客户端（主服务商使用自身）"""
+        if provider is LLMProvider.get_pool().primary and model == self.model_name:
+            return self
+        key = (provider.name, model)
+        client = self._backup_clients.get(key)
+        if client is None:
+            client = ChatOpenAI(
+                model=model,
+                api_key=provider.api_key,
+                base_url=provider.base_url,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                timeout=self.request_timeout,
+                max_retries=self.max_retries,
+                stream_usage=True,
+            )
+            self._backup_clients[key] = client
+        return client
+
+    def _messages_for(self, client: ChatOpenAI, messages: List[BaseMessage]) -> List[BaseMessage]:
+        """备用服务商不一定支持显式缓存标记，发送前去掉"""
+        return messages if client is self else strip_cache_markers(messages)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        def run(provider, model, ticket):
+            client = self._client_for(provider, model)
+            result = ChatOpenAI._generate(client, self._messages_for(client, messages), stop=stop, **kwargs)
+            ticket.used_tokens = _result_tokens(result)
+            _record_result_usage(model, result)
+            return result
+
+        with get_task_latency_stats().track(self.task, self.model_name):
+            return LLMProvider.get_pool().call_sync(self.model_name, run, self._estimate(messages))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        async def run(provider, model, ticket):
+            client = self._client_for(provider, model)
+            result = await ChatOpenAI._agenerate(client, self._messages_for(client, messages), stop=stop, **kwargs)
+            ticket.used_tokens = _result_tokens(result)
+            _record_result_usage(model, result)
+            return result
+
+        with get_task_latency_stats().track(self.task, self.model_name):
+            return await LLMProvider.get_pool().call(self.model_name, run, self._estimate(messages))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[Any]:
+        def open_stream(provider, model, ticket):
+            client = self._client_for(provider, model)
+            for chunk in ChatOpenAI._stream(client, self._messages_for(client, messages), stop=stop, **kwargs):
+                record_usage_metadata(model, getattr(chunk.message, "usage_metadata", None))
+                yield chunk
+
+        with get_task_latency_stats().track(self.task, self.model_name):
+            for chunk in LLMProvider.get_pool().stream_sync(self.model_name, open_stream, self._estimate(messages)):
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[Any]:
+        # 回调只对胜出的请求触发，对冲落败的请求不会产生重复 token
+        async def open_stream(provider, model, ticket):
+            client = self._client_for(provider, model)
+            async for chunk in ChatOpenAI._astream(client, self._messages_for(client, messages), stop=stop, **kwargs):
+                record_usage_metadata(model, getattr(chunk.message, "usage_metadata", None))
+                yield chunk
+
+        with get_task_latency_stats().track(self.task, self.model_name):
+            async for chunk in LLMProvider.get_pool().stream(self.model_name, open_stream, self._estimate(messages)):
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
 
 
 class LLMProvider:
@@ -11,17 +116,42 @@ class LLMProvider:
     
     _llm: Optional[ChatOpenAI] = None
     _multimodal_llm: Optional[ChatOpenAI] = None
+    _pool: Optional[ProviderPool] = None
+    _task_llms: Dict[str, ChatOpenAI] = {}
+
+    @classmethod
+    def get_pool(cls) -> ProviderPool:
+        """
+        获取服务商池：主服务商（LLM_BASE_URL）在前，其后为 LLM_BACKUP_PROVIDERS
+        """
+        if cls._pool is None:
+            settings = get_settings()
+            providers = [ProviderConfig(
+                name=settings.LLM_PROVIDER,
+                base_url=settings.LLM_BASE_URL,
+                api_key=settings.LLM_API_KEY
+            )]
+            providers += [ProviderConfig(**backup) for backup in settings.LLM_BACKUP_PROVIDERS]
+            cls._pool = ProviderPool(
+                providers,
+                hedge_delay=settings.LLM_HEDGE_DELAY_SECONDS,
+                failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+                reset_timeout=settings.LLM_CIRCUIT_RESET_SECONDS
+            )
+        return cls._pool
     
     @classmethod
-    def get_llm(cls) -> ChatOpenAI:
+    def get_llm(cls, task: Optional[str] = None) -> ChatOpenAI:
         """
         获取普通文本 LLM 实例
         
-        使用 DashScope 兼容的 OpenAI 接口
+        使用 DashScope 兼容的 OpenAI 接口；指定 task 时按 LLM_TASK_ROUTES 选择模型、温度与最大 token
         """
+        if task is not None:
+            return cls._get_task_llm(task)
         if cls._llm is None:
             settings = get_settings()
-            cls._llm = ChatOpenAI(
+            cls._llm = ScheduledChatOpenAI(
                 model=settings.LLM_MODEL,
                 api_key=settings.LLM_API_KEY,
                 base_url=settings.LLM_BASE_URL,
@@ -29,9 +159,35 @@ class LLMProvider:
                 max_tokens=settings.LLM_MAX_TOKENS,
                 timeout=settings.LLM_TIMEOUT,
                 max_retries=settings.LLM_MAX_RETRIES,
+                stream_usage=True,  # 流式响应也返回 usage（用于缓存命中统计）
             )
         return cls._llm
     
+    @classmethod
+    def _get_task_llm(cls, task: str) -> ChatOpenAI:
+        llm = cls._task_llms.get(task)
+        if llm is None:
+            settings = get_settings()
+            route = resolve_task(
+                task,
+                model=settings.LLM_MODEL,
+                temperature=settings.LLM_TEMPERATURE,
+                max_tokens=settings.LLM_MAX_TOKENS
+            )
+            llm = ScheduledChatOpenAI(
+                model=route.model,
+                api_key=settings.LLM_API_KEY,
+                base_url=settings.LLM_BASE_URL,
+                temperature=route.temperature,
+                max_tokens=route.max_tokens,
+                timeout=settings.LLM_TIMEOUT,
+                max_retries=settings.LLM_MAX_RETRIES,
+                stream_usage=True,
+                task=task,
+            )
+            cls._task_llms[task] = llm
+        return llm
+    
     @classmethod
     def get_multimodal_llm(cls) -> ChatOpenAI:
         """
@@ -41,7 +197,7 @@ class LLMProvider:
         """
         if cls._multimodal_llm is None:
             settings = get_settings()
-            cls._multimodal_llm = ChatOpenAI(
+            cls._multimodal_llm = ScheduledChatOpenAI(
                 model=settings.QWEN_VL_MODEL,
                 api_key=settings.LLM_API_KEY,
                 base_url=settings.LLM_BASE_URL,
@@ -49,6 +205,7 @@ class LLMProvider:
                 max_tokens=settings.LLM_VL_MAX_TOKENS,
                 timeout=60,  # 图片分析需要更长时间
                 max_retries=settings.LLM_MAX_RETRIES,
+                stream_usage=True,
             )
         return cls._multimodal_llm
     
@@ -57,3 +214,5 @@ class LLMProvider:
         """重置 LLM 实例（用于测试或配置变更）"""
         cls._llm = None
         cls._multimodal_llm = None
+        cls._pool = None
+        cls._task_llms = {}
@@ -0,0 +1,124 @@
+"""
+LLM 任务分级路由
+
+快捷选项、症状提取、关联判断、问诊评估等辅助任务输出短、结构固定，
+不需要与主诊断相同的模型。LLM_TASK_ROUTES 按任务类型配置模型、温度与最大输出 token，
+BaseAIService、DiagnosisAgent、LLMProvider 调用前查询路由表，未配置的字段沿用调用方的值。
+
+每次调用按任务记录耗时，供调整路由表参考（GET /admin/stats/llm-tasks）。
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Iterator, Optional, Tuple
+
+from ..config import get_settings
+
+settings = get_settings()
+
+
+class LLMTask:
+    """任务类型"""
+    DIAGNOSIS = "diagnosis"  # 诊断报告
+    QUESTION = "question"  # 问诊追问（流式）
+    QUICK_OPTIONS = "quick_options"  # 快捷选项
+    ASSESSMENT = "assessment"  # 问诊进度评估
+    SYMPTOM_EXTRACTION = "symptom_extraction"  # 症状提取
+    RELATION_CHECK = "relation_check"  # 事件关联判断
+    SUMMARY = "summary"  # 病历摘要
+    AGGREGATION = "aggregation"  # 事件聚合与合并摘要
+    TRANSCRIPTION = "transcription"  # 语音转写后整理
+
+
+@dataclass(frozen=True)
+class TaskRoute:
+    """任务的实际调用参数"""
+    task: Optional[str]
+    model: str
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+
+
+def resolve_task(
+    task: Optional[str],
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None
+) -> TaskRoute:
+    """
+    查询路由表
+
+    路由表中配置的字段优先，其余使用调用方传入的值，模型最终回退到 LLM_MODEL
+    """
+    route = settings.LLM_TASK_ROUTES.get(task, {}) if task else {}
+    return TaskRoute(
+        task=task,
+        model=route.get("model") or model or settings.LLM_MODEL,
+        temperature=route.get("temperature", temperature),
+        max_tokens=route.get("max_tokens", max_tokens)
+    )
+
+
+class TaskLatencyStats:
+    """按任务、模型统计调用耗时（保留最近 window 次）"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+        self._counts: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, task: Optional[str], model: str, seconds: float, ok: bool = True):
+        key = (task or "default", model)
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+                self._counts[key] = {"count": 0, "errors": 0}
+            samples.append(seconds)
+            self._counts[key]["count"] += 1
+            if not ok:
+                self._counts[key]["errors"] += 1
+
+    @contextmanager
+    def track(self, task: Optional[str], model: str) -> Iterator[None]:
+        """记录一次调用的耗时（抛出异常计为失败）"""
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record(task, model, time.perf_counter() - start, ok)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result: Dict[str, Any] = {}
+            for (task, model), samples in self._samples.items():
+                ordered = sorted(samples)
+                result.setdefault(task, {})[model] = {
+                    **self._counts[(task, model)],
+                    "avg_ms": round(sum(ordered) / len(ordered) * 1000, 1),
+                    "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1),
+                    "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+                }
+            return result
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+
+# 单例
+_task_latency_stats: Optional[TaskLatencyStats] = None
+
+
+def get_task_latency_stats() -> TaskLatencyStats:
+    """获取任务耗时统计单例"""
+    global _task_latency_stats
+    if _task_latency_stats is None:
+        _task_latency_stats = TaskLatencyStats()
+    return _task_latency_stats
@@ -0,0 +1,432 @@
+"""
+LLM 全局调度
+
+所有 LLM 调用（QwenService、BaseAIService、DiagnosisAgent、LLMProvider、CrewAI 智能体）
+在发出请求前向调度器申请名额：
+
+- 每个模型限制并发数与每分钟 token 预算（令牌桶，先按估算预扣，结束后按实际用量多退少补）
+- 按优先级排队：默认 在线问诊 > 紧急问诊 > 后台任务（摘要、聚合等），顺序可通过 LLM_LANE_ORDER 调整，
+  并为在线问诊预留若干并发名额，后台任务积压时也不会占满
+- 服务商返回 429 时暂停该模型的新请求（throttle），避免重试雪崩
+- stats() 提供各模型、各优先级的排队数、运行数、等待时长
+
+优先级通过上下文变量传递：入口处 `with llm_priority(Priority.BACKGROUND): ...`，
+其后在同一上下文（含其创建的 asyncio 任务）中发起的调用都按该优先级排队。
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+import logging
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence
+
+from ..config import get_settings
+from .metrics import LLM_TOKENS
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """调度优先级（排队顺序由调度器的 lane_order 决定）"""
+    INTERACTIVE = 0  # 在线问诊
+    EMERGENCY = 1  # 风险等级为紧急的问诊
+    BACKGROUND = 2  # 摘要、聚合等后台任务
+
+
+DEFAULT_LANE_ORDER = (Priority.INTERACTIVE, Priority.EMERGENCY, Priority.BACKGROUND)
+
+
+def parse_lane_order(names: Sequence[str]) -> List[Priority]:
+    """解析优先级顺序配置（如 ["interactive", "emergency", "background"]），未列出的优先级按默认顺序排在最后"""
+    order = []
+    for name in names:
+        try:
+            priority = Priority[name.upper()]
+        except KeyError:
+            raise ValueError(f"未知的 LLM 调度优先级: {name}")
+        if priority not in order:
+            order.append(priority)
+    return order + [p for p in DEFAULT_LANE_ORDER if p not in order]
+
+
+_current_priority: ContextVar[Optional[Priority]] = ContextVar("llm_priority", default=None)
+
+
+@contextmanager
+def llm_priority(priority: Priority) -> Iterator[None]:
+    """设置当前上下文中 LLM 调用的优先级"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority(default: Priority = Priority.INTERACTIVE) -> Priority:
+    """当前上下文的优先级（未设置时使用调用方给出的默认值）"""
+    priority = _current_priority.get()
+    return default if priority is None else priority
+
+
+def priority_for_state(state: Optional[Dict[str, Any]]) -> Priority:
+    """根据会话状态确定问诊优先级（上一轮已判定为紧急的会话优先）"""
+    if state and state.get("risk_level") == "emergency":
+        return Priority.EMERGENCY
+    return Priority.INTERACTIVE
+
+
+@dataclass
+class ModelLimits:
+    """单个模型的调度限制"""
+    max_concurrency: int = 16
+    tokens_per_minute: int = 0  # 0 表示不限制
+    reserved_interactive: int = 4  # 后台任务不可占用的并发名额
+
+
+@dataclass
+class Ticket:
+    """已获得的调用名额"""
+    model: str
+    priority: Priority
+    tokens: int
+    waited: float = 0.0
+    used_tokens: Optional[int] = None  # 调用方填入实际用量，释放时结算
+    released: bool = False
+
+
+class _Waiter:
+    __slots__ = ("ticket", "enqueued_at", "notify", "granted", "cancelled")
+
+    def __init__(self, ticket: Ticket, notify: Callable[[], None]):
+        self.ticket = ticket
+        self.enqueued_at = time.monotonic()
+        self.notify = notify
+        self.granted = False
+        self.cancelled = False
+
+
+@dataclass
+class _LaneStats:
+    queued: int = 0
+    granted: int = 0
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+
+@dataclass
+class _ModelState:
+    limits: ModelLimits
+    active: int = 0
+    tokens: float = 0.0
+    refilled_at: float = field(default_factory=time.monotonic)
+    throttled_until: float = 0.0
+    throttled_count: int = 0
+    timer: Optional[threading.Timer] = None
+    queue: List = field(default_factory=list)  # (优先级排名, seq, waiter)
+    lanes: Dict[Priority, _LaneStats] = field(
+        default_factory=lambda: {p: _LaneStats() for p in Priority}
+    )
+
+
+class LLMScheduler:
+    """按模型限流、按优先级排队的 LLM 调度器（线程安全，同时支持协程与同步调用）"""
+
+    def __init__(
+        self,
+        default_limits: Optional[ModelLimits] = None,
+        model_limits: Optional[Dict[str, ModelLimits]] = None,
+        lane_order: Sequence[Priority] = DEFAULT_LANE_ORDER
+    ):
+        self.default_limits = default_limits or ModelLimits()
+        self.model_limits = dict(model_limits or {})
+        self.lane_order = list(lane_order)
+        self._rank = {priority: rank for rank, priority in enumerate(self.lane_order)}
+        self._models: Dict[str, _ModelState] = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+
+    # ============= 申请与释放 =============
+
+    async def acquire(self, model: str, tokens: int = 0, priority: Optional[Priority] = None) -> Ticket:
+        """申请名额（协程），排队期间被取消时自动退出队列"""
+        ticket = Ticket(model=model, priority=current_priority() if priority is None else priority, tokens=tokens)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enqueue(ticket, notify)
+        if waiter.granted:
+            return ticket
+        try:
+            await future
+        except BaseException:
+            self._cancel(waiter)
+            raise
+        return ticket
+
+    def acquire_sync(self, model: str, tokens: int = 0, priority: Optional[Priority] = None) -> Ticket:
+        """
+        申请名额（同步，供线程池中的 LangChain / CrewAI 调用使用）
+
+        不能在事件循环线程中调用：排队会卡住整个事件循环，导致持有名额的协程无法释放而死锁。
+        协程中的同步 LLM 调用应通过 asyncio.to_thread 放到线程中执行
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError("事件循环线程中不能同步调用 LLM，请使用异步接口或 asyncio.to_thread")
+
+        ticket = Ticket(model=model, priority=current_priority() if priority is None else priority, tokens=tokens)
+        event = threading.Event()
+        waiter = self._enqueue(ticket, event.set)
+        if not waiter.granted:
+            try:
+                event.wait()
+            except BaseException:
+                self._cancel(waiter)
+                raise
+        return ticket
+
+    def release(self, ticket: Ticket, used_tokens: Optional[int] = None):
+        """释放名额；给出实际用量时按差额结算 token 预算"""
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            state = self._state(ticket.model)
+            state.active -= 1
+            used = used_tokens if used_tokens is not None else ticket.used_tokens
+            if used:
+                LLM_TOKENS.inc(used, model=ticket.model)
+            if used is not None and state.limits.tokens_per_minute:
+                state.tokens = min(
+                    state.tokens + ticket.tokens - used, float(state.limits.tokens_per_minute)
+                )
+            self._dispatch(ticket.model, state)
+
+    @asynccontextmanager
+    async def slot(self, model: str, tokens: int = 0, priority: Optional[Priority] = None) -> AsyncIterator[Ticket]:
+        """`async with scheduler.slot(model, tokens) as ticket:` 包裹一次调用"""
+        ticket = await self.acquire(model, tokens, priority)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @contextmanager
+    def slot_sync(self, model: str, tokens: int = 0, priority: Optional[Priority] = None) -> Iterator[Ticket]:
+        """同步版本的 slot()"""
+        ticket = self.acquire_sync(model, tokens, priority)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def throttle(self, model: str, retry_after: float):
+        """服务商限流（429）：retry_after 秒内不再放行该模型的新请求"""
+        with self._lock:
+            state = self._state(model)
+            until = time.monotonic() + max(retry_after, 0.0)
+            if until > state.throttled_until:
+                state.throttled_until = until
+            state.throttled_count += 1
+            self._schedule_timer(model, state, retry_after)
+        logger.warning("LLM 模型 %s 被限流，暂停 %.1f 秒", model, retry_after)
+
+    # ============= 内部调度 =============
+
+    def _state(self, model: str) -> _ModelState:
+        state = self._models.get(model)
+        if state is None:
+            limits = self.model_limits.get(model, self.default_limits)
+            state = _ModelState(limits=limits, tokens=float(limits.tokens_per_minute))
+            self._models[model] = state
+        return state
+
+    def _refill(self, state: _ModelState, now: float):
+        tpm = state.limits.tokens_per_minute
+        if tpm:
+            state.tokens = min(float(tpm), state.tokens + (now - state.refilled_at) * tpm / 60.0)
+        state.refilled_at = now
+
+    def _enqueue(self, ticket: Ticket, notify: Callable[[], None]) -> _Waiter:
+        waiter = _Waiter(ticket, notify)
+        with self._lock:
+            state = self._state(ticket.model)
+            heapq.heappush(state.queue, (self._rank[ticket.priority], next(self._seq), waiter))
+            state.lanes[ticket.priority].queued += 1
+            self._dispatch(ticket.model, state, notify_caller=waiter)
+        return waiter
+
+    def _cancel(self, waiter: _Waiter):
+        """排队中的调用方放弃（取消 / 超时）"""
+        with self._lock:
+            if waiter.granted:
+                granted = True
+            else:
+                granted = False
+                waiter.cancelled = True
+                state = self._state(waiter.ticket.model)
+                state.lanes[waiter.ticket.priority].queued -= 1
+        if granted:
+            self.release(waiter.ticket)
+
+    def _grant(self, state: _ModelState, ticket: Ticket, waited: float):
+        state.active += 1
+        if state.limits.tokens_per_minute:
+            state.tokens -= min(ticket.tokens, state.limits.tokens_per_minute)
+        ticket.waited = waited
+        lane = state.lanes[ticket.priority]
+        lane.granted += 1
+        lane.wait_seconds += waited
+        lane.max_wait_seconds = max(lane.max_wait_seconds, waited)
+
+    def _dispatch(self, model: str, state: _ModelState, notify_caller: Optional[_Waiter] = None):
+        """按优先级放行排队的请求（需持有锁）"""
+        now = time.monotonic()
+        self._refill(state, now)
+        limits = state.limits
+        while state.queue:
+            _, _, waiter = state.queue[0]
+            priority = waiter.ticket.priority
+            if waiter.cancelled:
+                heapq.heappop(state.queue)
+                continue
+            if state.throttled_until > now:
+                self._schedule_timer(model, state, state.throttled_until - now)
+                return
+            capacity = limits.max_concurrency
+            if priority == Priority.BACKGROUND:
+                capacity = max(1, capacity - limits.reserved_interactive)
+            if state.active >= capacity:
+                return
+            if limits.tokens_per_minute:
+                needed = min(waiter.ticket.tokens, limits.tokens_per_minute)
+                if state.tokens < needed:
+                    self._schedule_timer(model, state, (needed - state.tokens) * 60.0 / limits.tokens_per_minute)
+                    return
+
+            heapq.heappop(state.queue)
+            state.lanes[priority].queued -= 1
+            waiter.granted = True
+            self._grant(state, waiter.ticket, now - waiter.enqueued_at)
+            if waiter is not notify_caller:
+                waiter.notify()
+
+    def _schedule_timer(self, model: str, state: _ModelState, delay: float):
+        """预算不足或被限流时，到期后重新调度（需持有锁）"""
+        if state.timer is not None and state.timer.is_alive():
+            return
+
+        def fire():
+            with self._lock:
+                state.timer = None
+                self._dispatch(model, state)
+
+        state.timer = threading.Timer(max(delay, 0.01), fire)
+        state.timer.daemon = True
+        state.timer.start()
+
+    # ============= 监控 =============
+
+    def stats(self) -> Dict[str, Any]:
+        """各模型的运行数、排队数与等待时长"""
+        with self._lock:
+            now = time.monotonic()
+            result = {}
+            for model, state in self._models.items():
+                self._refill(state, now)
+                result[model] = {
+                    "active": state.active,
+                    "max_concurrency": state.limits.max_concurrency,
+                    "tokens_available": int(state.tokens) if state.limits.tokens_per_minute else None,
+                    "tokens_per_minute": state.limits.tokens_per_minute or None,
+                    "throttled": state.throttled_until > now,
+                    "throttled_count": state.throttled_count,
+                    "lanes": {
+                        p.name.lower(): {
+                            "queued": lane.queued,
+                            "granted": lane.granted,
+                            "avg_wait_ms": round(lane.wait_seconds / lane.granted * 1000, 1) if lane.granted else 0.0,
+                            "max_wait_ms": round(lane.max_wait_seconds * 1000, 1),
+                        }
+                        for p, lane in sorted(state.lanes.items(), key=lambda item: self._rank[item[0]])
+                    }
+                }
+            return result
+
+
+def retry_after_seconds(headers: Any, default: float = 2.0) -> float:
+    """解析 429 响应的 Retry-After 头（只支持秒数）"""
+    value = headers.get("retry-after") if headers is not None else None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+def usage_tokens(data: Optional[Dict[str, Any]]) -> Optional[int]:
+    """从 OpenAI 兼容响应中取实际 token 用量"""
+    usage = (data or {}).get("usage") or {}
+    total = usage.get("total_tokens")
+    return int(total) if isinstance(total, (int, float)) else None
+
+
+def schedule_crew_llm(llm: Any) -> Any:
+    """
+    让 CrewAI LLM 实例的调用经过调度器
+
+    CrewAI 按模型前缀返回不同的原生实现类，这里直接包装实例上的 call / acall
+    """
+    from .ai.tokens import estimate_tokens
+
+    scheduler = get_llm_scheduler()
+    model = llm.model
+    call, acall = llm.call, llm.acall
+
+    def estimate(messages: Any) -> int:
+        return estimate_tokens(str(messages)) + (getattr(llm, "max_tokens", None) or 0)
+
+    def scheduled_call(messages, *args, **kwargs):
+        with scheduler.slot_sync(model, estimate(messages)):
+            return call(messages, *args, **kwargs)
+
+    async def scheduled_acall(messages, *args, **kwargs):
+        async with scheduler.slot(model, estimate(messages)):
+            return await acall(messages, *args, **kwargs)
+
+    # pydantic 模型不允许普通赋值新属性
+    object.__setattr__(llm, "call", scheduled_call)
+    object.__setattr__(llm, "acall", scheduled_acall)
+    return llm
+
+
+# 单例
+_llm_scheduler: Optional[LLMScheduler] = None
+
+
+def get_llm_scheduler() -> LLMScheduler:
+    """获取 LLM 调度器单例"""
+    global _llm_scheduler
+    if _llm_scheduler is None:
+        default = ModelLimits(
+            max_concurrency=settings.LLM_MAX_CONCURRENCY,
+            tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE,
+            reserved_interactive=settings.LLM_RESERVED_INTERACTIVE_SLOTS
+        )
+        overrides = {
+            model: ModelLimits(**{**default.__dict__, **limits})
+            for model, limits in settings.LLM_MODEL_LIMITS.items()
+        }
+        _llm_scheduler = LLMScheduler(default, overrides, parse_lane_order(settings.LLM_LANE_ORDER))
+    return _llm_scheduler
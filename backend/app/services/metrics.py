@@ -0,0 +1,397 @@
+"""
+进程内指标
+
+提供 Counter / Gauge / Histogram 三类指标，GET /metrics 以 Prometheus 文本格式（0.0.4）输出，
+不依赖 prometheus_client。
+
+标签基数受限：每个指标最多保留 max_series 组标签值，超出后新的组合统一记为 "other"，
+避免把会话 ID、原始 URL 之类的值写进标签导致内存无限增长。
+"""
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from ..config import get_settings
+
+settings = get_settings()
+
+OVERFLOW_LABEL = "other"
+
+# 秒级耗时的默认分桶（覆盖毫秒级接口到分钟级的 LLM 生成）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# 数据库查询耗时分桶
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """指标基类：负责标签校验与基数限制"""
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), max_series: Optional[int] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.max_series = max_series or settings.METRICS_MAX_SERIES
+        self._series: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        """调用方需持有 self._lock"""
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        if key not in self._series and len(self._series) >= self.max_series:
+            key = (OVERFLOW_LABEL,) * len(self.labelnames)
+        return key
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def _get(self, labels: Dict[str, object]):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = self._new_series()
+        return series
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._series.items())
+            lines.extend(self._render_series(items))
+        return lines
+
+    def _render_series(self, items) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value[0])}"
+            for key, value in items
+        ]
+
+
+class Counter(_Metric):
+    """只增计数器"""
+    type_name = "counter"
+
+    def _new_series(self):
+        return [0.0]
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError("Counter 只能增加")
+        with self._lock:
+            self._get(labels)[0] += amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            series = self._series.get(tuple(str(labels[n]) for n in self.labelnames))
+            return series[0] if series else 0.0
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值"""
+    type_name = "gauge"
+
+    def _new_series(self):
+        return [0.0]
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._get(labels)[0] = value
+
+    def inc(self, amount: float = 1, **labels):
+        with self._lock:
+            self._get(labels)[0] += amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            series = self._series.get(tuple(str(labels[n]) for n in self.labelnames))
+            return series[0] if series else 0.0
+
+
+class _HistogramSeries:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    """固定分桶的直方图"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, max_series: Optional[int] = None):
+        super().__init__(name, documentation, labelnames, max_series)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self):
+        return _HistogramSeries(len(self.buckets))
+
+    def observe(self, value: float, **labels):
+        with self._lock:
+            series = self._get(labels)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series.counts[i] += 1
+                    break
+            series.sum += value
+            series.count += 1
+
+    def time(self, **labels) -> "_Timer":
+        """`with histogram.time(route="/x"):` 记录代码块耗时"""
+        return _Timer(self, labels)
+
+    def snapshot(self, **labels) -> Dict[str, float]:
+        """返回 {count, sum}，未记录过时为 0"""
+        with self._lock:
+            series = self._series.get(tuple(str(labels[n]) for n in self.labelnames))
+            if series is None:
+                return {"count": 0, "sum": 0.0}
+            return {"count": series.count, "sum": series.sum}
+
+    def _render_series(self, items) -> List[str]:
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {series.count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series.sum)}")
+            lines.append(f"{self.name}_count{labels} {series.count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, object]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """指标注册表，render() 前先运行采集回调（用于队列深度等按需读取的值）"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs) -> Counter:
+        return self._register(Counter(name, documentation, labelnames, **kwargs))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, **kwargs))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, **kwargs))
+
+    def add_collector(self, collector: Callable[[], None]):
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics.values())
+        for collector in collectors:
+            try:
+                collector()
+            except Exception:
+                # 采集失败不影响其它指标输出
+                pass
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """获取指标注册表单例"""
+    return _registry
+
+
+# ========== 指标定义 ==========
+
+HTTP_REQUEST_SECONDS = _registry.histogram(
+    "http_request_duration_seconds", "HTTP 请求耗时（按路由模板）", ("method", "route", "status")
+)
+AGENT_FIRST_TOKEN_SECONDS = _registry.histogram(
+    "agent_time_to_first_token_seconds", "智能体首个输出片段耗时", ("agent_type",)
+)
+AGENT_GENERATION_SECONDS = _registry.histogram(
+    "agent_generation_seconds", "智能体单轮生成总耗时", ("agent_type", "outcome")
+)
+GRAPH_NODE_SECONDS = _registry.histogram(
+    "langgraph_node_duration_seconds", "LangGraph 节点耗时", ("graph", "node")
+)
+DB_QUERY_SECONDS = _registry.histogram(
+    "db_query_duration_seconds", "数据库语句耗时", ("operation",), buckets=DB_BUCKETS
+)
+LLM_TOKENS = _registry.counter(
+    "llm_tokens_total", "LLM 实际消耗的 token 数", ("model",)
+)
+LLM_PROMPT_TOKENS = _registry.counter(
+    "llm_prompt_tokens_total", "LLM 提示词 token 数（服务商返回的 usage）", ("model",)
+)
+LLM_CACHED_PROMPT_TOKENS = _registry.counter(
+    "llm_cached_prompt_tokens_total", "命中服务商上下文缓存的提示词 token 数", ("model",)
+)
+LLM_QUEUE_DEPTH = _registry.gauge(
+    "llm_queue_depth", "LLM 调度器排队请求数", ("model", "lane")
+)
+LLM_ACTIVE_REQUESTS = _registry.gauge(
+    "llm_active_requests", "LLM 调度器进行中的请求数", ("model",)
+)
+IMAGE_PREPROCESS_SECONDS = _registry.histogram(
+    "image_preprocess_duration_seconds", "多模态分析前图片预处理耗时", ("outcome",)
+)
+IMAGE_PREPROCESS_BYTES_SAVED = _registry.counter(
+    "image_preprocess_bytes_saved_total", "图片预处理减少的上传字节数"
+)
+STREAM_BUFFERS = _registry.gauge(
+    "stream_replay_buffers", "可断线续传的流式回合缓冲数"
+)
+ACCESS_LOG_PENDING = _registry.gauge(
+    "share_access_log_pending", "等待批量写入的共享链接访问日志条数"
+)
+
+
+class GenerationTimer:
+    """
+    记录一轮智能体生成的首字耗时与总耗时
+
+        timer = GenerationTimer(agent_type)
+        ...首个片段输出时 timer.first_token()
+        ...结束时 timer.finish()（异常时 timer.finish("error")）
+    """
+
+    def __init__(self, agent_type: str):
+        self.agent_type = agent_type or "unknown"
+        self.start = time.perf_counter()
+        self._first_seen = False
+        self._finished = False
+
+    def first_token(self):
+        if not self._first_seen:
+            self._first_seen = True
+            AGENT_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - self.start, agent_type=self.agent_type)
+
+    def finish(self, outcome: str = "ok"):
+        if not self._finished:
+            self._finished = True
+            AGENT_GENERATION_SECONDS.observe(
+                time.perf_counter() - self.start, agent_type=self.agent_type, outcome=outcome
+            )
+
+
+class GraphNodeTimer:
+    """
+    从 astream_events(version="v2") 的事件流中计算节点耗时
+
+    LangGraph 节点以 chain 事件出现，metadata.langgraph_node 为节点名；
+    同一节点内部的子 chain 也带有该 metadata，按 name 过滤只统计节点本身。
+    """
+
+    def __init__(self, graph: str):
+        self.graph = graph
+        self._starts: Dict[str, float] = {}
+
+    def observe(self, event: Dict):
+        kind = event.get("event")
+        if kind not in ("on_chain_start", "on_chain_end"):
+            return
+        node = (event.get("metadata") or {}).get("langgraph_node")
+        if not node or event.get("name") != node:
+            return
+        run_id = str(event.get("run_id"))
+        if kind == "on_chain_start":
+            self._starts[run_id] = time.perf_counter()
+        else:
+            start = self._starts.pop(run_id, None)
+            if start is not None:
+                GRAPH_NODE_SECONDS.observe(time.perf_counter() - start, graph=self.graph, node=node)
+
+
+def sql_operation(statement: str) -> str:
+    """取 SQL 首个关键字作为标签（SELECT / INSERT / ...），其余归为 OTHER；db span 名称使用同一分类"""
+    word = statement.lstrip().split(None, 1)[0].upper() if statement and statement.strip() else ""
+    return word if word in ("SELECT", "INSERT", "UPDATE", "DELETE", "BEGIN", "COMMIT", "ROLLBACK") else "OTHER"
+
+
+def instrument_engine(engine):
+    """为 SQLAlchemy Engine 注册语句耗时统计"""
+    from sqlalchemy import event
+
+    if getattr(engine, "_metrics_instrumented", False):
+        return
+    engine._metrics_instrumented = True
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("_metrics_query_start")
+        if starts:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - starts.pop(), operation=sql_operation(statement))
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("_metrics_query_start") if context.connection is not None else None
+        if starts:
+            DB_QUERY_SECONDS.observe(
+                time.perf_counter() - starts.pop(), operation=sql_operation(context.statement or "")
+            )
@@ -9,13 +9,14 @@ from pydantic import BaseModel, Field
 from crewai import Agent, Task, LLM
 
 from ...config import get_settings
+from ..llm_scheduler import schedule_crew_llm
 
 settings = get_settings()
 
 
 def create_llm() -> LLM:
     """创建 LLM 实例 - 使用 DashScope OpenAI 兼容接口"""
-    return LLM(
+    return schedule_crew_llm(LLM(
         model=f"openai/{settings.LLM_MODEL}",
         api_key=settings.LLM_API_KEY,
         base_url=settings.LLM_BASE_URL,
@@ -23,7 +24,7 @@ def create_llm() -> LLM:
         max_tokens=2000,
         timeout=90,
         max_retries=2,
-    )
+    ))
 
 
 class OrthoConversationOutput(BaseModel):
@@ -0,0 +1,259 @@
+"""
+流式 PDF 生成
+
+不依赖第三方 PDF 库，按页写出：
+- 每页内容流排版完成后立即写入文件，内存中只保留对象偏移量和页对象编号
+- 中文使用 PDF 标准 CJK 字体 STSong-Light（UniGB-UCS2-H 编码），不嵌入字体文件，
+  主流阅读器（Acrobat / Chrome / 预览 / pdf.js）均可直接显示
+- 页面内容可先写入片段文件（FragmentWriter），再由 StreamingPDFWriter 按顺序拼接，
+  用于多进程并发渲染多个事件
+"""
+import struct
+from typing import BinaryIO, Dict, Iterator, List, Optional, Protocol
+
+# A4 纸张（单位：pt）
+PAGE_WIDTH = 595.28
+PAGE_HEIGHT = 841.89
+
+_FONT_NAME = "STSong-Light"
+
+# 固定对象编号：目录、页树、字体
+_CATALOG_OBJ = 1
+_PAGES_OBJ = 2
+_FONT_OBJ = 3
+_CID_FONT_OBJ = 4
+_FONT_DESCRIPTOR_OBJ = 5
+_FIRST_FREE_OBJ = 6
+
+
+def char_width(ch: str) -> float:
+    """字符宽度（以字号为单位）：ASCII 半角 0.5，其余按全角 1"""
+    return 0.5 if ord(ch) < 128 else 1.0
+
+
+def text_width(text: str, size: float) -> float:
+    """文本宽度（pt）"""
+    return sum(char_width(ch) for ch in text) * size
+
+
+def encode_text(text: str) -> str:
+    """编码为 UCS-2 十六进制字符串（超出基本平面的字符替换为 ?）"""
+    codes = []
+    for ch in text:
+        code = ord(ch)
+        if code > 0xFFFF or 0xD800 <= code <= 0xDFFF:
+            code = ord("?")
+        codes.append(f"{code:04X}")
+    return "<" + "".join(codes) + ">"
+
+
+def wrap_text(text: str, size: float, max_width: float) -> List[str]:
+    """按宽度折行（保留原有换行；英文单词过长时按字符断开）"""
+    lines: List[str] = []
+    for raw_line in (text or "").splitlines() or [""]:
+        current = ""
+        width = 0.0
+        for ch in raw_line:
+            w = char_width(ch) * size
+            if current and width + w > max_width:
+                lines.append(current)
+                current, width = "", 0.0
+                if ch == " ":
+                    continue
+            current += ch
+            width += w
+        lines.append(current)
+    return lines
+
+
+class PageSink(Protocol):
+    """页面内容接收方"""
+
+    def add_page(self, content: bytes) -> None:
+        ...
+
+
+class StreamingPDFWriter:
+    """逐页写出的 PDF 文件"""
+
+    def __init__(self, fp: BinaryIO):
+        self._fp = fp
+        self._offsets: Dict[int, int] = {}
+        self._page_objs: List[int] = []
+        self._next_obj = _FIRST_FREE_OBJ
+        self._closed = False
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def page_count(self) -> int:
+        return len(self._page_objs)
+
+    def _write(self, data: bytes):
+        self._fp.write(data)
+
+    def _alloc(self) -> int:
+        num = self._next_obj
+        self._next_obj += 1
+        return num
+
+    def _write_obj(self, num: int, body: bytes):
+        self._offsets[num] = self._fp.tell()
+        self._write(f"{num} 0 obj\n".encode("ascii") + body + b"\nendobj\n")
+
+    def add_page(self, content: bytes):
+        """写入一页（content 为页面内容流）"""
+        content_obj = self._alloc()
+        page_obj = self._alloc()
+        self._write_obj(
+            content_obj,
+            f"<< /Length {len(content)} >>\nstream\n".encode("ascii") + content + b"\nendstream"
+        )
+        self._write_obj(page_obj, (
+            f"<< /Type /Page /Parent {_PAGES_OBJ} 0 R "
+            f"/MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 {_FONT_OBJ} 0 R >> >> "
+            f"/Contents {content_obj} 0 R >>"
+        ).encode("ascii"))
+        self._page_objs.append(page_obj)
+
+    def add_fragment(self, fp: BinaryIO) -> int:
+        """按顺序写入片段文件中的全部页面，返回页数"""
+        count = 0
+        for content in FragmentWriter.iter_pages(fp):
+            self.add_page(content)
+            count += 1
+        return count
+
+    def close(self):
+        """写出页树、字体、交叉引用表和文件尾"""
+        if self._closed:
+            return
+        self._closed = True
+        if not self._page_objs:
+            self.add_page(b"")
+
+        kids = " ".join(f"{num} 0 R" for num in self._page_objs)
+        self._write_obj(
+            _PAGES_OBJ,
+            f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_objs)} >>".encode("ascii")
+        )
+        self._write_obj(_CATALOG_OBJ, f"<< /Type /Catalog /Pages {_PAGES_OBJ} 0 R >>".encode("ascii"))
+        self._write_obj(_FONT_OBJ, (
+            f"<< /Type /Font /Subtype /Type0 /BaseFont /{_FONT_NAME} /Encoding /UniGB-UCS2-H "
+            f"/DescendantFonts [{_CID_FONT_OBJ} 0 R] >>"
+        ).encode("ascii"))
+        self._write_obj(_CID_FONT_OBJ, (
+            f"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /{_FONT_NAME} "
+            f"/CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) /Supplement 2 >> "
+            f"/FontDescriptor {_FONT_DESCRIPTOR_OBJ} 0 R /DW 1000 /W [1 95 500] >>"
+        ).encode("ascii"))
+        self._write_obj(_FONT_DESCRIPTOR_OBJ, (
+            f"<< /Type /FontDescriptor /FontName /{_FONT_NAME} /Flags 6 "
+            f"/FontBBox [-25 -254 1000 880] /ItalicAngle 0 /Ascent 880 /Descent -120 "
+            f"/CapHeight 880 /StemV 93 >>"
+        ).encode("ascii"))
+
+        xref_offset = self._fp.tell()
+        size = self._next_obj
+        self._write(f"xref\n0 {size}\n".encode("ascii"))
+        self._write(b"0000000000 65535 f \n")
+        for num in range(1, size):
+            self._write(f"{self._offsets[num]:010d} 00000 n \n".encode("ascii"))
+        self._write((
+            f"trailer\n<< /Size {size} /Root {_CATALOG_OBJ} 0 R >>\n"
+            f"startxref\n{xref_offset}\n%%EOF\n"
+        ).encode("ascii"))
+
+
+class FragmentWriter:
+    """页面片段文件：依次保存 [4 字节长度][页面内容流]"""
+
+    def __init__(self, fp: BinaryIO):
+        self._fp = fp
+        self.page_count = 0
+
+    def add_page(self, content: bytes):
+        self._fp.write(struct.pack(">I", len(content)))
+        self._fp.write(content)
+        self.page_count += 1
+
+    @staticmethod
+    def iter_pages(fp: BinaryIO) -> Iterator[bytes]:
+        while True:
+            header = fp.read(4)
+            if len(header) < 4:
+                return
+            (length,) = struct.unpack(">I", header)
+            yield fp.read(length)
+
+
+class PageLayout:
+    """
+    简单的自上而下排版
+
+    只缓存当前页的内容，写满一页即交给 sink
+    """
+
+    def __init__(
+        self,
+        sink: PageSink,
+        margin: float = 56.0,
+        font_size: float = 10.5,
+        line_spacing: float = 1.5
+    ):
+        self.sink = sink
+        self.margin = margin
+        self.font_size = font_size
+        self.line_spacing = line_spacing
+        self.max_width = PAGE_WIDTH - margin * 2
+        self._ops: List[str] = []
+        self._y = PAGE_HEIGHT - margin
+
+    def _ensure_space(self, height: float):
+        if self._y - height < self.margin:
+            self.new_page()
+
+    def new_page(self):
+        """结束当前页"""
+        if self._ops:
+            self.sink.add_page("\n".join(self._ops).encode("ascii"))
+        self._ops = []
+        self._y = PAGE_HEIGHT - self.margin
+
+    def text(self, text: str, size: Optional[float] = None, indent: float = 0.0):
+        """写入一段文本（自动折行、分页）"""
+        size = size or self.font_size
+        leading = size * self.line_spacing
+        for line in wrap_text(text, size, self.max_width - indent):
+            self._ensure_space(leading)
+            self._y -= leading
+            if line:
+                self._ops.append(
+                    f"BT /F1 {size:.2f} Tf {self.margin + indent:.2f} {self._y:.2f} Td {encode_text(line)} Tj ET"
+                )
+
+    def heading(self, text: str, size: float = 14.0):
+        """标题（与上文留出间距）"""
+        self.space(size * 0.5)
+        self.text(text, size=size)
+        self.space(size * 0.25)
+
+    def rule(self):
+        """水平分隔线"""
+        self._ensure_space(8)
+        self._y -= 4
+        self._ops.append(
+            f"0.6 w {self.margin:.2f} {self._y:.2f} m {PAGE_WIDTH - self.margin:.2f} {self._y:.2f} l S"
+        )
+        self._y -= 4
+
+    def space(self, height: float):
+        """空白"""
+        if self._y - height < self.margin:
+            self.new_page()
+        else:
+            self._y -= height
+
+    def finish(self):
+        """输出最后一页"""
+        self.new_page()
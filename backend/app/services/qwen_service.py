@@ -1,5 +1,9 @@
-import httpx
 from ..config import get_settings
+from .ai.context_builder import ContextBuilder
+from .ai.prompt_cache import DYNAMIC, SEMI_STATIC, PromptAssembly
+from .ai.tokens import estimate_messages_tokens, estimate_tokens
+from .llm_pool import ProviderError
+from .llm_provider import LLMProvider
 
 settings = get_settings()
 
@@ -7,21 +11,8 @@ settings = get_settings()
 class QwenService:
     """使用 OpenAI 兼容接口调用阿里千问"""
 
-    @staticmethod
-    def build_system_prompt(
-        doctor_name: str, 
-        doctor_title: str, 
-        specialty: str,
-        persona_prompt: str = None,
-        rag_context: str = None
-    ) -> str:
-        if persona_prompt:
-            base_prompt = persona_prompt
-        else:
-            base_prompt = f"""你是{doctor_name}医生的AI分身，职称是{doctor_title}。
-擅长领域：{specialty}
-
-你的职责是：
+    # 默认人设的通用指令（所有医生相同，放在最前面作为可缓存前缀）
+    DEFAULT_RULES = """你的职责是：
 1. 以专业、温和、耐心的态度回答患者的健康咨询
 2. 根据患者描述的症状，给出初步的分析和建议
 3. 必要时建议患者进行相关检查或线下就医
@@ -31,11 +22,47 @@ class QwenService:
 - 回复要简洁明了，控制在200字以内
 - 如果问题超出你的专业范围，请诚实告知并建议咨询相关科室
 - 遇到紧急情况，请建议患者立即就医或拨打急救电话"""
-        
+
+    @classmethod
+    def assemble_system_prompt(
+        cls,
+        doctor_name: str,
+        doctor_title: str,
+        specialty: str,
+        persona_prompt: str = None,
+        rag_context: str = None
+    ) -> PromptAssembly:
+        """
+        组装系统提示词：通用指令 → 医生身份 / 人设 → RAG 参考资料
+
+        同一医生的前缀逐字不变，RAG 资料等每轮变化的内容放在最后，便于服务商缓存前缀
+        """
+        prompt = PromptAssembly()
+        if persona_prompt:
+            prompt.add(persona_prompt, SEMI_STATIC)
+        else:
+            prompt.add(cls.DEFAULT_RULES)
+            prompt.add(f"你是{doctor_name}医生的AI分身，职称是{doctor_title}。\n擅长领域：{specialty}", SEMI_STATIC)
+
         if rag_context:
-            base_prompt += f"\n\n{rag_context}\n\n请结合以上参考资料回答患者问题。"
-        
-        return base_prompt
+            prompt.add(f"{rag_context}\n\n请结合以上参考资料回答患者问题。", DYNAMIC)
+
+        return prompt
+
+    @classmethod
+    def build_system_prompt(
+        cls,
+        doctor_name: str, 
+        doctor_title: str, 
+        specialty: str,
+        persona_prompt: str = None,
+        rag_context: str = None
+    ) -> str:
+        return cls.assemble_system_prompt(
+            doctor_name, doctor_title, specialty,
+            persona_prompt=persona_prompt,
+            rag_context=rag_context
+        ).text()
 
     @classmethod
     async def get_ai_response(
@@ -49,59 +76,65 @@ class QwenService:
         rag_context: str = None,
         model: str = None,
         temperature: float = None,
-        max_tokens: int = None
+        max_tokens: int = None,
+        context_state: dict = None
     ) -> str:
+        """
+        history 按模型的提示词预算截取：近期消息原文保留，更早的压缩为摘要附加在系统提示词之后。
+        传入 context_state（会话状态）时摘要缓存在其 context_summary 中，之后的轮次增量更新
+        """
         if not settings.LLM_API_KEY:
             return f"您好，我是{doctor_name}医生AI分身。感谢您的咨询，根据您描述的情况，建议您注意休息，保持良好的生活习惯。如果症状持续，建议到医院进行详细检查。"
 
-        system_prompt = cls.build_system_prompt(
+        system_prompt = cls.assemble_system_prompt(
             doctor_name, doctor_title, specialty, 
             persona_prompt=persona_prompt, 
             rag_context=rag_context
         )
 
-        messages = [{"role": "system", "content": system_prompt}]
+        # 使用传入的参数或默认配置
+        use_model = model or settings.LLM_MODEL
+        use_temperature = temperature if temperature is not None else settings.LLM_TEMPERATURE
+        use_max_tokens = max_tokens or 500
 
+        history_messages = []
         if history:
-            for msg in history[-6:]:
-                role = "user" if msg["sender"] == "user" else "assistant"
-                messages.append({"role": role, "content": msg["content"]})
+            builder = ContextBuilder.for_model(
+                use_model,
+                reserved=estimate_tokens(system_prompt.text()) + estimate_tokens(user_message) + use_max_tokens
+            )
+            summary_state = context_state.get("context_summary") if context_state is not None else None
+            context = builder.build(history, summary_state=summary_state)
+            if context_state is not None:
+                context_state["context_summary"] = context.summary_state
+            system_prompt.add(context.preamble(), DYNAMIC)
+            history_messages = context.as_dicts()
 
+        messages = [system_prompt.system_message(use_model)]
+        messages.extend(history_messages)
         messages.append({"role": "user", "content": user_message})
 
-        # 使用传入的参数或默认配置
-        use_model = model or settings.LLM_MODEL
-        use_temperature = temperature if temperature is not None else settings.LLM_TEMPERATURE
-        use_max_tokens = max_tokens or 500
+        estimated = estimate_messages_tokens(messages) + use_max_tokens
 
         try:
-            api_url = f"{settings.LLM_BASE_URL}/chat/completions"
-            
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    api_url,
-                    headers={
-                        "Authorization": f"Bearer {settings.LLM_API_KEY}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": use_model,
-                        "messages": messages,
-                        "temperature": use_temperature,
-                        "max_tokens": use_max_tokens
-                    }
-                )
-
-                if response.status_code == 200:
-                    data = response.json()
-                    choices = data.get("choices", [])
-                    if choices and len(choices) > 0:
-                        return choices[0].get("message", {}).get("content", "抱歉，暂时无法回复，请稍后再试。")
-                    return "抱歉，暂时无法回复，请稍后再试。"
-                else:
-                    print(f"LLM API error: {response.status_code} - {response.text}")
-                    return "医生繁忙，请稍后再试。"
+            data = await LLMProvider.get_pool().chat_completion(
+                {
+                    "model": use_model,
+                    "messages": messages,
+                    "temperature": use_temperature,
+                    "max_tokens": use_max_tokens
+                },
+                tokens=estimated,
+                timeout=60.0
+            )
+            choices = data.get("choices", [])
+            if choices and len(choices) > 0:
+                return choices[0].get("message", {}).get("content", "抱歉，暂时无法回复，请稍后再试。")
+            return "抱歉，暂时无法回复，请稍后再试。"
 
+        except ProviderError as e:
+            print(f"LLM API error: {e}")
+            return "医生繁忙，请稍后再试。"
         except Exception as e:
             print(f"LLM API exception: {e}")
             return "网络繁忙，请稍后再试。"
@@ -3,10 +3,13 @@ Qwen-VL 多模态服务 - 支持图像理解与分析
 用于皮肤科图像识别、报告解读等场景
 """
 import base64
-import httpx
 import json
 from typing import Optional, List, Dict, Any
 from ..config import get_settings
+from .ai.tokens import estimate_tokens
+from .image_preprocessing import get_image_preprocessor
+from .llm_pool import ProviderError
+from .llm_provider import LLMProvider
 
 settings = get_settings()
 
@@ -60,12 +63,14 @@ class QwenVLService:
                 "content": None
             }
         
-        # 构建图像内容
+        # 构建图像内容（base64 图片先缩放、重新编码，见 image_preprocessing）
+        preprocessed = None
         if image_base64:
+            preprocessed = await get_image_preprocessor().preprocess(image_base64)
             image_content = {
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/jpeg;base64,{image_base64}"
+                    "url": preprocessed.data_url
                 }
             }
         else:
@@ -89,45 +94,42 @@ class QwenVLService:
             ]
         })
         
+        estimated = estimate_tokens(system_prompt or "") + estimate_tokens(prompt) + max_tokens
+
         try:
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(
-                    self.api_url,
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": self.vl_model,
-                        "messages": messages,
-                        "temperature": temperature,
-                        "max_tokens": max_tokens
-                    }
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    choices = data.get("choices", [])
-                    if choices:
-                        content = choices[0].get("message", {}).get("content", "")
-                        return {
-                            "success": True,
-                            "content": content,
-                            "usage": data.get("usage", {})
-                        }
-                    return {
-                        "success": False,
-                        "error": "无有效响应",
-                        "content": None
-                    }
-                else:
-                    print(f"Qwen-VL API error: {response.status_code} - {response.text}")
-                    return {
-                        "success": False,
-                        "error": f"API请求失败: {response.status_code}",
-                        "content": None
-                    }
-                    
+            # 只有在 model_map 中映射了多模态模型的备用服务商才会参与故障转移
+            data = await LLMProvider.get_pool().chat_completion(
+                {
+                    "model": self.vl_model,
+                    "messages": messages,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens
+                },
+                tokens=estimated,
+                timeout=120.0
+            )
+            choices = data.get("choices", [])
+            if choices:
+                content = choices[0].get("message", {}).get("content", "")
+                return {
+                    "success": True,
+                    "content": content,
+                    "usage": data.get("usage", {}),
+                    "preprocess": preprocessed.stats() if preprocessed else None
+                }
+            return {
+                "success": False,
+                "error": "无有效响应",
+                "content": None
+            }
+
+        except ProviderError as e:
+            print(f"Qwen-VL API error: {e}")
+            return {
+                "success": False,
+                "error": f"API请求失败: {e.status_code}",
+                "content": None
+            }
         except Exception as e:
             print(f"Qwen-VL API exception: {e}")
             return {
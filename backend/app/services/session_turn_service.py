@@ -0,0 +1,338 @@
+"""
+会话轮次服务 - 幂等键去重与会话级串行化
+
+- 同一会话内的轮次通过 SessionTurnLock 依次执行，避免并发读写 agent_state 互相覆盖
+- 锁分两层：进程内 asyncio.Lock 负责本 worker 内排队，数据库 session_locks 表负责跨 worker 互斥
+- 持有期间每 ttl/3 续租一次，轮次耗时超过 TTL（重试、排队）时不会被其它 worker 当作过期锁抢占
+- 不同会话之间完全并发
+"""
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..database import SessionLocal
+from ..models.session_turn import SessionTurn, SessionLock, TurnStatus
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class SessionBusyError(Exception):
+    """等待会话锁超时"""
+    pass
+
+
+class IdempotencyConflictError(Exception):
+    """同一幂等键对应了不同的请求内容"""
+    pass
+
+
+def compute_request_hash(content: str, attachments: List[Dict[str, Any]], action: str) -> str:
+    """计算请求指纹，用于校验同一幂等键是否对应同一请求"""
+    payload = json.dumps(
+        {"content": content, "attachments": attachments or [], "action": action},
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SessionTurnLock:
+    """会话级互斥锁"""
+
+    def __init__(
+        self,
+        ttl_seconds: int = 180,
+        wait_timeout: float = 60,
+        poll_interval: float = 0.2,
+        session_factory=SessionLocal,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._session_factory = session_factory
+        self._local_locks: Dict[str, asyncio.Lock] = {}
+        self._local_waiters: Dict[str, int] = {}
+        self._heartbeats: Dict[str, asyncio.Task] = {}  # owner → 续租任务
+
+    async def acquire(self, session_id: str) -> str:
+        """
+        获取会话锁
+
+        返回: 锁持有者标识（释放时使用）
+        抛出: SessionBusyError 等待超时
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        local_lock = self._local_locks.setdefault(session_id, asyncio.Lock())
+        self._local_waiters[session_id] = self._local_waiters.get(session_id, 0) + 1
+        try:
+            await asyncio.wait_for(local_lock.acquire(), timeout=self.wait_timeout)
+        except asyncio.TimeoutError:
+            self._drop_waiter(session_id)
+            raise SessionBusyError(session_id)
+
+        owner = str(uuid.uuid4())
+        try:
+            while not self._try_acquire_db(session_id, owner):
+                if time.monotonic() >= deadline:
+                    raise SessionBusyError(session_id)
+                await asyncio.sleep(self.poll_interval)
+        except BaseException:
+            local_lock.release()
+            self._drop_waiter(session_id)
+            raise
+        self._heartbeats[owner] = asyncio.create_task(self._heartbeat(session_id, owner))
+        return owner
+
+    def release(self, session_id: str, owner: str):
+        """释放会话锁"""
+        heartbeat = self._heartbeats.pop(owner, None)
+        if heartbeat:
+            heartbeat.cancel()
+        db = self._session_factory()
+        try:
+            db.query(SessionLock).filter(
+                SessionLock.session_id == session_id,
+                SessionLock.owner == owner
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error("释放会话锁失败: session=%s, error=%s", session_id, e)
+        finally:
+            db.close()
+
+        local_lock = self._local_locks.get(session_id)
+        if local_lock and local_lock.locked():
+            local_lock.release()
+        self._drop_waiter(session_id)
+
+    def _drop_waiter(self, session_id: str):
+        count = self._local_waiters.get(session_id, 0) - 1
+        if count <= 0:
+            self._local_waiters.pop(session_id, None)
+            self._local_locks.pop(session_id, None)
+        else:
+            self._local_waiters[session_id] = count
+
+    async def _heartbeat(self, session_id: str, owner: str):
+        """持有期间定期续租；锁已被抢占时停止续租并记录错误"""
+        interval = self.ttl_seconds / 3
+        while True:
+            await asyncio.sleep(interval)
+            renewed = self._renew_db(session_id, owner)
+            if renewed is False:
+                logger.error("会话锁续租失败，锁已被其它请求持有: session=%s, owner=%s", session_id, owner)
+                return
+
+    def _renew_db(self, session_id: str, owner: str) -> Optional[bool]:
+        """
+        延长锁的过期时间
+
+        返回: 是否仍持有锁；数据库异常返回 None（下次续租时重试）
+        """
+        db = self._session_factory()
+        try:
+            renewed = db.query(SessionLock).filter(
+                SessionLock.session_id == session_id,
+                SessionLock.owner == owner
+            ).update(
+                {"expires_at": datetime.utcnow() + timedelta(seconds=self.ttl_seconds)},
+                synchronize_session=False
+            )
+            db.commit()
+            return bool(renewed)
+        except Exception as e:
+            db.rollback()
+            logger.warning("会话锁续租异常: session=%s, error=%s", session_id, e)
+            return None
+        finally:
+            db.close()
+
+    def _try_acquire_db(self, session_id: str, owner: str) -> bool:
+        db = self._session_factory()
+        try:
+            now = datetime.utcnow()
+            expires_at = now + timedelta(seconds=self.ttl_seconds)
+            # 抢占已过期的锁（持有者 worker 崩溃等情况）
+            taken = db.query(SessionLock).filter(
+                SessionLock.session_id == session_id,
+                SessionLock.expires_at < now
+            ).update({"owner": owner, "expires_at": expires_at}, synchronize_session=False)
+            if taken:
+                db.commit()
+                return True
+            db.add(SessionLock(session_id=session_id, owner=owner, expires_at=expires_at))
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()
+            return False
+        finally:
+            db.close()
+
+
+class SessionTurnService:
+    """会话轮次记录管理"""
+
+    @staticmethod
+    def get_by_key(db: Session, session_id: str, idempotency_key: str) -> Optional[SessionTurn]:
+        return db.query(SessionTurn).filter(
+            SessionTurn.session_id == session_id,
+            SessionTurn.idempotency_key == idempotency_key
+        ).first()
+
+    @staticmethod
+    def create_turn(
+        db: Session,
+        session_id: str,
+        idempotency_key: Optional[str],
+        request_hash: str
+    ) -> Tuple[SessionTurn, bool]:
+        """
+        创建轮次记录
+
+        返回: (轮次, 是否新建)。幂等键冲突时返回已存在的轮次
+        """
+        turn = SessionTurn(
+            id=str(uuid.uuid4()),
+            session_id=session_id,
+            idempotency_key=idempotency_key,
+            request_hash=request_hash,
+            status=TurnStatus.running.value
+        )
+        db.add(turn)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            existing = SessionTurnService.get_by_key(db, session_id, idempotency_key)
+            if existing is None:
+                raise
+            return existing, False
+        return turn, True
+
+    @staticmethod
+    def claim_turn(
+        db: Session,
+        session_id: str,
+        idempotency_key: Optional[str],
+        request_hash: str
+    ) -> Tuple[SessionTurn, bool]:
+        """
+        按幂等键认领轮次
+
+        返回: (轮次, 是否需要本请求执行)。
+        已存在且未失败的轮次返回 False，调用方应重放其结果
+        """
+        if idempotency_key:
+            existing = SessionTurnService.get_by_key(db, session_id, idempotency_key)
+            if existing is None:
+                existing, created = SessionTurnService.create_turn(
+                    db, session_id, idempotency_key, request_hash
+                )
+                if created:
+                    return existing, True
+            if existing.request_hash != request_hash:
+                raise IdempotencyConflictError(idempotency_key)
+            if existing.status == TurnStatus.failed.value:
+                return existing, SessionTurnService.restart_turn(db, existing)
+            return existing, False
+
+        turn, _ = SessionTurnService.create_turn(db, session_id, None, request_hash)
+        return turn, True
+
+    @staticmethod
+    def restart_turn(db: Session, turn: SessionTurn) -> bool:
+        """
+        失败的轮次允许以同一幂等键重试
+
+        使用条件更新，保证并发重试时只有一个请求真正重新执行
+        """
+        updated = db.query(SessionTurn).filter(
+            SessionTurn.id == turn.id,
+            SessionTurn.status == TurnStatus.failed.value
+        ).update({
+            "status": TurnStatus.running.value,
+            "error": None,
+            "result": None
+        }, synchronize_session=False)
+        db.commit()
+        db.refresh(turn)
+        return bool(updated)
+
+    @staticmethod
+    def finish_turn(
+        turn_id: str,
+        status: TurnStatus,
+        user_message_id: Optional[int] = None,
+        ai_message_id: Optional[int] = None,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None
+    ):
+        """记录轮次结果（使用独立数据库会话，可在后台任务中调用）"""
+        db = SessionLocal()
+        try:
+            turn = db.query(SessionTurn).filter(SessionTurn.id == turn_id).first()
+            if not turn:
+                return
+            turn.status = status.value
+            if user_message_id is not None:
+                turn.user_message_id = user_message_id
+            if ai_message_id is not None:
+                turn.ai_message_id = ai_message_id
+            if result is not None:
+                turn.result = result
+            turn.error = error
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error("更新轮次状态失败: turn=%s, error=%s", turn_id, e)
+        finally:
+            db.close()
+
+    @staticmethod
+    async def wait_for_turn(turn_id: str, timeout: float, poll_interval: float = 0.5) -> Optional[SessionTurn]:
+        """
+        等待其它 worker 上运行中的轮次结束
+
+        返回结束后的轮次（已从会话分离），超时返回 None
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            db = SessionLocal()
+            try:
+                turn = db.query(SessionTurn).filter(SessionTurn.id == turn_id).first()
+                if turn and turn.status != TurnStatus.running.value:
+                    db.expunge(turn)
+                    return turn
+            finally:
+                db.close()
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(poll_interval)
+
+
+# 全局实例
+_session_lock: Optional[SessionTurnLock] = None
+
+
+def get_session_lock() -> SessionTurnLock:
+    """获取会话锁单例"""
+    global _session_lock
+    if _session_lock is None:
+        _session_lock = SessionTurnLock(
+            ttl_seconds=settings.SESSION_TURN_LOCK_TTL_SECONDS,
+            wait_timeout=settings.SESSION_TURN_LOCK_WAIT_SECONDS,
+        )
+    return _session_lock
@@ -0,0 +1,249 @@
+"""
+共享链接访问服务
+
+共享链接常被转发到家庭群里，短时间内被反复打开。访问路径尽量不读主库：
+- 共享内容按 token 缓存为预先序列化好的 JSON 快照（带 TTL），命中时不再查询事件
+- 访问次数由一条带条件的 UPDATE 原子地校验并递增，并发访问不会超出上限
+- 访问日志先写入内存缓冲，由后台线程批量写库
+
+链接失效、过期、访问次数由 UPDATE 的条件以数据库为准判断，快照只影响展示内容，
+内容最多滞后 SHARE_SNAPSHOT_TTL_SECONDS。
+"""
+import threading
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert, or_, update
+from sqlalchemy.orm import Session, sessionmaker
+
+from ..config import get_settings
+from ..database import SessionLocal
+from ..models.medical_event import ExportAccessLog, ExportRecord
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ShareSnapshot:
+    """共享链接快照"""
+    export_id: int
+    expires_at: Optional[datetime]
+    share_password: Optional[str]
+    events_json: bytes  # 已序列化的事件列表
+    export_info: Any  # ExportRecordSchema，view_count 每次访问更新
+    created_at: float = field(default_factory=time.time)
+
+    def render(self, view_count: Optional[int], accessed_at: datetime) -> bytes:
+        """拼接响应体（事件部分直接复用已序列化的内容）"""
+        info = self.export_info
+        if view_count is not None:
+            info = info.model_copy(update={"view_count": view_count})
+        return b"".join((
+            b'{"events":', self.events_json,
+            b',"export_info":', info.model_dump_json().encode("utf-8"),
+            b',"accessed_at":"', accessed_at.isoformat().encode("ascii"), b'"}'
+        ))
+
+
+class ShareSnapshotCache:
+    """按 token 缓存共享链接快照（LRU + TTL）"""
+
+    def __init__(self, ttl_seconds: int = 60, max_entries: int = 256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, ShareSnapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[ShareSnapshot]:
+        with self._lock:
+            snapshot = self._entries.get(token)
+            if snapshot is None:
+                return None
+            if snapshot.created_at + self.ttl_seconds < time.time():
+                self._entries.pop(token, None)
+                return None
+            self._entries.move_to_end(token)
+            return snapshot
+
+    def set(self, token: str, snapshot: ShareSnapshot):
+        with self._lock:
+            self._entries[token] = snapshot
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token: Optional[str]):
+        """移除快照（链接失效时调用）"""
+        if not token:
+            return
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ShareLinkService:
+    """共享链接访问计数"""
+
+    @staticmethod
+    def consume_view(db: Session, export_id: int, now: Optional[datetime] = None) -> Optional[int]:
+        """
+        原子地校验并递增访问次数（单条带条件的 UPDATE，已提交）
+
+        Returns:
+            递增后的访问次数；链接已失效、过期或达到访问上限时返回 None
+        """
+        now = now or datetime.utcnow()
+        stmt = update(ExportRecord).where(
+            ExportRecord.id == export_id,
+            ExportRecord.is_active == True,
+            or_(ExportRecord.expires_at.is_(None), ExportRecord.expires_at >= now),
+            or_(ExportRecord.max_views.is_(None), ExportRecord.view_count < ExportRecord.max_views)
+        ).values(
+            view_count=ExportRecord.view_count + 1,
+            last_viewed_at=now
+        ).execution_options(synchronize_session=False)
+
+        if db.get_bind().dialect.update_returning:
+            view_count = db.execute(stmt.returning(ExportRecord.view_count)).scalar()
+            db.commit()
+            return view_count
+
+        result = db.execute(stmt)
+        db.commit()
+        if result.rowcount == 0:
+            return None
+        return db.query(ExportRecord.view_count).filter(ExportRecord.id == export_id).scalar()
+
+
+class AccessLogBuffer:
+    """
+    访问日志批量写入
+
+    add() 只追加到内存列表；后台线程每隔 flush_interval 秒或积累到 batch_size 条时
+    一次性批量插入。缓冲超过 max_pending 时丢弃最早的记录，避免数据库故障时内存无限增长。
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker = SessionLocal,
+        batch_size: int = 100,
+        flush_interval: float = 2.0,
+        max_pending: int = 10000
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+
+    def add(
+        self,
+        export_id: int,
+        ip_address: Optional[str] = None,
+        user_agent: Optional[str] = None,
+        accessed_at: Optional[datetime] = None
+    ):
+        """记录一次访问（不访问数据库）"""
+        row = {
+            "export_id": export_id,
+            "ip_address": ip_address[:50] if ip_address else None,
+            "user_agent": user_agent[:500] if user_agent else None,
+            "accessed_at": accessed_at or datetime.utcnow()
+        }
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self._pending.pop(0)
+                self.dropped += 1
+            self._pending.append(row)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+        self._ensure_worker()
+
+    @property
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self) -> int:
+        """立即写入缓冲中的全部日志，返回写入条数"""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return 0
+        db = self.session_factory()
+        try:
+            db.execute(insert(ExportAccessLog), rows)
+            db.commit()
+            return len(rows)
+        except Exception as e:
+            db.rollback()
+            logger.error("共享链接访问日志写入失败，丢弃 %s 条: %s", len(rows), e)
+            return 0
+        finally:
+            db.close()
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._stopped.clear()
+            self._worker = threading.Thread(target=self._run, name="share-access-log", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stop(self):
+        """停止后台线程并写入剩余日志（应用关闭时调用）"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._worker is not None:
+            self._worker.join(timeout=5)
+            self._worker = None
+        self.flush()
+
+
+# 单例
+_snapshot_cache: Optional[ShareSnapshotCache] = None
+_access_log_buffer: Optional[AccessLogBuffer] = None
+
+
+def get_share_snapshot_cache() -> ShareSnapshotCache:
+    """获取共享链接快照缓存单例"""
+    global _snapshot_cache
+    if _snapshot_cache is None:
+        _snapshot_cache = ShareSnapshotCache(
+            ttl_seconds=settings.SHARE_SNAPSHOT_TTL_SECONDS,
+            max_entries=settings.SHARE_SNAPSHOT_MAX_ENTRIES
+        )
+    return _snapshot_cache
+
+
+def get_access_log_buffer() -> AccessLogBuffer:
+    """获取访问日志缓冲单例"""
+    global _access_log_buffer
+    if _access_log_buffer is None:
+        _access_log_buffer = AccessLogBuffer(
+            batch_size=settings.SHARE_ACCESS_LOG_BATCH_SIZE,
+            flush_interval=settings.SHARE_ACCESS_LOG_FLUSH_SECONDS
+        )
+    return _access_log_buffer
@@ -0,0 +1,227 @@
+"""
+SSE 流重放缓冲模块
+
+移动网络下 SSE 连接经常在回答中途断开。为避免客户端重发消息导致重复调用 LLM，
+每一轮对话（turn）的流式事件都会写入一个带 TTL 的重放缓冲区：
+
+- 每个事件携带单调递增的 id（SSE `id:` 字段）
+- 智能体任务与 HTTP 连接解耦，连接断开后任务继续运行直到完成
+- 客户端可携带 `Last-Event-ID` 重新连接，从断点继续接收事件
+
+智能体内部（工具、LangGraph 同步节点线程）通过 emit_turn_event 向当前轮次追加文本之外的事件，
+如结构化结果的增量（structured_partial）。
+"""
+import asyncio
+import json
+import time
+import uuid
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional, Tuple
+
+from ..config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+def format_sse(event_id: Optional[int], event: str, data: str) -> str:
+    """格式化单条 SSE 事件"""
+    if event_id is None:
+        return f"event: {event}\ndata: {data}\n\n"
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+
+
+def parse_last_event_id(value: Optional[str]) -> int:
+    """解析 Last-Event-ID，非法值视为从头开始"""
+    if not value:
+        return 0
+    try:
+        return max(int(value.strip()), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+@dataclass
+class TurnStreamBuffer:
+    """单轮对话的事件缓冲"""
+    turn_id: str
+    session_id: str
+    user_id: int
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    events: List[Tuple[int, str, str]] = field(default_factory=list)
+    task: Optional[asyncio.Task] = None
+    _condition: asyncio.Condition = field(default_factory=asyncio.Condition, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def last_event_id(self) -> int:
+        return self.events[-1][0] if self.events else 0
+
+    async def append(self, event: str, payload: Any) -> int:
+        """追加事件，返回事件 id"""
+        data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+        async with self._condition:
+            event_id = self.last_event_id + 1
+            self.events.append((event_id, event, data))
+            self._condition.notify_all()
+        return event_id
+
+    async def finish(self):
+        """标记本轮结束，唤醒所有等待中的读者"""
+        async with self._condition:
+            if self.finished_at is None:
+                self.finished_at = time.time()
+            self._condition.notify_all()
+
+    async def iter_events(self, last_event_id: int = 0) -> AsyncGenerator[Tuple[int, str, str], None]:
+        """
+        从 last_event_id 之后开始迭代事件
+
+        已缓冲的事件立即返回，之后等待新事件直到本轮结束。
+        事件 id 从 1 开始连续递增，因此可以直接按下标定位。
+        """
+        cursor = max(last_event_id, 0)
+        while True:
+            async with self._condition:
+                while cursor >= len(self.events) and not self.done:
+                    await self._condition.wait()
+                pending = self.events[cursor:]
+                finished = self.done
+            for item in pending:
+                yield item
+            cursor += len(pending)
+            if finished and cursor >= len(self.events):
+                return
+
+    async def stream(self, last_event_id: int = 0) -> AsyncGenerator[str, None]:
+        """以 SSE 文本形式输出事件"""
+        async for event_id, event, data in self.iter_events(last_event_id):
+            yield format_sse(event_id, event, data)
+
+
+class _TurnEventSink:
+    """当前轮次的事件入口，可在任意线程中写入"""
+
+    def __init__(self, buffer: TurnStreamBuffer, loop: asyncio.AbstractEventLoop):
+        self.buffer = buffer
+        self.loop = loop
+        self._pending: List[Any] = []
+
+    def emit(self, event: str, payload: Any):
+        coro = self.buffer.append(event, payload)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._pending.append(self.loop.create_task(coro))
+        else:
+            self._pending.append(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    async def drain(self):
+        """等待已提交的事件全部写入缓冲"""
+        pending, self._pending = self._pending, []
+        futures = [p if isinstance(p, asyncio.Future) else asyncio.wrap_future(p) for p in pending]
+        if futures:
+            await asyncio.gather(*futures, return_exceptions=True)
+
+
+_turn_events: ContextVar[Optional[_TurnEventSink]] = ContextVar("turn_events", default=None)
+
+
+@asynccontextmanager
+async def turn_events(buffer: TurnStreamBuffer) -> AsyncIterator[None]:
+    """
+    `async with turn_events(buffer):` 期间（含其中启动的线程与子任务）emit_turn_event 写入该轮次；
+    退出时等待已提交的事件写完，保证它们排在之后的 complete / error 事件之前
+    """
+    sink = _TurnEventSink(buffer, asyncio.get_running_loop())
+    token = _turn_events.set(sink)
+    try:
+        yield
+    finally:
+        _turn_events.reset(token)
+        await sink.drain()
+
+
+def emit_turn_event(event: str, payload: Any) -> bool:
+    """向当前轮次追加事件，不在轮次内时忽略并返回 False"""
+    sink = _turn_events.get()
+    if sink is None:
+        return False
+    sink.emit(event, payload)
+    return True
+
+
+class TurnStreamRegistry:
+    """
+    对话轮次缓冲注册表
+
+    已完成的轮次在 ttl_seconds 后过期；运行中的轮次不会被清理，
+    但超过 max_age_seconds 仍未结束的会被强制移除，防止泄漏。
+    生产多实例部署时需要配合会话粘滞（sticky session）使用。
+    """
+
+    def __init__(self, ttl_seconds: int = 300, max_age_seconds: int = 3600):
+        self._buffers: Dict[str, TurnStreamBuffer] = {}
+        self.ttl_seconds = ttl_seconds
+        self.max_age_seconds = max_age_seconds
+
+    def create(self, session_id: str, user_id: int, turn_id: Optional[str] = None) -> TurnStreamBuffer:
+        """创建新的轮次缓冲"""
+        self.cleanup_expired()
+        buffer = TurnStreamBuffer(
+            turn_id=turn_id or str(uuid.uuid4()),
+            session_id=session_id,
+            user_id=user_id,
+        )
+        self._buffers[buffer.turn_id] = buffer
+        return buffer
+
+    def get(self, turn_id: str) -> Optional[TurnStreamBuffer]:
+        """获取轮次缓冲，过期返回 None"""
+        buffer = self._buffers.get(turn_id)
+        if buffer and self._is_expired(buffer, time.time()):
+            self._buffers.pop(turn_id, None)
+            return None
+        return buffer
+
+    def _is_expired(self, buffer: TurnStreamBuffer, now: float) -> bool:
+        if buffer.finished_at is not None:
+            return now - buffer.finished_at > self.ttl_seconds
+        return now - buffer.created_at > self.max_age_seconds
+
+    def cleanup_expired(self) -> int:
+        """清理过期缓冲，返回清理数量"""
+        now = time.time()
+        expired = [tid for tid, buf in self._buffers.items() if self._is_expired(buf, now)]
+        for turn_id in expired:
+            self._buffers.pop(turn_id, None)
+        if expired:
+            logger.debug("清理过期 SSE 缓冲 %d 个", len(expired))
+        return len(expired)
+
+    def __len__(self) -> int:
+        return len(self._buffers)
+
+
+# 全局实例
+_registry: Optional[TurnStreamRegistry] = None
+
+
+def get_stream_registry() -> TurnStreamRegistry:
+    """获取轮次缓冲注册表单例"""
+    global _registry
+    if _registry is None:
+        _registry = TurnStreamRegistry(
+            ttl_seconds=settings.STREAM_REPLAY_TTL_SECONDS,
+            max_age_seconds=settings.STREAM_REPLAY_MAX_AGE_SECONDS,
+        )
+    return _registry
@@ -0,0 +1,314 @@
+"""
+结构化日志
+
+替代问诊热路径上的 print 调试输出：
+
+- 结构化：log.debug("tool_call", tool=name, args=...) 记录事件名与字段，按 LOG_FORMAT 输出 text 或 json
+- 惰性求值：字段值可以是无参函数（如 lambda: list(state.keys())），只有确实要输出时才调用；
+  级别未开启且没有调试捕获时直接返回，不做任何格式化
+- 分模块级别：LOG_LEVEL 为默认级别，LOG_MODULE_LEVELS 按 logger 名覆盖
+- 限流采样：WARNING 以下的同一事件每秒最多输出 LOG_SAMPLE_RATE_PER_SECOND 条，
+  超出的丢弃并在下一条输出中以 sampled_out 字段报告丢弃数
+- 调试捕获：管理后台对指定会话开启后，该会话（log_context 或 session_id 字段）的所有级别日志（含 DEBUG）写入环形缓冲，
+  不受级别与采样限制；是否同时输出到标准输出仍按级别与采样决定（捕获仅在当前进程内有效）
+"""
+import json
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from ..config import get_settings
+
+settings = get_settings()
+
+# 当前日志上下文中的会话 ID（asyncio 任务与 LangGraph 节点线程会继承）
+_session_id: ContextVar[Optional[str]] = ContextVar("log_session_id", default=None)
+
+
+@contextmanager
+def log_context(session_id: Optional[str]) -> Iterator[None]:
+    """`with log_context(session_id):` 标记代码块所属会话（用于调试捕获与日志字段）"""
+    token = _session_id.set(session_id)
+    try:
+        yield
+    finally:
+        _session_id.reset(token)
+
+
+# ============= 限流采样 =============
+
+class RateSampler:
+    """按 (logger, 事件) 的令牌桶限流，返回 (是否输出, 此前被丢弃的条数)"""
+
+    def __init__(self, rate_per_second: float = 5.0, burst: Optional[int] = None, max_keys: int = 1000):
+        self.rate = rate_per_second
+        self.burst = float(burst if burst is not None else max(1, int(rate_per_second * 2)))
+        self.max_keys = max_keys
+        self._buckets: Dict[Tuple[str, str], List[float]] = {}  # key → [tokens, 上次补充时间, 丢弃数]
+        self._lock = threading.Lock()
+
+    def allow(self, logger_name: str, event: str) -> Tuple[bool, int]:
+        if self.rate <= 0:
+            return True, 0
+        key = (logger_name, event)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._buckets.clear()
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False, 0
+            bucket[0] -= 1
+            dropped, bucket[2] = int(bucket[2]), 0
+            return True, dropped
+
+
+# ============= 调试捕获 =============
+
+class _Capture:
+    __slots__ = ("records", "expires_at", "started_at")
+
+    def __init__(self, capacity: int, ttl_seconds: float):
+        self.records: Deque[Dict[str, Any]] = deque(maxlen=capacity)
+        self.started_at = time.time()
+        self.expires_at = time.monotonic() + ttl_seconds
+
+
+class DebugCapture:
+    """按会话开启的环形日志缓冲"""
+
+    def __init__(self, capacity: int = 500, ttl_seconds: float = 1800, max_sessions: int = 50):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._captures: Dict[str, _Capture] = {}
+        self._lock = threading.Lock()
+
+    def enable(self, session_id: str, ttl_seconds: Optional[float] = None, capacity: Optional[int] = None) -> Dict[str, Any]:
+        """开启（或重新开启并清空）会话的调试捕获"""
+        with self._lock:
+            self._purge()
+            if session_id not in self._captures and len(self._captures) >= self.max_sessions:
+                raise ValueError(f"同时开启调试捕获的会话数已达上限 {self.max_sessions}")
+            capture = _Capture(capacity or self.capacity, ttl_seconds or self.ttl_seconds)
+            self._captures[session_id] = capture
+            return self._describe(session_id, capture)
+
+    def disable(self, session_id: str) -> bool:
+        with self._lock:
+            return self._captures.pop(session_id, None) is not None
+
+    def active(self, session_id: Optional[str]) -> Optional[_Capture]:
+        """会话是否处于捕获中（未开启任何捕获时只做一次判空）"""
+        if not self._captures or not session_id:
+            return None
+        capture = self._captures.get(session_id)
+        if capture is not None and capture.expires_at < time.monotonic():
+            self.disable(session_id)
+            return None
+        return capture
+
+    def records(self, session_id: str) -> Optional[List[Dict[str, Any]]]:
+        capture = self.active(session_id)
+        if capture is None:
+            return None
+        with self._lock:
+            return list(capture.records)
+
+    def sessions(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._purge()
+            return [self._describe(sid, c) for sid, c in self._captures.items()]
+
+    def _purge(self):
+        now = time.monotonic()
+        for sid in [sid for sid, c in self._captures.items() if c.expires_at < now]:
+            self._captures.pop(sid, None)
+
+    @staticmethod
+    def _describe(session_id: str, capture: _Capture) -> Dict[str, Any]:
+        return {
+            "session_id": session_id,
+            "records": len(capture.records),
+            "capacity": capture.records.maxlen,
+            "started_at": datetime.fromtimestamp(capture.started_at, timezone.utc).isoformat(),
+            "expires_in_seconds": max(0, round(capture.expires_at - time.monotonic())),
+        }
+
+
+# ============= Logger =============
+
+def _resolve(fields: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: (v() if callable(v) else v) for k, v in fields.items()}
+
+
+class StructuredLogger:
+    """
+    结构化日志接口
+
+        log = get_logger(__name__)
+        log.debug("agent_turn_finished", error=error, keys=lambda: list(state.keys())[:10])
+    """
+
+    def __init__(self, name: str, sampler: "RateSampler", capture: DebugCapture):
+        self.name = name
+        self._logger = logging.getLogger(name)
+        self._sampler = sampler
+        self._capture = capture
+
+    def debug(self, event: str, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event: str, **fields):
+        """ERROR 级别并附带当前异常堆栈"""
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+    def _log(self, level: int, event: str, fields: Dict[str, Any], exc_info: bool = False):
+        session_id = fields.get("session_id") or _session_id.get()
+        capture = self._capture.active(session_id)
+        enabled = self._logger.isEnabledFor(level)
+        if not enabled and capture is None:
+            return
+
+        dropped = 0
+        if enabled and level < logging.WARNING:
+            enabled, dropped = self._sampler.allow(self.name, event)
+            if not enabled and capture is None:
+                return
+
+        values = _resolve(fields)
+        if session_id:
+            values["session_id"] = session_id
+
+        if capture is not None:
+            record = {
+                "ts": datetime.now(timezone.utc).isoformat(),
+                "level": logging.getLevelName(level),
+                "logger": self.name,
+                "event": event,
+                **{k: _jsonable(v) for k, v in values.items()},
+            }
+            if exc_info:
+                error = sys.exc_info()[1]
+                if error is not None:
+                    record["error"] = f"{type(error).__name__}: {error}"
+            capture.records.append(record)
+
+        if enabled:
+            if dropped:
+                values["sampled_out"] = dropped
+            self._logger.log(level, event, exc_info=exc_info, extra={"fields": values}, stacklevel=3)
+
+
+def _jsonable(value: Any) -> Any:
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    return str(value)
+
+
+# ============= 输出格式 =============
+
+class StructuredFormatter(logging.Formatter):
+    """
+    text：2026-01-01T00:00:00 INFO app.routes.sessions agent_turn_finished session_id=... error=None
+    json：每行一个 JSON 对象
+
+    普通 logging 调用（没有 fields）按原消息输出
+    """
+
+    def __init__(self, fmt: str = "text"):
+        super().__init__()
+        self.fmt = fmt
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None) or {}
+        ts = datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds")
+        message = record.getMessage()
+        if self.fmt == "json":
+            data = {"ts": ts, "level": record.levelname, "logger": record.name, "event": message}
+            data.update({k: _jsonable(v) for k, v in fields.items()})
+            if record.exc_info:
+                data["exc_info"] = self.formatException(record.exc_info)
+            return json.dumps(data, ensure_ascii=False)
+
+        parts = [ts, record.levelname, record.name, message]
+        parts.extend(f"{k}={_text_value(v)}" for k, v in fields.items())
+        line = " ".join(parts)
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def _text_value(value: Any) -> str:
+    if isinstance(value, str):
+        return json.dumps(value, ensure_ascii=False) if (" " in value or not value) else value
+    return json.dumps(_jsonable(value), ensure_ascii=False)
+
+
+_HANDLER_NAME = "structured"
+
+
+def configure_logging():
+    """安装根 handler 并设置默认级别与分模块级别（可重复调用）"""
+    root = logging.getLogger()
+    handler = next((h for h in root.handlers if h.get_name() == _HANDLER_NAME), None)
+    if handler is None:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.set_name(_HANDLER_NAME)
+        root.addHandler(handler)
+    handler.setFormatter(StructuredFormatter(settings.LOG_FORMAT))
+    root.setLevel(settings.LOG_LEVEL.upper())
+    for name, level in settings.LOG_MODULE_LEVELS.items():
+        logging.getLogger(name).setLevel(level.upper())
+
+
+# 单例
+_sampler: Optional[RateSampler] = None
+_debug_capture: Optional[DebugCapture] = None
+
+
+def get_debug_capture() -> DebugCapture:
+    """获取调试捕获单例"""
+    global _debug_capture
+    if _debug_capture is None:
+        _debug_capture = DebugCapture(
+            capacity=settings.LOG_DEBUG_CAPTURE_SIZE,
+            ttl_seconds=settings.LOG_DEBUG_CAPTURE_TTL_SECONDS
+        )
+    return _debug_capture
+
+
+def _get_sampler() -> RateSampler:
+    global _sampler
+    if _sampler is None:
+        _sampler = RateSampler(settings.LOG_SAMPLE_RATE_PER_SECOND)
+    return _sampler
+
+
+def get_logger(name: str) -> StructuredLogger:
+    """获取结构化 logger（通常传入 __name__）"""
+    return StructuredLogger(name, _get_sampler(), get_debug_capture())
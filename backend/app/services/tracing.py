@@ -0,0 +1,363 @@
+"""
+请求级链路追踪
+
+基于 OpenTelemetry SDK，使用独立的 TracerProvider（不修改全局 provider，避免与 CrewAI 自带的遥测互相影响）。
+span 依赖 contextvars 传递父子关系，asyncio 任务与 LangGraph 的同步节点线程都会继承当前上下文：
+
+    HTTP 请求（TracingMiddleware）
+    └── session.turn（一轮问诊）
+        └── agent.run（AgentRouter 返回的智能体）
+            ├── node <name>（LangGraph 节点）
+            │   ├── tool <name>（ReAct 工具）
+            │   └── llm.call / llm.attempt（BaseAIService / 服务商池的每次尝试）
+            └── db <operation>（SQLAlchemy 语句）
+
+结束的 span 按 trace 保存在内存（最近 TRACING_MAX_TRACES 条），可按 trace_id 或 turn_id
+从 GET /admin/stats/traces/... 查询瀑布图；TRACING_EXPORTER 可额外导出到本地 JSONL 文件或 OTLP collector。
+"""
+import functools
+import inspect
+import json
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from opentelemetry import trace
+from opentelemetry.context import Context
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.sampling import ALWAYS_OFF, ParentBased, TraceIdRatioBased
+from opentelemetry.trace import Span, SpanKind, Status, StatusCode
+
+from ..config import get_settings
+from .metrics import sql_operation
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# 记录到 span 属性的 SQL 最大长度
+MAX_STATEMENT_LENGTH = 300
+
+
+def format_trace_id(trace_id: int) -> str:
+    return format(trace_id, "032x")
+
+
+def format_span_id(span_id: int) -> str:
+    return format(span_id, "016x")
+
+
+class TraceStore(SpanProcessor):
+    """
+    按 trace 保存已结束的 span，供瀑布图查询
+
+    只保留最近 max_traces 条 trace，每条最多 max_spans 个 span；
+    span 开始时若带有 turn.id 属性则建立 turn_id → trace_id 索引。
+    """
+
+    def __init__(self, max_traces: int = 200, max_spans: int = 500):
+        self.max_traces = max_traces
+        self.max_spans = max_spans
+        self._traces: "OrderedDict[str, List[ReadableSpan]]" = OrderedDict()
+        self._turns: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def on_start(self, span, parent_context=None):
+        turn_id = (span.attributes or {}).get("turn.id")
+        if turn_id:
+            with self._lock:
+                self._turns[str(turn_id)] = format_trace_id(span.context.trace_id)
+                self._turns.move_to_end(str(turn_id))
+                while len(self._turns) > self.max_traces:
+                    self._turns.popitem(last=False)
+
+    def on_end(self, span: ReadableSpan):
+        trace_id = format_trace_id(span.context.trace_id)
+        with self._lock:
+            spans = self._traces.get(trace_id)
+            if spans is None:
+                spans = self._traces[trace_id] = []
+                while len(self._traces) > self.max_traces:
+                    self._traces.popitem(last=False)
+            if len(spans) < self.max_spans:
+                spans.append(span)
+
+    def shutdown(self):
+        pass
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
+
+    def trace_for_turn(self, turn_id: str) -> Optional[str]:
+        with self._lock:
+            return self._turns.get(turn_id)
+
+    def spans(self, trace_id: str) -> List[ReadableSpan]:
+        with self._lock:
+            return list(self._traces.get(trace_id, []))
+
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """最近的 trace 摘要（新的在前）"""
+        with self._lock:
+            items = list(self._traces.items())[-limit:]
+        result = []
+        for trace_id, spans in reversed(items):
+            start = min(s.start_time for s in spans)
+            end = max(s.end_time for s in spans)
+            root = _root_span(spans)
+            result.append({
+                "trace_id": trace_id,
+                "name": root.name,
+                "turn_id": next((s.attributes.get("turn.id") for s in spans if s.attributes.get("turn.id")), None),
+                "duration_ms": round((end - start) / 1e6, 1),
+                "span_count": len(spans),
+                "error": any(s.status.status_code == StatusCode.ERROR for s in spans),
+            })
+        return result
+
+    def waterfall(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        """
+        瀑布图：span 按开始时间排序，start_ms 为相对整条 trace 开始的偏移，
+        depth 为在本 trace 已记录的 span 中的嵌套层级
+        """
+        spans = self.spans(trace_id)
+        if not spans:
+            return None
+        spans.sort(key=lambda s: s.start_time)
+        trace_start = spans[0].start_time
+        trace_end = max(s.end_time for s in spans)
+        by_id = {s.context.span_id: s for s in spans}
+
+        def depth(span: ReadableSpan) -> int:
+            level = 0
+            parent = span.parent
+            while parent is not None and parent.span_id in by_id and level < 64:
+                level += 1
+                parent = by_id[parent.span_id].parent
+            return level
+
+        return {
+            "trace_id": trace_id,
+            "duration_ms": round((trace_end - trace_start) / 1e6, 1),
+            "spans": [
+                {
+                    "span_id": format_span_id(s.context.span_id),
+                    "parent_id": format_span_id(s.parent.span_id) if s.parent else None,
+                    "name": s.name,
+                    "depth": depth(s),
+                    "start_ms": round((s.start_time - trace_start) / 1e6, 1),
+                    "duration_ms": round((s.end_time - s.start_time) / 1e6, 1),
+                    "status": s.status.status_code.name,
+                    "attributes": dict(s.attributes or {}),
+                }
+                for s in spans
+            ]
+        }
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+            self._turns.clear()
+
+
+def _root_span(spans: Sequence[ReadableSpan]) -> ReadableSpan:
+    ids = {s.context.span_id for s in spans}
+    roots = [s for s in spans if s.parent is None or s.parent.span_id not in ids]
+    return min(roots or spans, key=lambda s: s.start_time)
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """把 span 以 JSON Lines 追加写入本地文件（每行格式同 ReadableSpan.to_json()）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        try:
+            lines = [json.dumps(json.loads(s.to_json()), ensure_ascii=False) for s in spans]
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            return SpanExportResult.SUCCESS
+        except OSError as e:
+            logger.warning("写入链路追踪文件失败: %s", e)
+            return SpanExportResult.FAILURE
+
+    def shutdown(self):
+        pass
+
+
+def _create_exporter() -> Optional[SpanExporter]:
+    exporter = settings.TRACING_EXPORTER
+    if exporter == "file":
+        return JsonLinesSpanExporter(settings.TRACING_FILE_PATH)
+    if exporter == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            logger.warning("未安装 opentelemetry-exporter-otlp-proto-http，跳过 OTLP 导出")
+            return None
+        return OTLPSpanExporter(endpoint=settings.TRACING_OTLP_ENDPOINT)
+    return None
+
+
+# 单例
+_provider: Optional[TracerProvider] = None
+_trace_store: Optional[TraceStore] = None
+_init_lock = threading.Lock()
+
+
+def _init():
+    global _provider, _trace_store
+    with _init_lock:
+        if _provider is not None:
+            return
+        sampler = ParentBased(TraceIdRatioBased(settings.TRACING_SAMPLE_RATIO)) if settings.TRACING_ENABLED else ALWAYS_OFF
+        provider = TracerProvider(
+            resource=Resource.create({"service.name": settings.TRACING_SERVICE_NAME}),
+            sampler=sampler
+        )
+        store = TraceStore(max_traces=settings.TRACING_MAX_TRACES)
+        provider.add_span_processor(store)
+        exporter = _create_exporter()
+        if exporter is not None:
+            provider.add_span_processor(BatchSpanProcessor(exporter))
+        _trace_store = store
+        _provider = provider
+
+
+def get_tracer() -> trace.Tracer:
+    """获取本应用的 Tracer"""
+    if _provider is None:
+        _init()
+    return _provider.get_tracer("home-health")
+
+
+def get_trace_store() -> TraceStore:
+    """获取 trace 存储单例"""
+    if _trace_store is None:
+        _init()
+    return _trace_store
+
+
+def shutdown_tracing():
+    """应用关闭时导出剩余 span"""
+    if _provider is not None:
+        _provider.shutdown()
+
+
+# ============= 埋点工具 =============
+
+@contextmanager
+def start_span(
+    name: str,
+    attributes: Optional[Dict[str, Any]] = None,
+    kind: SpanKind = SpanKind.INTERNAL,
+    context: Optional[Context] = None
+) -> Iterator[Span]:
+    """
+    `with start_span("tool xxx", {...}) as span:` 创建当前上下文（或给定 context）的子 span
+
+    同步、异步代码均可使用；异常会记录到 span 并标记为 ERROR 后继续抛出
+    """
+    with get_tracer().start_as_current_span(name, context=context, kind=kind, attributes=_clean(attributes)) as span:
+        yield span
+
+
+def set_error(span: Span, error: BaseException):
+    """记录已被调用方捕获的异常"""
+    if span.is_recording():
+        span.record_exception(error)
+        span.set_status(Status(StatusCode.ERROR, f"{type(error).__name__}: {error}"))
+
+
+def current_trace_id() -> Optional[str]:
+    context = trace.get_current_span().get_span_context()
+    return format_trace_id(context.trace_id) if context.is_valid else None
+
+
+def _clean(attributes: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """去掉 None 值，非基础类型转为字符串（OTel 属性只接受 str/bool/int/float）"""
+    if not attributes:
+        return None
+    return {
+        k: v if isinstance(v, (str, bool, int, float)) else str(v)
+        for k, v in attributes.items() if v is not None
+    }
+
+
+def trace_node(graph: str, node: str, fn: Callable) -> Callable:
+    """包装 LangGraph 节点函数，节点执行期间的 LLM、工具、数据库调用都挂在节点 span 下"""
+    attributes = {"langgraph.graph": graph, "langgraph.node": node}
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            with start_span(f"node {node}", attributes):
+                return await fn(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with start_span(f"node {node}", attributes):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def trace_agent(agent, agent_type: str):
+    """包装智能体实例的 run()，生成 agent.run span"""
+    run = agent.run
+
+    @functools.wraps(run)
+    async def traced_run(*args, **kwargs):
+        attributes = {"agent.type": agent_type, "agent.action": kwargs.get("action")}
+        with start_span("agent.run", attributes):
+            return await run(*args, **kwargs)
+
+    agent.run = traced_run
+    return agent
+
+
+def instrument_engine_tracing(engine):
+    """
+    为 SQLAlchemy Engine 的每条语句生成 db span
+
+    只在已有追踪上下文时记录，启动、后台线程等无父 span 的查询不单独产生 trace
+    """
+    from sqlalchemy import event
+
+    if getattr(engine, "_tracing_instrumented", False):
+        return
+    engine._tracing_instrumented = True
+    system = engine.dialect.name
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if not trace.get_current_span().is_recording():
+            return
+        span = get_tracer().start_span(
+            f"db {sql_operation(statement)}",
+            kind=SpanKind.CLIENT,
+            attributes={"db.system": system, "db.statement": statement[:MAX_STATEMENT_LENGTH]}
+        )
+        conn.info.setdefault("_trace_spans", []).append(span)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("_trace_spans")
+        if spans:
+            span = spans.pop()
+            if cursor.rowcount is not None and cursor.rowcount >= 0:
+                span.set_attribute("db.rows", cursor.rowcount)
+            span.end()
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        spans = context.connection.info.get("_trace_spans") if context.connection is not None else None
+        if spans:
+            span = spans.pop()
+            set_error(span, context.original_exception)
+            span.end()
@@ -0,0 +1,143 @@
+"""
+已认证用户缓存
+
+每个需要登录的请求都要解码 JWT 并查询 users 表，SSE 与轮询接口上这部分开销占比很高。
+这里做两级短 TTL 的进程内缓存：
+
+- token → 用户ID：命中时跳过 jwt.decode，过期时间不超过 token 本身的 exp
+- 用户ID → CurrentUser 快照：命中时跳过 users 查询；资料、密码变更后显式失效
+
+路由拿到的是与数据库会话无关的 CurrentUser 快照，需要修改用户时按 id 重新查询 ORM 对象。
+多进程部署时失效只作用于本进程，其它进程最多滞后 AUTH_USER_CACHE_TTL_SECONDS。
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Hashable, Optional, Tuple
+
+from ..config import get_settings
+from ..models.user import User
+
+settings = get_settings()
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """当前用户快照（字段与 User 一致，不含密码哈希）"""
+    id: int
+    phone: str
+    nickname: Optional[str] = None
+    avatar_url: Optional[str] = None
+    gender: Optional[str] = None
+    birthday: Optional[date] = None
+    emergency_contact_name: Optional[str] = None
+    emergency_contact_phone: Optional[str] = None
+    emergency_contact_relation: Optional[str] = None
+    is_profile_completed: bool = False
+    is_active: bool = True
+    has_password: bool = False
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+    @classmethod
+    def from_user(cls, user: User) -> "CurrentUser":
+        return cls(
+            id=user.id,
+            phone=user.phone,
+            nickname=user.nickname,
+            avatar_url=user.avatar_url,
+            gender=user.gender,
+            birthday=user.birthday,
+            emergency_contact_name=user.emergency_contact_name,
+            emergency_contact_phone=user.emergency_contact_phone,
+            emergency_contact_relation=user.emergency_contact_relation,
+            is_profile_completed=bool(user.is_profile_completed),
+            is_active=user.is_active is not False,
+            has_password=user.has_password,
+            created_at=user.created_at,
+            updated_at=user.updated_at
+        )
+
+
+class AuthUserCache:
+    """token 与用户快照缓存（LRU + TTL）"""
+
+    def __init__(self, ttl_seconds: int = 30, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._tokens: "OrderedDict[Hashable, Tuple[float, int]]" = OrderedDict()
+        self._users: "OrderedDict[int, Tuple[float, CurrentUser]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, entries: OrderedDict, key: Hashable):
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            entries.pop(key, None)
+            return None
+        entries.move_to_end(key)
+        return value
+
+    def _set(self, entries: OrderedDict, key: Hashable, expires_at: float, value):
+        entries[key] = (expires_at, value)
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def get_user_id(self, token: str, kind: str = "user") -> Optional[int]:
+        """
+        查询 token 对应的用户ID
+
+        Args:
+            kind: token 类别（普通用户 / 管理员 token 分开缓存，互不冒用）
+        """
+        with self._lock:
+            return self._get(self._tokens, (kind, token))
+
+    def set_token(self, token: str, user_id: int, token_exp: Optional[float] = None, kind: str = "user"):
+        """缓存已验证的 token（不晚于 token 自身的过期时间）"""
+        expires_at = time.time() + self.ttl_seconds
+        if token_exp is not None:
+            expires_at = min(expires_at, float(token_exp))
+        with self._lock:
+            self._set(self._tokens, (kind, token), expires_at, user_id)
+
+    def get_user(self, user_id: int) -> Optional[CurrentUser]:
+        with self._lock:
+            return self._get(self._users, user_id)
+
+    def set_user(self, user: User) -> CurrentUser:
+        """缓存用户快照并返回"""
+        snapshot = CurrentUser.from_user(user)
+        with self._lock:
+            self._set(self._users, user.id, time.time() + self.ttl_seconds, snapshot)
+        return snapshot
+
+    def invalidate_user(self, user_id: int):
+        """用户资料变更、停用后调用"""
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self._users.clear()
+
+
+# 单例
+_auth_user_cache: Optional[AuthUserCache] = None
+
+
+def get_auth_user_cache() -> AuthUserCache:
+    """获取已认证用户缓存单例"""
+    global _auth_user_cache
+    if _auth_user_cache is None:
+        _auth_user_cache = AuthUserCache(
+            ttl_seconds=settings.AUTH_USER_CACHE_TTL_SECONDS,
+            max_entries=settings.AUTH_USER_CACHE_MAX_ENTRIES
+        )
+    return _auth_user_cache
@@ -0,0 +1,532 @@
+"""
+验证码与发送频率限制存储
+
+VerificationCodeStore 定义存储接口，提供两种实现：
+- MemoryVerificationCodeStore：进程内存储，过期数据由时间轮在每次操作时增量清理，
+  内存占用只与有效期内的手机号 / IP 数量有关（单进程部署）
+- DatabaseVerificationCodeStore：存放在共享数据库（SQLite 文件或 PostgreSQL）中，
+  多个 worker 共用同一份验证码与频率计数；计数、校验均为带条件的单条 UPDATE
+
+通过 SMS_CODE_STORE_BACKEND 选择实现（见 create_verification_code_store）。
+"""
+import math
+import random
+import threading
+import time
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+from sqlalchemy import (
+    Column, Float, Integer, MetaData, String, Table, create_engine, delete, event, insert, select, update
+)
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+
+from ..config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class VerificationCode:
+    """验证码数据结构"""
+    code: str
+    phone: str
+    created_at: float
+    expires_at: float
+    attempts: int = 0
+    verified: bool = False
+
+
+@dataclass
+class RateLimitInfo:
+    """频率限制信息"""
+    count: int = 0
+    first_request_time: float = 0
+    locked_until: float = 0
+
+
+class VerificationCodeStore(ABC):
+    """
+    验证码存储接口
+
+    手机号、IP 两类频率限制共用同一套逻辑，子类只需实现按 (类别, 键) 读写的基本操作
+    """
+
+    def __init__(self):
+        # 配置
+        self.code_expire_seconds = 300  # 验证码有效期 5 分钟
+        self.code_cooldown_seconds = 60  # 发送冷却时间 60 秒
+        self.max_attempts = 5  # 最大验证尝试次数
+        self.phone_rate_limit_window = 3600  # 1小时
+        self.phone_rate_limit_max = 10  # 同一手机号每小时最多10次
+        self.ip_rate_limit_window = 3600  # 1小时
+        self.ip_rate_limit_max = 30  # 同一IP每小时最多30次
+        self.lock_duration = 1800  # 锁定时长 30 分钟
+        self.expired_code_retention = 600  # 过期验证码再保留 10 分钟，以便提示“已过期”
+
+    def generate_code(self, length: int = 6) -> str:
+        """生成随机验证码"""
+        return ''.join([str(random.randint(0, 9)) for _ in range(length)])
+
+    def _window(self, kind: str) -> int:
+        return self.phone_rate_limit_window if kind == "phone" else self.ip_rate_limit_window
+
+    def _limit(self, kind: str) -> int:
+        return self.phone_rate_limit_max if kind == "phone" else self.ip_rate_limit_max
+
+    def check_phone_rate_limit(self, phone: str) -> Tuple[bool, str]:
+        """
+        检查手机号频率限制
+        返回: (是否允许, 错误消息)
+        """
+        locked, remaining = self._check_rate_limit("phone", phone, time.time())
+        if locked:
+            if remaining is None:
+                return False, "发送次数过多，请稍后重试"
+            return False, f"该手机号已被锁定，请{remaining // 60}分钟后重试"
+        return True, ""
+
+    def check_ip_rate_limit(self, ip: str) -> Tuple[bool, str]:
+        """
+        检查IP频率限制
+        返回: (是否允许, 错误消息)
+        """
+        locked, remaining = self._check_rate_limit("ip", ip, time.time())
+        if locked:
+            if remaining is None:
+                return False, "请求过于频繁，请稍后重试"
+            return False, f"请求过于频繁，请{remaining // 60}分钟后重试"
+        return True, ""
+
+    def increment_rate_limit(self, phone: str, ip: str):
+        """增加频率计数"""
+        now = time.time()
+        self._increment_rate_limit("phone", phone, now)
+        self._increment_rate_limit("ip", ip, now)
+
+    def verify_code(self, phone: str, code: str) -> Tuple[bool, str]:
+        """
+        验证码校验
+        返回: (是否验证成功, 错误消息)
+        """
+        # 测试模式下允许 000000
+        if settings.TEST_MODE and code == "000000":
+            logger.info(f"[SMS] 测试模式验证通过: phone={phone}")
+            return True, ""
+        return self._verify_code(phone, code, time.time())
+
+    @abstractmethod
+    def check_cooldown(self, phone: str) -> Tuple[bool, int]:
+        """
+        检查是否在冷却期
+        返回: (是否可发送, 剩余冷却秒数)
+        """
+
+    @abstractmethod
+    def store_code(self, phone: str, code: str) -> VerificationCode:
+        """存储验证码（覆盖该手机号之前的验证码）"""
+
+    @abstractmethod
+    def cleanup_expired(self):
+        """清理过期数据"""
+
+    @abstractmethod
+    def _check_rate_limit(self, kind: str, key: str, now: float) -> Tuple[bool, Optional[int]]:
+        """
+        检查频率限制
+
+        Returns:
+            (是否受限, 剩余锁定秒数)；本次检查才触发锁定时剩余秒数为 None
+        """
+
+    @abstractmethod
+    def _increment_rate_limit(self, kind: str, key: str, now: float):
+        """计数加一（时间窗口已过期时重新开始计数）"""
+
+    @abstractmethod
+    def _verify_code(self, phone: str, code: str, now: float) -> Tuple[bool, str]:
+        """校验验证码，成功后删除"""
+
+
+# ============= 进程内存储 =============
+
+class TimingWheel:
+    """
+    哈希时间轮
+
+    键按到期时间放入环形槽位（每槽 tick_seconds 秒），advance() 只取出指针扫过的槽位，
+    不需要遍历全部数据。槽位只是候选：调用方需再核对真实到期时间，未到期（超过一圈
+    或已延期）的键重新放回。
+    """
+
+    def __init__(self, tick_seconds: float = 1.0, slots: int = 512):
+        self.tick_seconds = tick_seconds
+        self.slots = slots
+        self._buckets: List[Set[Hashable]] = [set() for _ in range(slots)]
+        self._current: Optional[int] = None
+
+    def _tick(self, timestamp: float) -> int:
+        return int(timestamp // self.tick_seconds)
+
+    def schedule(self, key: Hashable, deadline: float):
+        """登记键的到期时间（同一槽位内去重）"""
+        tick = math.ceil(deadline / self.tick_seconds)
+        if self._current is not None:
+            tick = max(tick, self._current + 1)
+        self._buckets[tick % self.slots].add(key)
+
+    def advance(self, now: float) -> List[Hashable]:
+        """推进到 now，返回扫过的槽位中的候选键"""
+        now_tick = self._tick(now)
+        if self._current is None:
+            self._current = now_tick
+            return []
+        if now_tick <= self._current:
+            return []
+        steps = min(now_tick - self._current, self.slots)
+        due: List[Hashable] = []
+        for i in range(1, steps + 1):
+            bucket = self._buckets[(self._current + i) % self.slots]
+            if bucket:
+                due.extend(bucket)
+                bucket.clear()
+        self._current = now_tick
+        return due
+
+
+class MemoryVerificationCodeStore(VerificationCodeStore):
+    """
+    进程内验证码存储
+
+    每次操作先推进时间轮清理到期数据（时间轮从第一次操作开始计时），
+    单次清理的开销与到期条目数成正比
+    """
+
+    def __init__(self, tick_seconds: float = 1.0, slots: int = 512):
+        super().__init__()
+        self._codes: Dict[str, VerificationCode] = {}
+        self._rate_limits: Dict[Tuple[str, str], RateLimitInfo] = {}
+        self._wheel = TimingWheel(tick_seconds, slots)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """当前保存的条目数（验证码 + 频率限制）"""
+        return len(self._codes) + len(self._rate_limits)
+
+    def _rate_deadline(self, kind: str, info: RateLimitInfo) -> float:
+        return max(info.first_request_time + self._window(kind), info.locked_until)
+
+    def _sweep(self, now: float):
+        """清理到期条目（需持有锁）"""
+        for key in self._wheel.advance(now):
+            kind, ident = key
+            if kind == "code":
+                info = self._codes.get(ident)
+                if info is None:
+                    continue
+                deadline = info.expires_at + self.expired_code_retention
+                if deadline <= now:
+                    del self._codes[ident]
+                    continue
+            else:
+                info = self._rate_limits.get(key)
+                if info is None:
+                    continue
+                deadline = self._rate_deadline(kind, info)
+                if deadline <= now:
+                    del self._rate_limits[key]
+                    continue
+            self._wheel.schedule(key, deadline)
+
+    def check_cooldown(self, phone: str) -> Tuple[bool, int]:
+        with self._lock:
+            now = time.time()
+            self._sweep(now)
+            code_info = self._codes.get(phone)
+            if code_info is not None:
+                elapsed = now - code_info.created_at
+                if elapsed < self.code_cooldown_seconds:
+                    return False, int(self.code_cooldown_seconds - elapsed)
+            return True, 0
+
+    def _check_rate_limit(self, kind: str, key: str, now: float) -> Tuple[bool, Optional[int]]:
+        with self._lock:
+            self._sweep(now)
+            info = self._rate_limits.get((kind, key))
+            if info is None:
+                return False, None
+            if info.locked_until > now:
+                return True, int(info.locked_until - now)
+            if now - info.first_request_time > self._window(kind):
+                info.count = 0
+                info.first_request_time = now
+            if info.count >= self._limit(kind):
+                info.locked_until = now + self.lock_duration
+                self._wheel.schedule((kind, key), info.locked_until)
+                return True, None
+            return False, None
+
+    def _increment_rate_limit(self, kind: str, key: str, now: float):
+        with self._lock:
+            self._sweep(now)
+            info = self._rate_limits.get((kind, key))
+            if info is None:
+                info = RateLimitInfo()
+                self._rate_limits[(kind, key)] = info
+            if info.count == 0 or now - info.first_request_time > self._window(kind):
+                info.count = 0
+                info.first_request_time = now
+            info.count += 1
+            self._wheel.schedule((kind, key), self._rate_deadline(kind, info))
+
+    def store_code(self, phone: str, code: str) -> VerificationCode:
+        with self._lock:
+            now = time.time()
+            self._sweep(now)
+            code_info = VerificationCode(
+                code=code,
+                phone=phone,
+                created_at=now,
+                expires_at=now + self.code_expire_seconds
+            )
+            self._codes[phone] = code_info
+            self._wheel.schedule(("code", phone), code_info.expires_at + self.expired_code_retention)
+            return code_info
+
+    def _verify_code(self, phone: str, code: str, now: float) -> Tuple[bool, str]:
+        with self._lock:
+            self._sweep(now)
+            code_info = self._codes.get(phone)
+            if code_info is None:
+                return False, "请先获取验证码"
+
+            # 检查是否已过期
+            if now > code_info.expires_at:
+                del self._codes[phone]
+                return False, "验证码已过期，请重新获取"
+
+            # 检查验证次数
+            if code_info.attempts >= self.max_attempts:
+                del self._codes[phone]
+                return False, "验证次数过多，请重新获取验证码"
+
+            # 验证码比对
+            code_info.attempts += 1
+            if code_info.code != code:
+                remaining = self.max_attempts - code_info.attempts
+                return False, f"验证码错误，还剩{remaining}次机会"
+
+            # 验证成功，删除验证码
+            del self._codes[phone]
+            return True, ""
+
+    def cleanup_expired(self):
+        with self._lock:
+            self._sweep(time.time())
+
+
+# ============= 共享数据库存储 =============
+
+_metadata = MetaData()
+
+verification_codes = Table(
+    "sms_verification_codes", _metadata,
+    Column("phone", String(20), primary_key=True),
+    Column("code", String(10), nullable=False),
+    Column("created_at", Float, nullable=False),
+    Column("expires_at", Float, nullable=False, index=True),
+    Column("attempts", Integer, nullable=False, default=0),
+)
+
+rate_limits = Table(
+    "sms_rate_limits", _metadata,
+    Column("kind", String(10), primary_key=True),  # phone / ip
+    Column("key", String(64), primary_key=True),
+    Column("count", Integer, nullable=False, default=0),
+    Column("first_request_time", Float, nullable=False),
+    Column("locked_until", Float, nullable=False, default=0),
+    Column("expires_at", Float, nullable=False, index=True),  # 窗口结束与锁定结束中较晚者
+)
+
+
+def _create_store_engine(url: str) -> Engine:
+    """创建验证码存储使用的数据库连接（SQLite 开启 WAL，允许多进程并发读写）"""
+    if not url.startswith("sqlite"):
+        return create_engine(url, pool_pre_ping=True)
+
+    engine = create_engine(url, connect_args={"check_same_thread": False, "timeout": 30})
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    return engine
+
+
+class DatabaseVerificationCodeStore(VerificationCodeStore):
+    """
+    共享数据库验证码存储（多 worker 部署）
+
+    每个操作一个短事务；计数、尝试次数用带条件的 UPDATE 原子修改，
+    验证成功以 DELETE 是否命中为准，同一验证码只能被使用一次
+    """
+
+    def __init__(self, engine: Engine, cleanup_interval: float = 60.0):
+        super().__init__()
+        self.engine = engine
+        self.cleanup_interval = cleanup_interval
+        self._last_cleanup = 0.0
+        _metadata.create_all(engine)
+
+    def check_cooldown(self, phone: str) -> Tuple[bool, int]:
+        now = time.time()
+        with self.engine.connect() as conn:
+            created_at = conn.execute(
+                select(verification_codes.c.created_at).where(
+                    verification_codes.c.phone == phone,
+                    verification_codes.c.expires_at >= now
+                )
+            ).scalar()
+        if created_at is not None:
+            elapsed = now - created_at
+            if elapsed < self.code_cooldown_seconds:
+                return False, int(self.code_cooldown_seconds - elapsed)
+        return True, 0
+
+    def _check_rate_limit(self, kind: str, key: str, now: float) -> Tuple[bool, Optional[int]]:
+        t = rate_limits
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                select(t.c.count, t.c.first_request_time, t.c.locked_until).where(
+                    t.c.kind == kind, t.c.key == key
+                )
+            ).first()
+            if row is None:
+                return False, None
+            if row.locked_until > now:
+                return True, int(row.locked_until - now)
+            if now - row.first_request_time > self._window(kind):
+                return False, None
+            if row.count >= self._limit(kind):
+                locked_until = now + self.lock_duration
+                conn.execute(update(t).where(t.c.kind == kind, t.c.key == key).values(
+                    locked_until=locked_until,
+                    expires_at=locked_until
+                ))
+                return True, None
+        return False, None
+
+    def _increment_rate_limit(self, kind: str, key: str, now: float):
+        t = rate_limits
+        window = self._window(kind)
+        window_expired = t.c.first_request_time < now - window
+        stmt = update(t).where(t.c.kind == kind, t.c.key == key).values(
+            count=t.c.count + 1,
+            expires_at=t.c.first_request_time + window
+        )
+        with self.engine.begin() as conn:
+            # 窗口已过期：重新开始计数
+            restarted = conn.execute(
+                update(t).where(t.c.kind == kind, t.c.key == key, window_expired).values(
+                    count=1,
+                    first_request_time=now,
+                    expires_at=now + window
+                )
+            ).rowcount
+            if restarted:
+                return
+            if conn.execute(stmt).rowcount:
+                return
+            try:
+                with conn.begin_nested():
+                    conn.execute(insert(t).values(
+                        kind=kind, key=key, count=1, first_request_time=now,
+                        locked_until=0, expires_at=now + window
+                    ))
+            except IntegrityError:
+                # 其它 worker 同时插入，改为递增
+                conn.execute(stmt)
+
+    def store_code(self, phone: str, code: str) -> VerificationCode:
+        now = time.time()
+        code_info = VerificationCode(
+            code=code,
+            phone=phone,
+            created_at=now,
+            expires_at=now + self.code_expire_seconds
+        )
+        values = dict(code=code, created_at=now, expires_at=code_info.expires_at, attempts=0)
+        with self.engine.begin() as conn:
+            updated = conn.execute(
+                update(verification_codes).where(verification_codes.c.phone == phone).values(**values)
+            ).rowcount
+            if not updated:
+                try:
+                    with conn.begin_nested():
+                        conn.execute(insert(verification_codes).values(phone=phone, **values))
+                except IntegrityError:
+                    conn.execute(
+                        update(verification_codes).where(verification_codes.c.phone == phone).values(**values)
+                    )
+        # 各 worker 定期顺带清理过期数据
+        if now - self._last_cleanup > self.cleanup_interval:
+            self._last_cleanup = now
+            self.cleanup_expired()
+        return code_info
+
+    def _verify_code(self, phone: str, code: str, now: float) -> Tuple[bool, str]:
+        t = verification_codes
+        with self.engine.begin() as conn:
+            # 原子地占用一次尝试机会
+            counted = conn.execute(
+                update(t).where(
+                    t.c.phone == phone,
+                    t.c.expires_at >= now,
+                    t.c.attempts < self.max_attempts
+                ).values(attempts=t.c.attempts + 1)
+            ).rowcount
+
+            if not counted:
+                row = conn.execute(select(t.c.expires_at).where(t.c.phone == phone)).first()
+                if row is None:
+                    return False, "请先获取验证码"
+                conn.execute(delete(t).where(t.c.phone == phone))
+                if now > row.expires_at:
+                    return False, "验证码已过期，请重新获取"
+                return False, "验证次数过多，请重新获取验证码"
+
+            # 验证成功即删除；并发请求中只有一个能删除成功
+            if conn.execute(delete(t).where(t.c.phone == phone, t.c.code == code)).rowcount:
+                return True, ""
+
+            attempts = conn.execute(select(t.c.attempts).where(t.c.phone == phone)).scalar()
+            if attempts is None:
+                return False, "请先获取验证码"
+            return False, f"验证码错误，还剩{self.max_attempts - attempts}次机会"
+
+    def cleanup_expired(self):
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(delete(verification_codes).where(
+                verification_codes.c.expires_at < now - self.expired_code_retention
+            ))
+            conn.execute(delete(rate_limits).where(rate_limits.c.expires_at < now))
+
+
+def create_verification_code_store() -> VerificationCodeStore:
+    """按配置创建验证码存储"""
+    backend = settings.SMS_CODE_STORE_BACKEND
+    if backend == "database":
+        url = settings.SMS_CODE_STORE_URL or settings.DATABASE_URL
+        logger.info("[SMS] 验证码存储使用共享数据库")
+        return DatabaseVerificationCodeStore(_create_store_engine(url))
+    if backend != "memory":
+        logger.warning(f"[SMS] 未知的验证码存储类型 {backend}，使用进程内存储")
+    return MemoryVerificationCodeStore()
@@ -0,0 +1,12 @@
+"""
+容量压测工具
+
+- mock_llm_server：本地 OpenAI / DashScope 兼容模式的模拟 LLM 服务（可配置首 token 延迟、输出速率、错误注入）
+- load_test：按智能体类型模拟 N 个并发用户，通过 SSE 调用 /sessions/{id}/messages
+- report：汇总首 token 耗时、轮次耗时分位数、吞吐与 DB/LLM 调用次数，保存为 JSON 并与基线对比
+
+运行方式:
+    cd backend
+    python -m benchmarks.load_test --users 20 --turns 3
+    python -m benchmarks.report benchmarks/results/baseline.json benchmarks/results/loadtest-xxx.json
+"""
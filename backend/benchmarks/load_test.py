@@ -0,0 +1,376 @@
+"""
+问诊接口容量压测
+
+默认在本机启动模拟 LLM 服务与一个后端进程（临时 SQLite 库，LLM_BASE_URL 指向模拟服务），
+然后模拟 N 个并发用户：登录 → 按智能体类型创建会话 → 通过 SSE 调用 /sessions/{id}/messages 完成若干轮问诊。
+
+每轮记录首个 chunk 事件耗时（TTFT）与整轮耗时；压测前后抓取 /metrics 与模拟服务 /stats，
+得到本次压测的数据库语句数与 LLM 调用数。结果保存为 JSON，可用 benchmarks.report 与基线对比。
+
+运行方式:
+    cd backend
+    python -m benchmarks.load_test --users 20 --turns 3
+    python -m benchmarks.load_test --users 50 --agent-types dermatology --llm-latency 0.8 --error-rate 0.05
+    python -m benchmarks.load_test --base-url http://127.0.0.1:8100 --no-mock   # 压测已启动的后端
+    python -m benchmarks.load_test --compare benchmarks/results/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_llm_server import MockConfig, MockLLMServer
+from benchmarks.report import TurnSample, compare, format_comparison, format_summary, summarize
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+
+# 各智能体的问诊话术（按轮次循环使用）
+PROMPTS: Dict[str, List[str]] = {
+    "general": [
+        "我这两天有点发烧，37.8度，还有点咳嗽",
+        "没有痰，晚上咳得比较厉害",
+        "需要吃什么药吗？",
+    ],
+    "dermatology": [
+        "我手臂上起了一片红疹，很痒",
+        "大概三天了，洗澡后更明显",
+        "之前没有过敏史，这需要去医院吗？",
+    ],
+    "cardiology": [
+        "最近爬楼梯的时候胸口有点闷",
+        "休息几分钟就好了，血压平时140/90左右",
+        "需要做哪些检查？",
+    ],
+    "orthopedics": [
+        "我膝盖疼了一个多星期",
+        "上下楼梯的时候最疼，没有受过伤",
+        "可以热敷吗？",
+    ],
+}
+DEFAULT_PROMPTS = PROMPTS["general"]
+
+_METRIC_LINE = re.compile(r'^(\w+)(?:\{([^}]*)\})?\s+([0-9.eE+-]+|NaN|[+-]Inf)$')
+
+
+# ============= 指标抓取 =============
+
+def parse_metrics(text: str) -> Dict[str, List[Any]]:
+    """解析 Prometheus 文本格式：指标名 → [(标签字典, 数值)]"""
+    result: Dict[str, List[Any]] = {}
+    for line in text.splitlines():
+        match = _METRIC_LINE.match(line.strip())
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        parsed = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', labels or ""))
+        result.setdefault(name, []).append((parsed, float(value)))
+    return result
+
+
+def _sum_by(metrics: Dict[str, List[Any]], name: str, label: Optional[str] = None) -> Dict[str, float]:
+    totals: Dict[str, float] = {}
+    for labels, value in metrics.get(name, []):
+        key = labels.get(label, "") if label else ""
+        totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+
+def diff_db_queries(before: Dict[str, List[Any]], after: Dict[str, List[Any]]) -> Dict[str, int]:
+    """两次 /metrics 抓取之间按操作类型的数据库语句数"""
+    start = _sum_by(before, "db_query_duration_seconds_count", "operation")
+    end = _sum_by(after, "db_query_duration_seconds_count", "operation")
+    return {op: int(end[op] - start.get(op, 0)) for op in sorted(end) if end[op] - start.get(op, 0) > 0}
+
+
+async def scrape_metrics(client: httpx.AsyncClient) -> Optional[Dict[str, List[Any]]]:
+    try:
+        response = await client.get("/metrics")
+    except httpx.HTTPError:
+        return None
+    return parse_metrics(response.text) if response.status_code == 200 else None
+
+
+# ============= 模拟用户 =============
+
+async def read_turn(response: httpx.Response, started: float) -> Dict[str, Any]:
+    """读取一轮 SSE 响应，返回首 chunk 耗时、chunk 数与结束事件"""
+    ttft = None
+    chunks = 0
+    event = None
+    async for line in response.aiter_lines():
+        if line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            if event == "chunk":
+                chunks += 1
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+            elif event in ("complete", "error"):
+                data = line[5:].strip()
+                return {"ttft": ttft, "chunks": chunks, "event": event, "data": data}
+    return {"ttft": ttft, "chunks": chunks, "event": None, "data": None}
+
+
+async def run_user(
+    client: httpx.AsyncClient,
+    index: int,
+    agent_type: str,
+    turns: int,
+    samples: List[TurnSample],
+    timeout: float
+):
+    """单个模拟用户：登录、创建会话并依次发送 turns 条消息"""
+    phone = f"199{os.getpid() % 10000:04d}{index:04d}"
+    response = await client.post("/auth/login", json={"phone": phone, "code": "000000"})
+    if response.status_code != 200:
+        samples.append(TurnSample(agent_type, False, None, 0.0, error=f"login {response.status_code}"))
+        return
+    headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+    response = await client.post("/sessions", json={"agent_type": agent_type}, headers=headers)
+    if response.status_code != 200:
+        samples.append(TurnSample(agent_type, False, None, 0.0, error=f"create session {response.status_code}"))
+        return
+    session_id = response.json()["session_id"]
+
+    prompts = PROMPTS.get(agent_type, DEFAULT_PROMPTS)
+    stream_headers = {**headers, "Accept": "text/event-stream"}
+    for turn in range(turns):
+        started = time.perf_counter()
+        try:
+            async with client.stream(
+                "POST",
+                f"/sessions/{session_id}/messages",
+                json={"content": prompts[turn % len(prompts)]},
+                headers=stream_headers,
+                timeout=timeout
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    samples.append(TurnSample(
+                        agent_type, False, None, time.perf_counter() - started,
+                        error=f"HTTP {response.status_code}"
+                    ))
+                    continue
+                result = await read_turn(response, started)
+        except httpx.HTTPError as e:
+            samples.append(TurnSample(
+                agent_type, False, None, time.perf_counter() - started, error=type(e).__name__
+            ))
+            continue
+
+        latency = time.perf_counter() - started
+        if result["event"] == "complete":
+            samples.append(TurnSample(agent_type, True, result["ttft"], latency, result["chunks"]))
+        else:
+            samples.append(TurnSample(
+                agent_type, False, result["ttft"], latency, result["chunks"],
+                error=f"{result['event'] or 'stream closed'}: {(result['data'] or '')[:60]}"
+            ))
+
+
+async def run_load(
+    base_url: str,
+    users: int,
+    turns: int,
+    agent_types: Optional[List[str]],
+    ramp_up: float,
+    timeout: float,
+    mock_stats_url: Optional[str] = None
+) -> Dict[str, Any]:
+    """对 base_url 上的后端执行压测，返回汇总结果"""
+    limits = httpx.Limits(max_connections=users + 10, max_keepalive_connections=users + 10)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        if not agent_types:
+            agent_types = sorted((await client.get("/sessions/agents")).json().keys())
+        if mock_stats_url:
+            await client.post(f"{mock_stats_url}/stats/reset")
+        metrics_before = await scrape_metrics(client)
+
+        samples: List[TurnSample] = []
+
+        async def start_user(i: int):
+            if ramp_up > 0:
+                await asyncio.sleep(ramp_up * i / users)
+            await run_user(client, i, agent_types[i % len(agent_types)], turns, samples, timeout)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(start_user(i) for i in range(users)))
+        elapsed = time.perf_counter() - started
+
+        metrics_after = await scrape_metrics(client)
+        mock_stats = (await client.get(f"{mock_stats_url}/stats")).json() if mock_stats_url else None
+
+    result = summarize(samples, elapsed)
+    turns_done = max(1, result["overall"]["turns"])
+    if metrics_before is not None and metrics_after is not None:
+        by_operation = diff_db_queries(metrics_before, metrics_after)
+        queries = sum(by_operation.values())
+        result["db"] = {
+            "queries": queries,
+            "queries_per_turn": round(queries / turns_done, 2),
+            "by_operation": by_operation,
+        }
+    if mock_stats is not None:
+        result["llm"] = {
+            "calls": mock_stats["requests"],
+            "stream_calls": mock_stats["stream_requests"],
+            "injected_errors": mock_stats["injected_errors"],
+            "calls_per_turn": round(mock_stats["requests"] / turns_done, 2),
+            "prompt_tokens": mock_stats["prompt_tokens"],
+            "cached_prompt_ratio": round(mock_stats["cached_prompt_tokens"] / mock_stats["prompt_tokens"], 3)
+            if mock_stats["prompt_tokens"] else 0.0,
+            "completion_tokens": mock_stats["completion_tokens"],
+            "by_model": mock_stats["models"],
+        }
+    result["agent_types"] = agent_types
+    return result
+
+
+# ============= 本地环境 =============
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_backend(llm_base_url: str, workdir: str, port: int, workers: int) -> subprocess.Popen:
+    """以子进程启动后端（临时 SQLite 库、LLM 指向模拟服务）"""
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        "LLM_BASE_URL": llm_base_url,
+        "LLM_API_KEY": "mock-key",
+        "SEED_DATA": "false",
+        "TEST_MODE": "true",
+        "METRICS_ENABLED": "true",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    }
+    command = [
+        sys.executable, "-m", "uvicorn", "app.main:app",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning", "--no-access-log",
+    ]
+    log = open(os.path.join(workdir, "backend.log"), "w")
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_for_health(base_url: str, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"后端进程已退出（exit {process.returncode}）")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError("等待后端启动超时")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the consultation SSE endpoint")
+    parser.add_argument("--users", type=int, default=10, help="并发用户数")
+    parser.add_argument("--turns", type=int, default=3, help="每个用户的问诊轮数")
+    parser.add_argument("--agent-types", nargs="*", help="参与压测的智能体类型（默认全部，用户按类型轮流分配）")
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="用户在多少秒内陆续开始")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单轮超时（秒）")
+    parser.add_argument("--base-url", help="压测已启动的后端（不再自动启动）")
+    parser.add_argument("--workers", type=int, default=1, help="自动启动后端时的 worker 数")
+    parser.add_argument("--no-mock", action="store_true", help="不启动模拟 LLM 服务（后端使用真实 LLM 配置）")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="模拟服务首 token 延迟（秒）")
+    parser.add_argument("--llm-tps", type=float, default=60.0, help="模拟服务输出速率（token/秒）")
+    parser.add_argument("--reply-tokens", type=int, default=120, help="模拟服务回复长度（token）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟服务错误注入概率")
+    parser.add_argument("--error-status", type=int, default=500, help="注入错误的状态码")
+    parser.add_argument("--output", help="结果文件（默认 benchmarks/results/loadtest-<时间>.json）")
+    parser.add_argument("--compare", help="与该基线结果对比")
+    args = parser.parse_args()
+
+    mock = None
+    backend = None
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    try:
+        mock_config = MockConfig(
+            first_token_latency=args.llm_latency,
+            tokens_per_second=args.llm_tps,
+            reply_tokens=args.reply_tokens,
+            error_rate=args.error_rate,
+            error_status=args.error_status,
+        )
+        if not args.no_mock:
+            mock = MockLLMServer(mock_config).start()
+            print(f"Mock LLM: {mock.base_url}")
+
+        base_url = args.base_url
+        if base_url is None:
+            if mock is None:
+                parser.error("自动启动后端需要模拟 LLM 服务，去掉 --no-mock 或指定 --base-url")
+            port = _free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            backend = start_backend(mock.base_url, workdir, port, args.workers)
+            wait_for_health(base_url, backend)
+            print(f"Backend: {base_url}  (logs: {os.path.join(workdir, 'backend.log')})")
+
+        mock_stats_url = mock.base_url[:-len("/v1")] if mock is not None else None
+        result = asyncio.run(run_load(
+            base_url, args.users, args.turns, args.agent_types, args.ramp_up, args.timeout, mock_stats_url
+        ))
+    finally:
+        if backend is not None:
+            backend.terminate()
+            try:
+                backend.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                backend.kill()
+        if mock is not None:
+            mock.stop()
+
+    result["config"] = {
+        "users": args.users,
+        "turns": args.turns,
+        "ramp_up": args.ramp_up,
+        "workers": args.workers,
+        "mock": None if mock is None else {
+            "first_token_latency": mock_config.first_token_latency,
+            "tokens_per_second": mock_config.tokens_per_second,
+            "reply_tokens": mock_config.reply_tokens,
+            "error_rate": mock_config.error_rate,
+            "error_status": mock_config.error_status,
+        },
+    }
+    result["created_at"] = datetime.now().isoformat(timespec="seconds")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"loadtest-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(format_summary(result))
+    print(f"\n结果已保存: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(baseline, result)
+        print(f"\n对比基线 {args.compare}:")
+        print(format_comparison(rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+"""
+热路径函数微基准（pytest-benchmark）
+
+每轮问诊都会执行的纯 Python 函数：JSON 过滤与解析、消息序列化、知识检索打分、结构化数据提取。
+基线保存在 benchmarks/micro/baselines/ 下（按机器分目录），优化前后对比同一台机器上的结果。
+
+运行方式:
+    cd backend
+    pip install pytest-benchmark
+    python -m pytest benchmarks/micro                                  # 运行并输出表格
+    python -m pytest benchmarks/micro --benchmark-compare              # 与最近一次保存的基线对比
+    python -m pytest benchmarks/micro --benchmark-compare --benchmark-compare-fail=median:20%
+    python -m pytest benchmarks/micro --benchmark-save=baseline         # 更新基线
+"""
@@ -0,0 +1,19 @@
+import pytest
+
+from app.models import Department, Doctor  # noqa: F401  注册外键引用的表
+from app.models.knowledge_base import KnowledgeBase, KnowledgeDocument
+from tests.conftest import memory_session_factory
+
+from . import fixtures
+
+
+@pytest.fixture(scope="session")
+def knowledge_db():
+    """内存 SQLite 中的知识库（500 篇已审核文档）"""
+    db = memory_session_factory(KnowledgeBase, KnowledgeDocument)()
+    db.add(KnowledgeBase(id="kb-bench", name="基准知识库"))
+    for doc in fixtures.knowledge_documents():
+        db.add(KnowledgeDocument(knowledge_base_id="kb-bench", status="approved", **doc))
+    db.commit()
+    yield db
+    db.close()
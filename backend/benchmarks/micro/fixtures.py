@@ -0,0 +1,116 @@
+"""
+微基准的输入数据
+
+按线上问诊的典型形态构造（固定随机种子，保证每次生成相同的数据）：长中文回复、内嵌诊断 JSON 的回复、
+长对话历史与大体积状态。
+"""
+import json
+import random
+from typing import Any, Dict, List
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+PARAGRAPHS = [
+    "根据您描述的症状，手臂内侧出现成片的红色丘疹并伴有明显瘙痒，夜间加重，这种表现比较符合湿疹的特点。",
+    "湿疹的发生与皮肤屏障功能受损、环境刺激以及个人体质都有关系，洗澡水温过高、频繁使用碱性沐浴露都会加重症状。",
+    "建议您先做好以下几点护理：每天洗澡后三分钟内涂抹无香料的保湿霜，衣物选择纯棉材质，避免搔抓和热水烫洗。",
+    "如果瘙痒影响睡眠，可以在医生指导下短期外用弱效糖皮质激素药膏，比如氢化可的松乳膏，每天一到两次，不超过两周。",
+    "需要注意的是，如果皮疹出现渗液、结痂、明显疼痛或者范围在几天内迅速扩大，可能合并细菌感染，应尽快到皮肤科就诊。",
+    "另外，接触性皮炎也会出现类似的表现，如果最近更换过洗衣液、护肤品或者佩戴了新的首饰，请留意皮疹是否局限在接触部位。",
+    "请问您的皮疹是从什么时候开始的？之前有没有类似的发作？家里人有没有过敏性鼻炎、哮喘之类的过敏性疾病？",
+]
+
+DIAGNOSIS = {
+    "summary": "手臂内侧红色丘疹伴瘙痒3天，夜间加重",
+    "conditions": [
+        {"name": "湿疹", "confidence": 0.72, "rationale": ["红斑丘疹", "剧烈瘙痒", "夜间加重"]},
+        {"name": "接触性皮炎", "confidence": 0.18, "rationale": ["需排除新接触物"]},
+        {"name": "荨麻疹", "confidence": 0.06, "rationale": ["皮疹持续不消退，不支持"]},
+    ],
+    "risk_level": "low",
+    "need_offline_visit": False,
+    "urgency": "如出现渗液或迅速扩大请及时就诊",
+    "care_plan": ["洗澡后涂抹保湿霜", "避免搔抓与热水烫洗", "穿纯棉衣物", "必要时短期外用弱效激素"],
+    "references": [
+        {"id": "kb-001", "title": "湿疹诊疗指南", "source": "中华皮肤科杂志"},
+        {"id": "kb-002", "title": "接触性皮炎诊断要点", "source": "皮肤病学教材"},
+    ],
+    "reasoning_steps": ["收集症状", "检索知识库", "鉴别诊断", "给出护理建议"],
+}
+
+
+def long_reply(paragraphs: int = 24) -> str:
+    """约 1 万字的纯文本回复（无 JSON）"""
+    return "\n\n".join(PARAGRAPHS[i % len(PARAGRAPHS)] for i in range(paragraphs))
+
+
+def reply_with_embedded_json(paragraphs: int = 24) -> str:
+    """正文中夹带诊断 JSON 块（LLM 偶尔把结构化输出混进回复）"""
+    text = long_reply(paragraphs)
+    middle = text.index("\n\n", len(text) // 2)
+    block = json.dumps(DIAGNOSIS, ensure_ascii=False, indent=2)
+    return f"{text[:middle]}\n\n{block}\n\n{text[middle:]}\n\n```json\n{block}\n```"
+
+
+def reply_with_unbalanced_braces(count: int = 200) -> str:
+    """大量未闭合的左花括号（如患者粘贴的代码片段或表情），每个都会向后扫描到文本末尾"""
+    return "".join(f"{PARAGRAPHS[i % len(PARAGRAPHS)]}{{" for i in range(count))
+
+
+def json_reply() -> str:
+    """整段为 JSON 的回复"""
+    return json.dumps(DIAGNOSIS, ensure_ascii=False, indent=2)
+
+
+def markdown_json_reply() -> str:
+    """markdown 代码块包装的 JSON（BaseAIService 解析的典型输入）"""
+    return f"以下是分析结果：\n\n```json\n{json_reply()}\n```\n\n以上仅供参考。"
+
+
+def prose_wrapped_json_reply() -> str:
+    """前后带说明文字且没有代码块的 JSON（走 find/rfind 兜底分支）"""
+    return f"{PARAGRAPHS[0]}\n{json_reply()}\n{PARAGRAPHS[-1]}"
+
+
+def conversation(turns: int = 100) -> List[Any]:
+    """长对话历史：system + 多轮用户/助手消息 + 工具消息"""
+    messages: List[Any] = [SystemMessage(content="你是一名经验丰富的皮肤科医生。" * 20)]
+    for i in range(turns):
+        messages.append(HumanMessage(content=PARAGRAPHS[i % len(PARAGRAPHS)]))
+        if i % 5 == 0:
+            messages.append(ToolMessage(content=json.dumps(DIAGNOSIS["references"], ensure_ascii=False), tool_call_id=f"call-{i}"))
+        messages.append(AIMessage(content=long_reply(3)))
+    return messages
+
+
+def large_state(turns: int = 100) -> Dict[str, Any]:
+    """问诊状态：长对话、多张图片分析结果与病历字段"""
+    return {
+        "session_id": "bench-session",
+        "messages": conversation(turns),
+        "chief_complaint": PARAGRAPHS[0],
+        "symptoms": ["红疹", "瘙痒", "脱屑", "渗液"],
+        "skin_analyses": [
+            {"description": PARAGRAPHS[i % len(PARAGRAPHS)], "conditions": DIAGNOSIS["conditions"]}
+            for i in range(20)
+        ],
+        "latest_analysis": None,
+        "latest_interpretation": {"summary": DIAGNOSIS["summary"], "items": DIAGNOSIS["conditions"] * 10},
+        "diagnosis": DIAGNOSIS,
+    }
+
+
+def knowledge_documents(count: int = 500, seed: int = 7) -> List[Dict[str, Any]]:
+    """知识库文档（标题、正文与标签）"""
+    rng = random.Random(seed)
+    topics = ["湿疹", "荨麻疹", "银屑病", "痤疮", "带状疱疹", "接触性皮炎", "真菌感染", "高血压", "冠心病", "膝关节炎"]
+    documents = []
+    for i in range(count):
+        topic = topics[i % len(topics)]
+        body = "".join(rng.choice(PARAGRAPHS) for _ in range(6))
+        documents.append({
+            "title": f"{topic}诊疗要点（{i}）",
+            "content": f"{topic} {body}",
+            "tags": [topic, rng.choice(topics), "指南"],
+        })
+    return documents
@@ -0,0 +1,62 @@
+"""回复文本处理：JSON 检测与过滤、JSON 解析、消息序列化"""
+import pytest
+
+from app.services.ai.base_ai_service import BaseAIService
+from app.services.base.langgraph_base import _serialize_messages
+from app.services.dermatology.react_wrapper import (
+    _filter_json_from_response, _is_json_content, _serialize_messages as _serialize_react_messages
+)
+
+from . import fixtures
+
+REPLIES = {
+    "plain": fixtures.long_reply(),
+    "embedded_json": fixtures.reply_with_embedded_json(),
+    "unbalanced_braces": fixtures.reply_with_unbalanced_braces(),
+    "json_only": fixtures.json_reply(),
+}
+
+
+@pytest.mark.benchmark(group="filter_json_from_response")
+@pytest.mark.parametrize("kind", list(REPLIES))
+def test_filter_json_from_response(benchmark, kind):
+    result = benchmark(_filter_json_from_response, REPLIES[kind])
+    if kind == "json_only":
+        assert result == ""
+    elif kind == "embedded_json":
+        assert '"care_plan"' not in result and "湿疹" in result
+
+
+@pytest.mark.benchmark(group="is_json_content")
+@pytest.mark.parametrize("kind", ["plain", "json_only"])
+def test_is_json_content(benchmark, kind):
+    assert benchmark(_is_json_content, REPLIES[kind]) is (kind == "json_only")
+
+
+PARSE_INPUTS = {
+    "bare": fixtures.json_reply(),
+    "markdown": fixtures.markdown_json_reply(),
+    "prose_wrapped": fixtures.prose_wrapped_json_reply(),
+}
+
+
+@pytest.mark.benchmark(group="parse_json")
+@pytest.mark.parametrize("kind", list(PARSE_INPUTS))
+def test_parse_json(benchmark, kind):
+    service = BaseAIService()
+    result = benchmark(service._parse_json, PARSE_INPUTS[kind])
+    assert result["risk_level"] == "low"
+
+
+@pytest.mark.benchmark(group="serialize_messages")
+def test_serialize_messages(benchmark):
+    messages = fixtures.conversation(200)
+    result = benchmark(_serialize_messages, messages)
+    assert len(result) == len(messages)
+
+
+@pytest.mark.benchmark(group="serialize_messages")
+def test_serialize_react_messages(benchmark):
+    messages = fixtures.conversation(200)
+    result = benchmark(_serialize_react_messages, messages)
+    assert all(m["role"] in ("user", "assistant") for m in result)
@@ -0,0 +1,36 @@
+"""知识检索打分与结构化数据提取"""
+import pytest
+
+from app.routes.sessions import extract_structured_data
+from app.services.dermatology.react_tools import retrieve_derma_knowledge
+from app.services.knowledge_service import KnowledgeService
+
+from . import fixtures
+
+
+@pytest.mark.benchmark(group="search_documents")
+@pytest.mark.parametrize("query", ["湿疹 瘙痒 红斑 保湿", "手臂上起了红疹很痒怎么办"], ids=["keywords", "sentence"])
+def test_search_documents(benchmark, knowledge_db, query):
+    docs = benchmark(KnowledgeService.search_documents, knowledge_db, "kb-bench", query, 5)
+    assert len(docs) <= 5
+
+
+@pytest.mark.benchmark(group="retrieve_derma_knowledge")
+def test_retrieve_derma_knowledge(benchmark):
+    results = benchmark(
+        retrieve_derma_knowledge.func,
+        symptoms=["红斑", "瘙痒", "水疱", "脱屑"],
+        location="手掌",
+        query="反复发作"
+    )
+    assert results[0]["id"] == "kb-004"
+
+
+@pytest.mark.benchmark(group="extract_structured_data")
+@pytest.mark.parametrize("with_analysis", [False, True])
+def test_extract_structured_data(benchmark, with_analysis):
+    state = fixtures.large_state()
+    if with_analysis:
+        state["latest_analysis"] = state["skin_analyses"][-1]
+    result = benchmark(extract_structured_data, state)
+    assert result["type"] == ("skin_analysis" if with_analysis else "report_interpretation")
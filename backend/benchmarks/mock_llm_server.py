@@ -0,0 +1,317 @@
+"""
+模拟 LLM 服务（OpenAI / DashScope 兼容模式）
+
+POST /chat/completions（也挂在 /v1 与 /compatible-mode/v1 下），支持流式与非流式：
+- 首 token 延迟 first_token_latency（秒，可加 jitter 比例随机抖动）
+- 输出速率 tokens_per_second，回复长度 reply_tokens（1 个汉字按 1 个 token 计）
+- 错误注入：按 error_rate 概率返回 error_status（429 时带 Retry-After）
+- response_format 为 json_object / json_schema 时返回 JSON（json_schema 按 schema 生成符合结构的示例）
+
+GET /stats 返回请求数、流式请求数、注入错误数与 token 统计，POST /stats/reset 清零。
+
+运行方式:
+    cd backend
+    python -m benchmarks.mock_llm_server --port 18080 --latency 0.3 --tps 60 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+REPLY_TEXT = (
+    "根据您的描述，这种情况可能与皮肤屏障受损或过敏反应有关。"
+    "建议先避免接触可疑的刺激物，保持局部清洁干燥，不要搔抓。"
+    "如果症状持续超过一周、范围扩大或出现渗液、发热，请及时到医院就诊。"
+    "请问症状是从什么时候开始的？有没有伴随瘙痒或疼痛？"
+)
+
+
+@dataclass
+class MockConfig:
+    """模拟服务的行为配置（运行中可直接修改属性）"""
+    first_token_latency: float = 0.3
+    jitter: float = 0.2  # 延迟随机抖动比例
+    tokens_per_second: float = 60.0
+    reply_tokens: int = 120
+    chunk_tokens: int = 4  # 流式每个片段的 token 数
+    error_rate: float = 0.0
+    error_status: int = 500
+    seed: Optional[int] = None
+
+
+@dataclass
+class MockStats:
+    requests: int = 0
+    stream_requests: int = 0
+    injected_errors: int = 0
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    completion_tokens: int = 0
+    models: Dict[str, int] = field(default_factory=dict)
+
+
+def _reply(tokens: int) -> str:
+    text = REPLY_TEXT * (tokens // len(REPLY_TEXT) + 1)
+    return text[:tokens]
+
+
+def _prompt_tokens(messages: Any) -> int:
+    total = 0
+    for message in messages or []:
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, str):
+            total += len(content)
+        elif isinstance(content, list):
+            total += sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+    return total
+
+
+def _cached_tokens(messages: Any, seen: set) -> int:
+    """模拟服务商前缀缓存：系统消息与之前某次请求逐字相同时，其 token 计为命中缓存"""
+    first = (messages or [None])[0]
+    if not isinstance(first, dict) or first.get("role") != "system":
+        return 0
+    key = json.dumps(first.get("content"), ensure_ascii=False, sort_keys=True)
+    if key in seen:
+        return _prompt_tokens([first])
+    seen.add(key)
+    return 0
+
+
+def _sample_from_schema(schema: Dict[str, Any], defs: Dict[str, Any], text: str, depth: int = 0) -> Any:
+    """按 JSON Schema 生成一个结构合法的示例值（字符串字段填入回复文本）"""
+    if depth > 8:
+        return None
+    if "$ref" in schema:
+        return _sample_from_schema(defs.get(schema["$ref"].rsplit("/", 1)[-1], {}), defs, text, depth + 1)
+    for key in ("anyOf", "oneOf", "allOf"):
+        if schema.get(key):
+            options = [s for s in schema[key] if s.get("type") != "null"] or schema[key]
+            return _sample_from_schema(options[0], defs, text, depth + 1)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "const" in schema:
+        return schema["const"]
+    kind = schema.get("type")
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != "null"), "null")
+    if kind == "object" or "properties" in schema:
+        return {
+            name: _sample_from_schema(prop, defs, text, depth + 1)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [_sample_from_schema(schema.get("items", {}), defs, text, depth + 1)]
+    if kind == "string":
+        return text
+    if kind == "integer":
+        return 1
+    if kind == "number":
+        return 1.0
+    if kind == "boolean":
+        return False
+    return None
+
+
+def _json_reply(response_format: Dict[str, Any], text: str) -> Optional[str]:
+    kind = response_format.get("type")
+    if kind == "json_object":
+        return json.dumps({"reply": text}, ensure_ascii=False)
+    if kind == "json_schema":
+        schema = (response_format.get("json_schema") or {}).get("schema") or {}
+        sample = _sample_from_schema(schema, schema.get("$defs", {}), text)
+        return json.dumps(sample, ensure_ascii=False)
+    return None
+
+
+def create_mock_app(config: Optional[MockConfig] = None) -> FastAPI:
+    """创建模拟服务应用，app.state.config / app.state.stats 可在测试中直接读写"""
+    app = FastAPI(title="Mock LLM")
+    app.state.config = config or MockConfig()
+    app.state.stats = MockStats()
+    lock = threading.Lock()
+    rng = random.Random(app.state.config.seed)
+    seen_prefixes: set = set()
+
+    def delay(seconds: float) -> float:
+        jitter = app.state.config.jitter
+        return max(0.0, seconds * (1 + rng.uniform(-jitter, jitter))) if jitter else seconds
+
+    async def chat_completions(request: Request):
+        cfg: MockConfig = app.state.config
+        stats: MockStats = app.state.stats
+        body = await request.json()
+        model = body.get("model", "unknown")
+        stream = bool(body.get("stream"))
+        reply_tokens = min(cfg.reply_tokens, body.get("max_tokens") or cfg.reply_tokens)
+        prompt_tokens = _prompt_tokens(body.get("messages"))
+
+        with lock:
+            stats.requests += 1
+            stats.stream_requests += int(stream)
+            stats.models[model] = stats.models.get(model, 0) + 1
+            inject = cfg.error_rate > 0 and rng.random() < cfg.error_rate
+            if inject:
+                stats.injected_errors += 1
+            else:
+                cached_tokens = _cached_tokens(body.get("messages"), seen_prefixes)
+                stats.prompt_tokens += prompt_tokens
+                stats.cached_prompt_tokens += cached_tokens
+                stats.completion_tokens += reply_tokens
+
+        await asyncio.sleep(delay(cfg.first_token_latency))
+        if inject:
+            headers = {"Retry-After": "1"} if cfg.error_status == 429 else {}
+            return JSONResponse(
+                {"error": {"message": "injected error", "type": "mock_error"}},
+                status_code=cfg.error_status,
+                headers=headers
+            )
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        text = _json_reply(body.get("response_format") or {}, _reply(min(reply_tokens, 40))) or _reply(reply_tokens)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            "completion_tokens": reply_tokens,
+            "total_tokens": prompt_tokens + reply_tokens
+        }
+
+        if not stream:
+            if cfg.tokens_per_second > 0:
+                await asyncio.sleep(delay(reply_tokens / cfg.tokens_per_second))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            }
+
+        async def events():
+            step = max(1, cfg.chunk_tokens)
+            interval = step / cfg.tokens_per_second if cfg.tokens_per_second > 0 else 0
+            for i in range(0, len(text), step):
+                if i and interval:
+                    await asyncio.sleep(interval)
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": text[i:i + step]}, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            final = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                "usage": usage
+            }
+            yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    for prefix in ("", "/v1", "/compatible-mode/v1"):
+        app.add_api_route(f"{prefix}/chat/completions", chat_completions, methods=["POST"])
+
+    @app.get("/stats")
+    def get_stats():
+        with lock:
+            return {**asdict(app.state.stats), "config": asdict(app.state.config)}
+
+    @app.post("/stats/reset")
+    def reset_stats():
+        with lock:
+            app.state.stats = MockStats()
+        return {"message": "ok"}
+
+    return app
+
+
+class MockLLMServer:
+    """在后台线程中运行模拟服务（压测脚本与测试使用）"""
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        import uvicorn
+
+        self.app = create_mock_app(config)
+        self._server = uvicorn.Server(uvicorn.Config(self.app, host=host, port=port, log_level="warning"))
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.servers[0].sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def stats(self) -> MockStats:
+        return self.app.state.stats
+
+    def start(self, timeout: float = 10.0) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self._server.run, name="mock-llm", daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError("模拟 LLM 服务启动失败")
+            time.sleep(0.02)
+        return self
+
+    def stop(self):
+        self._server.should_exit = True
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI/DashScope-compatible mock LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency", type=float, default=0.3, help="首 token 延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="延迟随机抖动比例")
+    parser.add_argument("--tps", type=float, default=60.0, help="输出速率（token/秒）")
+    parser.add_argument("--reply-tokens", type=int, default=120, help="回复长度（token）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="错误注入概率")
+    parser.add_argument("--error-status", type=int, default=500, help="注入错误的状态码")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = MockConfig(
+        first_token_latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tps,
+        reply_tokens=args.reply_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status
+    )
+    print(f"Mock LLM: http://{args.host}:{args.port}/v1  {config}")
+    uvicorn.run(create_mock_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
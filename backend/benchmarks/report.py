@@ -0,0 +1,183 @@
+"""
+压测结果汇总与对比
+
+summarize() 把单轮样本汇总为 TTFT / 轮次耗时分位数与吞吐；compare() 对比两份结果的关键指标。
+
+运行方式（对比基线与本次结果）:
+    cd backend
+    python -m benchmarks.report benchmarks/results/baseline.json benchmarks/results/loadtest-xxx.json
+"""
+import argparse
+import json
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+@dataclass
+class TurnSample:
+    """一轮问诊的测量结果（时间单位：秒）"""
+    agent_type: str
+    ok: bool
+    ttft: Optional[float]  # 首个 chunk 事件耗时，没有输出时为 None
+    latency: float  # 发出请求到 complete / error 事件
+    chunks: int = 0
+    error: Optional[str] = None
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """最近秩分位数（q 取 0~100）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _distribution(values: List[float]) -> Dict[str, Optional[float]]:
+    def ms(value: Optional[float]) -> Optional[float]:
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        "count": len(values),
+        "mean_ms": ms(sum(values) / len(values)) if values else None,
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(max(values)) if values else None,
+    }
+
+
+def summarize(samples: Iterable[TurnSample], elapsed: float) -> Dict[str, Any]:
+    """汇总样本：整体与按智能体类型的 TTFT、轮次耗时与吞吐"""
+    samples = list(samples)
+
+    def group(items: List[TurnSample]) -> Dict[str, Any]:
+        ok = [s for s in items if s.ok]
+        errors: Dict[str, int] = {}
+        for s in items:
+            if not s.ok:
+                key = (s.error or "unknown")[:80]
+                errors[key] = errors.get(key, 0) + 1
+        return {
+            "turns": len(items),
+            "ok": len(ok),
+            "errors": len(items) - len(ok),
+            "error_rate": round((len(items) - len(ok)) / len(items), 4) if items else 0.0,
+            "throughput_turns_per_s": round(len(ok) / elapsed, 3) if elapsed > 0 else None,
+            "ttft": _distribution([s.ttft for s in ok if s.ttft is not None]),
+            "latency": _distribution([s.latency for s in ok]),
+            "error_kinds": errors,
+        }
+
+    by_agent: Dict[str, List[TurnSample]] = {}
+    for s in samples:
+        by_agent.setdefault(s.agent_type, []).append(s)
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "overall": group(samples),
+        "by_agent": {agent: group(items) for agent, items in sorted(by_agent.items())},
+    }
+
+
+# 对比时关注的指标：(路径, 数值越大越好)
+COMPARED_METRICS: List[Tuple[str, bool]] = [
+    ("overall.throughput_turns_per_s", True),
+    ("overall.error_rate", False),
+    ("overall.ttft.p50_ms", False),
+    ("overall.ttft.p95_ms", False),
+    ("overall.latency.p50_ms", False),
+    ("overall.latency.p95_ms", False),
+    ("overall.latency.p99_ms", False),
+    ("llm.calls_per_turn", False),
+    ("db.queries_per_turn", False),
+]
+
+
+def _lookup(data: Dict[str, Any], path: str) -> Optional[float]:
+    for key in path.split("."):
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data if isinstance(data, (int, float)) else None
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float = 0.1) -> List[Dict[str, Any]]:
+    """
+    对比两份结果，变化超过 tolerance（比例）且方向变差的指标标记为 regression
+    """
+    rows = []
+    for path, higher_is_better in COMPARED_METRICS:
+        before, after = _lookup(baseline, path), _lookup(current, path)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before if before else (0.0 if after == before else math.inf)
+        worse = change < -tolerance if higher_is_better else change > tolerance
+        rows.append({
+            "metric": path,
+            "baseline": before,
+            "current": after,
+            "change": round(change, 4) if math.isfinite(change) else None,
+            "regression": worse,
+        })
+    return rows
+
+
+def format_summary(result: Dict[str, Any]) -> str:
+    """终端输出的表格"""
+    lines = [
+        f"{'agent':<14} {'turns':>6} {'err':>5} {'turns/s':>8} "
+        f"{'ttft p50':>9} {'ttft p95':>9} {'lat p50':>9} {'lat p95':>9} {'lat p99':>9}"
+    ]
+    rows = [("overall", result["overall"])] + list(result["by_agent"].items())
+    for name, group in rows:
+        ttft, latency = group["ttft"], group["latency"]
+        lines.append(
+            f"{name:<14} {group['turns']:>6} {group['errors']:>5} {group['throughput_turns_per_s'] or 0:>8.2f} "
+            f"{_fmt(ttft['p50_ms'])} {_fmt(ttft['p95_ms'])} "
+            f"{_fmt(latency['p50_ms'])} {_fmt(latency['p95_ms'])} {_fmt(latency['p99_ms'])}"
+        )
+    if "llm" in result:
+        llm = result["llm"]
+        lines.append(
+            f"LLM 调用 {llm.get('calls')}（流式 {llm.get('stream_calls')}，注入错误 {llm.get('injected_errors')}），"
+            f"每轮 {llm.get('calls_per_turn')} 次，提示词缓存命中 {llm.get('cached_prompt_ratio', 0):.1%}"
+        )
+    if "db" in result:
+        db = result["db"]
+        lines.append(f"DB 语句 {db.get('queries')}，每轮 {db.get('queries_per_turn')} 条 {db.get('by_operation')}")
+    return "\n".join(lines)
+
+
+def format_comparison(rows: List[Dict[str, Any]]) -> str:
+    lines = [f"{'metric':<32} {'baseline':>10} {'current':>10} {'change':>8}"]
+    for row in rows:
+        change = f"{row['change'] * 100:+.1f}%" if row["change"] is not None else "n/a"
+        flag = "  <-- regression" if row["regression"] else ""
+        lines.append(f"{row['metric']:<32} {row['baseline']:>10} {row['current']:>10} {change:>8}{flag}")
+    return "\n".join(lines)
+
+
+def _fmt(value: Optional[float]) -> str:
+    return f"{value:>9.0f}" if value is not None else f"{'-':>9}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two load test result files")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="视为回归的变化比例")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    rows = compare(baseline, current, args.tolerance)
+    print(format_comparison(rows))
+    if any(row["regression"] for row in rows):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+为 medical_events 添加列表查询用的复合索引
+
+- (user_id, status, start_time)
+- (user_id, agent_type, start_time)
+- (user_id, created_at)（列表默认排序）
+
+新库由 create_all 自动创建，已有数据库执行本脚本补建。
+SQLite 数据库同时把已有的时间值统一为秒级文本格式（与 CURRENT_TIMESTAMP 一致），
+保证游标分页直接比较列值时结果正确。
+
+执行方式:
+cd backend
+python migrations/add_medical_event_indexes.py
+python migrations/add_medical_event_indexes.py --downgrade
+"""
+import sys
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.models.medical_event import MedicalEvent
+
+INDEX_NAMES = (
+    "ix_medical_events_user_status_start",
+    "ix_medical_events_user_agent_start",
+    "ix_medical_events_user_created",
+)
+
+SORT_COLUMNS = ("start_time", "created_at", "updated_at")
+
+
+def _indexes():
+    return [idx for idx in MedicalEvent.__table__.indexes if idx.name in INDEX_NAMES]
+
+
+def upgrade():
+    """创建索引（已存在时跳过）"""
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            for column in SORT_COLUMNS:
+                conn.execute(text(
+                    f"UPDATE medical_events SET {column} = datetime({column}) "
+                    f"WHERE {column} IS NOT NULL AND {column} != datetime({column})"
+                ))
+        print("✅ 已统一 medical_events 时间格式")
+    for index in _indexes():
+        index.create(bind=engine, checkfirst=True)
+    print("✅ 成功添加 medical_events 复合索引")
+
+
+def downgrade():
+    """回滚迁移"""
+    for index in _indexes():
+        index.drop(bind=engine, checkfirst=True)
+    print("✅ 成功回滚 medical_events 复合索引")
+
+
+if __name__ == "__main__":
+    if "--downgrade" in sys.argv:
+        downgrade()
+    else:
+        upgrade()
@@ -0,0 +1,102 @@
+"""
+迁移脚本：将 medical_events.sessions (JSON) 转换为 event_sessions 表
+
+每个会话一行，对话内容能与 messages 表一一对应时改为引用消息 ID，
+否则原样保存在 event_sessions.details 中。转换完成的事件会清空旧 JSON。
+
+执行前请先备份数据库：
+    pg_dump -U postgres home_health > backup_before_migration.sql
+
+执行方式：
+    cd backend
+    python -m migrations.migrate_event_sessions
+
+    # 预览 / 调整每批事件数
+    python -m migrations.migrate_event_sessions --dry-run
+    python -m migrations.migrate_event_sessions --batch-size 200
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.medical_event import MedicalEvent, EventSession
+from app.services.event_session_service import EventSessionService
+from app.database import SessionLocal, engine
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def migrate_event_sessions(dry_run: bool = False, batch_size: int = 100):
+    """
+    分批转换事件会话记录
+
+    按事件 ID 递增分批读取（每批单独提交），中断后重新执行会跳过已转换的事件
+    """
+    if not dry_run:
+        EventSession.__table__.create(bind=engine, checkfirst=True)
+
+    db = SessionLocal()
+    migrated_events = 0
+    migrated_sessions = 0
+    last_id = 0
+
+    try:
+        if dry_run:
+            logger.info("=== DRY RUN MODE - No changes will be made ===")
+
+        while True:
+            events = db.query(MedicalEvent).filter(
+                MedicalEvent.id > last_id
+            ).order_by(MedicalEvent.id).limit(batch_size).all()
+            if not events:
+                break
+            last_id = events[-1].id
+
+            for event in events:
+                legacy = event.sessions or []
+                if not legacy:
+                    continue
+                if dry_run:
+                    logger.debug(f"Would migrate event {event.id}: {len(legacy)} sessions")
+                    migrated_sessions += len(legacy)
+                    migrated_events += 1
+                    continue
+
+                count = EventSessionService.migrate_legacy(db, event)
+                if count:
+                    migrated_sessions += count
+                    migrated_events += 1
+
+            if not dry_run:
+                db.commit()
+            # 释放本批对象，避免大表迁移时内存持续增长
+            db.expunge_all()
+            logger.info(f"Progress: up to event {last_id}, migrated {migrated_events} events / {migrated_sessions} sessions")
+
+        logger.info("=" * 50)
+        logger.info("Event Sessions Migration Summary:")
+        logger.info(f"  Events migrated: {migrated_events}")
+        logger.info(f"  Sessions migrated: {migrated_sessions}")
+        logger.info("=" * 50)
+
+        return {"events_migrated": migrated_events, "sessions_migrated": migrated_sessions}
+
+    except Exception as e:
+        logger.error(f"Migration failed: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Migrate medical_events.sessions JSON to event_sessions table")
+    parser.add_argument("--dry-run", action="store_true", help="Only show what would be migrated")
+    parser.add_argument("--batch-size", type=int, default=100, help="Events per batch")
+    args = parser.parse_args()
+
+    migrate_event_sessions(dry_run=args.dry_run, batch_size=args.batch_size)
@@ -0,0 +1,83 @@
+"""
+验证码存储压测：模拟高并发登录（发送验证码 + 校验）
+
+每个登录流程依次执行：冷却检查 → 手机号/IP 频率检查 → 存储验证码 → 计数 → 输错一次 → 校验成功。
+database 存储用多个存储实例共享同一个 SQLite 文件，模拟多 worker 部署。
+
+运行方式:
+    cd backend
+    python -m scripts.benchmark_verification_store
+    python -m scripts.benchmark_verification_store --logins 20000 --threads 32 --backends memory
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.verification_code_store import (
+    DatabaseVerificationCodeStore, MemoryVerificationCodeStore, _create_store_engine
+)
+
+
+def login_flow(store, i: int) -> float:
+    """单次登录流程，返回耗时（秒）"""
+    phone = f"13{i:09d}"
+    ip = f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+    code = f"{(i * 7919) % 900000 + 100000}"
+    start = time.perf_counter()
+    store.check_cooldown(phone)
+    store.check_phone_rate_limit(phone)
+    store.check_ip_rate_limit(ip)
+    store.store_code(phone, code)
+    store.increment_rate_limit(phone, ip)
+    store.verify_code(phone, "000001")
+    ok, msg = store.verify_code(phone, code)
+    if not ok:
+        raise RuntimeError(f"校验失败: {phone} {msg}")
+    return time.perf_counter() - start
+
+
+def run(name: str, stores, logins: int, threads: int):
+    """并发执行登录流程并输出吞吐与延迟"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(lambda i: login_flow(stores[i % len(stores)], i), range(logins)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(
+        f"{name:<10} {logins:>8} {threads:>8} {logins / elapsed:>12.0f} "
+        f"{statistics.median(latencies) * 1000:>10.3f} {p99 * 1000:>10.3f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark verification code stores under concurrent logins")
+    parser.add_argument("--logins", type=int, default=5000, help="登录流程总数")
+    parser.add_argument("--threads", type=int, default=16, help="并发线程数")
+    parser.add_argument("--workers", type=int, default=4, help="database 存储模拟的 worker 数")
+    parser.add_argument("--backends", nargs="+", default=["memory", "database"])
+    args = parser.parse_args()
+
+    print(f"{'backend':<10} {'logins':>8} {'threads':>8} {'logins/s':>12} {'p50(ms)':>10} {'p99(ms)':>10}")
+    for backend in args.backends:
+        if backend == "memory":
+            store = MemoryVerificationCodeStore()
+            run("memory", [store], args.logins, args.threads)
+            print(f"{'':<10} 剩余条目: {len(store)}（验证码校验后删除，仅保留频率计数，窗口结束后由时间轮清理）")
+        elif backend == "database":
+            with tempfile.TemporaryDirectory() as tmp:
+                url = f"sqlite:///{os.path.join(tmp, 'codes.db')}"
+                stores = [DatabaseVerificationCodeStore(_create_store_engine(url)) for _ in range(args.workers)]
+                run("database", stores, args.logins, args.threads)
+                for store in stores:
+                    store.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
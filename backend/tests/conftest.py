@@ -0,0 +1,35 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+
+def memory_session_factory(*models) -> sessionmaker:
+    """创建内存 SQLite 数据库（单连接，可跨线程共享），只建给定模型的表"""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    for model in models:
+        model.__table__.create(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def make_session_factory():
+    """
+    按表创建内存数据库，测试结束后释放连接
+
+        session_factory = make_session_factory(SessionModel, Message)
+    """
+    factories = []
+
+    def make(*models) -> sessionmaker:
+        factory = memory_session_factory(*models)
+        factories.append(factory)
+        return factory
+
+    yield make
+    for factory in factories:
+        factory.kw["bind"].dispose()
@@ -0,0 +1,63 @@
+"""
+测试 AI 算法接口（/ai）
+"""
+from datetime import datetime
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.database import get_db
+from app.dependencies import get_current_user
+from app.models.medical_event import EventAttachment, EventNote, EventSession, EventStatus, MedicalEvent
+from app.models.user import User
+from app.routes import ai
+from app.services.ai.aggregation_service import AggregationResult
+
+
+class FakeAggregationService:
+    def __init__(self):
+        self.events = None
+
+    async def smart_aggregate(self, session_info, existing_events):
+        self.events = existing_events
+        return AggregationResult(
+            should_merge=True,
+            confidence=0.9,
+            related_events=[str(existing_events[0]["id"])],
+            merge_reason="同科室、时间相近",
+            suggested_action="add_to_existing",
+            target_event_id=str(existing_events[0]["id"])
+        )
+
+
+@pytest.fixture
+def client(make_session_factory, monkeypatch):
+    db = make_session_factory(User, MedicalEvent, EventSession, EventAttachment, EventNote)()
+    db.add(User(id=1, phone="13800000000"))
+    db.add_all([
+        MedicalEvent(user_id=1, title="手臂红疹", department="皮肤科", start_time=datetime(2026, 1, 2)),
+        MedicalEvent(user_id=1, title="旧病历", department="皮肤科", status=EventStatus.archived),
+        MedicalEvent(user_id=2, title="其他用户", department="皮肤科"),
+    ])
+    db.commit()
+
+    service = FakeAggregationService()
+    monkeypatch.setattr(ai, "get_aggregation_service", lambda: service)
+    app = FastAPI()
+    app.include_router(ai.router)
+    app.dependency_overrides[get_db] = lambda: db
+    app.dependency_overrides[get_current_user] = lambda: db.get(User, 1)
+    yield TestClient(app), service
+    db.close()
+
+
+def test_smart_aggregate(client):
+    """测试智能聚合只把当前用户的活跃事件交给聚合服务"""
+    http, service = client
+    response = http.post("/ai/smart-aggregate", json={
+        "session_id": "s1", "session_type": "derma", "department": "皮肤科", "chief_complaint": "红疹"
+    })
+    assert response.status_code == 200
+    assert response.json()["action"] == "add_to_existing"
+    assert [e["title"] for e in service.events] == ["手臂红疹"]
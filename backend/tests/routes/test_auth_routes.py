@@ -0,0 +1,33 @@
+"""
+测试认证接口（/auth）
+"""
+from datetime import datetime
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.database import get_db
+from app.dependencies import get_current_user
+from app.models.user import User
+from app.routes import auth
+from app.services.auth_service import AuthService
+from app.services.user_cache import CurrentUser
+
+
+def test_set_password_returns_updated_user(make_session_factory, monkeypatch):
+    """测试设置密码返回更新后的用户，而不是认证时的用户快照"""
+    db = make_session_factory(User)()
+    db.add(User(id=1, phone="13800000000", updated_at=datetime(2020, 1, 1)))
+    db.commit()
+    snapshot = CurrentUser.from_user(db.get(User, 1))
+    monkeypatch.setattr(AuthService, "verify_code", staticmethod(lambda phone, code: (True, "")))
+
+    app = FastAPI()
+    app.include_router(auth.router)
+    app.dependency_overrides[get_db] = lambda: db
+    app.dependency_overrides[get_current_user] = lambda: snapshot
+    response = TestClient(app).post("/auth/password/set", json={"code": "123456", "new_password": "abc12345"})
+
+    assert response.status_code == 200
+    assert not response.json()["updated_at"].startswith("2020")
+    db.close()
@@ -0,0 +1,34 @@
+"""
+测试病历导出记录接口
+"""
+from sqlalchemy import event
+
+from app.models.medical_event import ExportJob, ExportJobStatus, ExportRecord
+from app.models.user import User
+from app.routes import medical_events
+
+
+def test_list_exports_loads_jobs_in_one_query(make_session_factory):
+    """测试导出记录列表批量加载渲染任务，查询次数不随记录数增长"""
+    db = make_session_factory(User, ExportRecord, ExportJob)()
+    db.add(User(id=1, phone="13800000000"))
+    for i in range(5):
+        db.add(ExportRecord(
+            user_id=1, event_ids=[i], export_type="pdf",
+            job=ExportJob(cache_key=f"key{i}", status=ExportJobStatus.ready)
+        ))
+    db.commit()
+    db.expire_all()
+    user = db.get(User, 1)
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.get_bind(), "before_cursor_execute", listener)
+    try:
+        records = medical_events.list_exports(current_user=user, db=db)
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", listener)
+
+    assert [r.file_status for r in records] == ["ready"] * 5
+    assert len(statements) == 2
+    db.close()
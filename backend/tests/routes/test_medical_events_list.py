@@ -0,0 +1,123 @@
+"""
+测试病历事件列表（游标分页、估算总数、摘要字段加载）
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+
+from app.database import get_db
+from app.dependencies import get_current_user
+from app.models.medical_event import EventStatus, MedicalEvent
+from app.models.user import User
+from app.routes import medical_events
+
+
+@pytest.fixture
+def db(make_session_factory):
+    session = make_session_factory(User, MedicalEvent)()
+    session.add(User(id=1, phone="13800000000"))
+    base = datetime(2026, 1, 1, 9, 0, 0, 123456)
+    for i in range(23):
+        # 每 4 条共用一个时间，验证同一时间的事件按 id 翻页
+        start = base + timedelta(hours=i // 4)
+        session.add(MedicalEvent(
+            user_id=1, title=f"事件{i}", department="皮肤科", start_time=start, created_at=start,
+            status=EventStatus.active if i % 2 else EventStatus.completed,
+            ai_analysis={"detail": "x" * 1000}
+        ))
+    # 时间由数据库默认值写入的事件
+    session.add(MedicalEvent(user_id=1, title="默认时间", department="皮肤科"))
+    session.add(MedicalEvent(user_id=2, title="其他用户", department="皮肤科"))
+    session.commit()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def client(db):
+    app = FastAPI()
+    app.include_router(medical_events.router)
+    app.dependency_overrides[get_db] = lambda: db
+    app.dependency_overrides[get_current_user] = lambda: db.get(User, 1)
+    return TestClient(app)
+
+
+def _all_pages(client, **params):
+    titles, cursor = [], None
+    while True:
+        query = {**params, "page_size": 5, **({"cursor": cursor} if cursor else {})}
+        body = client.get("/medical-events", params=query).json()
+        titles += [e["title"] for e in body["events"]]
+        cursor = body["next_cursor"]
+        if not cursor:
+            return titles
+
+
+@pytest.mark.parametrize("sort_by", ["created_at", "start_time", "updated_at"])
+@pytest.mark.parametrize("sort_order", ["desc", "asc"])
+def test_cursor_pages_cover_all_events_once(client, sort_by, sort_order):
+    """测试游标翻页：同一时间的多条事件不重复、不遗漏，顺序与 offset 分页一致"""
+    titles = _all_pages(client, sort_by=sort_by, sort_order=sort_order)
+    assert len(titles) == 24 and len(set(titles)) == 24
+    by_offset = client.get("/medical-events", params={"sort_by": sort_by, "sort_order": sort_order, "page_size": 100})
+    assert titles == [e["title"] for e in by_offset.json()["events"]]
+
+
+def test_cursor_with_status_filter(client):
+    """测试带筛选条件的游标翻页"""
+    titles = _all_pages(client, status="active", sort_by="start_time")
+    assert titles == ["默认时间"] + [f"事件{i}" for i in range(21, 0, -2)]
+
+
+def test_invalid_cursor_rejected(client):
+    """测试无法解析的游标、与排序条件不一致的游标返回 400"""
+    assert client.get("/medical-events", params={"cursor": "not-a-cursor"}).status_code == 400
+    cursor = client.get("/medical-events", params={"page_size": 5}).json()["next_cursor"]
+    response = client.get("/medical-events", params={"cursor": cursor, "sort_by": "start_time"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "分页游标与排序条件不一致"
+
+
+def test_approximate_total_capped(client, monkeypatch):
+    """测试估算总数超过上限时返回上限并标记 total_approximate"""
+    monkeypatch.setattr(medical_events.settings, "EVENT_LIST_APPROX_COUNT_CAP", 10)
+    body = client.get("/medical-events", params={"approximate_total": True}).json()
+    assert (body["total"], body["total_approximate"]) == (10, True)
+    assert len(body["events"]) == 20
+    body = client.get("/medical-events", params={"approximate_total": True, "status": "completed", "department": "无"}).json()
+    assert (body["total"], body["total_approximate"]) == (0, False)
+    monkeypatch.setattr(medical_events.settings, "EVENT_LIST_APPROX_COUNT_CAP", 30)
+    body = client.get("/medical-events", params={"approximate_total": True}).json()
+    assert (body["total"], body["total_approximate"]) == (24, False)
+
+
+def test_list_skips_json_columns(client, db):
+    """测试列表只查询摘要字段，不读取 ai_analysis / sessions"""
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.get_bind(), "before_cursor_execute", listener)
+    try:
+        assert client.get("/medical-events").status_code == 200
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", listener)
+    select = next(s for s in statements if "ORDER BY" in s)
+    assert "ai_analysis" not in select and "sessions" not in select
+
+
+@pytest.mark.parametrize("filters, order_by, index", [
+    ("status = 'active'", "start_time", "ix_medical_events_user_status_start"),
+    ("agent_type = 'general'", "start_time", "ix_medical_events_user_agent_start"),
+    ("1 = 1", "created_at", "ix_medical_events_user_created"),
+])
+def test_seek_and_sort_served_by_index(db, filters, order_by, index):
+    """测试 SQLite 下游标条件与排序直接作用于列，由复合索引完成，不需要额外排序"""
+    plan = db.execute(text(
+        f"EXPLAIN QUERY PLAN SELECT id FROM medical_events WHERE user_id = 1 AND {filters} "
+        f"AND {order_by} < '2026-01-01 12:00:00' ORDER BY {order_by} DESC, id DESC LIMIT 5"
+    )).all()
+    detail = " | ".join(row[-1] for row in plan)
+    assert index in detail
+    assert "TEMP B-TREE" not in detail
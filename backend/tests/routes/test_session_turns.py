@@ -0,0 +1,85 @@
+"""
+测试流式轮次的结束状态（run_agent_turn）
+"""
+import pytest
+
+from app import database
+from app.models import User  # noqa: F401  注册 users 表供外键解析
+from app.models.message import Message
+from app.models.session import Session as SessionModel
+from app.models.session_turn import SessionTurn, TurnStatus
+from app.routes.sessions import run_agent_turn
+from app.services import session_turn_service
+from app.services.stream_replay import TurnStreamRegistry
+
+
+@pytest.fixture
+def session_factory(make_session_factory, monkeypatch):
+    factory = make_session_factory(SessionModel, Message, SessionTurn)
+    monkeypatch.setattr(database, "SessionLocal", factory)
+    monkeypatch.setattr(session_turn_service, "SessionLocal", factory)
+    return factory
+
+
+class FakeAgent:
+    def __init__(self, final_state):
+        self.final_state = final_state
+
+    async def run(self, **kwargs):
+        return self.final_state
+
+
+async def _run_turn(session_factory, final_state, with_session=True):
+    db = session_factory()
+    if with_session:
+        db.add(SessionModel(id="s1", user_id=1, agent_type="dermatology"))
+    db.add(SessionTurn(id="t1", session_id="s1", status=TurnStatus.running.value))
+    db.commit()
+    db.close()
+
+    buffer = TurnStreamRegistry().create("s1", user_id=1, turn_id="t1")
+    await run_agent_turn(
+        buffer=buffer, agent=FakeAgent(final_state), state={}, user_input="你好",
+        attachments=[], action="conversation", session_id="s1", agent_type="dermatology"
+    )
+    await buffer.finish()
+    events = [event for _, event, _ in [item async for item in buffer.iter_events(0)]]
+
+    db = session_factory()
+    turn = db.query(SessionTurn).filter(SessionTurn.id == "t1").first()
+    db.close()
+    return turn, events
+
+
+@pytest.mark.asyncio
+async def test_completed_turn_saves_ai_message(session_factory):
+    """测试正常结束：保存 AI 消息并发送 complete 事件"""
+    turn, events = await _run_turn(session_factory, {"current_response": "建议保湿", "stage": "collecting"})
+    assert events == ["meta", "complete"]
+    assert turn.status == TurnStatus.completed.value
+    assert turn.ai_message_id is not None
+
+
+@pytest.mark.asyncio
+async def test_empty_agent_result_fails_turn(session_factory):
+    """测试智能体未返回结果时轮次标记为失败并发送 error 事件"""
+    turn, events = await _run_turn(session_factory, None)
+    assert events == ["meta", "error"]
+    assert turn.status == TurnStatus.failed.value
+
+
+@pytest.mark.asyncio
+async def test_unsaved_reply_fails_turn(session_factory):
+    """测试 AI 回复未能保存时轮次标记为失败，不记录没有消息的已完成轮次"""
+    turn, events = await _run_turn(session_factory, {"current_response": "好的", "bad": object()})
+    assert events == ["meta", "error"]
+    assert turn.status == TurnStatus.failed.value
+    assert turn.ai_message_id is None
+
+
+@pytest.mark.asyncio
+async def test_missing_session_fails_turn(session_factory):
+    """测试会话已不存在时轮次标记为失败"""
+    turn, events = await _run_turn(session_factory, {"current_response": "好的"}, with_session=False)
+    assert events == ["meta", "error"]
+    assert turn.error == "会话不存在"
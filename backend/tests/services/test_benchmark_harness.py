@@ -0,0 +1,106 @@
+import json
+
+from fastapi.testclient import TestClient
+
+from benchmarks.load_test import diff_db_queries, parse_metrics
+from benchmarks.mock_llm_server import MockConfig, create_mock_app
+from benchmarks.report import TurnSample, compare, percentile, summarize
+
+
+def _client(**overrides):
+    config = MockConfig(first_token_latency=0, jitter=0, tokens_per_second=0, reply_tokens=12, chunk_tokens=5, seed=1)
+    for key, value in overrides.items():
+        setattr(config, key, value)
+    return TestClient(create_mock_app(config))
+
+
+def test_mock_streaming_and_plain_completions():
+    """测试模拟服务的流式与非流式响应，以及请求统计"""
+    client = _client()
+    messages = [{"role": "user", "content": "头疼"}]
+
+    response = client.post("/compatible-mode/v1/chat/completions", json={"model": "qwen-plus", "messages": messages})
+    assert response.json()["choices"][0]["message"]["content"]
+    assert response.json()["usage"]["completion_tokens"] == 12
+
+    with client.stream("POST", "/v1/chat/completions", json={
+        "model": "qwen-plus", "messages": messages, "stream": True
+    }) as response:
+        lines = [line for line in response.iter_lines() if line.startswith("data: ")]
+    assert lines[-1] == "data: [DONE]"
+    chunks = [json.loads(line[6:]) for line in lines[:-1]]
+    assert len(chunks) == 4  # 12 个 token 按每片 5 个切成 3 片，加上带 usage 的结束片段
+    assert chunks[-1]["usage"]["completion_tokens"] == 12
+    assert len("".join(c["choices"][0]["delta"].get("content", "") for c in chunks)) == 12
+
+    stats = client.get("/stats").json()
+    assert (stats["requests"], stats["stream_requests"], stats["models"]) == (2, 1, {"qwen-plus": 2})
+
+
+def test_mock_error_injection_and_json_schema():
+    """测试错误注入（429 带 Retry-After）与按 json_schema 生成结构化输出"""
+    client = _client(error_rate=1.0, error_status=429)
+    response = client.post("/v1/chat/completions", json={"model": "m", "messages": []})
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1"
+    assert client.get("/stats").json()["injected_errors"] == 1
+
+    client.app.state.config.error_rate = 0
+    schema = {
+        "type": "object",
+        "properties": {
+            "reply": {"type": "string"},
+            "urgency": {"$ref": "#/$defs/Urgency"},
+            "options": {"type": "array", "items": {"type": "string"}},
+            "confidence": {"anyOf": [{"type": "number"}, {"type": "null"}]},
+        },
+        "$defs": {"Urgency": {"enum": ["low", "high"]}},
+    }
+    response = client.post("/v1/chat/completions", json={
+        "model": "m",
+        "messages": [],
+        "response_format": {"type": "json_schema", "json_schema": {"name": "out", "schema": schema}},
+    })
+    data = json.loads(response.json()["choices"][0]["message"]["content"])
+    assert data["urgency"] == "low"
+    assert isinstance(data["reply"], str) and isinstance(data["options"], list)
+    assert data["confidence"] == 1.0
+
+
+def test_summary_percentiles_and_regressions():
+    """测试分位数、按智能体汇总与基线对比"""
+    assert percentile([], 50) is None
+    assert percentile(list(range(1, 101)), 95) == 95
+    assert percentile([3.0], 99) == 3.0
+
+    samples = [TurnSample("general", True, 0.1 * i, 0.5 * i, 3) for i in range(1, 11)]
+    samples.append(TurnSample("dermatology", False, None, 2.0, error="HTTP 409"))
+    result = summarize(samples, elapsed=5.0)
+    assert result["overall"]["turns"] == 11
+    assert result["overall"]["errors"] == 1
+    assert result["overall"]["throughput_turns_per_s"] == 2.0
+    assert result["by_agent"]["general"]["latency"]["p50_ms"] == 2500.0
+    assert result["by_agent"]["dermatology"]["error_kinds"] == {"HTTP 409": 1}
+
+    slower = json.loads(json.dumps(result))
+    slower["overall"]["latency"]["p95_ms"] *= 1.5
+    rows = {row["metric"]: row for row in compare(result, slower)}
+    assert rows["overall.latency.p95_ms"]["regression"] is True
+    assert rows["overall.latency.p50_ms"]["regression"] is False
+
+
+def test_metrics_diff():
+    """测试从 /metrics 文本中解析并计算数据库语句增量"""
+    before = parse_metrics(
+        '# TYPE db_query_duration_seconds histogram\n'
+        'db_query_duration_seconds_count{operation="SELECT"} 10\n'
+        'db_query_duration_seconds_count{operation="INSERT"} 2\n'
+    )
+    after = parse_metrics(
+        'db_query_duration_seconds_count{operation="SELECT"} 25\n'
+        'db_query_duration_seconds_count{operation="INSERT"} 2\n'
+        'db_query_duration_seconds_count{operation="UPDATE"} 4\n'
+        'llm_tokens_total{model="qwen-plus"} 1.5e3\n'
+    )
+    assert diff_db_queries(before, after) == {"SELECT": 15, "UPDATE": 4}
+    assert after["llm_tokens_total"] == [({"model": "qwen-plus"}, 1500.0)]
@@ -0,0 +1,155 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from app.services.ai.context_builder import ContextBuilder, context_budget
+from app.services.ai.tokens import estimate_tokens
+from app.services.diagnosis_agent import DiagnosisAgent, create_initial_state
+from app.services.qwen_service import QwenService
+
+FACTS = {"主诉": "手臂红疹伴瘙痒", "部位": "手臂内侧", "持续时间": "3天", "症状": ["红疹", "瘙痒"]}
+
+
+def _dialogue(turns):
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"第{i}轮：皮疹夜间瘙痒加重，抓挠后有少量渗液。" * 3})
+        messages.append({"role": "assistant", "content": f"第{i}轮回复：建议保湿并避免搔抓，请问是否接触过新的洗护用品？" * 3})
+    return messages
+
+
+def test_short_history_kept_verbatim():
+    """测试预算内的历史原样保留，不生成摘要"""
+    messages = _dialogue(3)
+    context = ContextBuilder(budget=2000).build(messages, facts=FACTS)
+    assert context.messages == messages
+    assert context.summary == "" and context.summary_state is None
+    assert "- 部位：手臂内侧" in context.preamble()
+
+
+def test_long_history_fits_budget_and_keeps_facts():
+    """测试长会话按预算截取：近期消息原文保留、早期压缩为摘要，关键信息始终保留"""
+    messages = _dialogue(60)
+    builder = ContextBuilder(budget=1500, summary_tokens=300)
+    context = builder.build(messages, facts=FACTS)
+
+    assert context.tokens <= 1500
+    assert context.messages == messages[-len(context.messages):]
+    assert context.messages[-1] is messages[-1]
+    assert context.summary_state["covered"] == len(messages) - len(context.messages)
+    assert estimate_tokens(context.summary) <= 300
+    assert "第" in context.summary and "患者：" in context.summary
+    for label in ("主诉：手臂红疹伴瘙痒", "持续时间：3天", "症状：红疹、瘙痒"):
+        assert label in context.preamble()
+
+
+def test_rolling_summary_reused_and_extended():
+    """测试摘要缓存：窗口未移动时直接复用，新移出的消息只追加压缩，不重算已有摘要"""
+    calls = []
+
+    def summarizer(previous, turns):
+        calls.append(len(turns))
+        return previous + "".join(f"[{text[:3]}]" for _, text in turns)
+
+    builder = ContextBuilder(budget=1200, summary_tokens=400, summarizer=summarizer)
+    messages = _dialogue(30)
+    first = builder.build(messages)
+    assert calls == [first.summary_state["covered"]]
+
+    again = builder.build(messages, summary_state=first.summary_state)
+    assert calls == [first.summary_state["covered"]]
+    assert again.summary == first.summary and again.messages == first.messages
+
+    messages += _dialogue(2)
+    later = builder.build(messages, summary_state=first.summary_state)
+    assert later.summary.startswith(first.summary)
+    assert calls[-1] == later.summary_state["covered"] - first.summary_state["covered"]
+
+
+def test_tool_call_kept_with_results():
+    """测试工具调用消息与工具结果作为整体保留，窗口不会从 ToolMessage 开始"""
+    long_text = "患者描述皮疹反复发作，伴有明显瘙痒。" * 20
+    messages = [
+        HumanMessage(content=long_text),
+        AIMessage(content="", tool_calls=[{"name": "retrieve_derma_knowledge", "args": {"query": "湿疹"}, "id": "c1"}]),
+        ToolMessage(content="已检索到 3 条相关医学知识：" + "湿疹指南" * 40, tool_call_id="c1"),
+        AIMessage(content="根据检索结果，考虑湿疹可能性较大。"),
+        HumanMessage(content="需要用药吗？"),
+    ]
+    for budget in range(40, 800, 20):
+        context = ContextBuilder(budget=budget, summary_tokens=30).build(messages)
+        kept = context.messages
+        assert kept[-1] is messages[-1]
+        assert kept[0].type != "tool"
+        if messages[2] in kept:
+            assert messages[1] in kept
+
+
+def test_serialized_history_keeps_summary_aligned():
+    """测试会话结束序列化（去掉工具消息）后，摘要覆盖的消息数与下一轮对齐"""
+    tool_turn = [
+        AIMessage(content="", tool_calls=[{"name": "t", "args": {}, "id": "c"}]),
+        ToolMessage(content="结果" * 50, tool_call_id="c"),
+    ]
+    raw = []
+    for message in _dialogue(20):
+        raw.append(HumanMessage(content=message["content"]) if message["role"] == "user" else AIMessage(content=message["content"]))
+        if message["role"] == "user":
+            raw.extend(tool_turn)
+    builder = ContextBuilder(budget=900)
+    context = builder.build(raw)
+
+    serialized = [
+        {"role": "assistant" if m.type == "ai" else "user", "content": m.content}
+        for m in raw if m.type != "tool"
+    ]
+    next_turn = builder.build(serialized, summary_state=context.summary_state)
+    assert next_turn.summary == context.summary
+    assert [m["content"] for m in next_turn.as_dicts()] == [m.content for m in context.messages if m.type != "tool" and m.content]
+
+
+def test_budget_per_model(monkeypatch):
+    """测试按模型覆盖提示词预算"""
+    from app.services.ai import context_builder
+    monkeypatch.setattr(context_builder.settings, "LLM_CONTEXT_BUDGETS", {"small": 1000})
+    assert context_budget("small") == 1000
+    assert context_budget("other") == context_builder.settings.LLM_CONTEXT_TOKEN_BUDGET
+    assert ContextBuilder.for_model("small", reserved=300).budget == 700
+
+
+@pytest.mark.asyncio
+async def test_qwen_service_history_within_budget(monkeypatch):
+    """测试通用问诊按预算发送历史，并把摘要缓存到会话状态"""
+    from app.services import qwen_service
+
+    sent = {}
+
+    class FakePool:
+        async def chat_completion(self, payload, tokens, timeout):
+            sent.update(payload)
+            return {"choices": [{"message": {"content": "好的"}}]}
+
+    monkeypatch.setattr(qwen_service.settings, "LLM_API_KEY", "test")
+    monkeypatch.setattr(qwen_service.settings, "LLM_CONTEXT_TOKEN_BUDGET", 2000)
+    monkeypatch.setattr(qwen_service.LLMProvider, "get_pool", classmethod(lambda cls: FakePool()))
+
+    state = {"messages": _dialogue(40)}
+    reply = await QwenService.get_ai_response("还需要注意什么？", history=state["messages"], model="qwen-plus", context_state=state)
+    assert reply == "好的"
+    assert sum(estimate_tokens(m["content"]) for m in sent["messages"]) < 2000
+    assert "【早期对话摘要】" in sent["messages"][0]["content"]
+    assert sent["messages"][-2]["content"] == state["messages"][-1]["content"]
+    assert state["context_summary"]["covered"] > 0
+
+
+def test_diagnosis_agent_transcript_uses_summary(monkeypatch):
+    """测试问诊智能体的对话记录按预算截取并缓存摘要"""
+    from app.services.ai import context_builder
+    monkeypatch.setattr(context_builder.settings, "LLM_CONTEXT_TOKEN_BUDGET", 2500)
+    agent = DiagnosisAgent()
+    state = create_initial_state("c1", 1, chief_complaint="皮疹")
+    state["messages"] = _dialogue(40)
+
+    transcript = agent._format_messages(state, agent.QUESTION_PROMPT, "question")
+    assert transcript.startswith("（早期对话摘要）")
+    assert transcript.endswith(state["messages"][-1]["content"])
+    assert state["context_summary"]["covered"] > 0
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models import User  # noqa: F401  注册 users 表供外键解析
+from app.models.medical_event import EventAttachment, EventNote, EventSession, ExportRecord, MedicalEvent
+from app.models.message import Message, SenderType
+from app.models.session import Session as SessionModel
+from app.services.event_session_service import EventSessionService
+
+
+@pytest.fixture
+def db(make_session_factory):
+    session = make_session_factory(SessionModel, Message, MedicalEvent, EventSession, EventAttachment, EventNote, ExportRecord)()
+    yield session
+    session.close()
+
+
+def add_messages(db, session_id: str, contents):
+    base = datetime(2026, 1, 1, 10, 0, 0)
+    messages = [
+        Message(session_id=session_id, sender=SenderType.user, content=c, created_at=base + timedelta(minutes=i))
+        for i, c in enumerate(contents)
+    ]
+    db.add_all(messages)
+    db.commit()
+    return [m.id for m in messages]
+
+
+def make_event(db, sessions=None) -> MedicalEvent:
+    event = MedicalEvent(user_id=1, title="皮肤科", department="皮肤科", sessions=sessions or [], session_count=len(sessions or []))
+    db.add(event)
+    db.commit()
+    return event
+
+
+def test_upsert_references_messages_by_id(db):
+    """测试会话记录只保存消息 ID，读取时批量还原对话"""
+    ids = add_messages(db, "s1", ["手臂起红疹", "多久了？"])
+    event = make_event(db)
+    data = {"session_id": "s1", "session_type": "derma", "timestamp": "2026-01-01T10:00:00", "summary": "皮肤科问诊"}
+    EventSessionService.upsert_session(db, event, data, ids)
+    EventSessionService.upsert_session(db, event, {**data, "summary": "皮肤科问诊 - 红疹"}, ids)
+    db.commit()
+
+    assert db.query(EventSession).count() == 1
+    sessions = EventSessionService.load_sessions(db, event)
+    assert sessions[0]["summary"] == "皮肤科问诊 - 红疹"
+    assert [m["content"] for m in sessions[0]["messages"]] == ["手臂起红疹", "多久了？"]
+    assert "messages" not in EventSessionService.load_sessions(db, event, with_messages=False)[0]
+
+
+def test_migrate_legacy_json(db):
+    """测试旧 JSON 转换：能对应消息表的改为引用 ID，否则原样保留"""
+    add_messages(db, "s1", ["手臂起红疹"])
+    legacy = [
+        {"session_id": "s1", "session_type": "derma", "timestamp": "2026-01-01T10:00:00",
+         "summary": "第一次", "messages": [{"role": "user", "content": "手臂起红疹"}]},
+        {"session_id": "s2", "session_type": "derma", "timestamp": "2026-01-02T10:00:00",
+         "summary": "第二次", "messages": [{"role": "user", "content": "已删除的旧对话"}]},
+    ]
+    event = make_event(db, legacy)
+
+    assert EventSessionService.migrate_legacy(db, event) == 2
+    db.commit()
+    assert event.sessions == []
+    assert event.session_count == 2
+
+    sessions = EventSessionService.load_sessions(db, event)
+    assert sessions[0]["message_ids"]
+    assert sessions[0]["messages"][0]["content"] == "手臂起红疹"
+    assert sessions[1]["message_ids"] == []
+    assert sessions[1]["messages"][0]["content"] == "已删除的旧对话"
+
+
+def test_save_sessions_keeps_inline_messages(db):
+    """测试回写摘要结果时保留内联的旧对话"""
+    legacy = [{"session_id": "s2", "session_type": "derma", "timestamp": "2026-01-02T10:00:00",
+               "messages": [{"role": "user", "content": "旧对话"}]}]
+    event = make_event(db, legacy)
+    sessions = EventSessionService.load_sessions(db, event)
+    sessions[0]["ai_summary"] = {"summary": "单次摘要"}
+
+    EventSessionService.save_sessions(db, event, sessions)
+    db.commit()
+
+    reloaded = EventSessionService.load_sessions(db, event)
+    assert reloaded[0]["ai_summary"] == {"summary": "单次摘要"}
+    assert reloaded[0]["messages"][0]["content"] == "旧对话"
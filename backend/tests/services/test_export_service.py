@@ -0,0 +1,149 @@
+import io
+import os
+import re
+
+import pytest
+
+from app.models import User
+from app.models.medical_event import (
+    EventAttachment, EventNote, EventSession, ExportJob, ExportJobStatus, ExportRecord, MedicalEvent
+)
+from app.models.message import Message
+from app.models.session import Session as SessionModel
+from app.services.export_service import ExportService, compute_cache_key, parse_byte_range
+from app.services.pdf_writer import FragmentWriter, PageLayout, StreamingPDFWriter, text_width, wrap_text
+
+
+@pytest.fixture
+def session_factory(make_session_factory):
+    return make_session_factory(
+        User, SessionModel, Message, MedicalEvent, EventSession, EventAttachment, EventNote, ExportRecord, ExportJob
+    )
+
+
+def make_event(db, user_id=1, title="皮肤科 - 手臂红疹") -> MedicalEvent:
+    event = MedicalEvent(user_id=user_id, title=title, department="皮肤科", summary="手臂出现红疹三天" * 50)
+    db.add(event)
+    db.commit()
+    return event
+
+
+def test_pdf_xref_offsets_point_to_objects():
+    """测试交叉引用表中的偏移量指向对应对象"""
+    fp = io.BytesIO()
+    writer = StreamingPDFWriter(fp)
+    layout = PageLayout(writer)
+    for i in range(200):
+        layout.text(f"第 {i} 行：病历内容 record line")
+    layout.finish()
+    writer.close()
+    data = fp.getvalue()
+
+    assert data.startswith(b"%PDF-1.4")
+    assert data.rstrip().endswith(b"%%EOF")
+    assert writer.page_count > 1
+    startxref = int(re.search(rb"startxref\n(\d+)", data).group(1))
+    assert data[startxref:startxref + 4] == b"xref"
+    entries = re.findall(rb"(\d{10}) 00000 n", data[startxref:])
+    for num, offset in enumerate(entries, start=1):
+        assert data[int(offset):].startswith(f"{num} 0 obj".encode())
+
+
+def test_wrap_text_respects_width():
+    """测试折行后每行不超过最大宽度"""
+    lines = wrap_text("中文与 English 混排的长文本" * 10, 10.5, 120)
+    assert len(lines) > 1
+    assert all(text_width(line, 10.5) <= 120 for line in lines)
+    assert wrap_text("a\nb", 10, 100) == ["a", "b"]
+
+
+def test_fragment_roundtrip():
+    """测试片段文件拼接后页数不变"""
+    frag = io.BytesIO()
+    fragment = FragmentWriter(frag)
+    fragment.add_page(b"BT ET")
+    fragment.add_page(b"")
+    frag.seek(0)
+    writer = StreamingPDFWriter(io.BytesIO())
+    assert writer.add_fragment(frag) == 2
+    assert writer.page_count == 2
+
+
+def test_parse_byte_range():
+    """测试 Range 请求头解析"""
+    assert parse_byte_range(None, 100) is None
+    assert parse_byte_range("bytes=0-9", 100) == (0, 9)
+    assert parse_byte_range("bytes=90-", 100) == (90, 99)
+    assert parse_byte_range("bytes=-10", 100) == (90, 99)
+    assert parse_byte_range("bytes=50-500", 100) == (50, 99)
+    assert parse_byte_range("bytes=0-1,5-6", 100) is None
+    with pytest.raises(ValueError):
+        parse_byte_range("bytes=100-", 100)
+    with pytest.raises(ValueError):
+        parse_byte_range("bytes=abc", 100)
+
+
+def test_cache_key_changes_with_content(session_factory):
+    """测试事件内容或导出选项变化时指纹随之变化"""
+    db = session_factory()
+    event = make_event(db)
+    options = {"include_ai_analysis": True}
+    key = compute_cache_key(db, [event], options)
+    assert compute_cache_key(db, [event], dict(options)) == key
+    assert compute_cache_key(db, [event], {"include_ai_analysis": False}) != key
+
+    db.add(EventNote(event_id=event.id, content="复诊前停药"))
+    db.commit()
+    assert compute_cache_key(db, [event], options) != key
+    db.close()
+
+
+def test_run_job_renders_and_reuses_file(session_factory, tmp_path):
+    """测试后台渲染生成文件，相同内容再次导出直接复用"""
+    service = ExportService(export_dir=str(tmp_path), workers=0, session_factory=session_factory)
+    db = session_factory()
+    user = User(phone="13800000000", nickname="张三")
+    db.add(user)
+    db.commit()
+    events = [make_event(db, user.id), make_event(db, user.id, title="心内科 - 心悸")]
+    options = {"include_personal_info": True}
+
+    def create_export():
+        record = ExportRecord(user_id=user.id, event_ids=[e.id for e in events], export_type="pdf",
+                              export_options=options)
+        db.add(record)
+        job = service.prepare_job(db, record, events, options, user)
+        db.commit()
+        return job
+
+    job = create_export()
+    assert job.status == ExportJobStatus.pending
+    service.run_job(job.id)
+    assert service._key_locks == {}
+    db.expire_all()
+    assert job.status == ExportJobStatus.ready
+    assert job.page_count >= 3
+    with open(job.file_path, "rb") as fp:
+        assert fp.read(8) == b"%PDF-1.4"
+    assert not [f for f in os.listdir(tmp_path) if not f.endswith(".pdf")]
+
+    second = create_export()
+    assert second.status == ExportJobStatus.ready
+    assert second.file_path == job.file_path
+    db.close()
+
+
+def test_run_job_marks_failure(session_factory, tmp_path):
+    """测试事件不存在时任务标记为失败"""
+    service = ExportService(export_dir=str(tmp_path), workers=0, session_factory=session_factory)
+    db = session_factory()
+    record = ExportRecord(user_id=1, event_ids=[999], export_type="pdf", export_options={})
+    record.job = ExportJob(cache_key="missing", status=ExportJobStatus.pending)
+    db.add(record)
+    db.commit()
+
+    service.run_job(record.job.id)
+    db.expire_all()
+    assert record.job.status == ExportJobStatus.failed
+    assert "999" in record.job.error
+    db.close()
@@ -0,0 +1,109 @@
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+from app.services.image_preprocessing import ImagePreprocessor, split_data_url
+
+
+def _photo(size=(4000, 3000), orientation=None, fmt="JPEG", mode="RGB") -> str:
+    """生成带噪点的测试照片（纯色图压缩率过高，不像手机原图）"""
+    image = Image.effect_noise(size, 64).convert(mode)
+    buffer = io.BytesIO()
+    options = {"quality": 95} if fmt == "JPEG" else {}
+    if orientation:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        options["exif"] = exif
+    image.save(buffer, format=fmt, **options)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def _decode(result):
+    return Image.open(io.BytesIO(base64.b64decode(result.base64)))
+
+
+def test_large_photo_downscaled_and_oriented():
+    """测试大图按 EXIF 方向旋转、长边缩放到上限，输出不保留 EXIF"""
+    original = _photo(orientation=6)  # 顺时针旋转 90°：横向存储的竖拍照片
+    result = ImagePreprocessor(max_edge=1024, workers=0).preprocess_sync(original)
+
+    assert result.skipped is None
+    assert (result.width, result.height) == (768, 1024)
+    assert result.bytes_saved > 0 and result.output_bytes < result.original_bytes
+    assert result.data_url.startswith("data:image/jpeg;base64,")
+    decoded = _decode(result)
+    assert decoded.size == (768, 1024)
+    assert 0x0112 not in decoded.getexif()
+
+
+def test_small_image_kept_when_no_gain():
+    """测试无需缩放旋转且重新编码不会更小时保留原图"""
+    original = _photo(size=(200, 200), fmt="JPEG")
+    result = ImagePreprocessor(max_edge=1024, quality=100, workers=0).preprocess_sync("data:image/jpeg;base64," + original)
+    assert result.skipped == "no_gain"
+    assert result.base64 == original
+    assert result.bytes_saved == 0
+
+
+def test_png_with_alpha_to_webp():
+    """测试 PNG 透明图按 WebP 输出"""
+    original = _photo(size=(2000, 1000), fmt="PNG", mode="RGBA")
+    result = ImagePreprocessor(max_edge=800, output_format="webp", workers=0).preprocess_sync(original)
+    assert result.mime == "image/webp"
+    assert (result.width, result.height) == (800, 400)
+    assert _decode(result).format == "WEBP"
+
+
+def test_invalid_image_falls_back_to_original():
+    """测试无法解码的内容原样发送，不影响后续分析"""
+    preprocessor = ImagePreprocessor(workers=0)
+    data = base64.b64encode(b"not an image").decode("ascii")
+    result = preprocessor.preprocess_sync("data:image/png;base64," + data)
+    assert result.skipped == "decode_error"
+    assert result.data_url == "data:image/png;base64," + data
+    assert split_data_url("abc") == (None, "abc")
+
+
+@pytest.mark.asyncio
+async def test_process_pool_preprocess():
+    """测试在进程池中预处理，不阻塞事件循环"""
+    preprocessor = ImagePreprocessor(max_edge=512, workers=1, timeout=60)
+    try:
+        result = await preprocessor.preprocess(_photo(size=(2048, 1024)))
+    finally:
+        preprocessor.shutdown()
+    assert result.skipped is None
+    assert (result.width, result.height) == (512, 256)
+
+
+@pytest.mark.asyncio
+async def test_disabled_sends_original():
+    """测试关闭预处理时原样发送"""
+    original = _photo(size=(300, 200))
+    result = await ImagePreprocessor(enabled=False).preprocess(original)
+    assert result.skipped == "disabled"
+    assert result.data_url == "data:image/jpeg;base64," + original
+
+
+def test_skin_image_tool_sends_preprocessed_image(monkeypatch):
+    """测试皮肤图片分析工具发送缩小后的图片，并返回预处理统计"""
+    from app.services import image_preprocessing
+    from app.services.dermatology import react_tools
+
+    sent = {}
+
+    class FakeLLM:
+        def invoke(self, messages):
+            sent["url"] = messages[1].content[0]["image_url"]["url"]
+            return type("Response", (), {"content": "红斑"})()
+
+    monkeypatch.setattr(react_tools.LLMProvider, "get_multimodal_llm", classmethod(lambda cls: FakeLLM()))
+    monkeypatch.setattr(image_preprocessing, "_image_preprocessor", ImagePreprocessor(max_edge=1024, workers=0))
+
+    original = _photo()
+    result = react_tools.analyze_skin_image.invoke({"image_base64": "data:image/jpeg;base64," + original})
+    assert result["description"] == "红斑"
+    assert result["preprocess"]["bytes_saved"] > 0
+    assert len(sent["url"]) < len(original)
@@ -0,0 +1,216 @@
+"""
+服务商池测试
+
+用本地 HTTP 服务模拟 OpenAI 兼容的服务商（可配置延迟与状态码）
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from app.services.llm_pool import CircuitBreaker, ProviderConfig, ProviderError, ProviderPool
+from app.services.llm_scheduler import LLMScheduler, ModelLimits
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.requests.append(body)
+        time.sleep(server.delay)
+        if server.status != 200:
+            data = json.dumps({"error": {"message": "unavailable"}}).encode()
+            self.send_response(server.status)
+            if server.status == 429:
+                self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for text in server.chunks:
+                chunk = {"choices": [{"index": 0, "delta": {"content": text}}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+
+        data = json.dumps({
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": server.reply}}],
+            "usage": {"total_tokens": 10}
+        }, ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def stand_in():
+    """启动模拟服务商，返回工厂函数"""
+    servers = []
+
+    def start(reply="ok", delay=0.0, status=200, chunks=("你", "好")):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        server.daemon_threads = True
+        server.reply, server.delay, server.status, server.chunks = reply, delay, status, chunks
+        server.requests = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _pool(*servers, **kwargs):
+    providers = [ProviderConfig(name=f"p{i}", base_url=s.base_url, api_key="k") for i, s in enumerate(servers)]
+    return ProviderPool(providers, scheduler=LLMScheduler(ModelLimits(reserved_interactive=0)), **kwargs)
+
+
+def _payload():
+    return {"model": "qwen-plus", "messages": [{"role": "user", "content": "hi"}]}
+
+
+@pytest.mark.asyncio
+async def test_failover_to_backup_on_server_error(stand_in):
+    """测试主服务商 5xx 时切换到备用服务商"""
+    primary = stand_in(status=503)
+    backup = stand_in(reply="backup")
+    pool = _pool(primary, backup)
+
+    data = await pool.chat_completion(_payload())
+    assert data["choices"][0]["message"]["content"] == "backup"
+    stats = pool.stats()["providers"]
+    assert stats[0]["failures"] == 1
+    assert stats[1]["requests"] == 1
+
+
+@pytest.mark.asyncio
+async def test_client_error_not_failed_over(stand_in):
+    """测试 400 等请求错误直接抛出，不切换服务商也不影响健康度"""
+    primary = stand_in(status=400)
+    backup = stand_in()
+    pool = _pool(primary, backup)
+
+    with pytest.raises(ProviderError) as exc:
+        await pool.chat_completion(_payload())
+    assert exc.value.status_code == 400
+    assert backup.requests == []
+    assert pool.stats()["providers"][0]["failures"] == 0
+
+
+@pytest.mark.asyncio
+async def test_circuit_opens_and_recovers(stand_in):
+    """测试连续失败后熔断，到期后试探成功恢复"""
+    primary = stand_in(status=500)
+    backup = stand_in(reply="backup")
+    pool = _pool(primary, backup, failure_threshold=2, reset_timeout=0.2)
+
+    for _ in range(3):
+        await pool.chat_completion(_payload())
+    # 第三次请求时主服务商已熔断，直接走备用
+    assert len(primary.requests) == 2
+    assert pool.stats()["providers"][0]["state"] == CircuitBreaker.OPEN
+
+    primary.status = 200
+    await asyncio.sleep(0.25)
+    data = await pool.chat_completion(_payload())
+    assert data["choices"][0]["message"]["content"] == "ok"
+    assert pool.stats()["providers"][0]["state"] == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_wins_and_cancels_slow_primary(stand_in):
+    """测试首个结果超时后对冲请求先返回，主服务商请求被取消"""
+    primary = stand_in(reply="slow", delay=1.0)
+    backup = stand_in(reply="fast")
+    pool = _pool(primary, backup, hedge_delay=0.1)
+
+    start = time.monotonic()
+    data = await pool.chat_completion(_payload())
+    elapsed = time.monotonic() - start
+
+    assert data["choices"][0]["message"]["content"] == "fast"
+    assert elapsed < 0.8
+    stats = pool.stats()
+    assert stats["hedges_fired"] == 1
+    assert stats["hedges_won"] == 1
+    # 被取消的一方不计失败，也不占用调度名额
+    assert stats["providers"][0]["failures"] == 0
+    assert pool.scheduler.stats()["qwen-plus"]["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_no_hedge_when_primary_fast(stand_in):
+    """测试主服务商在对冲时长内返回时不发起对冲"""
+    primary = stand_in(reply="primary")
+    backup = stand_in()
+    pool = _pool(primary, backup, hedge_delay=0.5)
+
+    data = await pool.chat_completion(_payload())
+    assert data["choices"][0]["message"]["content"] == "primary"
+    assert backup.requests == []
+    assert pool.stats()["hedges_fired"] == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_hedged_on_first_token(stand_in):
+    """测试流式请求以首个 token 为准对冲，只输出胜出一方的内容"""
+    primary = stand_in(delay=1.0, chunks=("慢",))
+    backup = stand_in(chunks=("快", "速"))
+    pool = _pool(primary, backup, hedge_delay=0.1)
+
+    chunks = [c async for c in pool.stream_chat_completion(_payload())]
+    assert chunks == ["快", "速"]
+    assert backup.requests[0]["stream"] is True
+
+
+@pytest.mark.asyncio
+async def test_model_map_limits_backup_models(stand_in):
+    """测试备用服务商只接收 model_map 中映射的模型，并改写模型名"""
+    primary = stand_in(status=503)
+    backup = stand_in(reply="backup")
+    pool = ProviderPool(
+        [
+            ProviderConfig(name="primary", base_url=primary.base_url, api_key="k"),
+            ProviderConfig(name="backup", base_url=backup.base_url, api_key="k", model_map={"qwen-plus": "deepseek-chat"}),
+        ],
+        scheduler=LLMScheduler(ModelLimits(reserved_interactive=0))
+    )
+
+    await pool.chat_completion(_payload())
+    assert backup.requests[0]["model"] == "deepseek-chat"
+
+    with pytest.raises(ProviderError):
+        await pool.chat_completion({**_payload(), "model": "qwen3-vl-plus"})
+    assert len(backup.requests) == 1
+
+
+def test_sync_call_fails_over():
+    """测试同步调用按顺序故障转移"""
+    pool = ProviderPool(
+        [ProviderConfig(name="a", base_url="http://a"), ProviderConfig(name="b", base_url="http://b")],
+        scheduler=LLMScheduler(ModelLimits(reserved_interactive=0))
+    )
+
+    def run(provider, model, ticket):
+        if provider.name == "a":
+            raise ConnectionError("refused")
+        return provider.name
+
+    assert pool.call_sync("qwen-plus", run) == "b"
+    assert pool.stats()["providers"][0]["failures"] == 1
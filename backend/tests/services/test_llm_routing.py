@@ -0,0 +1,108 @@
+import pytest
+from app.services import llm_routing
+from app.services.ai.base_ai_service import BaseAIService
+from app.services.diagnosis_agent import DiagnosisAgent
+from app.services.llm_provider import LLMProvider
+from app.services.llm_routing import LLMTask, TaskLatencyStats, get_task_latency_stats, resolve_task
+
+
+ROUTES = {
+    "quick_options": {"model": "qwen-turbo", "max_tokens": 300},
+    "assessment": {"model": "qwen-turbo", "temperature": 0.1},
+}
+
+
+class RecordingPool:
+    """记录请求参数的服务商池"""
+
+    def __init__(self):
+        self.payloads = []
+
+    async def chat_completion(self, payload, **kwargs):
+        self.payloads.append(payload)
+        return {"choices": [{"message": {"content": "ok"}}]}
+
+
+@pytest.fixture
+def routes(monkeypatch):
+    monkeypatch.setattr(llm_routing.settings, "LLM_TASK_ROUTES", ROUTES)
+    get_task_latency_stats().clear()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    recording = RecordingPool()
+    monkeypatch.setattr(LLMProvider, "_pool", recording)
+    return recording
+
+
+def test_route_overrides_caller_defaults(routes):
+    """测试路由表中的配置优先，未配置的字段沿用调用方参数"""
+    route = resolve_task(LLMTask.QUICK_OPTIONS, model="qwen-plus", temperature=0.5, max_tokens=1000)
+    assert (route.model, route.temperature, route.max_tokens) == ("qwen-turbo", 0.5, 300)
+
+    route = resolve_task(LLMTask.DIAGNOSIS, model="qwen-plus", temperature=0.5, max_tokens=1000)
+    assert (route.model, route.temperature, route.max_tokens) == ("qwen-plus", 0.5, 1000)
+
+    route = resolve_task(None)
+    assert route.model == llm_routing.settings.LLM_MODEL
+
+
+@pytest.mark.asyncio
+async def test_diagnosis_agent_routes_by_task(routes, pool):
+    """测试问诊智能体按任务选择模型，并记录各任务耗时"""
+    agent = DiagnosisAgent()
+    agent.api_key = "test"
+
+    await agent._call_llm("system", "prompt", temperature=0.5, task=LLMTask.QUICK_OPTIONS)
+    await agent._call_llm("system", "prompt", temperature=0.3, task=LLMTask.ASSESSMENT)
+    await agent._call_llm("system", "prompt", temperature=0.5)
+
+    quick, assessment, diagnosis = pool.payloads
+    assert (quick["model"], quick["max_tokens"], quick["temperature"]) == ("qwen-turbo", 300, 0.5)
+    assert (assessment["model"], assessment["max_tokens"], assessment["temperature"]) == ("qwen-turbo", 1000, 0.1)
+    assert diagnosis["model"] == agent.model
+
+    stats = get_task_latency_stats().stats()
+    assert stats["quick_options"]["qwen-turbo"]["count"] == 1
+    assert stats["diagnosis"][agent.model]["count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_ai_service_uses_default_task(routes, pool):
+    """测试 AI 服务的默认任务与单次调用指定的任务"""
+    service = BaseAIService(max_tokens=2000, task=LLMTask.SUMMARY)
+    service.api_key = "test"
+
+    await service._call_llm("system", "prompt")
+    await service._call_llm("system", "prompt", max_tokens=600, task=LLMTask.QUICK_OPTIONS)
+
+    summary, quick = pool.payloads
+    assert (summary["model"], summary["max_tokens"]) == (service.model, 2000)
+    assert (quick["model"], quick["max_tokens"]) == ("qwen-turbo", 300)
+    assert get_task_latency_stats().stats()["summary"][service.model]["count"] == 1
+
+
+def test_task_llm_instances_cached_per_task(routes, monkeypatch):
+    """测试 LLMProvider 按任务返回独立配置的 LLM 实例"""
+    monkeypatch.setattr(LLMProvider, "_task_llms", {})
+    quick = LLMProvider.get_llm(task=LLMTask.QUICK_OPTIONS)
+    assert quick.model_name == "qwen-turbo"
+    assert quick.max_tokens == 300
+    assert quick.task == LLMTask.QUICK_OPTIONS
+    assert LLMProvider.get_llm(task=LLMTask.QUICK_OPTIONS) is quick
+
+
+def test_latency_stats_records_errors():
+    """测试耗时统计记录失败次数与分位数"""
+    stats = TaskLatencyStats(window=10)
+    for ms in range(1, 21):
+        stats.record("summary", "qwen-plus", ms / 1000)
+    with pytest.raises(RuntimeError):
+        with stats.track("summary", "qwen-plus"):
+            raise RuntimeError("timeout")
+
+    summary = stats.stats()["summary"]["qwen-plus"]
+    assert summary["count"] == 21
+    assert summary["errors"] == 1
+    assert summary["p95_ms"] >= summary["p50_ms"]
@@ -0,0 +1,176 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from app.services.llm_scheduler import (
+    DEFAULT_LANE_ORDER, LLMScheduler, ModelLimits, Priority, current_priority, llm_priority, parse_lane_order,
+    priority_for_state
+)
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limited_per_model():
+    """测试单个模型的并发数不超过上限"""
+    scheduler = LLMScheduler(ModelLimits(max_concurrency=2, reserved_interactive=0))
+    running = 0
+    peak = 0
+
+    async def call():
+        nonlocal running, peak
+        async with scheduler.slot("qwen-plus", priority=Priority.INTERACTIVE):
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.02)
+            running -= 1
+
+    await asyncio.gather(*[call() for _ in range(6)])
+    assert peak == 2
+    stats = scheduler.stats()["qwen-plus"]
+    assert stats["active"] == 0
+    assert stats["lanes"]["interactive"]["granted"] == 6
+
+
+@pytest.mark.asyncio
+async def test_models_limited_independently():
+    """测试不同模型互不占用名额"""
+    scheduler = LLMScheduler(ModelLimits(max_concurrency=1, reserved_interactive=0))
+    await scheduler.acquire("qwen-plus")
+    ticket = await asyncio.wait_for(scheduler.acquire("qwen-vl-plus"), timeout=1)
+    scheduler.release(ticket)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("lane_order, expected", [
+    (DEFAULT_LANE_ORDER, [Priority.INTERACTIVE, Priority.EMERGENCY, Priority.BACKGROUND]),
+    (parse_lane_order(["emergency"]), [Priority.EMERGENCY, Priority.INTERACTIVE, Priority.BACKGROUND]),
+])
+async def test_higher_priority_dispatched_first(lane_order, expected):
+    """测试名额释放后按优先级顺序放行（默认 在线 > 紧急 > 后台，可配置）"""
+    scheduler = LLMScheduler(ModelLimits(max_concurrency=1, reserved_interactive=0), lane_order=lane_order)
+    holder = await scheduler.acquire("m", priority=Priority.INTERACTIVE)
+    order = []
+
+    async def call(priority):
+        async with scheduler.slot("m", priority=priority):
+            order.append(priority)
+
+    tasks = [
+        asyncio.create_task(call(Priority.BACKGROUND)),
+        asyncio.create_task(call(Priority.EMERGENCY)),
+        asyncio.create_task(call(Priority.INTERACTIVE)),
+    ]
+    await asyncio.sleep(0.01)
+    assert scheduler.stats()["m"]["lanes"]["background"]["queued"] == 1
+    scheduler.release(holder)
+    await asyncio.gather(*tasks)
+    assert order == expected
+
+
+def test_parse_lane_order():
+    """测试优先级顺序配置解析"""
+    assert parse_lane_order(["Background", "interactive"]) == [Priority.BACKGROUND, Priority.INTERACTIVE, Priority.EMERGENCY]
+    with pytest.raises(ValueError):
+        parse_lane_order(["urgent"])
+
+
+@pytest.mark.asyncio
+async def test_background_cannot_use_reserved_slots():
+    """测试后台任务不占用为在线问诊预留的名额"""
+    scheduler = LLMScheduler(ModelLimits(max_concurrency=3, reserved_interactive=1))
+    await scheduler.acquire("m", priority=Priority.BACKGROUND)
+    await scheduler.acquire("m", priority=Priority.BACKGROUND)
+
+    blocked = asyncio.create_task(scheduler.acquire("m", priority=Priority.BACKGROUND))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+
+    interactive = await asyncio.wait_for(scheduler.acquire("m", priority=Priority.INTERACTIVE), timeout=1)
+    assert scheduler.stats()["m"]["active"] == 3
+    blocked.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await blocked
+    scheduler.release(interactive)
+    assert scheduler.stats()["m"]["lanes"]["background"]["queued"] == 0
+
+
+@pytest.mark.asyncio
+async def test_token_budget_delays_until_refilled():
+    """测试每分钟 token 预算不足时等待补充，并按实际用量退还"""
+    scheduler = LLMScheduler(ModelLimits(max_concurrency=10, tokens_per_minute=6000, reserved_interactive=0))
+    first = await scheduler.acquire("m", tokens=6000)
+    scheduler.release(first, used_tokens=5900)  # 退还 100
+
+    start = time.monotonic()
+    second = await asyncio.wait_for(scheduler.acquire("m", tokens=150), timeout=2)
+    waited = time.monotonic() - start
+    scheduler.release(second)
+    # 补充速度 100 token/秒，还差约 50 token
+    assert 0.3 < waited < 1.5
+
+
+@pytest.mark.asyncio
+async def test_throttle_pauses_model():
+    """测试 429 限流期间暂停放行"""
+    scheduler = LLMScheduler(ModelLimits(max_concurrency=4, reserved_interactive=0))
+    scheduler.throttle("m", 0.2)
+    start = time.monotonic()
+    async with scheduler.slot("m"):
+        pass
+    assert time.monotonic() - start >= 0.15
+    assert scheduler.stats()["m"]["throttled_count"] == 1
+
+
+def test_sync_acquire_from_threads():
+    """测试线程中的同步调用同样受并发上限约束"""
+    scheduler = LLMScheduler(ModelLimits(max_concurrency=2, reserved_interactive=0))
+    lock = threading.Lock()
+    running = 0
+    peak = 0
+
+    def call():
+        nonlocal running, peak
+        with scheduler.slot_sync("m"):
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+
+    threads = [threading.Thread(target=call) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=5)
+    assert peak == 2
+    assert scheduler.stats()["m"]["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_sync_acquire_in_event_loop_rejected():
+    """测试事件循环线程中的同步调用直接报错（不绕过调度，也不卡住事件循环），线程中正常排队"""
+    scheduler = LLMScheduler(ModelLimits(max_concurrency=1, reserved_interactive=0))
+    holder = await scheduler.acquire("m")
+    with pytest.raises(RuntimeError):
+        scheduler.acquire_sync("m")
+    assert scheduler.stats()["m"]["active"] == 1
+
+    waiting = asyncio.create_task(asyncio.to_thread(scheduler.acquire_sync, "m"))
+    await asyncio.sleep(0.05)
+    assert not waiting.done()
+    scheduler.release(holder)
+    scheduler.release(await asyncio.wait_for(waiting, timeout=1))
+    assert scheduler.stats()["m"]["active"] == 0
+
+
+def test_priority_context():
+    """测试优先级上下文与会话风险等级映射"""
+    assert current_priority() == Priority.INTERACTIVE
+    assert current_priority(Priority.BACKGROUND) == Priority.BACKGROUND
+    with llm_priority(Priority.EMERGENCY):
+        assert current_priority(Priority.BACKGROUND) == Priority.EMERGENCY
+    assert current_priority() == Priority.INTERACTIVE
+    assert priority_for_state({"risk_level": "emergency"}) == Priority.EMERGENCY
+    assert priority_for_state({"risk_level": "low"}) == Priority.INTERACTIVE
+    assert priority_for_state(None) == Priority.INTERACTIVE
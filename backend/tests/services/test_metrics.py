@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from app.middleware import MetricsMiddleware
+from app.services.llm_scheduler import LLMScheduler, ModelLimits
+from app.services.metrics import (
+    AGENT_FIRST_TOKEN_SECONDS, AGENT_GENERATION_SECONDS, DB_QUERY_SECONDS, GRAPH_NODE_SECONDS,
+    HTTP_REQUEST_SECONDS, LLM_TOKENS,
+    GenerationTimer, GraphNodeTimer, MetricsRegistry, instrument_engine
+)
+
+
+def test_render_prometheus_text_format():
+    """测试 Counter / Gauge / Histogram 的文本格式输出"""
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "请求数", ("route",))
+    gauge = registry.gauge("queue_depth", "队列深度")
+    histogram = registry.histogram("latency_seconds", "耗时", ("route",), buckets=(0.1, 1.0))
+
+    counter.inc(route="/a")
+    counter.inc(2, route="/a")
+    gauge.set(5)
+    histogram.observe(0.05, route="/a")
+    histogram.observe(0.5, route="/a")
+    histogram.observe(3, route="/a")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{route="/a"} 3' in lines
+    assert "queue_depth 5" in lines
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{route="/a"} 3' in lines
+    assert 'latency_seconds_sum{route="/a"} 3.55' in lines
+
+
+def test_label_cardinality_bounded():
+    """测试标签组合超过上限后归入 other"""
+    registry = MetricsRegistry()
+    counter = registry.counter("events_total", "事件数", ("session",), max_series=3)
+    for i in range(10):
+        counter.inc(session=f"s{i}")
+
+    assert counter.value(session="s0") == 1
+    assert counter.value(session="other") == 7
+    assert len(counter._series) == 4
+    with pytest.raises(ValueError):
+        counter.inc(wrong="x")
+
+
+def test_collectors_run_before_render():
+    """测试渲染前调用采集回调，采集异常不影响输出"""
+    registry = MetricsRegistry()
+    gauge = registry.gauge("buffers", "缓冲数")
+    registry.add_collector(lambda: gauge.set(7))
+    registry.add_collector(lambda: 1 / 0)
+    assert "buffers 7" in registry.render().splitlines()
+
+
+def test_http_middleware_uses_route_template():
+    """测试 HTTP 耗时按路由模板记录，未匹配路径归为 unmatched"""
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int):
+        return {"id": item_id}
+
+    HTTP_REQUEST_SECONDS.clear()
+    client = TestClient(app)
+    for i in range(3):
+        client.get(f"/items/{i}")
+    client.get("/missing")
+
+    assert HTTP_REQUEST_SECONDS.snapshot(method="GET", route="/items/{item_id}", status=200)["count"] == 3
+    assert HTTP_REQUEST_SECONDS.snapshot(method="GET", route="unmatched", status=404)["count"] == 1
+
+
+def test_graph_node_timer_from_events():
+    """测试从 astream_events 事件计算节点耗时，忽略节点内部的子 chain"""
+    GRAPH_NODE_SECONDS.clear()
+    timer = GraphNodeTimer("TestAgent")
+    events = [
+        {"event": "on_chain_start", "name": "LangGraph", "run_id": "g", "metadata": {}},
+        {"event": "on_chain_start", "name": "diagnose", "run_id": "1", "metadata": {"langgraph_node": "diagnose"}},
+        {"event": "on_chain_start", "name": "RunnableSequence", "run_id": "2", "metadata": {"langgraph_node": "diagnose"}},
+        {"event": "on_chain_end", "name": "RunnableSequence", "run_id": "2", "metadata": {"langgraph_node": "diagnose"}},
+        {"event": "on_chain_end", "name": "diagnose", "run_id": "1", "metadata": {"langgraph_node": "diagnose"}},
+        {"event": "on_chain_end", "name": "LangGraph", "run_id": "g", "metadata": {}},
+    ]
+    for event in events:
+        timer.observe(event)
+
+    assert GRAPH_NODE_SECONDS.snapshot(graph="TestAgent", node="diagnose")["count"] == 1
+    assert GRAPH_NODE_SECONDS.snapshot(graph="TestAgent", node="RunnableSequence")["count"] == 0
+
+
+def test_generation_timer_records_once():
+    """测试首字耗时只记录一次"""
+    timer = GenerationTimer("metrics_test")
+    before = AGENT_FIRST_TOKEN_SECONDS.snapshot(agent_type="metrics_test")["count"]
+    timer.first_token()
+    timer.first_token()
+    timer.finish()
+    timer.finish("error")
+    assert AGENT_FIRST_TOKEN_SECONDS.snapshot(agent_type="metrics_test")["count"] == before + 1
+    assert AGENT_GENERATION_SECONDS.snapshot(agent_type="metrics_test", outcome="ok")["count"] >= 1
+    assert AGENT_GENERATION_SECONDS.snapshot(agent_type="metrics_test", outcome="error")["count"] == 0
+
+
+def test_db_query_duration_by_operation():
+    """测试数据库语句按操作类型记录耗时"""
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    instrument_engine(engine)  # 重复调用不重复注册
+    DB_QUERY_SECONDS.clear()
+
+    with engine.connect() as conn:
+        conn.execute(text("CREATE TABLE t (x INTEGER)"))
+        conn.execute(text("INSERT INTO t VALUES (1)"))
+        conn.execute(text("SELECT x FROM t")).fetchall()
+        with pytest.raises(Exception):
+            conn.execute(text("SELECT y FROM missing"))
+
+    assert DB_QUERY_SECONDS.snapshot(operation="INSERT")["count"] == 1
+    assert DB_QUERY_SECONDS.snapshot(operation="SELECT")["count"] == 2
+    assert DB_QUERY_SECONDS.snapshot(operation="OTHER")["count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_scheduler_counts_used_tokens():
+    """测试调度器释放名额时累计实际 token 用量"""
+    scheduler = LLMScheduler(ModelLimits(reserved_interactive=0))
+    before = LLM_TOKENS.value(model="metrics-model")
+    ticket = await scheduler.acquire("metrics-model", tokens=100)
+    scheduler.release(ticket, used_tokens=42)
+    async with scheduler.slot("metrics-model"):
+        await asyncio.sleep(0)
+    assert LLM_TOKENS.value(model="metrics-model") == before + 42
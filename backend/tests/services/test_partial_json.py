@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from app.services.ai.partial_json import PartialJsonParser, StructuredStream
+from app.services.dermatology import react_tools
+from app.services.stream_replay import TurnStreamBuffer, emit_turn_event, turn_events
+
+CARD = {
+    "summary": "手臂红疹伴瘙痒，\"夜间\"加重 \\ 3天",
+    "conditions": [
+        {"name": "湿疹", "confidence": 0.72, "rationale": ["红斑丘疹", "剧烈瘙痒"]},
+        {"name": "接触性皮炎", "confidence": 1e-1, "rationale": []},
+    ],
+    "risk_level": "low",
+    "need_offline_visit": False,
+    "urgency": None,
+    "care_plan": ["保湿", "避免搔抓"],
+}
+
+
+def _feed(parser, text, size):
+    updates = []
+    for i in range(0, len(text), size):
+        updates.extend(parser.feed(text[i:i + size]))
+    return updates
+
+
+@pytest.mark.parametrize("size", [1, 4, 17, 10000])
+def test_fields_reported_as_soon_as_complete(size):
+    """测试任意切分方式下字段按路径逐个报告，最终结果与 json.loads 一致"""
+    text = "以下是诊断结果：\n```json\n" + json.dumps(CARD, ensure_ascii=size % 2 == 0) + "\n```"
+    parser = PartialJsonParser()
+    updates = _feed(parser, text, size)
+    assert parser.done and not parser.failed
+    assert parser.value == CARD
+    assert updates[:3] == [
+        ("summary", CARD["summary"]),
+        ("conditions[0].name", "湿疹"),
+        ("conditions[0].confidence", 0.72),
+    ]
+    assert ("conditions[1].rationale", []) in updates
+    assert ("urgency", None) in updates
+
+
+def test_name_reported_before_rest_of_object_arrives():
+    """测试 conditions[0].name 在对象其余部分到达前即可报告，半截字符串不报告"""
+    parser = PartialJsonParser()
+    assert parser.feed('{"conditions": [{"name": "湿') == []
+    assert parser.feed('疹", "confi') == [("conditions[0].name", "湿疹")]
+    assert parser.value == {"conditions": [{"name": "湿疹"}]}
+
+
+def test_malformed_output_falls_back_to_parse_json():
+    """测试非法 JSON 停止报告，结果回退到原有解析逻辑"""
+    stream = StructuredStream("card")
+    stream.feed('{"summary": "红疹", "risk_level": low}')
+    assert stream.parser.failed
+    assert stream.result({"summary": ""}) == {"summary": ""}
+
+    # 说明文字里的括号不影响之后的 JSON
+    stream = StructuredStream("card")
+    stream.feed('[注意] 结果：{"risk_level": "high"}')
+    assert stream.result() == {"risk_level": "high"}
+
+
+@pytest.mark.asyncio
+async def test_turn_events_from_worker_threads_precede_complete():
+    """测试线程中写入的事件在 turn_events 退出前全部进入缓冲"""
+    buffer = TurnStreamBuffer(turn_id="t1", session_id="s1", user_id=1)
+    assert emit_turn_event("structured_partial", {}) is False
+
+    def work():
+        for i in range(20):
+            emit_turn_event("structured_partial", {"i": i})
+
+    async with turn_events(buffer):
+        await asyncio.to_thread(work)
+        emit_turn_event("structured_partial", {"i": 20})
+    await buffer.append("complete", {})
+
+    assert [json.loads(data).get("i") for _, _, data in buffer.events[:-1]] == list(range(21))
+    assert buffer.events[-1][1] == "complete"
+
+
+@pytest.mark.asyncio
+async def test_structured_diagnosis_streams_partial_events(monkeypatch):
+    """测试结构化诊断工具流式生成时推送 structured_partial 事件，并返回完整诊断卡"""
+    model = GenericFakeChatModel(messages=iter([AIMessage(content=json.dumps(CARD, ensure_ascii=False, indent=1))]))
+    monkeypatch.setattr(react_tools.LLMProvider, "get_llm", classmethod(lambda cls, task=None: model))
+
+    buffer = TurnStreamBuffer(turn_id="t2", session_id="s2", user_id=1)
+    args = {"symptoms": ["红疹"], "location": "手臂", "duration": "3天"}
+    async with turn_events(buffer):
+        result = await asyncio.to_thread(react_tools.generate_structured_diagnosis.invoke, args)
+
+    assert result["conditions"][0]["name"] == "湿疹"
+    assert result["care_plan"] == CARD["care_plan"]
+    paths = [u["path"] for _, event, data in buffer.events for u in json.loads(data)["updates"]]
+    assert {event for _, event, _ in buffer.events} == {"structured_partial"}
+    assert paths.index("summary") < paths.index("conditions[0].name") < paths.index("care_plan[1]")
@@ -0,0 +1,122 @@
+import pytest
+from langchain_core.messages import HumanMessage
+
+from app.services.ai import prompt_cache
+from app.services.ai.prompt_cache import (
+    DYNAMIC, SEMI_STATIC, PromptAssembly, get_prompt_cache_stats, record_usage, record_usage_metadata,
+    strip_cache_markers
+)
+from app.services.llm_pool import ProviderConfig, ProviderPool
+from app.services.llm_scheduler import LLMScheduler, ModelLimits
+from app.services.qwen_service import QwenService
+from benchmarks.mock_llm_server import MockConfig, MockLLMServer
+
+RULES = "你是一位皮肤科医生。\n" * 30
+
+
+@pytest.fixture
+def cache_models(monkeypatch):
+    monkeypatch.setattr(prompt_cache.settings, "LLM_PROMPT_CACHE_MODELS", ["qwen-plus"])
+    monkeypatch.setattr(prompt_cache.settings, "LLM_PROMPT_CACHE_MIN_TOKENS", 100)
+
+
+@pytest.fixture(autouse=True)
+def reset_stats():
+    get_prompt_cache_stats().reset()
+    yield
+    get_prompt_cache_stats().reset()
+
+
+def test_segments_ordered_static_to_dynamic():
+    """测试片段按 静态 → 半静态 → 动态 排列，同级保持添加顺序，空片段忽略"""
+    prompt = PromptAssembly().add("资料", DYNAMIC).add("人设", SEMI_STATIC).add("规则一").add("").add("摘要", DYNAMIC).add("规则二")
+    assert prompt.text() == "规则一\n\n规则二\n\n人设\n\n资料\n\n摘要"
+    assert prompt.prefix == "规则一\n\n规则二\n\n人设"
+
+
+def test_doctor_prompt_prefix_independent_of_rag():
+    """测试通用问诊的系统提示词：同一医生的前缀不受 RAG 资料影响，RAG 资料位于末尾"""
+    a = QwenService.assemble_system_prompt("张三", "主任医师", "内科", rag_context="资料A")
+    b = QwenService.assemble_system_prompt("张三", "主任医师", "内科", rag_context="资料B")
+    other = QwenService.assemble_system_prompt("李四", "主治医师", "外科")
+    assert a.prefix == b.prefix
+    assert a.text().endswith("请结合以上参考资料回答患者问题。")
+    assert other.text().startswith(QwenService.DEFAULT_RULES)
+
+
+def test_cache_markers_only_for_supported_models(cache_models):
+    """测试只对支持的模型、且前缀达到最小长度时加显式缓存标记"""
+    prompt = PromptAssembly().add(RULES).add("关键信息", DYNAMIC)
+    content = prompt.content("qwen-plus")
+    assert content[0] == {"type": "text", "text": RULES.strip(), "cache_control": {"type": "ephemeral"}}
+    assert content[1]["text"] == "\n\n关键信息"
+    assert prompt.content("qwen-turbo") == prompt.text()
+    assert PromptAssembly().add("短").content("qwen-plus") == "短"
+
+
+def test_strip_cache_markers(cache_models):
+    """测试去掉缓存标记后还原为与未加标记时一致的纯文本，无标记的消息原样返回"""
+    prompt = PromptAssembly().add(RULES).add("关键信息", DYNAMIC)
+    user = {"role": "user", "content": "你好"}
+    stripped = strip_cache_markers([prompt.system_message("qwen-plus"), user])
+    assert stripped[0]["content"] == prompt.text()
+    assert stripped[1] is user
+
+    message = prompt.langchain_message("qwen-plus")
+    assert strip_cache_markers([message])[0].content == prompt.text()
+    assert isinstance(message.content, list)
+
+    image = HumanMessage(content=[
+        {"type": "text", "text": "看看", "cache_control": {"type": "ephemeral"}},
+        {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}},
+    ])
+    assert strip_cache_markers([image])[0].content == [
+        {"type": "text", "text": "看看"},
+        {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}},
+    ]
+
+
+def test_backup_provider_receives_plain_prompt(cache_models):
+    """测试显式缓存标记只发给主服务商"""
+    pool = ProviderPool(
+        [ProviderConfig(name="primary", base_url="http://a", api_key="k"),
+         ProviderConfig(name="backup", base_url="http://b", api_key="k")],
+        scheduler=LLMScheduler(ModelLimits(reserved_interactive=0))
+    )
+    payload = {"model": "qwen-plus", "messages": [PromptAssembly().add(RULES).system_message("qwen-plus")]}
+    primary, backup = pool.providers[0].config, pool.providers[1].config
+    assert isinstance(pool._payload_for(primary, payload, "qwen-plus")["messages"][0]["content"], list)
+    assert pool._payload_for(backup, payload, "deepseek-chat")["messages"][0]["content"] == RULES.strip()
+    assert pool._payload_for(backup, payload, "deepseek-chat")["model"] == "deepseek-chat"
+
+
+def test_usage_recorded_as_cached_ratio():
+    """测试按模型累计缓存命中比例（OpenAI usage 与 LangChain usage_metadata 两种格式）"""
+    record_usage("qwen-plus", {"prompt_tokens": 1000, "prompt_tokens_details": {"cached_tokens": 800}})
+    record_usage("qwen-plus", {"prompt_tokens": 1000})
+    record_usage_metadata("qwen-turbo", {"input_tokens": 400, "input_token_details": {"cache_read": 100}})
+    record_usage("qwen-plus", None)
+    assert get_prompt_cache_stats().stats() == [
+        {"model": "qwen-plus", "requests": 2, "prompt_tokens": 2000, "cached_tokens": 800, "cached_ratio": 0.4},
+        {"model": "qwen-turbo", "requests": 1, "prompt_tokens": 400, "cached_tokens": 100, "cached_ratio": 0.25},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_pool_records_usage_for_plain_and_stream_calls():
+    """测试服务商池从非流式响应与流式结束片段中读取 usage，重复的系统提示词计为命中缓存"""
+    config = MockConfig(first_token_latency=0, jitter=0, tokens_per_second=0, reply_tokens=8, seed=1)
+    with MockLLMServer(config) as server:
+        pool = ProviderPool(
+            [ProviderConfig(name="mock", base_url=server.base_url, api_key="k")],
+            scheduler=LLMScheduler(ModelLimits(reserved_interactive=0))
+        )
+        messages = [{"role": "system", "content": RULES}, {"role": "user", "content": "你好"}]
+        await pool.chat_completion({"model": "qwen-plus", "messages": messages})
+        chunks = [c async for c in pool.stream_chat_completion({"model": "qwen-plus", "messages": messages})]
+
+    assert "".join(chunks)
+    stats = get_prompt_cache_stats().stats()[0]
+    assert stats["requests"] == 2
+    assert stats["cached_tokens"] == len(RULES)
+    assert 0.4 < stats["cached_ratio"] < 0.5
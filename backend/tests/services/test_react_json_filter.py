@@ -0,0 +1,53 @@
+import json
+import time
+
+import pytest
+
+from app.services.dermatology.react_wrapper import StreamingJsonFilter, _filter_json_from_response
+
+DIAGNOSIS = json.dumps({
+    "summary": "手臂红疹伴瘙痒",
+    "conditions": [{"name": "湿疹", "confidence": 0.7, "rationale": ["瘙痒 {夜间加重}"]}],
+    "note": "引号 \" 与反斜杠 \\ 以及 } 括号",
+}, ensure_ascii=False, indent=2)
+
+REPLY = f"根据您的描述，可能是湿疹。\n\n{DIAGNOSIS}\n\n请保持皮肤湿润{{如有不适}}及时就医。"
+EXPECTED = "根据您的描述，可能是湿疹。\n\n请保持皮肤湿润{如有不适}及时就医。"
+
+
+def _stream(text, size):
+    json_filter = StreamingJsonFilter()
+    parts = [json_filter.process_chunk(text[i:i + size]) for i in range(0, len(text), size)]
+    return parts, "".join(parts) + json_filter.flush()
+
+
+def test_filter_removes_json_keeps_text_braces():
+    """测试过滤内嵌 JSON（字符串内的括号与转义不影响配对），保留普通文本中的括号"""
+    assert _filter_json_from_response(REPLY) == EXPECTED
+    assert _filter_json_from_response(DIAGNOSIS) == ""
+    assert _filter_json_from_response('公式 {x} 与 {"a": 1} 结束') == "公式 {x} 与  结束"
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 50])
+def test_streaming_output_independent_of_chunking(size):
+    """测试任意切分方式下流式输出与整段过滤一致，且 JSON 内容从不出现在已发送的片段中"""
+    parts, output = _stream(REPLY, size)
+    assert output.replace("\n\n\n\n", "\n\n") == EXPECTED
+    assert not any('"summary"' in part or "confidence" in part for part in parts)
+
+
+def test_text_streams_without_waiting_for_unclosed_brace():
+    """测试未闭合的 `{` 不会把后续文本一直扣留到流结束"""
+    json_filter = StreamingJsonFilter()
+    assert json_filter.process_chunk("建议{") == "建议"
+    assert json_filter.process_chunk("先观察") == "{先观察"
+    assert json_filter.process_chunk('，详见 {"risk_level": "lo') == "，详见 "
+    assert json_filter.flush() == ""
+
+
+def test_unbalanced_braces_linear():
+    """测试大量未闭合括号时耗时为线性（旧实现每个括号都扫描到文本末尾）"""
+    text = "皮疹反复发作，夜间瘙痒明显{" * 20000
+    start = time.perf_counter()
+    assert _filter_json_from_response(text) == text.strip()
+    assert time.perf_counter() - start < 1.0
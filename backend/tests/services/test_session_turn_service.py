@@ -0,0 +1,100 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models.session_turn import SessionLock
+from app.services.session_turn_service import (
+    SessionBusyError,
+    SessionTurnLock,
+    compute_request_hash,
+)
+
+
+@pytest.fixture
+def session_factory(make_session_factory):
+    return make_session_factory(SessionLock)
+
+
+def test_request_hash_stable():
+    """测试请求指纹与字段顺序无关"""
+    a = compute_request_hash("你好", [{"type": "image", "url": "u"}], "conversation")
+    b = compute_request_hash("你好", [{"url": "u", "type": "image"}], "conversation")
+    c = compute_request_hash("你好", [], "conversation")
+    assert a == b
+    assert a != c
+
+
+@pytest.mark.asyncio
+async def test_turns_serialized_across_workers(session_factory):
+    """测试两个 worker 的锁实例对同一会话互斥"""
+    worker_a = SessionTurnLock(poll_interval=0.01, session_factory=session_factory)
+    worker_b = SessionTurnLock(poll_interval=0.01, session_factory=session_factory)
+    order = []
+
+    async def run_turn(lock, name):
+        owner = await lock.acquire("s1")
+        order.append(f"{name}-start")
+        await asyncio.sleep(0.05)
+        order.append(f"{name}-end")
+        lock.release("s1", owner)
+
+    await asyncio.gather(run_turn(worker_a, "a"), run_turn(worker_b, "b"))
+    assert order in (
+        ["a-start", "a-end", "b-start", "b-end"],
+        ["b-start", "b-end", "a-start", "a-end"],
+    )
+
+
+@pytest.mark.asyncio
+async def test_different_sessions_run_concurrently(session_factory):
+    """测试不同会话互不阻塞"""
+    lock = SessionTurnLock(wait_timeout=0.1, session_factory=session_factory)
+    owner1 = await lock.acquire("s1")
+    owner2 = await lock.acquire("s2")
+    lock.release("s1", owner1)
+    lock.release("s2", owner2)
+
+
+@pytest.mark.asyncio
+async def test_busy_session_times_out(session_factory):
+    """测试等待超时抛出 SessionBusyError"""
+    holder = SessionTurnLock(session_factory=session_factory)
+    waiter = SessionTurnLock(wait_timeout=0.05, poll_interval=0.01, session_factory=session_factory)
+    owner = await holder.acquire("s1")
+    with pytest.raises(SessionBusyError):
+        await waiter.acquire("s1")
+    holder.release("s1", owner)
+
+
+@pytest.mark.asyncio
+async def test_expired_lock_taken_over(session_factory):
+    """测试过期的锁可以被抢占"""
+    db = session_factory()
+    db.add(SessionLock(
+        session_id="s1",
+        owner="crashed-worker",
+        expires_at=datetime.utcnow() - timedelta(seconds=1),
+    ))
+    db.commit()
+    db.close()
+
+    lock = SessionTurnLock(wait_timeout=0.1, session_factory=session_factory)
+    owner = await lock.acquire("s1")
+    assert owner != "crashed-worker"
+    lock.release("s1", owner)
+
+
+@pytest.mark.asyncio
+async def test_lock_renewed_while_turn_runs(session_factory):
+    """测试持有期间续租：轮次耗时超过 TTL 时锁不会被其它 worker 抢占"""
+    holder = SessionTurnLock(ttl_seconds=0.15, session_factory=session_factory)
+    waiter = SessionTurnLock(ttl_seconds=0.15, wait_timeout=0.4, poll_interval=0.01, session_factory=session_factory)
+    owner = await holder.acquire("s1")
+    with pytest.raises(SessionBusyError):
+        await waiter.acquire("s1")
+    holder.release("s1", owner)
+    assert not holder._heartbeats
+
+    owner = await waiter.acquire("s1")
+    waiter.release("s1", owner)
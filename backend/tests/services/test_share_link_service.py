@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import uuid
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models import User  # noqa: F401  注册 users 表供外键解析
+from app.models.medical_event import ExportAccessLog, ExportRecord
+from app.services.share_link_service import AccessLogBuffer, ShareLinkService, ShareSnapshot, ShareSnapshotCache
+
+
+@pytest.fixture
+def session_factory(make_session_factory):
+    return make_session_factory(ExportRecord, ExportAccessLog)
+
+
+def make_export(db, **kwargs) -> ExportRecord:
+    export = ExportRecord(user_id=1, event_ids=[1], export_type="link", share_token=uuid.uuid4().hex, **kwargs)
+    db.add(export)
+    db.commit()
+    return export
+
+
+def make_snapshot(export_id=1) -> ShareSnapshot:
+    return ShareSnapshot(export_id=export_id, expires_at=None, share_password=None, events_json=b"[]", export_info=None)
+
+
+def test_consume_view_enforces_max_views(tmp_path):
+    """测试并发访问时访问次数不超过上限"""
+    # 每个线程使用独立连接（文件数据库）
+    engine = create_engine(f"sqlite:///{tmp_path}/share.db", connect_args={"check_same_thread": False, "timeout": 30})
+    ExportRecord.__table__.create(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    db = session_factory()
+    export = make_export(db, max_views=5)
+
+    def visit(_):
+        session = session_factory()
+        try:
+            return ShareLinkService.consume_view(session, export.id)
+        finally:
+            session.close()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(visit, range(20)))
+
+    assert sorted(r for r in results if r is not None) == [1, 2, 3, 4, 5]
+    db.refresh(export)
+    assert export.view_count == 5
+    assert export.last_viewed_at is not None
+    db.close()
+
+
+def test_consume_view_rejects_inactive_or_expired(session_factory):
+    """测试失效或过期的链接不计数"""
+    db = session_factory()
+    inactive = make_export(db, is_active=False)
+    expired = make_export(db, expires_at=datetime.utcnow() - timedelta(minutes=1))
+    active = make_export(db, expires_at=datetime.utcnow() + timedelta(days=1))
+
+    assert ShareLinkService.consume_view(db, inactive.id) is None
+    assert ShareLinkService.consume_view(db, expired.id) is None
+    assert ShareLinkService.consume_view(db, active.id) == 1
+    db.close()
+
+
+def test_snapshot_cache_ttl_and_lru(monkeypatch):
+    """测试快照缓存过期与容量淘汰"""
+    cache = ShareSnapshotCache(ttl_seconds=60, max_entries=2)
+    cache.set("a", make_snapshot(1))
+    cache.set("b", make_snapshot(2))
+    assert cache.get("a").export_id == 1
+    cache.set("c", make_snapshot(3))
+    assert cache.get("b") is None  # 最久未使用的被淘汰
+    cache.invalidate("c")
+    assert cache.get("c") is None
+
+    import app.services.share_link_service as module
+    now = module.time.time()
+    monkeypatch.setattr(module.time, "time", lambda: now + 61)
+    assert cache.get("a") is None
+
+
+def test_access_log_buffer_batches_inserts(session_factory):
+    """测试访问日志批量写入，停止时写入剩余日志"""
+    db = session_factory()
+    export = make_export(db)
+    buffer = AccessLogBuffer(session_factory=session_factory, batch_size=1000, flush_interval=60)
+
+    for i in range(10):
+        buffer.add(export.id, ip_address=f"10.0.0.{i}", user_agent="WeChat")
+    assert db.query(ExportAccessLog).count() == 0
+    assert buffer.pending_count == 10
+
+    buffer.stop()
+    assert buffer.pending_count == 0
+    assert db.query(ExportAccessLog).count() == 10
+    db.close()
+
+
+def test_access_log_buffer_drops_oldest_when_full(session_factory):
+    """测试缓冲已满时丢弃最早的记录"""
+    buffer = AccessLogBuffer(session_factory=session_factory, batch_size=1000, flush_interval=60, max_pending=3)
+    for i in range(5):
+        buffer.add(i + 1)
+    assert buffer.pending_count == 3
+    assert buffer.dropped == 2
+    buffer.stop()
@@ -0,0 +1,68 @@
+import pytest
+
+from app.models import User  # noqa: F401  注册 users 表供外键解析
+from app.models.medical_event import EventAttachment, EventNote, EventSession, ExportRecord, MedicalEvent
+from app.services.ai.similarity_index import EventSimilarityIndex, shingles
+
+
+@pytest.fixture
+def db(make_session_factory):
+    session = make_session_factory(MedicalEvent, EventSession, EventAttachment, EventNote, ExportRecord)()
+    yield session
+    session.close()
+
+
+def test_shingles_mixed_text():
+    """测试中文按字二元组、英文按词切分"""
+    assert shingles("手臂红疹 ECG") == {"手臂", "臂红", "红疹", "ecg"}
+    assert shingles("") == set()
+
+
+def test_query_ranks_similar_events_first():
+    """测试相似事件排在前面，无关事件不返回"""
+    index = EventSimilarityIndex()
+    index.upsert(1, 1, "皮肤科 手臂红疹 瘙痒 两天")
+    index.upsert(1, 2, "皮肤科 手臂红疹 瘙痒加重 扩散到背部")
+    index.upsert(1, 3, "心血管内科 胸闷 心悸 活动后加重")
+    index.upsert(1, 4, "骨科 膝关节疼痛 上下楼梯困难")
+    index.upsert(2, 5, "皮肤科 手臂红疹 瘙痒 两天")
+
+    result = index.query(1, event_id=1, top_k=3)
+    ids = [eid for eid, _ in result]
+    assert ids[0] == 2
+    assert 1 not in ids
+    assert 5 not in ids  # 不跨用户
+    assert 4 not in ids
+
+
+def test_upsert_and_remove():
+    """测试更新文档后签名随之更新，删除后不再召回"""
+    index = EventSimilarityIndex()
+    index.upsert(1, 1, "手臂红疹 瘙痒")
+    index.upsert(1, 2, "胸闷 心悸")
+    assert index.query(1, text="手臂红疹", top_k=1)[0][0] == 1
+
+    index.upsert(1, 2, "手臂红疹 瘙痒 复诊")
+    assert {eid for eid, _ in index.query(1, text="手臂红疹 瘙痒", top_k=2)} == {1, 2}
+
+    index.remove(1, 1)
+    assert [eid for eid, _ in index.query(1, text="手臂红疹 瘙痒", top_k=2)] == [2]
+
+
+def test_ensure_user_syncs_with_database(db):
+    """测试从数据库加载并在数据变化后重新同步"""
+    db.add_all([
+        MedicalEvent(id=1, user_id=7, title="皮肤科", department="皮肤科", chief_complaint="手臂红疹瘙痒"),
+        MedicalEvent(id=2, user_id=7, title="皮肤科复诊", department="皮肤科", chief_complaint="手臂红疹扩散"),
+        MedicalEvent(id=3, user_id=7, title="骨科", department="骨科", chief_complaint="膝关节疼痛"),
+    ])
+    db.commit()
+
+    index = EventSimilarityIndex()
+    index.ensure_user(db, 7)
+    assert index.query(7, event_id=1, top_k=1)[0][0] == 2
+
+    db.delete(db.get(MedicalEvent, 2))
+    db.commit()
+    index.ensure_user(db, 7)
+    assert all(eid != 2 for eid, _ in index.query(7, event_id=1, top_k=5))
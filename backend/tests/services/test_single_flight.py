@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from app.services.ai.single_flight import SingleFlight, content_version
+
+
+def test_content_version_changes_with_content():
+    """测试内容版本随输入变化"""
+    sessions = [{"session_id": "a", "summary": "红疹"}]
+    v1 = content_version("主诉", sessions, [])
+    v2 = content_version("主诉", sessions, [])
+    v3 = content_version("主诉", sessions, [{"content": "新备注"}])
+    assert v1 == v2
+    assert v1 != v3
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_computation():
+    """测试并发相同请求只计算一次"""
+    flight = SingleFlight()
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        return {"summary": "ok"}
+
+    results = await asyncio.gather(*[
+        flight.do(("summary", 1, "v1"), compute) for _ in range(5)
+    ])
+    assert calls == 1
+    assert all(r == {"summary": "ok"} for r in results)
+
+
+@pytest.mark.asyncio
+async def test_result_memoized_until_version_changes():
+    """测试结果按内容版本缓存"""
+    flight = SingleFlight()
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    assert await flight.do(("summary", 1, "v1"), compute) == 1
+    assert await flight.do(("summary", 1, "v1"), compute) == 1
+    assert await flight.do(("summary", 1, "v2"), compute) == 2
+    # 强制刷新跳过缓存
+    assert await flight.do(("summary", 1, "v1"), compute, use_cache=False) == 3
+
+
+@pytest.mark.asyncio
+async def test_failure_not_memoized():
+    """测试失败结果不缓存"""
+    flight = SingleFlight()
+    attempts = 0
+
+    async def compute():
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            raise RuntimeError("LLM 超时")
+        return "ok"
+
+    with pytest.raises(RuntimeError):
+        await flight.do(("find_related", 1, "v1"), compute)
+    assert await flight.do(("find_related", 1, "v1"), compute) == "ok"
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_cancel_computation():
+    """测试某个请求断开不影响其它等待者"""
+    flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    first = asyncio.create_task(flight.do(("merge_events", (1, 2), "v1"), compute))
+    second = asyncio.create_task(flight.do(("merge_events", (1, 2), "v1"), compute))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    assert await second == "done"
+
+
+@pytest.mark.asyncio
+async def test_memo_bounded():
+    """测试缓存条目数量有上限"""
+    flight = SingleFlight(max_entries=2)
+
+    async def compute():
+        return 1
+
+    for i in range(5):
+        await flight.do(("summary", i, "v"), compute)
+    assert len(flight._memo) == 2
@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+import pytest
+from app.services.stream_replay import (
+    TurnStreamRegistry,
+    format_sse,
+    parse_last_event_id,
+)
+
+
+def test_format_sse_with_id():
+    """测试带 id 的 SSE 格式"""
+    assert format_sse(3, "chunk", '{"text": "a"}') == 'id: 3\nevent: chunk\ndata: {"text": "a"}\n\n'
+    assert format_sse(None, "meta", "{}") == "event: meta\ndata: {}\n\n"
+
+
+def test_parse_last_event_id():
+    """测试 Last-Event-ID 解析"""
+    assert parse_last_event_id(None) == 0
+    assert parse_last_event_id("5") == 5
+    assert parse_last_event_id(" 7 ") == 7
+    assert parse_last_event_id("abc") == 0
+    assert parse_last_event_id("-2") == 0
+
+
+@pytest.mark.asyncio
+async def test_buffer_replay_from_last_event_id():
+    """测试从断点续传"""
+    registry = TurnStreamRegistry()
+    buffer = registry.create("s1", user_id=1)
+    await buffer.append("meta", {"turn_id": buffer.turn_id})
+    await buffer.append("chunk", {"text": "你好"})
+    await buffer.append("chunk", {"text": "世界"})
+    await buffer.finish()
+
+    events = [item async for item in buffer.iter_events(1)]
+    assert [e[0] for e in events] == [2, 3]
+    assert events[0][1] == "chunk"
+    assert "你好" in events[0][2]
+
+
+@pytest.mark.asyncio
+async def test_reader_receives_events_while_running():
+    """测试读者在任务运行中持续收到新事件"""
+    registry = TurnStreamRegistry()
+    buffer = registry.create("s1", user_id=1)
+
+    async def producer():
+        for i in range(3):
+            await asyncio.sleep(0.01)
+            await buffer.append("chunk", {"text": str(i)})
+        await buffer.finish()
+
+    task = asyncio.create_task(producer())
+    received = [item async for item in buffer.stream()]
+    await task
+    assert len(received) == 3
+    assert received[-1].startswith("id: 3\n")
+
+
+@pytest.mark.asyncio
+async def test_registry_expires_finished_turns():
+    """测试已完成轮次过期清理"""
+    registry = TurnStreamRegistry(ttl_seconds=0)
+    buffer = registry.create("s1", user_id=1)
+    running = registry.create("s1", user_id=1)
+    await buffer.finish()
+    buffer.finished_at = time.time() - 1
+
+    assert registry.get(buffer.turn_id) is None
+    assert registry.get(running.turn_id) is running
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import logging
+import time
+
+import pytest
+from app.services.structured_logging import (
+    DebugCapture, RateSampler, StructuredFormatter, StructuredLogger, log_context
+)
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def handler():
+    """挂在独立 logger 上的收集器，测试结束后恢复级别"""
+    logger = logging.getLogger("tests.structured")
+    collector = _ListHandler()
+    logger.addHandler(collector)
+    previous = logger.level
+    yield collector
+    logger.removeHandler(collector)
+    logger.setLevel(previous)
+
+
+def _logger(rate=0.0, capture=None):
+    return StructuredLogger("tests.structured", RateSampler(rate), capture or DebugCapture())
+
+
+def test_lazy_fields_not_evaluated_when_disabled(handler):
+    """测试级别未开启时不求值惰性字段"""
+    logging.getLogger("tests.structured").setLevel(logging.INFO)
+    log = _logger()
+    calls = []
+
+    log.debug("state", keys=lambda: calls.append("debug") or ["a"])
+    log.info("state", keys=lambda: calls.append("info") or ["b"])
+
+    assert calls == ["info"]
+    assert len(handler.records) == 1
+    assert handler.records[0].fields == {"keys": ["b"]}
+
+
+def test_sampling_limits_repeated_events(handler):
+    """测试同一事件超过速率后被丢弃，下一条输出带上丢弃数；WARNING 不受限"""
+    logging.getLogger("tests.structured").setLevel(logging.DEBUG)
+    sampler = RateSampler(rate_per_second=0.001, burst=2)
+    log = StructuredLogger("tests.structured", sampler, DebugCapture())
+
+    for _ in range(5):
+        log.debug("chunk")
+    log.debug("other_event")
+    for _ in range(3):
+        log.warning("slow")
+
+    events = [r.getMessage() for r in handler.records]
+    assert events.count("chunk") == 2
+    assert events.count("other_event") == 1
+    assert events.count("slow") == 3
+
+    sampler._buckets[("tests.structured", "chunk")][0] = 1  # 模拟令牌补充
+    log.debug("chunk")
+    assert handler.records[-1].fields["sampled_out"] == 3
+
+
+@pytest.mark.asyncio
+async def test_debug_capture_per_session(handler):
+    """测试对指定会话开启调试捕获后，DEBUG 日志写入环形缓冲，其它会话不受影响"""
+    logging.getLogger("tests.structured").setLevel(logging.WARNING)
+    capture = DebugCapture(capacity=3)
+    log = _logger(capture=capture)
+    capture.enable("s1")
+
+    async def turn(session_id):
+        with log_context(session_id):
+            await asyncio.sleep(0)
+            for i in range(5):
+                log.debug("tool_call", index=i)
+
+    await asyncio.gather(turn("s1"), turn("s2"))
+    log.debug("restored", session_id="s1", stage=lambda: "collecting")
+
+    records = capture.records("s1")
+    assert [r.get("index") for r in records] == [3, 4, None]
+    assert records[-1]["stage"] == "collecting"
+    assert all(r["session_id"] == "s1" for r in records)
+    assert capture.records("s2") is None
+    assert handler.records == []  # 未达到 logger 级别，不输出
+
+    assert capture.disable("s1") is True
+    assert capture.records("s1") is None
+
+
+def test_debug_capture_expires():
+    """测试调试捕获到期自动关闭"""
+    capture = DebugCapture()
+    capture.enable("s1", ttl_seconds=0.001)
+    time.sleep(0.01)
+    assert capture.active("s1") is None
+    assert capture.sessions() == []
+
+
+def test_formatter_outputs(handler):
+    """测试 text 与 json 两种输出格式"""
+    logging.getLogger("tests.structured").setLevel(logging.INFO)
+    _logger().info("turn_complete", turn_id="t1", advice_count=2, title="湿疹 护理")
+    record = handler.records[0]
+
+    text = StructuredFormatter("text").format(record)
+    assert text.split(" ", 3)[1:3] == ["INFO", "tests.structured"]
+    assert 'turn_complete turn_id=t1 advice_count=2 title="湿疹 护理"' in text
+
+    data = json.loads(StructuredFormatter("json").format(record))
+    assert data["event"] == "turn_complete"
+    assert data["advice_count"] == 2
@@ -0,0 +1,219 @@
+"""
+测试 AI 摘要服务的增量模式
+
+通过替换 _call_llm 记录提示词，不依赖真实 LLM
+"""
+import asyncio
+import json
+
+import pytest
+from app.services.ai import summary_service as summary_module
+from app.services.ai.summary_service import AISummaryService, SUMMARY_STATE_KEY
+from app.services.ai.tokens import estimate_tokens, truncate_to_tokens
+
+
+class RecordingSummaryService(AISummaryService):
+    """记录 LLM 调用的摘要服务"""
+
+    def __init__(self, fail_merge: bool = False):
+        super().__init__()
+        self.prompts = []
+        self.fail_merge = fail_merge
+
+    async def _call_llm(self, system_prompt, user_prompt, temperature=None, max_tokens=None, retry_count=3):
+        self.prompts.append(user_prompt)
+        if "单次问诊" in user_prompt:
+            return json.dumps({
+                "summary": "新增问诊：皮疹扩散",
+                "symptoms": ["瘙痒"],
+                "risk_level": "medium"
+            }, ensure_ascii=False)
+        if "新增问诊摘要" in user_prompt:
+            if self.fail_merge:
+                raise RuntimeError("LLM 不可用")
+            return json.dumps({
+                "summary": "合并后的摘要",
+                "symptoms": ["红疹", "瘙痒"],
+                "risk_level": "medium"
+            }, ensure_ascii=False)
+        return json.dumps({"summary": "全量摘要", "symptoms": ["红疹"], "risk_level": "low"}, ensure_ascii=False)
+
+
+def make_session(session_id: str, content: str) -> dict:
+    return {
+        "session_id": session_id,
+        "session_type": "derma",
+        "timestamp": "2026-01-01T10:00:00",
+        "summary": "皮肤科问诊",
+        "messages": [{"role": "user", "content": content}]
+    }
+
+
+@pytest.mark.asyncio
+async def test_full_rebuild_records_state():
+    """测试首次生成为全量模式并记录增量状态"""
+    service = RecordingSummaryService()
+    update = await service.update_summary("手臂红疹", "皮肤科", [make_session("s1", "手臂起红疹")])
+    assert update.mode == "full"
+    assert update.result.summary == "全量摘要"
+    assert "s1" in update.analysis[SUMMARY_STATE_KEY]["sessions"]
+    assert len(service.prompts) == 1
+
+
+@pytest.mark.asyncio
+async def test_new_session_merged_incrementally():
+    """测试新会话只做单次摘要 + 合并，不重发旧对话"""
+    service = RecordingSummaryService()
+    first = await service.update_summary("手臂红疹", "皮肤科", [make_session("s1", "旧对话内容")])
+
+    service.prompts.clear()
+    sessions = first.sessions + [make_session("s2", "皮疹扩散到背部")]
+    assert service.needs_update(sessions, [], [], first.analysis)
+
+    update = await service.update_summary(
+        "手臂红疹", "皮肤科", sessions,
+        existing_summary=first.result.summary,
+        existing_analysis=first.analysis
+    )
+    assert update.mode == "incremental"
+    assert update.result.summary == "合并后的摘要"
+    assert len(service.prompts) == 2
+    assert all("旧对话内容" not in p for p in service.prompts)
+    assert update.sessions[1]["ai_summary"]["summary"] == "新增问诊：皮疹扩散"
+    assert not service.needs_update(update.sessions, [], [], update.analysis)
+
+
+@pytest.mark.asyncio
+async def test_unchanged_event_skips_llm():
+    """测试内容未变化时不调用 LLM"""
+    service = RecordingSummaryService()
+    first = await service.update_summary("手臂红疹", "皮肤科", [make_session("s1", "手臂起红疹")])
+    service.prompts.clear()
+
+    update = await service.update_summary(
+        "手臂红疹", "皮肤科", first.sessions,
+        existing_summary=first.result.summary,
+        existing_analysis=first.analysis
+    )
+    assert update.mode == "unchanged"
+    assert service.prompts == []
+
+
+@pytest.mark.asyncio
+async def test_force_regenerate_rebuilds():
+    """测试 force_regenerate 触发全量重建"""
+    service = RecordingSummaryService()
+    first = await service.update_summary("手臂红疹", "皮肤科", [make_session("s1", "手臂起红疹")])
+    update = await service.update_summary(
+        "手臂红疹", "皮肤科", first.sessions,
+        existing_summary=first.result.summary,
+        existing_analysis=first.analysis,
+        force_regenerate=True
+    )
+    assert update.mode == "full"
+
+
+@pytest.mark.asyncio
+async def test_merge_falls_back_to_local_merge():
+    """测试合并失败时本地合并：症状取并集，风险取最高"""
+    service = RecordingSummaryService(fail_merge=True)
+    first = await service.update_summary("手臂红疹", "皮肤科", [make_session("s1", "手臂起红疹")])
+    update = await service.update_summary(
+        "手臂红疹", "皮肤科", first.sessions + [make_session("s2", "皮疹扩散")],
+        existing_summary=first.result.summary,
+        existing_analysis=first.analysis
+    )
+    assert update.result.symptoms == ["红疹", "瘙痒"]
+    assert update.result.risk_level == "medium"
+    assert "新增问诊：皮疹扩散" in update.result.summary
+
+
+class MapReduceRecordingService(AISummaryService):
+    """记录 map 并发度与 reduce 输入的摘要服务"""
+
+    def __init__(self):
+        super().__init__()
+        self.active = 0
+        self.max_active = 0
+        self.calls = {"map": 0, "group": 0, "reduce": 0}
+        self.reduce_prompt = ""
+
+    async def _call_llm(self, system_prompt, user_prompt, temperature=None, max_tokens=None, retry_count=3):
+        if "单次问诊" in user_prompt:
+            self.calls["map"] += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            await asyncio.sleep(0.01)
+            self.active -= 1
+            return json.dumps({"summary": "问诊摘要", "symptoms": ["红疹"], "risk_level": "low"}, ensure_ascii=False)
+        if "归并为一份阶段摘要" in user_prompt:
+            self.calls["group"] += 1
+            return json.dumps({"summary": "阶段小结", "symptoms": ["红疹"], "risk_level": "medium"}, ensure_ascii=False)
+        self.calls["reduce"] += 1
+        self.reduce_prompt = user_prompt
+        return json.dumps({"summary": "事件摘要", "symptoms": ["红疹"], "risk_level": "medium"}, ensure_ascii=False)
+
+
+def make_long_session(index: int) -> dict:
+    return {
+        "session_id": f"s{index}",
+        "timestamp": f"2026-01-{index + 1:02d}T10:00:00",
+        "summary": "皮肤科问诊",
+        "messages": [{"role": "user", "content": "手臂起红疹并且瘙痒" * 20} for _ in range(10)]
+    }
+
+
+@pytest.mark.asyncio
+async def test_map_reduce_bounded_concurrency(monkeypatch):
+    """测试大事件走 map-reduce，且 map 并发受信号量限制"""
+    monkeypatch.setattr(summary_module.settings, "AI_SUMMARY_SINGLE_PASS_TOKENS", 100)
+    monkeypatch.setattr(summary_module.settings, "AI_SUMMARY_CONCURRENCY", 2)
+    service = MapReduceRecordingService()
+
+    result, sessions = await service.generate_full_summary(
+        "手臂红疹", "皮肤科", [make_long_session(i) for i in range(6)]
+    )
+    assert service.calls["map"] == 6
+    assert service.max_active <= 2
+    assert service.calls["reduce"] == 1
+    assert result.summary == "事件摘要"
+    assert all(s["ai_summary"]["summary"] == "问诊摘要" for s in sessions)
+
+
+@pytest.mark.asyncio
+async def test_map_reuses_stored_session_summaries(monkeypatch):
+    """测试已有且未变化的单次问诊摘要不重复计算"""
+    monkeypatch.setattr(summary_module.settings, "AI_SUMMARY_SINGLE_PASS_TOKENS", 100)
+    service = MapReduceRecordingService()
+    _, sessions = await service.generate_full_summary("手臂红疹", "皮肤科", [make_long_session(i) for i in range(3)])
+
+    service.calls["map"] = 0
+    await service.generate_full_summary("手臂红疹", "皮肤科", sessions + [make_long_session(3)])
+    assert service.calls["map"] == 1
+
+
+@pytest.mark.asyncio
+async def test_reduce_groups_when_over_budget(monkeypatch):
+    """测试 reduce 输入超预算时分组逐级归并"""
+    monkeypatch.setattr(summary_module.settings, "AI_SUMMARY_REDUCE_TOKEN_BUDGET", 60)
+    service = MapReduceRecordingService()
+    summaries = [
+        {"summary": f"第{i}次问诊，红疹扩散", "timestamp": f"2026-01-{i + 1:02d}", "symptoms": ["红疹"]}
+        for i in range(8)
+    ]
+    result = await service.reduce_summaries("手臂红疹", "皮肤科", summaries, [], [])
+    assert service.calls["group"] >= 2
+    assert service.calls["reduce"] == 1
+    assert "阶段小结" in service.reduce_prompt
+    assert result.timeline
+
+
+def test_estimate_tokens():
+    """测试本地 token 估算"""
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("手臂起红疹") == 5
+    assert estimate_tokens("abcdefgh") == 2
+    text = "红疹" * 100
+    truncated = truncate_to_tokens(text, 20)
+    assert estimate_tokens(truncated) <= 20
+    assert truncated.endswith("...")
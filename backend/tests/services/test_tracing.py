@@ -0,0 +1,146 @@
+from typing import TypedDict
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from langgraph.graph import END, START, StateGraph
+from sqlalchemy import create_engine, text
+
+from app.middleware import TracingMiddleware
+from app.services.llm_pool import ProviderConfig, ProviderPool
+from app.services.llm_scheduler import LLMScheduler, ModelLimits
+from app.services.tracing import (
+    current_trace_id, get_trace_store, instrument_engine_tracing, start_span, trace_agent, trace_node
+)
+
+
+@pytest.fixture
+def store():
+    trace_store = get_trace_store()
+    trace_store.clear()
+    return trace_store
+
+
+def _by_name(waterfall):
+    return {span["name"]: span for span in waterfall["spans"]}
+
+
+def test_request_waterfall_with_db_spans(store):
+    """测试中间件创建根 span，请求内的子 span 与数据库语句组成瀑布图"""
+    engine = create_engine("sqlite://")
+    instrument_engine_tracing(engine)
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware)
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int):
+        with start_span("load item", {"item.id": item_id}):
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1")).fetchall()
+                conn.execute(text("PRAGMA user_version")).fetchall()
+        return {"id": item_id}
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 2"))  # 无追踪上下文，不产生 span
+    assert store.recent() == []
+
+    response = TestClient(app).get("/items/7")
+    trace_id = response.headers["x-trace-id"]
+
+    spans = _by_name(store.waterfall(trace_id))
+    assert spans["GET /items/{item_id}"]["depth"] == 0
+    assert spans["GET /items/{item_id}"]["attributes"]["http.status_code"] == 200
+    assert spans["load item"]["depth"] == 1
+    assert spans["db SELECT"]["depth"] == 2
+    assert spans["db SELECT"]["attributes"]["db.statement"] == "SELECT 1"
+    assert "db OTHER" in spans  # 与 db_query_duration_seconds 的 operation 标签分类一致
+    assert store.recent()[0]["trace_id"] == trace_id
+
+
+def test_incoming_traceparent_continued(store):
+    """测试上游 traceparent 头被延续为同一条 trace"""
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware)
+
+    @app.get("/ping")
+    def ping():
+        return {"trace_id": current_trace_id()}
+
+    upstream = "4bf92f3577b34da6a3ce929d0e0e4736"
+    response = TestClient(app).get("/ping", headers={"traceparent": f"00-{upstream}-00f067aa0ba902b7-01"})
+    assert response.json()["trace_id"] == upstream
+    assert response.headers["x-trace-id"] == upstream
+
+
+class _State(TypedDict):
+    steps: list
+
+
+@pytest.mark.asyncio
+async def test_langgraph_nodes_nested_under_agent(store):
+    """测试 LangGraph 节点（含在线程中执行的同步节点）挂在智能体 span 下，节点内的调用挂在节点下"""
+    async def plan(state: _State):
+        with start_span("tool search"):
+            pass
+        return {"steps": state["steps"] + ["plan"]}
+
+    def answer(state: _State):
+        with start_span("llm.call"):
+            pass
+        return {"steps": state["steps"] + ["answer"]}
+
+    graph = StateGraph(_State)
+    graph.add_node("plan", trace_node("test", "plan", plan))
+    graph.add_node("answer", trace_node("test", "answer", answer))
+    graph.add_edge(START, "plan")
+    graph.add_edge("plan", "answer")
+    graph.add_edge("answer", END)
+    compiled = graph.compile()
+
+    class Agent:
+        async def run(self, state, action="conversation"):
+            return await compiled.ainvoke(state)
+
+    agent = trace_agent(Agent(), "test")
+    with start_span("session.turn", {"turn.id": "turn-1"}):
+        result = await agent.run({"steps": []}, action="conversation")
+    assert result["steps"] == ["plan", "answer"]
+
+    waterfall = store.waterfall(store.trace_for_turn("turn-1"))
+    spans = _by_name(waterfall)
+    assert spans["agent.run"]["attributes"]["agent.type"] == "test"
+    assert spans["agent.run"]["parent_id"] == spans["session.turn"]["span_id"]
+    assert spans["node plan"]["parent_id"] == spans["agent.run"]["span_id"]
+    assert spans["node answer"]["parent_id"] == spans["agent.run"]["span_id"]
+    assert spans["tool search"]["parent_id"] == spans["node plan"]["span_id"]
+    assert spans["llm.call"]["parent_id"] == spans["node answer"]["span_id"]
+
+
+def test_errors_recorded_on_span(store):
+    """测试异常标记为 ERROR 并继续抛出"""
+    with pytest.raises(ValueError):
+        with start_span("failing") as span:
+            trace_id = format(span.get_span_context().trace_id, "032x")
+            raise ValueError("boom")
+    assert store.waterfall(trace_id)["spans"][0]["status"] == "ERROR"
+    assert store.recent()[0]["error"] is True
+
+
+def test_provider_attempts_traced(store):
+    """测试服务商池的每次尝试各有一个 span，失败的尝试标记为 ERROR"""
+    pool = ProviderPool(
+        [ProviderConfig(name="a", base_url="http://a"), ProviderConfig(name="b", base_url="http://b")],
+        scheduler=LLMScheduler(ModelLimits(reserved_interactive=0))
+    )
+
+    def run(provider, model, ticket):
+        if provider.name == "a":
+            raise ConnectionError("refused")
+        return provider.name
+
+    with start_span("call") as span:
+        trace_id = format(span.get_span_context().trace_id, "032x")
+        assert pool.call_sync("qwen-plus", run) == "b"
+
+    attempts = [s for s in store.waterfall(trace_id)["spans"] if s["name"] == "llm.attempt"]
+    assert [(s["attributes"]["llm.provider"], s["status"]) for s in attempts] == [("a", "ERROR"), ("b", "UNSET")]
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy import event
+
+from app.dependencies import get_current_user
+from app.models.user import User
+from app.services.auth_service import AuthService
+from app.services.user_cache import AuthUserCache, CurrentUser, get_auth_user_cache
+
+
+@pytest.fixture
+def db(make_session_factory):
+    session = make_session_factory(User)()
+    get_auth_user_cache().clear()
+    yield session
+    session.close()
+    get_auth_user_cache().clear()
+
+
+def count_selects(db):
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute",
+                 lambda conn, cursor, stmt, *args: statements.append(stmt) if stmt.startswith("SELECT") else None)
+    return statements
+
+
+def make_user(db) -> User:
+    user = User(phone="13800000000", nickname="张三", gender="male")
+    db.add(user)
+    db.commit()
+    return user
+
+
+def bearer(token: str) -> HTTPAuthorizationCredentials:
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+
+def test_cached_user_skips_decode_and_query(db, monkeypatch):
+    """测试缓存命中时不再解码 token 也不查询用户"""
+    user = make_user(db)
+    token = AuthService.create_token(user.id)
+    selects = count_selects(db)
+
+    first = get_current_user(bearer(token), db)
+    assert isinstance(first, CurrentUser)
+    assert first.id == user.id and first.nickname == "张三"
+    assert len(selects) == 1
+
+    monkeypatch.setattr(AuthService, "decode_token", lambda *a, **kw: pytest.fail("不应再次解码"))
+    second = get_current_user(bearer(token), db)
+    assert second == first
+    assert len(selects) == 1
+
+
+def test_profile_update_invalidates_snapshot(db):
+    """测试更新资料后快照失效"""
+    user = make_user(db)
+    token = AuthService.create_token(user.id)
+    current = get_current_user(bearer(token), db)
+
+    updated = AuthService.update_user_profile(db, current, {"nickname": "李四"})
+    assert isinstance(updated, User)
+    assert get_current_user(bearer(token), db).nickname == "李四"
+
+    with_password = AuthService.set_user_password(db, current, "abc12345")
+    assert isinstance(with_password, User) and with_password.password_hash
+    assert get_current_user(bearer(token), db).has_password is True
+
+
+def test_invalid_token_rejected(db):
+    """测试无效 token 与普通用户 token 之外的缓存不互相冒用"""
+    user = make_user(db)
+    with pytest.raises(HTTPException) as exc:
+        get_current_user(bearer("not-a-jwt"), db)
+    assert exc.value.status_code == 401
+
+    cache = get_auth_user_cache()
+    cache.set_token("admin-token", user.id, kind="admin")
+    with pytest.raises(HTTPException):
+        get_current_user(bearer("admin-token"), db)
+
+
+def test_token_entry_expires_with_token():
+    """测试 token 缓存不晚于 token 自身的过期时间"""
+    cache = AuthUserCache(ttl_seconds=60)
+    cache.set_token("t1", 1, token_exp=time.time() - 1)
+    cache.set_token("t2", 2)
+    assert cache.get_user_id("t1") is None
+    assert cache.get_user_id("t2") == 2